@@ -6,3 +6,64 @@ MONGO_URI = os.getenv("MONGO_URI")
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 4000 # 40 horas
+
+# Movimientos logísticos (colección time-series)
+# MOVIMIENTOS_RETENCION_DIAS: días que MongoDB conserva cada movimiento antes de expirarlo (0 = sin expiración)
+# MOVIMIENTOS_ARCHIVO_DIAS: antigüedad a partir de la cual scripts/archivar_movimientos_logisticos.py copia al archivo
+MOVIMIENTOS_RETENCION_DIAS = int(os.getenv("MOVIMIENTOS_RETENCION_DIAS", "0") or 0)
+MOVIMIENTOS_ARCHIVO_DIAS = int(os.getenv("MOVIMIENTOS_ARCHIVO_DIAS", "180") or 180)
+
+# Escritura diferida de movimientos logísticos (utils/write_behind.py)
+MOVIMIENTOS_BUFFER_MAX_LOTE = int(os.getenv("MOVIMIENTOS_BUFFER_MAX_LOTE", "500") or 500)
+MOVIMIENTOS_BUFFER_INTERVALO_MS = int(os.getenv("MOVIMIENTOS_BUFFER_INTERVALO_MS", "250") or 250)
+MOVIMIENTOS_BUFFER_MAX_COLA = int(os.getenv("MOVIMIENTOS_BUFFER_MAX_COLA", "10000") or 10000)
+
+# Snapshots de pedidos en facturas (utils/snapshots.py)
+# SNAPSHOT_COMPRIMIR_RESTO: guardar comprimido el resto del pedido; si es false solo se guardan
+# los campos congelados y el resto se toma del pedido actual al leer
+SNAPSHOT_COMPRIMIR_RESTO = os.getenv("SNAPSHOT_COMPRIMIR_RESTO", "true").lower() == "true"
+
+# Canal de eventos SSE (utils/eventos.py)
+# EVENTOS_CHANGE_STREAMS: generar los eventos desde change streams de MongoDB (requiere replica set);
+# necesario si hay varias instancias de la API detrás de un balanceador
+EVENTOS_CHANGE_STREAMS = os.getenv("EVENTOS_CHANGE_STREAMS", "false").lower() == "true"
+
+# Sincronización incremental de pedidos (/pedidos/cambios)
+# PEDIDOS_ELIMINADOS_RETENCION_DIAS: días que se conservan los tombstones de pedidos eliminados;
+# un cliente con un token más viejo debe volver a descargar la lista completa
+PEDIDOS_ELIMINADOS_RETENCION_DIAS = int(os.getenv("PEDIDOS_ELIMINADOS_RETENCION_DIAS", "90") or 90)
+
+# Imágenes de la configuración del home (utils/imagenes.py)
+# HOME_IMAGENES_ALMACEN: "r2" (Cloudflare R2, ver routes/files.py) o "local" (disco, para desarrollo y pruebas)
+# HOME_IMAGENES_DIR: directorio de los blobs con el almacén local
+# HOME_IMAGENES_URL_BASE: prefijo de las URLs guardadas en HOME_CONFIG; por defecto la ruta del endpoint
+# /home/imagenes de esta API, que GET/PUT /home/config devuelven como URL absoluta con el host de la
+# petición (o configurar la URL pública de la API o el dominio público del bucket + "/home")
+HOME_IMAGENES_ALMACEN = os.getenv("HOME_IMAGENES_ALMACEN", "r2").lower()
+HOME_IMAGENES_DIR = os.getenv("HOME_IMAGENES_DIR", "home_imagenes")
+HOME_IMAGENES_URL_BASE = os.getenv("HOME_IMAGENES_URL_BASE", "/home/imagenes").rstrip("/")
+
+# Respuestas condicionales con ETag (utils/versiones.py)
+# VERSIONES_REFRESCO_SEGUNDOS: cada cuánto se relee de MongoDB la versión de un recurso
+# (para ver las escrituras hechas por otras instancias de la API)
+VERSIONES_REFRESCO_SEGUNDOS = float(os.getenv("VERSIONES_REFRESCO_SEGUNDOS", "5") or 5)
+
+# Búsqueda de inventario en memoria (utils/busqueda.py)
+# INVENTARIO_BUSQUEDA_RECONSTRUIR_SEGUNDOS: intervalo mínimo entre reconstrucciones del índice
+# cuando cambia el inventario; mientras tanto se responde con el índice anterior
+INVENTARIO_BUSQUEDA_RECONSTRUIR_SEGUNDOS = float(os.getenv("INVENTARIO_BUSQUEDA_RECONSTRUIR_SEGUNDOS", "10") or 10)
+
+# Transacciones multi-documento (utils/transacciones.py)
+# MONGO_TRANSACCIONES: crear el pedido y descontar el inventario en una misma transacción cuando
+# MongoDB es un replica set o un cluster; con un servidor standalone se hace sin transacción
+MONGO_TRANSACCIONES = os.getenv("MONGO_TRANSACCIONES", "true").lower() == "true"
+
+# Consultas en paralelo (utils/concurrencia.py)
+# CONSULTAS_TIMEOUT_SEGUNDOS: tiempo máximo de cada consulta de un endpoint que combina varias colecciones
+CONSULTAS_TIMEOUT_SEGUNDOS = float(os.getenv("CONSULTAS_TIMEOUT_SEGUNDOS", "10") or 10)
+
+# Apartados (módulo APARTADO)
+# APARTADOS_ARCHIVO_DIAS: días después de facturado en que un apartado pasa a la colección apartados_archivo
+# (0 = no archivar); el trabajo "archivar_apartados" se lanza al arrancar y cada APARTADOS_ARCHIVO_INTERVALO_HORAS
+APARTADOS_ARCHIVO_DIAS = int(os.getenv("APARTADOS_ARCHIVO_DIAS", "30") or 0)
+APARTADOS_ARCHIVO_INTERVALO_HORAS = float(os.getenv("APARTADOS_ARCHIVO_INTERVALO_HORAS", "24") or 24)
@@ -1,7 +1,7 @@
 from pymongo import MongoClient
 from dotenv import load_dotenv
 import os
-from .config import MONGO_URI
+from .config import MONGO_URI, MOVIMIENTOS_RETENCION_DIAS, PEDIDOS_ELIMINADOS_RETENCION_DIAS
 # Cargar variables de entorno
 dotenv_path = os.path.join(os.path.dirname(__file__), '../../.env')
 load_dotenv(dotenv_path)
@@ -25,6 +25,7 @@ clientes_collection = db["CLIENTES"]  # Clientes de negocios (para pedidos)
 clientes_usuarios_collection = db["clientes_usuarios"]  # Usuarios clientes autenticados
 empleados_collection = db["EMPLEADOS"]
 pedidos_collection = db["PEDIDOS"]
+pedidos_eliminados_collection = db["PEDIDOS_ELIMINADOS"]  # Tombstones para /pedidos/cambios
 items_collection = db["INVENTARIO"]
 contadores_collection = db["CONTADORES"]
 
@@ -35,7 +36,14 @@ preferencias_clientes_collection = db["preferencias_clientes"]
 soporte_reclamos_clientes_collection = db["soporte_reclamos_clientes"]
 facturas_cliente_collection = db["facturas_cliente"]
 home_config_collection = db["HOME_CONFIG"]
-movimientos_logisticos_collection = db["MOVIMIENTOS_LOGISTICOS"]  # Para panel de control logístico
+# Panel de control logístico: colección time-series (timeField=fecha_dt, metaField=meta)
+MOVIMIENTOS_LOGISTICOS_TS = "MOVIMIENTOS_LOGISTICOS_TS"
+movimientos_logisticos_collection = db[MOVIMIENTOS_LOGISTICOS_TS]
+movimientos_logisticos_legacy_collection = db["MOVIMIENTOS_LOGISTICOS"]  # Colección anterior (fecha como string)
+movimientos_logisticos_archivo_collection = db["MOVIMIENTOS_LOGISTICOS_ARCHIVO"]
+jobs_collection = db["JOBS"]  # Trabajos de mantenimiento en segundo plano (utils/jobs.py)
+apartados_collection = db["apartados"]  # Colección para módulo APARTADO
+apartados_archivo_collection = db["apartados_archivo"]  # Apartados facturados archivados
 
 def init_pedidos_indexes():
     """
@@ -141,6 +149,51 @@ def init_pedidos_indexes():
     except Exception as e:
         if "already exists" in str(e).lower():
             pass  # Índice ya existe
+    
+    try:
+        # Índice para sincronización incremental (/pedidos/cambios): fecha_actualizacion + _id
+        pedidos_collection.create_index(
+            [("fecha_actualizacion", 1), ("_id", 1)],
+            name="idx_fecha_actualizacion"
+        )
+        print("✅ Índice creado en pedidos.fecha_actualizacion")
+    except Exception as e:
+        if "already exists" in str(e).lower():
+            print("ℹ️  Índice en pedidos.fecha_actualizacion ya existe")
+        else:
+            print(f"⚠️  Error al crear índice en pedidos.fecha_actualizacion: {e}")
+    
+    try:
+        # Pedidos con saldo pendiente por estado (listado de pagos /pedidos/estado/), más recientes primero
+        pedidos_collection.create_index(
+            [("estado_general", 1), ("fecha_creacion", -1), ("saldo_pendiente", 1)],
+            name="idx_estado_fecha_saldo"
+        )
+        # Cuentas por cobrar por cliente
+        pedidos_collection.create_index(
+            [("cliente_id", 1), ("saldo_pendiente", 1)],
+            name="idx_cliente_saldo"
+        )
+        print("✅ Índices creados en pedidos.saldo_pendiente")
+    except Exception as e:
+        if "already exists" in str(e).lower():
+            print("ℹ️  Índices en pedidos.saldo_pendiente ya existen")
+        else:
+            print(f"⚠️  Error al crear índices en pedidos.saldo_pendiente: {e}")
+    
+    try:
+        # Tombstones de pedidos eliminados: expiran tras PEDIDOS_ELIMINADOS_RETENCION_DIAS
+        pedidos_eliminados_collection.create_index(
+            [("fecha_eliminacion", 1)],
+            expireAfterSeconds=PEDIDOS_ELIMINADOS_RETENCION_DIAS * 24 * 3600,
+            name="idx_pedidos_eliminados_ttl"
+        )
+        print("✅ Índice TTL creado en pedidos_eliminados.fecha_eliminacion")
+    except Exception as e:
+        if "already exists" in str(e).lower():
+            print("ℹ️  Índice TTL en pedidos_eliminados.fecha_eliminacion ya existe")
+        else:
+            print(f"⚠️  Error al crear índice TTL en pedidos_eliminados: {e}")
 
 def init_clientes_indexes():
     """
@@ -222,6 +275,29 @@ def init_empleados_indexes():
         else:
             print(f"⚠️  Error al crear índice de texto en empleados.nombreCompleto: {e}")
 
+def init_codigo_norm_index():
+    """
+    Índice único de codigo_norm (utils/inventario.py). También lo llama el job
+    normalizar_codigos_inventario al terminar, por si al arrancar había códigos repetidos.
+    """
+    try:
+        # Único entre los items que lo tienen: los apartados (copias de un item),
+        # los códigos repetidos y los items sin backfill no lo llevan
+        items_collection.create_index(
+            [("codigo_norm", 1)],
+            unique=True,
+            partialFilterExpression={"codigo_norm": {"$type": "string"}},
+            name="idx_item_codigo_norm_unique"
+        )
+        print("✅ Índice único creado en inventario.codigo_norm")
+    except Exception as e:
+        if "already exists" in str(e).lower():
+            print("ℹ️  Índice único en inventario.codigo_norm ya existe")
+        elif "duplicate key" in str(e).lower():
+            print("⚠️  Hay códigos normalizados repetidos en inventario; ejecutar scripts/normalizar_codigos_inventario.py")
+        else:
+            print(f"⚠️  Error al crear índice único en inventario.codigo_norm: {e}")
+
 def init_inventario_indexes():
     """
     Inicializar índices para optimizar queries de inventario.
@@ -239,6 +315,24 @@ def init_inventario_indexes():
         else:
             print(f"⚠️  Error al crear índice en inventario.codigo: {e}")
     
+    init_codigo_norm_index()
+    
+    # Índices parciales de items sin existencia (panel de control logístico y planificación):
+    # solo contienen los items con la bandera en true, así los conteos son de solo índice
+    for campo in ("sin_existencia", "sin_existencia2"):
+        try:
+            items_collection.create_index(
+                [(campo, 1), ("activo", 1)],
+                partialFilterExpression={campo: True},
+                name=f"idx_item_{campo}"
+            )
+            print(f"✅ Índice parcial creado en inventario.{campo}")
+        except Exception as e:
+            if "already exists" in str(e).lower():
+                print(f"ℹ️  Índice parcial en inventario.{campo} ya existe")
+            else:
+                print(f"⚠️  Error al crear índice parcial en inventario.{campo}: {e}")
+    
     try:
         # Índice de texto para búsquedas por nombre
         items_collection.create_index(
@@ -264,6 +358,19 @@ def init_inventario_indexes():
             print("ℹ️  Índice en inventario.categoria ya existe")
         else:
             print(f"⚠️  Error al crear índice en inventario.categoria: {e}")
+    
+    # Catálogo paginado (/inventario/catalogo): igualdad en activo (+ filtro) y orden por _id descendente
+    for campo in (None, "categoria", "departamento", "marca"):
+        claves = [("activo", 1)] + ([(campo, 1)] if campo else []) + [("_id", -1)]
+        nombre = f"idx_item_catalogo_{campo}" if campo else "idx_item_catalogo"
+        try:
+            items_collection.create_index(claves, name=nombre)
+            print(f"✅ Índice {nombre} creado en inventario")
+        except Exception as e:
+            if "already exists" in str(e).lower():
+                print(f"ℹ️  Índice {nombre} en inventario ya existe")
+            else:
+                print(f"⚠️  Error al crear índice {nombre} en inventario: {e}")
 
 def init_clientes_indexes_adicionales():
     """
@@ -283,17 +390,39 @@ def init_clientes_indexes_adicionales():
             print(f"⚠️  Error al crear índice en clientes.rif: {e}")
     
     try:
-        # Índice de texto para búsquedas por nombre
+        # El índice de texto sobre cliente_nombre (campo antiguo) no lo usa ninguna consulta;
+        # la búsqueda por nombre usa el prefijo de nombre_busqueda
+        if "idx_cliente_nombre_text" in clientes_collection.index_information():
+            clientes_collection.drop_index("idx_cliente_nombre_text")
+            print("ℹ️  Índice de texto en clientes.cliente_nombre eliminado")
+    except Exception as e:
+        print(f"⚠️  Error al eliminar índice de texto en clientes.cliente_nombre: {e}")
+    
+    try:
+        # Búsqueda por prefijo de nombre normalizado (/clientes/buscar), ordenada por nombre
+        clientes_collection.create_index(
+            [("nombre_busqueda", 1), ("_id", 1)],
+            name="idx_cliente_nombre_busqueda"
+        )
+        print("✅ Índice creado en clientes.nombre_busqueda")
+    except Exception as e:
+        if "already exists" in str(e).lower():
+            print("ℹ️  Índice en clientes.nombre_busqueda ya existe")
+        else:
+            print(f"⚠️  Error al crear índice en clientes.nombre_busqueda: {e}")
+    
+    try:
+        # Búsqueda por prefijo de RIF/cédula normalizado (/clientes/buscar)
         clientes_collection.create_index(
-            [("cliente_nombre", "text")],
-            name="idx_cliente_nombre_text"
+            [("rif_normalizado", 1), ("_id", 1)],
+            name="idx_cliente_rif_normalizado"
         )
-        print("✅ Índice de texto creado en clientes.cliente_nombre")
+        print("✅ Índice creado en clientes.rif_normalizado")
     except Exception as e:
         if "already exists" in str(e).lower():
-            print("ℹ️  Índice de texto en clientes.cliente_nombre ya existe")
+            print("ℹ️  Índice en clientes.rif_normalizado ya existe")
         else:
-            print(f"⚠️  Error al crear índice de texto en clientes.cliente_nombre: {e}")
+            print(f"⚠️  Error al crear índice en clientes.rif_normalizado: {e}")
 
 def init_facturas_confirmadas_indexes():
     """
@@ -315,10 +444,16 @@ def init_facturas_confirmadas_indexes():
         else:
             print(f"⚠️  Error al crear índice en facturas_confirmadas.pedidoId: {e}")
     
+    # Índice para fecha_facturacion (ordenamiento del listado paginado).
+    # Incluye _id para desempatar el cursor; reemplaza la versión anterior solo por fecha
+    indice_fecha = [("fecha_facturacion", -1), ("_id", -1)]
     try:
-        # Índice para fecha_facturacion (ordenamiento frecuente)
+        existente = facturas_confirmadas_collection.index_information().get("idx_factura_fecha_facturacion_desc")
+        if existente and [(k, int(v)) for k, v in existente.get("key", [])] != indice_fecha:
+            facturas_confirmadas_collection.drop_index("idx_factura_fecha_facturacion_desc")
+            print("ℹ️  Índice anterior en facturas_confirmadas.fecha_facturacion eliminado")
         facturas_confirmadas_collection.create_index(
-            [("fecha_facturacion", -1)],
+            indice_fecha,
             name="idx_factura_fecha_facturacion_desc"
         )
         print("✅ Índice creado en facturas_confirmadas.fecha_facturacion")
@@ -327,3 +462,256 @@ def init_facturas_confirmadas_indexes():
             print("ℹ️  Índice en facturas_confirmadas.fecha_facturacion ya existe")
         else:
             print(f"⚠️  Error al crear índice en facturas_confirmadas.fecha_facturacion: {e}")
+    
+    try:
+        # Índice para el listado filtrado por cliente
+        facturas_confirmadas_collection.create_index(
+            [("cliente_id", 1), ("fecha_facturacion", -1), ("_id", -1)],
+            name="idx_factura_cliente_fecha"
+        )
+        print("✅ Índice creado en facturas_confirmadas.cliente_id/fecha_facturacion")
+    except Exception as e:
+        if "already exists" in str(e).lower():
+            print("ℹ️  Índice en facturas_confirmadas.cliente_id/fecha_facturacion ya existe")
+        else:
+            print(f"⚠️  Error al crear índice en facturas_confirmadas.cliente_id/fecha_facturacion: {e}")
+
+def init_movimientos_logisticos_collection():
+    """
+    Crear la colección time-series de movimientos logísticos si no existe.
+    Los movimientos se agrupan en buckets por fecha_dt y meta (item_codigo, tipo_movimiento).
+    La retención se controla con MOVIMIENTOS_RETENCION_DIAS (0 = sin expiración).
+    """
+    expire_seconds = MOVIMIENTOS_RETENCION_DIAS * 86400 if MOVIMIENTOS_RETENCION_DIAS > 0 else None
+    
+    try:
+        if not db.list_collection_names(filter={"name": MOVIMIENTOS_LOGISTICOS_TS}):
+            opciones = {
+                "timeseries": {
+                    "timeField": "fecha_dt",
+                    "metaField": "meta",
+                    "granularity": "minutes"
+                }
+            }
+            if expire_seconds:
+                opciones["expireAfterSeconds"] = expire_seconds
+            db.create_collection(MOVIMIENTOS_LOGISTICOS_TS, **opciones)
+            print(f"✅ Colección time-series {MOVIMIENTOS_LOGISTICOS_TS} creada")
+        else:
+            # Sincronizar la retención con la configuración actual
+            db.command(
+                "collMod",
+                MOVIMIENTOS_LOGISTICOS_TS,
+                expireAfterSeconds=expire_seconds if expire_seconds else "off"
+            )
+            print(f"ℹ️  Colección time-series {MOVIMIENTOS_LOGISTICOS_TS} ya existe")
+    except Exception as e:
+        print(f"⚠️  Error al crear colección time-series {MOVIMIENTOS_LOGISTICOS_TS}: {e}")
+    
+    try:
+        # Índice secundario para filtros por tipo (asignaciones terminadas, gráficas)
+        movimientos_logisticos_collection.create_index(
+            [("meta.tipo_movimiento", 1), ("fecha_dt", -1)],
+            name="idx_movimiento_tipo_fecha"
+        )
+        print("✅ Índice creado en movimientos_logisticos.meta.tipo_movimiento")
+    except Exception as e:
+        if "already exists" in str(e).lower():
+            print("ℹ️  Índice en movimientos_logisticos.meta.tipo_movimiento ya existe")
+        else:
+            print(f"⚠️  Error al crear índice en movimientos_logisticos.meta.tipo_movimiento: {e}")
+    
+    try:
+        # Índice secundario para movimientos por item
+        movimientos_logisticos_collection.create_index(
+            [("meta.item_codigo", 1), ("fecha_dt", -1)],
+            name="idx_movimiento_item_fecha"
+        )
+        print("✅ Índice creado en movimientos_logisticos.meta.item_codigo")
+    except Exception as e:
+        if "already exists" in str(e).lower():
+            print("ℹ️  Índice en movimientos_logisticos.meta.item_codigo ya existe")
+        else:
+            print(f"⚠️  Error al crear índice en movimientos_logisticos.meta.item_codigo: {e}")
+
+def init_jobs_indexes():
+    """
+    Inicializar índices para la colección de trabajos en segundo plano.
+    """
+    try:
+        # Índice para buscar trabajos activos por tipo
+        jobs_collection.create_index(
+            [("tipo", 1), ("estado", 1)],
+            name="idx_job_tipo_estado"
+        )
+        print("✅ Índice creado en jobs.tipo/estado")
+    except Exception as e:
+        if "already exists" in str(e).lower():
+            print("ℹ️  Índice en jobs.tipo/estado ya existe")
+        else:
+            print(f"⚠️  Error al crear índice en jobs.tipo/estado: {e}")
+    
+    try:
+        # Un solo trabajo activo por tipo (lanzamientos simultáneos). Los trabajos activos
+        # anteriores a la marca "activo" la reciben aquí, el más reciente de cada tipo
+        activos_por_tipo = set()
+        for job in jobs_collection.find(
+            {"estado": {"$in": ["pendiente", "en_ejecucion"]}, "activo": {"$exists": False}},
+            {"tipo": 1}
+        ).sort("fecha_creacion", -1):
+            if job.get("tipo") not in activos_por_tipo:
+                activos_por_tipo.add(job.get("tipo"))
+                jobs_collection.update_one({"_id": job["_id"]}, {"$set": {"activo": True}})
+        jobs_collection.create_index(
+            [("tipo", 1)],
+            unique=True,
+            partialFilterExpression={"activo": True},
+            name="idx_job_tipo_activo"
+        )
+        print("✅ Índice único creado en jobs.tipo (trabajos activos)")
+    except Exception as e:
+        if "already exists" in str(e).lower():
+            print("ℹ️  Índice único en jobs.tipo (trabajos activos) ya existe")
+        else:
+            print(f"⚠️  Error al crear índice único en jobs.tipo: {e}")
+    
+    try:
+        # Índice para listar trabajos recientes
+        jobs_collection.create_index(
+            [("fecha_creacion", -1)],
+            name="idx_job_fecha_creacion_desc"
+        )
+        print("✅ Índice creado en jobs.fecha_creacion")
+    except Exception as e:
+        if "already exists" in str(e).lower():
+            print("ℹ️  Índice en jobs.fecha_creacion ya existe")
+        else:
+            print(f"⚠️  Error al crear índice en jobs.fecha_creacion: {e}")
+
+def init_apartados_indexes():
+    """
+    Inicializar índices para el módulo APARTADO (listado paginado y archivo).
+    """
+    indices = [
+        (apartados_collection, [("pedido_id", 1)], "idx_apartado_pedido_id", "apartados.pedido_id"),
+        (apartados_collection, [("estado", 1), ("fecha", -1), ("_id", -1)], "idx_apartado_estado_fecha", "apartados.estado/fecha"),
+        (apartados_collection, [("fecha", -1), ("_id", -1)], "idx_apartado_fecha", "apartados.fecha"),
+        (apartados_archivo_collection, [("pedido_id", 1)], "idx_apartado_archivo_pedido_id", "apartados_archivo.pedido_id"),
+    ]
+    for collection, claves, nombre, descripcion in indices:
+        try:
+            collection.create_index(claves, name=nombre)
+            print(f"✅ Índice creado en {descripcion}")
+        except Exception as e:
+            if "already exists" in str(e).lower():
+                print(f"ℹ️  Índice en {descripcion} ya existe")
+            else:
+                print(f"⚠️  Error al crear índice en {descripcion}: {e}")
+
+def init_transacciones_indexes():
+    """
+    Inicializar índices para el historial de transacciones de métodos de pago
+    y sus checkpoints de saldo.
+    """
+    transacciones_collection = db["transacciones"]
+    saldos_checkpoints_collection = db["saldos_checkpoints"]
+    
+    try:
+        # Índice para el historial paginado de un método (más reciente primero)
+        transacciones_collection.create_index(
+            [("metodo_pago_id", 1), ("fecha", -1), ("_id", -1)],
+            name="idx_transaccion_metodo_fecha"
+        )
+        print("✅ Índice creado en transacciones.metodo_pago_id/fecha")
+    except Exception as e:
+        if "already exists" in str(e).lower():
+            print("ℹ️  Índice en transacciones.metodo_pago_id/fecha ya existe")
+        else:
+            print(f"⚠️  Error al crear índice en transacciones.metodo_pago_id/fecha: {e}")
+    
+    try:
+        # Índice para el historial completo paginado
+        transacciones_collection.create_index(
+            [("fecha", -1), ("_id", -1)],
+            name="idx_transaccion_fecha_desc"
+        )
+        print("✅ Índice creado en transacciones.fecha")
+    except Exception as e:
+        if "already exists" in str(e).lower():
+            print("ℹ️  Índice en transacciones.fecha ya existe")
+        else:
+            print(f"⚠️  Error al crear índice en transacciones.fecha: {e}")
+    
+    try:
+        # Índice para sumar las transacciones posteriores a un checkpoint
+        transacciones_collection.create_index(
+            [("metodo_pago_id", 1), ("secuencia", 1)],
+            name="idx_transaccion_metodo_secuencia"
+        )
+        print("✅ Índice creado en transacciones.metodo_pago_id/secuencia")
+    except Exception as e:
+        if "already exists" in str(e).lower():
+            print("ℹ️  Índice en transacciones.metodo_pago_id/secuencia ya existe")
+        else:
+            print(f"⚠️  Error al crear índice en transacciones.metodo_pago_id/secuencia: {e}")
+    
+    try:
+        # Índice para revertir los depósitos de un pedido al cancelarlo
+        transacciones_collection.create_index(
+            [("pedido_id", 1)],
+            name="idx_transaccion_pedido_id",
+            sparse=True
+        )
+        print("✅ Índice creado en transacciones.pedido_id")
+    except Exception as e:
+        if "already exists" in str(e).lower():
+            print("ℹ️  Índice en transacciones.pedido_id ya existe")
+        else:
+            print(f"⚠️  Error al crear índice en transacciones.pedido_id: {e}")
+    
+    try:
+        # Un checkpoint por método y secuencia; el último se busca ordenando por secuencia
+        saldos_checkpoints_collection.create_index(
+            [("metodo_pago_id", 1), ("secuencia", -1)],
+            name="idx_checkpoint_metodo_secuencia",
+            unique=True
+        )
+        print("✅ Índice creado en saldos_checkpoints.metodo_pago_id/secuencia")
+    except Exception as e:
+        if "already exists" in str(e).lower():
+            print("ℹ️  Índice en saldos_checkpoints.metodo_pago_id/secuencia ya existe")
+        else:
+            print(f"⚠️  Error al crear índice en saldos_checkpoints.metodo_pago_id/secuencia: {e}")
+
+def init_mensajes_indexes():
+    """
+    Inicializar índices para los mensajes de pedidos y de soporte.
+    """
+    mensajes_collection = db["mensajes"]
+    
+    try:
+        # Índice para abrir una conversación y para la bandeja de soporte (prefijo "soporte_")
+        mensajes_collection.create_index(
+            [("pedido_id", 1), ("fecha_creacion", 1)],
+            name="idx_mensaje_pedido_fecha"
+        )
+        print("✅ Índice creado en mensajes.pedido_id/fecha_creacion")
+    except Exception as e:
+        if "already exists" in str(e).lower():
+            print("ℹ️  Índice en mensajes.pedido_id/fecha_creacion ya existe")
+        else:
+            print(f"⚠️  Error al crear índice en mensajes.pedido_id/fecha_creacion: {e}")
+    
+    try:
+        # Índice para buscar los mensajes de soporte de un cliente
+        mensajes_collection.create_index(
+            [("cliente_id", 1), ("fecha_creacion", -1)],
+            name="idx_mensaje_cliente_fecha",
+            sparse=True
+        )
+        print("✅ Índice creado en mensajes.cliente_id")
+    except Exception as e:
+        if "already exists" in str(e).lower():
+            print("ℹ️  Índice en mensajes.cliente_id ya existe")
+        else:
+            print(f"⚠️  Error al crear índice en mensajes.cliente_id: {e}")
@@ -8,10 +8,12 @@ from .routes.auth import router as auth_router
 from .routes.clientes import router as cliente_router
 from .routes.empleados import router as empleado_router
 from .routes.pedidos import router as pedido_router
-from .routes.inventario import router as inventario_router
+from .routes.pedidos import movimientos_writer, programar_archivo_apartados
+from .routes.inventario import router as inventario_router, busqueda_inventario, programar_normalizacion_codigos
 from .routes.users import router as usuarios_router
 from .routes.files import router as files_router
 from .routes.metodos_pago import router as metodos_pago_router
+from .routes.metodos_pago import programar_normalizacion_transacciones, publicar_transacciones_pendientes
 from .routes.formatos_impresion import router as formatos_impresion_router
 from .routes.dashboard import router as dashboard_router
 from .routes.dashboard import get_dashboard_asignaciones
@@ -19,6 +21,13 @@ from .routes.cuentas_por_pagar import router as cuentas_por_pagar_router
 from .routes.facturas_y_pedidos import router as facturas_y_pedidos_router
 from .routes.mensajes import router as mensajes_router
 from .routes.home import router as home_router
+from .routes.jobs import router as jobs_router
+from .routes.jobs import job_runner
+from .routes.eventos import router as eventos_router
+from .routes.eventos import iniciar_change_streams
+from .utils.eventos import event_bus
+from .config.config import EVENTOS_CHANGE_STREAMS
+from .utils.inventario import corregir_sin_existencia_sucursal1
 
 from dotenv import load_dotenv
 from passlib.context import CryptContext
@@ -73,11 +82,17 @@ app.add_middleware(
         "Access-Control-Allow-Origin",
         "Access-Control-Allow-Methods",
         "Access-Control-Allow-Headers",
+        "If-None-Match",
+        "If-Modified-Since",
     ],
     expose_headers=[
         "Access-Control-Allow-Origin",
         "Access-Control-Allow-Methods", 
         "Access-Control-Allow-Headers",
+        "X-Next-Cursor",
+        "X-Total-Count",
+        "ETag",
+        "Last-Modified",
     ],
     max_age=3600,  # Cache preflight requests for 1 hour
 )
@@ -179,6 +194,8 @@ app.include_router(cuentas_por_pagar_router, prefix="/cuentas-por-pagar", tags=[
 app.include_router(facturas_y_pedidos_router, prefix="", tags=["Facturas y Pedidos"])  # Sin prefijo para rutas directas
 app.include_router(mensajes_router, prefix="/mensajes", tags=["Mensajes"])
 app.include_router(home_router, prefix="/home", tags=["Home"])
+app.include_router(jobs_router, prefix="/jobs", tags=["Trabajos"])
+app.include_router(eventos_router, prefix="/eventos", tags=["Eventos"])
 
 # Endpoint directo para /asignaciones (sin prefijo)
 @app.get("/asignaciones")
@@ -196,7 +213,12 @@ async def startup_event():
         init_empleados_indexes,
         init_inventario_indexes,
         init_clientes_indexes_adicionales,
-        init_facturas_confirmadas_indexes
+        init_facturas_confirmadas_indexes,
+        init_movimientos_logisticos_collection,
+        init_jobs_indexes,
+        init_transacciones_indexes,
+        init_mensajes_indexes,
+        init_apartados_indexes
     )
     print("🔧 Inicializando índices de MongoDB...")
     init_clientes_indexes()
@@ -205,4 +227,28 @@ async def startup_event():
     init_inventario_indexes()
     init_clientes_indexes_adicionales()
     init_facturas_confirmadas_indexes()
-    print("✅ Inicialización de índices completada")
\ No newline at end of file
+    init_movimientos_logisticos_collection()
+    init_jobs_indexes()
+    init_transacciones_indexes()
+    init_mensajes_indexes()
+    init_apartados_indexes()
+    print("✅ Inicialización de índices completada")
+    corregir_sin_existencia_sucursal1()
+    publicar_transacciones_pendientes()
+    movimientos_writer.start()
+    job_runner.reanudar_interrumpidos()
+    programar_archivo_apartados()
+    programar_normalizacion_transacciones()
+    programar_normalizacion_codigos()
+    event_bus.iniciar()
+    busqueda_inventario.precalentar()
+    if EVENTOS_CHANGE_STREAMS:
+        app.state.change_streams = iniciar_change_streams()
+
+# Vaciar buffers de escritura diferida al apagar
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Escribir los movimientos logísticos pendientes antes de terminar el proceso"""
+    await movimientos_writer.stop()
+    for watcher in getattr(app.state, "change_streams", []):
+        watcher.stop()
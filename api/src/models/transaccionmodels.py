@@ -10,6 +10,7 @@ class Transaccion(BaseModel):
     monto: float
     concepto: Optional[str] = None  # Concepto de la transacción
     fecha: datetime = Field(default_factory=datetime.utcnow)
+    saldo_despues: Optional[float] = None  # Saldo del método justo después de esta transacción
 
     class Config:
         populate_by_name = True
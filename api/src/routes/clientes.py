@@ -1,4 +1,4 @@
-from fastapi import APIRouter, HTTPException, Depends, Body
+from fastapi import APIRouter, HTTPException, Depends, Body, Query, Response
 from ..config.mongodb import (
     clientes_collection, 
     clientes_usuarios_collection,
@@ -9,10 +9,17 @@ from ..config.mongodb import (
 )
 from ..models.authmodels import Cliente
 from ..auth.auth import get_current_cliente
+from ..utils.busqueda import normalizar
+from ..utils.clientes import TIPOS_RIF, claves_busqueda_cliente, normalizar_rif
+from ..utils.paginacion import PAGINA_MAX, paginar
+from ..utils.concurrencia import ConsultaTimeout, consultas_en_paralelo
 from bson import ObjectId
 from pydantic import BaseModel
-from typing import Optional, Dict, Any, List
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from typing import Optional, Dict, Any, List, Literal
 from datetime import datetime
+import re
 
 router = APIRouter()
 
@@ -21,46 +28,109 @@ class ClienteUpdate(BaseModel):
     direccion: Optional[str] = None
     telefono: Optional[str] = None
 
+class OperacionCarrito(BaseModel):
+    op: Literal["agregar", "actualizar", "quitar", "cantidad"]
+    id: str  # id de la línea (campo "id" del item en el carrito)
+    item: Optional[Dict[str, Any]] = None  # agregar: línea completa; actualizar: solo los campos que cambian
+    cantidad: Optional[float] = None  # cantidad
+
+class PatchCarrito(BaseModel):
+    revision: int  # creciente por cada autoguardado del cliente
+    operaciones: List[OperacionCarrito]
+
+class PatchBorrador(BaseModel):
+    revision: int
+    campos: Dict[str, Any] = {}  # campos del borrador que cambian
+    quitar: List[str] = []  # campos del borrador que se eliminan
+
+# Proyección con solo los campos necesarios para normalizar el listado
+PROYECCION_CLIENTES_LISTA = {
+    "_id": 1,
+    "nombre": 1,
+    "nombres": 1,
+    "cliente_nombre": 1,
+    "rif": 1,
+    "cedula": 1,
+    "direccion": 1,
+    "cliente_direccion": 1,
+    "telefono": 1,
+    "telefono_contacto": 1,
+    "cliente_telefono": 1
+}
+ORDEN_CLIENTES_NOMBRE = [("nombre_busqueda", 1), ("_id", 1)]
+ORDEN_CLIENTES_RIF = [("rif_normalizado", 1), ("_id", 1)]
+# Consultas que se buscan por RIF/cédula: un dígito, opcionalmente precedido del tipo (V, J, ...)
+PATRON_CONSULTA_RIF = re.compile(rf"^[{TIPOS_RIF}]?\d")
+
+def normalizar_cliente_lista(cliente: dict) -> dict:
+    """Campos normalizados para compatibilidad con frontend"""
+    return {
+        "_id": str(cliente["_id"]),
+        "nombre": cliente.get("nombre") or cliente.get("nombres") or cliente.get("cliente_nombre") or "",
+        "rif": cliente.get("rif") or cliente.get("cedula") or "",
+        "direccion": cliente.get("direccion") or cliente.get("cliente_direccion") or "",
+        "telefono": cliente.get("telefono") or cliente.get("telefono_contacto") or cliente.get("cliente_telefono") or "",
+    }
+
+def rango_prefijo(prefijo: str) -> dict:
+    """Rango de strings que empiezan por prefijo (usa los límites del índice como un regex anclado)"""
+    return {"$gte": prefijo, "$lt": prefijo + "\uffff"}
+
 @router.get("/all")
 async def get_all_clientes():
     """
     Obtener todos los clientes.
     Retorna los campos normalizados para compatibilidad con frontend.
+    Para el selector de clientes usar /clientes/buscar (paginado, sin límite de 1000).
     """
-    # OPTIMIZACIÓN: Proyección con solo los campos necesarios para normalización
-    projection = {
-        "_id": 1,
-        "nombre": 1,
-        "nombres": 1,
-        "cliente_nombre": 1,
-        "rif": 1,
-        "cedula": 1,
-        "direccion": 1,
-        "cliente_direccion": 1,
-        "telefono": 1,
-        "telefono_contacto": 1,
-        "cliente_telefono": 1
-    }
-    
     # OPTIMIZACIÓN: Limitar a 1000 clientes más recientes y ordenar por fecha descendente
     # Si hay fecha_creacion, ordenar por ella, sino traer los primeros
-    clientes = list(clientes_collection.find({}, projection)
+    clientes = list(clientes_collection.find({}, PROYECCION_CLIENTES_LISTA)
                     .sort("_id", -1)  # Ordenar por _id descendente (más recientes primero)
                     .limit(1000))
     
-    # Normalizar campos para compatibilidad con frontend (misma lógica, sin cambios)
-    clientes_normalizados = []
-    for cliente in clientes:
-        cliente_normalizado = {
-            "_id": str(cliente["_id"]),
-            "nombre": cliente.get("nombre") or cliente.get("nombres") or cliente.get("cliente_nombre") or "",
-            "rif": cliente.get("rif") or cliente.get("cedula") or "",
-            "direccion": cliente.get("direccion") or cliente.get("cliente_direccion") or "",
-            "telefono": cliente.get("telefono") or cliente.get("telefono_contacto") or cliente.get("cliente_telefono") or "",
-        }
-        clientes_normalizados.append(cliente_normalizado)
-    
-    return clientes_normalizados
+    return [normalizar_cliente_lista(cliente) for cliente in clientes]
+
+@router.get("/buscar")
+async def buscar_clientes(
+    response: Response,
+    q: Optional[str] = Query(None, description="Prefijo del nombre o del RIF/cédula; vacío lista todos por nombre"),
+    limit: int = Query(20, gt=0, le=PAGINA_MAX, description="Clientes por página"),
+    cursor: Optional[str] = Query(None, description="Cursor de la página siguiente (header X-Next-Cursor)")
+):
+    """
+    Buscar clientes por prefijo de nombre (sin mayúsculas ni acentos) o de RIF/cédula,
+    ordenados alfabéticamente y paginados por cursor. Usa los campos nombre_busqueda y
+    rif_normalizado (ver scripts/normalizar_busqueda_clientes.py para clientes antiguos).
+    """
+    try:
+        consulta_rif = normalizar_rif(q)
+        if q and PATRON_CONSULTA_RIF.match(consulta_rif):
+            orden = ORDEN_CLIENTES_RIF
+            if consulta_rif[0].isdigit():
+                # Sin tipo: la cédula puede estar guardada con o sin la letra
+                filtro = {"$or": [
+                    {"rif_normalizado": rango_prefijo(prefijo + consulta_rif)}
+                    for prefijo in ("",) + tuple(TIPOS_RIF)
+                ]}
+            else:
+                filtro = {"rif_normalizado": rango_prefijo(consulta_rif)}
+        else:
+            orden = ORDEN_CLIENTES_NOMBRE
+            consulta_nombre = normalizar(q)
+            filtro = {"nombre_busqueda": rango_prefijo(consulta_nombre)} if consulta_nombre else {}
+
+        clientes, siguiente = paginar(clientes_collection, filtro, orden, limit, cursor, PROYECCION_CLIENTES_LISTA)
+        if siguiente:
+            response.headers["X-Next-Cursor"] = siguiente
+        return [normalizar_cliente_lista(cliente) for cliente in clientes]
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"ERROR BUSCAR CLIENTES: {str(e)}")
+        import traceback
+        print(f"ERROR BUSCAR CLIENTES TRACEBACK: {traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail=f"Error al buscar clientes: {str(e)}")
 
 @router.get("/id/{cliente_id}/")
 async def get_cliente(cliente_id: str):
@@ -100,6 +170,7 @@ async def create_cliente(cliente: Cliente):
         cliente_dict = cliente.dict(by_alias=True)
         if "id" in cliente_dict:
             del cliente_dict["id"]
+        cliente_dict.update(claves_busqueda_cliente(cliente_dict))
         
         # Verificar si ya existe un cliente con el mismo nombre
         existing_client = clientes_collection.find_one({"nombre": cliente.nombre})
@@ -135,9 +206,14 @@ async def update_cliente(cliente_id: str, cliente: Cliente):
         obj_id = ObjectId(cliente_id)
     except Exception:
         raise HTTPException(status_code=400, detail="ID de cliente inválido")
+    cambios = cliente.dict(exclude_unset=True)
+    if "nombre" in cambios:
+        cambios["nombre_busqueda"] = normalizar(cambios["nombre"])
+    if "rif" in cambios:
+        cambios["rif_normalizado"] = normalizar_rif(cambios["rif"])
     result = clientes_collection.update_one(
         {"_id": obj_id},
-        {"$set": cliente.dict(exclude_unset=True)}
+        {"$set": cambios}
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Cliente no encontrado")
@@ -232,6 +308,80 @@ async def update_cliente_perfil(cliente_id: str, cliente_update: ClienteUpdate,
 # ENDPOINTS PARA DATOS DEL DASHBOARD DE CLIENTES (Carrito, Borradores, Preferencias)
 # ============================================================================
 
+# Autoguardado con revisiones: el portal envía una revisión creciente en cada guardado y el
+# servidor descarta los que llegan después de uno más nuevo (peticiones desordenadas).
+# Los PATCH escriben solo la línea o los campos que cambiaron.
+
+CAMPO_LINEA_CARRITO = "id"
+
+def filtro_revision(cliente_id: str, campo: str, revision: Optional[int]) -> dict:
+    """Filtro del documento del cliente que solo coincide si la revisión guardada es menor"""
+    filtro = {"cliente_id": cliente_id}
+    if revision is not None:
+        filtro["$or"] = [{campo: {"$lt": revision}}, {campo: {"$exists": False}}]
+    return filtro
+
+def validar_campos_patch(campos) -> None:
+    for campo in campos:
+        if not isinstance(campo, str) or not campo or "." in campo or campo.startswith("$"):
+            raise HTTPException(status_code=400, detail=f"Nombre de campo inválido: {campo!r}")
+
+def _etapa_operacion_carrito(operacion: OperacionCarrito) -> dict:
+    """Etapa de pipeline de actualización que aplica una operación sobre la línea operacion.id"""
+    items = {"$ifNull": ["$items", []]}
+    es_linea = {"$eq": ["$$linea." + CAMPO_LINEA_CARRITO, operacion.id]}
+    if operacion.op == "agregar":
+        if not isinstance(operacion.item, dict):
+            raise HTTPException(status_code=400, detail="'agregar' requiere 'item'")
+        item = {"$literal": {**operacion.item, CAMPO_LINEA_CARRITO: operacion.id}}
+        # Si la línea ya estaba en el carrito se reemplaza en su lugar; si no, se agrega al final
+        return {"$set": {"items": {"$cond": [
+            {"$in": [operacion.id, {"$map": {"input": items, "as": "linea", "in": "$$linea." + CAMPO_LINEA_CARRITO}}]},
+            {"$map": {"input": items, "as": "linea", "in": {"$cond": [es_linea, item, "$$linea"]}}},
+            {"$concatArrays": [items, [item]]}
+        ]}}}
+    if operacion.op == "quitar":
+        return {"$set": {"items": {"$filter": {"input": items, "as": "linea", "cond": {"$not": [es_linea]}}}}}
+    if operacion.op == "actualizar":
+        if not isinstance(operacion.item, dict):
+            raise HTTPException(status_code=400, detail="'actualizar' requiere 'item'")
+        validar_campos_patch(operacion.item.keys())
+        cambios = {campo: valor for campo, valor in operacion.item.items() if campo != CAMPO_LINEA_CARRITO}
+    else:
+        if operacion.cantidad is None or operacion.cantidad <= 0:
+            raise HTTPException(status_code=400, detail="'cantidad' requiere una cantidad mayor a 0")
+        cambios = {"cantidad": operacion.cantidad}
+    return {"$set": {"items": {"$map": {"input": items, "as": "linea", "in": {"$cond": [
+        es_linea, {"$mergeObjects": ["$$linea", {"$literal": cambios}]}, "$$linea"
+    ]}}}}}
+
+def lineas_requeridas_carrito(operaciones: List[OperacionCarrito]) -> List[str]:
+    """
+    Líneas que ya deben estar en el carrito: las que se actualizan o cambian de cantidad sin
+    haberse agregado antes en el mismo cambio. Una línea quitada antes en el mismo cambio es un error.
+    """
+    agregadas = set()
+    quitadas = set()
+    requeridas = []
+    for operacion in operaciones:
+        if operacion.op == "agregar":
+            agregadas.add(operacion.id)
+            quitadas.discard(operacion.id)
+        elif operacion.op == "quitar":
+            quitadas.add(operacion.id)
+            agregadas.discard(operacion.id)
+        elif operacion.id in quitadas:
+            raise HTTPException(status_code=409, detail=f"La línea '{operacion.id}' se quita antes en el mismo cambio")
+        elif operacion.id not in agregadas and operacion.id not in requeridas:
+            requeridas.append(operacion.id)
+    return requeridas
+
+def pipeline_operaciones_carrito(operaciones: List[OperacionCarrito], marca: dict) -> list:
+    """Todas las operaciones en un solo pipeline de actualización (una etapa por operación)"""
+    return [_etapa_operacion_carrito(operacion) for operacion in operaciones] + [
+        {"$set": {campo: {"$literal": valor} for campo, valor in marca.items()}}
+    ]
+
 # ----------------------------- CARRITO -----------------------------
 
 @router.get("/{cliente_id}/carrito")
@@ -293,6 +443,9 @@ async def save_carrito_cliente(
         items = carrito_data.get("items", [])
         if not isinstance(items, list):
             raise HTTPException(status_code=400, detail="El campo 'items' debe ser un array")
+        revision = carrito_data.get("revision")
+        if revision is not None and not isinstance(revision, int):
+            raise HTTPException(status_code=400, detail="El campo 'revision' debe ser un entero")
         
         # Preparar documento del carrito
         carrito_doc = {
@@ -300,20 +453,34 @@ async def save_carrito_cliente(
             "items": items,
             "fecha_actualizacion": datetime.utcnow().isoformat()
         }
+        if revision is not None:
+            carrito_doc["revision"] = revision
         
-        # Usar upsert para crear o actualizar
-        result = carritos_clientes_collection.update_one(
-            {"cliente_id": cliente_id},
-            {"$set": carrito_doc},
-            upsert=True
-        )
+        # Usar upsert para crear o actualizar; con revisión, un guardado más viejo no coincide
+        # con el filtro y el upsert choca con el índice único de cliente_id
+        try:
+            carrito_actualizado = carritos_clientes_collection.find_one_and_update(
+                filtro_revision(cliente_id, "revision", revision),
+                {"$set": carrito_doc},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            carrito_actualizado = None
         
-        # Retornar el documento actualizado
-        carrito_actualizado = carritos_clientes_collection.find_one({"cliente_id": cliente_id})
-        carrito_actualizado["_id"] = str(carrito_actualizado["_id"])
+        if not carrito_actualizado:
+            carrito_actual = carritos_clientes_collection.find_one({"cliente_id": cliente_id})
+            carrito_actual["_id"] = str(carrito_actual["_id"])
+            return {
+                "message": "Guardado descartado: el carrito ya tiene una revisión más nueva",
+                "aplicado": False,
+                "carrito": carrito_actual
+            }
         
+        carrito_actualizado["_id"] = str(carrito_actualizado["_id"])
         return {
             "message": "Carrito guardado correctamente",
+            "aplicado": True,
             "carrito": carrito_actualizado
         }
         
@@ -325,6 +492,79 @@ async def save_carrito_cliente(
         print(f"ERROR SAVE CARRITO TRACEBACK: {traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=f"Error al guardar carrito: {str(e)}")
 
+@router.patch("/{cliente_id}/carrito")
+async def patch_carrito_cliente(
+    cliente_id: str,
+    patch: PatchCarrito,
+    cliente: dict = Depends(get_current_cliente)
+):
+    """
+    Aplicar cambios de líneas al carrito sin reenviar todos los items.
+    Body: { "revision": 12, "operaciones": [
+        {"op": "agregar", "id": "...", "item": {...}},
+        {"op": "actualizar", "id": "...", "item": {"campo": valor}},
+        {"op": "cantidad", "id": "...", "cantidad": 3},
+        {"op": "quitar", "id": "..."}
+    ]}
+    Las operaciones se aplican todas juntas en una sola escritura, o ninguna.
+    Si el carrito ya tiene una revisión igual o mayor, el cambio se descarta (aplicado: false)
+    y se devuelve el carrito actual. Actualizar o cambiar la cantidad de una línea que no está
+    en el carrito responde 409 sin aplicar nada.
+    """
+    try:
+        # Verificar que el cliente_id coincida con el cliente autenticado
+        if cliente.get("id") != cliente_id:
+            raise HTTPException(status_code=403, detail="No puedes modificar el carrito de otros clientes")
+        
+        if not patch.operaciones:
+            raise HTTPException(status_code=400, detail="No hay operaciones para aplicar")
+        
+        marca = {"revision": patch.revision, "fecha_actualizacion": datetime.utcnow().isoformat()}
+        pipeline = pipeline_operaciones_carrito(patch.operaciones, marca)
+        requeridas = lineas_requeridas_carrito(patch.operaciones)
+        
+        # Una sola escritura: o se aplican todas las operaciones o ninguna. Las líneas que se
+        # actualizan deben existir; sin ellas el filtro no coincide y no se crea el carrito
+        filtro = filtro_revision(cliente_id, "revision", patch.revision)
+        if requeridas:
+            filtro["$and"] = [{"items": {"$elemMatch": {CAMPO_LINEA_CARRITO: linea}}} for linea in requeridas]
+        try:
+            carrito = carritos_clientes_collection.find_one_and_update(
+                filtro, pipeline, upsert=not requeridas, return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            carrito = None
+        
+        aplicado = carrito is not None
+        if not aplicado:
+            carrito = carritos_clientes_collection.find_one({"cliente_id": cliente_id}) or {
+                "cliente_id": cliente_id, "items": [], "fecha_actualizacion": None
+            }
+            if carrito.get("revision") is None or carrito["revision"] < patch.revision:
+                # La revisión es válida: el filtro no coincidió por líneas que no están en el carrito
+                existentes = {linea.get(CAMPO_LINEA_CARRITO) for linea in carrito.get("items") or [] if isinstance(linea, dict)}
+                faltantes = [linea for linea in requeridas if linea not in existentes] or requeridas
+                raise HTTPException(
+                    status_code=409,
+                    detail=f"Líneas no encontradas en el carrito: {', '.join(faltantes)}"
+                )
+        if "_id" in carrito:
+            carrito["_id"] = str(carrito["_id"])
+        
+        return {
+            "message": "Carrito actualizado correctamente" if aplicado else "Cambio descartado: el carrito ya tiene una revisión más nueva",
+            "aplicado": aplicado,
+            "carrito": carrito
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"ERROR PATCH CARRITO: {str(e)}")
+        import traceback
+        print(f"ERROR PATCH CARRITO TRACEBACK: {traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail=f"Error al actualizar carrito: {str(e)}")
+
 # ----------------------------- BORRADORES -----------------------------
 
 @router.get("/{cliente_id}/borradores")
@@ -406,24 +646,38 @@ async def save_borrador_cliente(
             "fecha_actualizacion": datetime.utcnow().isoformat()
         }
         
+        # Revisión opcional del autoguardado: viene en el body como "_revision" (no se guarda en el borrador)
+        revision = borrador_data.pop("_revision", None)
+        if revision is not None and not isinstance(revision, int):
+            raise HTTPException(status_code=400, detail="El campo '_revision' debe ser un entero")
+        campo_revision = f"revisiones.{tipo}"
+        if revision is not None:
+            update_doc[campo_revision] = revision
+        
         # Actualizar o crear el documento de borradores
-        result = borradores_clientes_collection.update_one(
-            {"cliente_id": cliente_id},
-            {
-                "$set": {
-                    **update_field,
-                    **update_doc
-                }
-            },
-            upsert=True
-        )
+        try:
+            borradores_actualizado = borradores_clientes_collection.find_one_and_update(
+                filtro_revision(cliente_id, campo_revision, revision),
+                {
+                    "$set": {
+                        **update_field,
+                        **update_doc
+                    }
+                },
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            borradores_actualizado = None
         
-        # Retornar el documento actualizado
-        borradores_actualizado = borradores_clientes_collection.find_one({"cliente_id": cliente_id})
+        aplicado = borradores_actualizado is not None
+        if not aplicado:
+            borradores_actualizado = borradores_clientes_collection.find_one({"cliente_id": cliente_id})
         borradores_actualizado["_id"] = str(borradores_actualizado["_id"])
         
         return {
-            "message": f"Borrador {tipo} guardado correctamente",
+            "message": f"Borrador {tipo} guardado correctamente" if aplicado else f"Guardado descartado: el borrador {tipo} ya tiene una revisión más nueva",
+            "aplicado": aplicado,
             "borradores": borradores_actualizado
         }
         
@@ -435,6 +689,71 @@ async def save_borrador_cliente(
         print(f"ERROR SAVE BORRADOR TRACEBACK: {traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=f"Error al guardar borrador: {str(e)}")
 
+@router.patch("/{cliente_id}/borradores/{tipo}")
+async def patch_borrador_cliente(
+    cliente_id: str,
+    tipo: str,
+    patch: PatchBorrador,
+    cliente: dict = Depends(get_current_cliente)
+):
+    """
+    Actualizar solo los campos de un borrador que cambiaron.
+    Body: { "revision": 7, "campos": {"asunto": "..."}, "quitar": ["adjunto"] }
+    Si el borrador ya tiene una revisión igual o mayor, el cambio se descarta (aplicado: false).
+    """
+    try:
+        # Verificar que el cliente_id coincida con el cliente autenticado
+        if cliente.get("id") != cliente_id:
+            raise HTTPException(status_code=403, detail="No puedes modificar los borradores de otros clientes")
+        
+        # Validar tipo
+        if tipo not in ["reclamo", "soporte"]:
+            raise HTTPException(status_code=400, detail="El tipo debe ser 'reclamo' o 'soporte'")
+        
+        if not patch.campos and not patch.quitar:
+            raise HTTPException(status_code=400, detail="No hay cambios para aplicar")
+        validar_campos_patch(list(patch.campos) + patch.quitar)
+        
+        campo_revision = f"revisiones.{tipo}"
+        filtro = filtro_revision(cliente_id, campo_revision, patch.revision)
+        marca = {campo_revision: patch.revision, "fecha_actualizacion": datetime.utcnow().isoformat()}
+        update = {"$set": {**{f"borradores.{tipo}.{campo}": valor for campo, valor in patch.campos.items()}, **marca}}
+        if patch.quitar:
+            update["$unset"] = {f"borradores.{tipo}.{campo}": "" for campo in patch.quitar}
+        
+        try:
+            borradores = borradores_clientes_collection.find_one_and_update(
+                filtro, update, upsert=True, return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            borradores = None
+        except OperationFailure as e:
+            if e.code != 28:  # PathNotViable: el borrador está en null
+                raise
+            # Borrador vacío (null): se crea con los campos recibidos
+            borradores = borradores_clientes_collection.find_one_and_update(
+                filtro, {"$set": {f"borradores.{tipo}": patch.campos, **marca}}, return_document=ReturnDocument.AFTER
+            )
+        
+        aplicado = borradores is not None
+        if not aplicado:
+            borradores = borradores_clientes_collection.find_one({"cliente_id": cliente_id})
+        borradores["_id"] = str(borradores["_id"])
+        
+        return {
+            "message": f"Borrador {tipo} actualizado correctamente" if aplicado else f"Cambio descartado: el borrador {tipo} ya tiene una revisión más nueva",
+            "aplicado": aplicado,
+            "borradores": borradores
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"ERROR PATCH BORRADOR: {str(e)}")
+        import traceback
+        print(f"ERROR PATCH BORRADOR TRACEBACK: {traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail=f"Error al actualizar borrador: {str(e)}")
+
 @router.delete("/{cliente_id}/borradores/{tipo}")
 async def delete_borrador_cliente(
     cliente_id: str,
@@ -786,8 +1105,21 @@ async def get_datos_dashboard_cliente(cliente_id: str, cliente: dict = Depends(g
         except Exception:
             raise HTTPException(status_code=400, detail="ID de cliente inválido")
         
-        # Obtener carrito
-        carrito_doc = carritos_clientes_collection.find_one({"cliente_id": cliente_id})
+        # Las cuatro consultas son independientes: se ejecutan a la vez
+        try:
+            datos = await consultas_en_paralelo({
+                "carrito": lambda: carritos_clientes_collection.find_one({"cliente_id": cliente_id}),
+                "borradores": lambda: borradores_clientes_collection.find_one({"cliente_id": cliente_id}),
+                "preferencias": lambda: preferencias_clientes_collection.find_one({"cliente_id": cliente_id}),
+                "tickets": lambda: list(soporte_reclamos_clientes_collection.find({
+                    "cliente_id": cliente_id
+                }).sort("fecha_creacion", -1))
+            })
+        except ConsultaTimeout as e:
+            raise HTTPException(status_code=504, detail=f"Tiempo de espera agotado al obtener datos del dashboard: {e.nombre}")
+        
+        # Carrito
+        carrito_doc = datos["carrito"]
         carrito = {
             "cliente_id": cliente_id,
             "items": [],
@@ -802,8 +1134,8 @@ async def get_datos_dashboard_cliente(cliente_id: str, cliente: dict = Depends(g
             if "_id" in carrito_doc:
                 carrito["_id"] = str(carrito_doc["_id"])
         
-        # Obtener borradores
-        borradores_doc = borradores_clientes_collection.find_one({"cliente_id": cliente_id})
+        # Borradores
+        borradores_doc = datos["borradores"]
         borradores = {
             "cliente_id": cliente_id,
             "borradores": {
@@ -824,8 +1156,8 @@ async def get_datos_dashboard_cliente(cliente_id: str, cliente: dict = Depends(g
             if "borradores" not in borradores or not isinstance(borradores["borradores"], dict):
                 borradores["borradores"] = {"reclamo": None, "soporte": None}
         
-        # Obtener preferencias
-        preferencias_doc = preferencias_clientes_collection.find_one({"cliente_id": cliente_id})
+        # Preferencias
+        preferencias_doc = datos["preferencias"]
         preferencias = {
             "cliente_id": cliente_id,
             "vista_activa": "catalogo",
@@ -842,10 +1174,8 @@ async def get_datos_dashboard_cliente(cliente_id: str, cliente: dict = Depends(g
             if "_id" in preferencias_doc:
                 preferencias["_id"] = str(preferencias_doc["_id"])
         
-        # Obtener tickets de soporte/reclamos
-        tickets = list(soporte_reclamos_clientes_collection.find({
-            "cliente_id": cliente_id
-        }).sort("fecha_creacion", -1))
+        # Tickets de soporte/reclamos
+        tickets = datos["tickets"]
         for ticket in tickets:
             ticket["_id"] = str(ticket["_id"])
         
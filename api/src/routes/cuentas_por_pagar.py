@@ -11,6 +11,9 @@ from ..models.cuentasporpagarmodels import (
 )
 from ..auth.auth import get_current_user
 from ..config.mongodb import items_collection
+from ..utils.versiones import RECURSO_INVENTARIO, incrementar_version
+from ..utils.inventario import ETAPA_SIN_EXISTENCIA
+from .metodos_pago import aplicar_movimiento_saldo
 
 router = APIRouter()
 cuentas_por_pagar_collection = db["cuentas_por_pagar"]
@@ -273,16 +276,16 @@ async def create_cuenta_por_pagar(
                             # El campo "costo" en inventario debe representar: costo por unidad, no costo total
                             items_collection.update_one(
                                 {"_id": item_inventario["_id"]},
-                                {
-                                    "$inc": {
-                                        "cantidad": cantidad_a_sumar  # Sumar cantidad
-                                    },
-                                    "$set": {
+                                [
+                                    {"$set": {
+                                        "cantidad": {"$add": [{"$ifNull": ["$cantidad", 0]}, cantidad_a_sumar]},  # Sumar cantidad
                                         "costo": costo_unitario  # Establecer costo unitario (costo más reciente)
-                                    }
-                                }
+                                    }},
+                                    ETAPA_SIN_EXISTENCIA
+                                ]
                             )
                             
+                            incrementar_version(RECURSO_INVENTARIO)
                             nueva_cantidad = cantidad_actual + cantidad_a_sumar
                             
                             print(f"DEBUG CREAR CUENTA: Item {item_inventario.get('codigo', 'N/A')} actualizado:")
@@ -399,25 +402,27 @@ async def abonar_cuenta_por_pagar(
                 detail=f"Saldo insuficiente en el método de pago. Saldo disponible: {saldo_metodo}, Monto requerido: {request.monto}"
             )
         
-        # Restar del saldo del método de pago
-        nuevo_saldo_metodo = saldo_metodo - request.monto
-        metodos_pago_collection.update_one(
-            {"_id": metodo_pago_obj_id},
-            {"$set": {"saldo": nuevo_saldo_metodo}}
-        )
-        print(f"DEBUG ABONAR: Método de pago '{metodo_pago.get('nombre', 'N/A')}' actualizado: {saldo_metodo} -> {nuevo_saldo_metodo}")
-        
-        # Registrar transacción en el historial del método de pago
+        # Restar del saldo del método de pago (solo si el saldo sigue alcanzando) y registrar
+        # la transacción en el historial del método con el saldo resultante
         transaccion = {
-            "metodo_pago_id": str(metodo_pago_obj_id),
             "tipo": "pago_cuenta_por_pagar",
             "monto": -request.monto,  # Negativo porque es un egreso
             "concepto": request.concepto or f"Abono a cuenta por pagar - Proveedor: {cuenta.get('proveedor_nombre', 'N/A')}",
             "cuenta_por_pagar_id": str(cuenta_obj_id),
-            "fecha": datetime.utcnow().isoformat()
+            "fecha": datetime.utcnow()
         }
-        transacciones_collection.insert_one(transaccion)
-        print(f"DEBUG ABONAR: Transacción registrada en historial del método de pago")
+        metodo_actualizado = aplicar_movimiento_saldo(
+            {"_id": metodo_pago_obj_id, "saldo": {"$gte": request.monto}},
+            -request.monto,
+            transaccion
+        )
+        if not metodo_actualizado:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Saldo insuficiente en el método de pago. Monto requerido: {request.monto}"
+            )
+        nuevo_saldo_metodo = metodo_actualizado.get("saldo", 0)
+        print(f"DEBUG ABONAR: Método de pago '{metodo_pago.get('nombre', 'N/A')}' actualizado: {saldo_metodo} -> {nuevo_saldo_metodo}")
         
         # Calcular nuevo saldo pendiente
         nuevo_saldo_pendiente = saldo_pendiente - request.monto
@@ -5,6 +5,9 @@ from bson import ObjectId
 from ..auth.auth import get_current_user
 from ..config.mongodb import db
 from ..models.authmodels import Empleado
+from ..utils.jobs import JobContext, iterar_por_lotes
+from .jobs import job_runner
+from pymongo import UpdateOne
 
 router = APIRouter()
 
@@ -571,47 +574,35 @@ async def poblar_datos_asignaciones(current_user = Depends(get_current_user)):
         print(f"ERROR POBLAR: Error al poblar datos: {e}")
         raise HTTPException(status_code=500, detail="Error al poblar datos de prueba")
 
-@router.post("/asignaciones/migrar-datos-reales")
-async def migrar_datos_reales_dashboard():
-    """Migrar datos reales del seguimiento de pedidos a la colección de asignaciones"""
-    try:
-        collections = get_collections()
-        
-        print(f"DEBUG MIGRAR: Iniciando migración de datos reales")
-        
-        # Obtener todos los pedidos con seguimiento
-        pedidos = list(collections["pedidos"].find({
-            "seguimiento": {"$exists": True, "$ne": []}
-        }))
-        
-        print(f"DEBUG MIGRAR: Encontrados {len(pedidos)} pedidos con seguimiento")
-        
-        asignaciones_migradas = []
-        modulo_orden = {
-            1: "herreria",
-            2: "masillar", 
-            3: "preparar",
-            4: "listo_facturar"
-        }
-        
-        for pedido in pedidos:
+@job_runner.registrar("migrar_datos_reales_dashboard")
+def job_migrar_datos_reales_dashboard(ctx: JobContext):
+    """Copiar las asignaciones del seguimiento de pedidos a la colección asignaciones, por lotes"""
+    collections = get_collections()
+    filtro = {"seguimiento": {"$exists": True, "$ne": []}}
+    ctx.set_total(collections["pedidos"].count_documents(filtro))
+    
+    modulo_orden = {
+        1: "herreria",
+        2: "masillar", 
+        3: "preparar",
+        4: "listo_facturar"
+    }
+    
+    proyeccion = {"cliente_nombre": 1, "seguimiento": 1}
+    for lote in iterar_por_lotes(ctx, collections["pedidos"], filtro, proyeccion):
+        operaciones = []
+        for pedido in lote:
             pedido_id = str(pedido["_id"])
             cliente_nombre = pedido.get("cliente_nombre", "Sin nombre")
             
-            print(f"DEBUG MIGRAR: Procesando pedido {pedido_id} - {cliente_nombre}")
-            
-            seguimiento = pedido.get("seguimiento", [])
-            
-            for sub in seguimiento:
+            for sub in pedido.get("seguimiento", []):
                 orden = sub.get("orden")
                 modulo = modulo_orden.get(orden, "desconocido")
                 
                 if modulo == "desconocido":
                     continue
                 
-                asignaciones_articulos = sub.get("asignaciones_articulos", [])
-                
-                for asignacion in asignaciones_articulos:
+                for asignacion in sub.get("asignaciones_articulos", []):
                     # Crear asignación para el dashboard
                     nueva_asignacion = {
                         "pedido_id": pedido_id,
@@ -631,34 +622,40 @@ async def migrar_datos_reales_dashboard():
                         "estado_subestado": asignacion.get("estado_subestado", "pendiente")
                     }
                     
-                    # Verificar si ya existe esta asignación
-                    asignacion_existente = collections["asignaciones"].find_one({
-                        "pedido_id": pedido_id,
-                        "item_id": nueva_asignacion["item_id"],
-                        "modulo": modulo
-                    })
-                    
-                    if not asignacion_existente:
-                        resultado = collections["asignaciones"].insert_one(nueva_asignacion)
-                        nueva_asignacion["_id"] = str(resultado.inserted_id)
-                        asignaciones_migradas.append(nueva_asignacion)
-                        print(f"DEBUG MIGRAR: Asignación migrada - {modulo} - {nueva_asignacion['descripcionitem']}")
-                    else:
-                        print(f"DEBUG MIGRAR: Asignación ya existe - {modulo} - {nueva_asignacion['descripcionitem']}")
-        
-        print(f"DEBUG MIGRAR: Migración completada - {len(asignaciones_migradas)} asignaciones migradas")
-        
-        return {
-            "message": f"Migración completada exitosamente",
-            "asignaciones_migradas": len(asignaciones_migradas),
-            "pedidos_procesados": len(pedidos),
-            "asignaciones": asignaciones_migradas[:10],  # Mostrar solo las primeras 10
-            "success": True
-        }
-        
-    except Exception as e:
-        print(f"ERROR MIGRAR: Error al migrar datos: {e}")
-        raise HTTPException(status_code=500, detail=f"Error al migrar datos reales: {str(e)}")
+                    # Solo se inserta si no existe (pedido_id, item_id, modulo)
+                    operaciones.append(UpdateOne(
+                        {
+                            "pedido_id": pedido_id,
+                            "item_id": nueva_asignacion["item_id"],
+                            "modulo": modulo
+                        },
+                        {"$setOnInsert": nueva_asignacion},
+                        upsert=True
+                    ))
+        
+        migradas = 0
+        if operaciones:
+            migradas = collections["asignaciones"].bulk_write(operaciones, ordered=False).upserted_count
+        ctx.guardar_progreso(
+            procesados=len(lote),
+            checkpoint={"ultimo_id": lote[-1]["_id"]},
+            asignaciones_migradas=migradas,
+            asignaciones_existentes=len(operaciones) - migradas
+        )
+
+@router.post("/asignaciones/migrar-datos-reales", status_code=202)
+async def migrar_datos_reales_dashboard():
+    """
+    Migrar datos reales del seguimiento de pedidos a la colección de asignaciones.
+    Se ejecuta en segundo plano; consultar el progreso en /jobs/{job_id}
+    """
+    job = job_runner.lanzar("migrar_datos_reales_dashboard")
+    return {
+        "message": "Migración de datos reales en ejecución",
+        "job_id": job["job_id"],
+        "estado": job["estado"],
+        "success": True
+    }
 
 @router.get("/asignaciones/datos-reales")
 async def get_datos_reales_dashboard():
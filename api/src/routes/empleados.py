@@ -1,9 +1,12 @@
-from fastapi import APIRouter, HTTPException, Body, Depends
+from fastapi import APIRouter, HTTPException, Body, Depends, Request, Response
 from bson import ObjectId
 from datetime import datetime
 from ..config.mongodb import empleados_collection
 from ..auth.auth import get_password_hash, get_current_admin_user
 from ..models.authmodels import Empleado, EmpleadoCreate, EmpleadoUpdate
+from ..utils.cache import cache, CACHE_KEY_EMPLEADOS
+from ..utils.empleados import invalidar_empleados
+from ..utils.versiones import RECURSO_EMPLEADOS, respuesta_condicional
 import re
 
 router = APIRouter()
@@ -29,12 +32,15 @@ async def test_empleados_endpoint():
     return {"message": "Router de empleados funcionando correctamente", "status": "ok"}
 
 @router.get("/all/")
-async def get_all_empleados():
+async def get_all_empleados(request: Request, response: Response):
     """
     Obtener todos los empleados con caché (TTL: 5 minutos).
     Los empleados cambian poco, por lo que el caché mejora significativamente el rendimiento.
+    Si el cliente envía el ETag vigente se responde 304 sin cuerpo.
     """
-    from ..utils.cache import cache, CACHE_KEY_EMPLEADOS
+    no_modificado = respuesta_condicional(request, response, RECURSO_EMPLEADOS)
+    if no_modificado:
+        return no_modificado
     
     # Verificar caché primero (TTL de 5 minutos = 300 segundos)
     cached_empleados = cache.get(CACHE_KEY_EMPLEADOS)
@@ -120,6 +126,7 @@ async def create_empleado(empleado: EmpleadoCreate):
         raise HTTPException(status_code=400, detail="El usuario ya existe")
     
     result = empleados_collection.insert_one(empleado.dict())
+    invalidar_empleados()
     return {"message": "Empleado creado correctamente", "id": str(result.inserted_id)}
 
 @router.get("/{empleado_id}/")
@@ -162,6 +169,7 @@ async def update_empleado(empleado_id: str, empleado: EmpleadoUpdate):
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Empleado no encontrado")
+    invalidar_empleados()
     return {"message": "Empleado actualizado correctamente", "id": empleado_id}
 
 @router.get("/verificar-pin/{pin}")
@@ -267,6 +275,7 @@ async def agregar_vale(empleado_id: str, vale_data: dict = Body(...)):
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Empleado no encontrado")
+    invalidar_empleados()
     
     return {
         "message": "Vale agregado correctamente",
@@ -371,6 +380,7 @@ async def abonar_vale(empleado_id: str, abono_data: dict = Body(...)):
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Empleado no encontrado")
+    invalidar_empleados()
     
     return {
         "message": "Abono aplicado correctamente",
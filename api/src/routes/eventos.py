@@ -0,0 +1,166 @@
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from bson import ObjectId
+from typing import Optional
+import json
+import jwt
+from ..auth.auth import get_current_user, get_current_cliente, SECRET_KEY, ALGORITHM
+from ..config.mongodb import db, pedidos_collection
+from ..utils.eventos import ChangeStreamWatcher, event_bus
+
+router = APIRouter()
+
+# Temas que puede pedir el personal (los clientes solo sus conversaciones "mensajes:{pedido_id}")
+TEMAS_PERSONAL = {"asignaciones", "pedidos", "mensajes"}
+# Cada cuánto se envía un comentario para mantener viva la conexión (proxies, balanceadores)
+HEARTBEAT_SEGUNDOS = 15
+
+async def autenticar_suscriptor(token: Optional[str]) -> dict:
+    """
+    EventSource no permite enviar headers, así que el token llega como query param.
+    Devuelve {"tipo": "personal"|"cliente", "id": str}.
+    """
+    if not token:
+        raise HTTPException(status_code=401, detail="Debes estar autenticado")
+    try:
+        rol = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("rol")
+    except jwt.PyJWTError:
+        raise HTTPException(status_code=401, detail="Token inválido o expirado")
+    if rol == "cliente":
+        cliente = await get_current_cliente(token)
+        return {"tipo": "cliente", "id": str(cliente.get("id"))}
+    user = await get_current_user(token)
+    return {"tipo": "personal", "id": str(user.get("id"))}
+
+def temas_permitidos(temas: set, suscriptor: dict) -> set:
+    if suscriptor["tipo"] == "personal":
+        invalidos = {t for t in temas if t.split(":", 1)[0] not in TEMAS_PERSONAL}
+        if invalidos:
+            raise HTTPException(status_code=400, detail=f"Temas no válidos: {', '.join(sorted(invalidos))}")
+        return temas
+
+    # Clientes: solo conversaciones propias (soporte_{id} o sus pedidos)
+    permitidos = set()
+    for tema in temas:
+        base, _, pedido_id = tema.partition(":")
+        if base != "mensajes" or not pedido_id:
+            raise HTTPException(status_code=403, detail=f"No tienes acceso al tema {tema}")
+        if pedido_id == f"soporte_{suscriptor['id']}":
+            permitidos.add(tema)
+            continue
+        if not ObjectId.is_valid(pedido_id) or not pedidos_collection.find_one(
+            {"_id": ObjectId(pedido_id), "cliente_id": suscriptor["id"]}, {"_id": 1}
+        ):
+            raise HTTPException(status_code=403, detail=f"No tienes acceso al tema {tema}")
+        permitidos.add(tema)
+    return permitidos
+
+def formatear_evento(evento: dict) -> str:
+    datos = {**evento["datos"], "tema": evento["tema"], "fecha": evento["fecha"]}
+    return f"id: {evento['id']}\nevent: {evento['tema'].split(':', 1)[0]}\ndata: {json.dumps(datos, default=str)}\n\n"
+
+def eventos_desde_cambio_pedido(change: dict) -> list:
+    """Traducir un cambio de la colección pedidos a eventos del bus"""
+    pedido_id = str(change.get("documentKey", {}).get("_id"))
+    operacion = change.get("operationType")
+    if operacion == "insert":
+        return [("pedidos", {"pedido_id": pedido_id, "accion": "creado"})]
+    if operacion == "delete":
+        return [("pedidos", {"pedido_id": pedido_id, "accion": "eliminado"})]
+    campos = change.get("updateDescription", {}).get("updatedFields", {})
+    eventos = []
+    if any(c.split(".", 1)[0] in ("items", "seguimiento") for c in campos):
+        eventos.append(("asignaciones", {"pedido_id": pedido_id, "accion": "actualizado"}))
+    if "estado_general" in campos:
+        eventos.append(("pedidos", {"pedido_id": pedido_id, "accion": "estado", "estado_general": campos["estado_general"]}))
+    return eventos
+
+def eventos_desde_cambio_mensaje(change: dict) -> list:
+    mensaje = change.get("fullDocument") or {}
+    pedido_id = mensaje.get("pedido_id")
+    if not pedido_id:
+        return []
+    return [(f"mensajes:{pedido_id}", {
+        "pedido_id": pedido_id,
+        "mensaje_id": str(mensaje.get("_id")),
+        "remitente_tipo": mensaje.get("remitente_tipo")
+    })]
+
+def iniciar_change_streams() -> list:
+    """Arrancar los observadores de change streams; las publicaciones locales dejan de usarse"""
+    event_bus.desde_change_streams = True
+    watchers = [
+        ChangeStreamWatcher(
+            event_bus, pedidos_collection, eventos_desde_cambio_pedido,
+            [{"$match": {"operationType": {"$in": ["insert", "update", "replace", "delete"]}}}]
+        ),
+        ChangeStreamWatcher(
+            event_bus, db["mensajes"], eventos_desde_cambio_mensaje,
+            [{"$match": {"operationType": "insert"}}]
+        )
+    ]
+    for watcher in watchers:
+        watcher.start()
+    return watchers
+
+@router.get("/stream")
+async def stream_eventos(
+    request: Request,
+    temas: str = Query(..., description="Temas separados por coma: asignaciones,pedidos,mensajes o mensajes:{pedido_id}"),
+    token: Optional[str] = Query(None, description="Token JWT (EventSource no envía headers)"),
+    ultimo_id: Optional[int] = Query(None, description="Último evento recibido (alternativa a Last-Event-ID)")
+):
+    """
+    Canal Server-Sent Events con notificaciones compactas de cambios:
+    - asignaciones: asignación o terminación de items ({pedido_id, item_id, accion})
+    - pedidos: pedidos creados, cancelados o finalizados ({pedido_id, accion})
+    - mensajes:{pedido_id}: mensajes nuevos de una conversación ({pedido_id, mensaje_id, remitente_tipo})
+    El cliente vuelve a consultar solo lo que cambió. Al reconectar, EventSource envía
+    Last-Event-ID y se reenvían los eventos recientes que no recibió.
+    """
+    if not token:
+        authorization = request.headers.get("authorization", "")
+        if authorization.startswith("Bearer "):
+            token = authorization.replace("Bearer ", "")
+    suscriptor = await autenticar_suscriptor(token)
+
+    temas_pedidos = {t.strip() for t in temas.split(",") if t.strip()}
+    if not temas_pedidos:
+        raise HTTPException(status_code=400, detail="Debes indicar al menos un tema")
+    temas_suscritos = temas_permitidos(temas_pedidos, suscriptor)
+
+    last_event_id = request.headers.get("last-event-id")
+    if ultimo_id is None and last_event_id and last_event_id.isdigit():
+        ultimo_id = int(last_event_id)
+
+    suscripcion = event_bus.suscribir(temas_suscritos, ultimo_id)
+
+    async def generar():
+        try:
+            # Indicar al navegador cada cuánto reintentar si se corta la conexión
+            yield "retry: 3000\n\n"
+            while True:
+                if await request.is_disconnected():
+                    break
+                eventos = await suscripcion.siguiente(HEARTBEAT_SEGUNDOS)
+                if not eventos:
+                    yield ": ping\n\n"
+                    continue
+                for evento in eventos:
+                    yield formatear_evento(evento)
+        finally:
+            event_bus.cancelar(suscripcion)
+
+    return StreamingResponse(
+        generar(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # Evitar que nginx acumule la respuesta
+        }
+    )
+
+@router.get("/metricas")
+async def get_metricas_eventos():
+    """Suscripciones activas y último evento publicado"""
+    return event_bus.get_metricas()
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, HTTPException, Body, Depends
+from fastapi import APIRouter, HTTPException, Body, Depends, Query, Response
 from typing import List, Optional
 from bson import ObjectId
 from datetime import datetime
@@ -12,11 +12,47 @@ from ..models.facturasypedidosmodels import (
 )
 from ..auth.auth import get_current_user, get_current_cliente
 from ..config.mongodb import pedidos_collection
+from ..utils.paginacion import paginar, PAGINA_DEFAULT, PAGINA_MAX
+from ..utils.snapshots import CAMPO_SNAPSHOT, compactar_snapshot, reconstruir_datos_completos, expandir_snapshot
 
 router = APIRouter()
 facturas_confirmadas_collection = db["facturas_confirmadas"]
 pedidos_cargados_inventario_collection = db["pedidos_cargados_inventario"]
 
+# Listado de facturas: orden del índice idx_factura_fecha_facturacion_desc
+ORDEN_FACTURAS = [("fecha_facturacion", -1), ("_id", -1)]
+# Campos del resumen de factura; de datos_completos solo los usados como respaldo
+# por transform_factura_to_camelcase en facturas antiguas
+PROYECCION_RESUMEN_FACTURA = {
+    "pedidoId": 1,
+    "pedido_id": 1,
+    "numeroFactura": 1,
+    "numero_factura": 1,
+    "cliente_nombre": 1,
+    "clienteNombre": 1,
+    "cliente_id": 1,
+    "clienteId": 1,
+    "fecha_facturacion": 1,
+    "fecha_creacion": 1,
+    "items": 1,
+    "adicionales": 1,
+    "monto_total": 1,
+    "montoTotal": 1,
+    "estado_general": 1,
+    "datos_completos.cliente_nombre": 1,
+    "datos_completos.clienteNombre": 1,
+    "datos_completos.cliente_id": 1,
+    "datos_completos.monto_total": 1,
+    "datos_completos.montoTotal": 1,
+    "datos_completos.estado_general": 1,
+    "datos_completos_snapshot.campos.cliente_nombre": 1,
+    "datos_completos_snapshot.campos.clienteNombre": 1,
+    "datos_completos_snapshot.campos.cliente_id": 1,
+    "datos_completos_snapshot.campos.monto_total": 1,
+    "datos_completos_snapshot.campos.montoTotal": 1,
+    "datos_completos_snapshot.campos.estado_general": 1
+}
+
 def object_id_to_str(data):
     """Convierte ObjectId a string en documentos"""
     if isinstance(data, dict):
@@ -36,12 +72,13 @@ def transform_factura_to_camelcase(data):
     incluso si están vacíos o son None.
     Maneja ambos formatos (snake_case y camelCase) para compatibilidad.
     Si los datos no están en el nivel principal, busca en datos_completos como fallback.
+    datos_completos se reconstruye desde el snapshot compacto si la factura lo tiene.
     """
     if not isinstance(data, dict):
         return data
     
     # Obtener datos_completos primero para usarlo como fallback
-    datos_completos = data.get("datos_completos") or data.get("datosCompletos") or {}
+    datos_completos = reconstruir_datos_completos(data, pedidos_collection) or {}
     if not isinstance(datos_completos, dict):
         datos_completos = {}
     
@@ -215,9 +252,10 @@ async def crear_factura_confirmada(
             "items": items,
             "adicionales": adicionales if adicionales else [],  # Incluir adicionales
             "monto_total": float(monto_total) if monto_total is not None else None,
-            "estado_general": estado_general.strip() if estado_general else None,
-            "datos_completos": datos_completos
+            "estado_general": estado_general.strip() if estado_general else None
         }
+        # Guardar el pedido como snapshot compacto (solo lo que no está ya en la factura)
+        factura_dict[CAMPO_SNAPSHOT] = compactar_snapshot(datos_completos, factura_dict, pedido_id)
         
         if factura_existente:
             # Actualizar registro existente - Combinar datos existentes con nuevos datos
@@ -232,13 +270,22 @@ async def crear_factura_confirmada(
                 "adicionales": adicionales if adicionales is not None else factura_existente.get("adicionales", []),  # Incluir adicionales
                 "monto_total": float(monto_total) if monto_total is not None else factura_existente.get("monto_total"),
                 "estado_general": estado_general.strip() if estado_general else factura_existente.get("estado_general"),
-                "datos_completos": datos_completos if datos_completos else factura_existente.get("datos_completos", {}),
                 "fecha_creacion": factura_existente.get("fecha_creacion", fecha_actual)
             }
+            cambios = {"$set": factura_dict_actualizada}
+            if datos_completos:
+                factura_dict_actualizada[CAMPO_SNAPSHOT] = compactar_snapshot(datos_completos, factura_dict_actualizada, pedido_id)
+                cambios["$unset"] = {"datos_completos": ""}
+            elif factura_existente.get("datos_completos"):
+                # Compactar el respaldo anterior
+                factura_dict_actualizada[CAMPO_SNAPSHOT] = compactar_snapshot(
+                    factura_existente["datos_completos"], factura_dict_actualizada, pedido_id
+                )
+                cambios["$unset"] = {"datos_completos": ""}
             
             result = facturas_confirmadas_collection.update_one(
                 {"pedidoId": pedido_id},
-                {"$set": factura_dict_actualizada}
+                cambios
             )
             
             if result.modified_count == 0:
@@ -271,24 +318,98 @@ async def crear_factura_confirmada(
 
 @router.get("/facturas-confirmadas", response_model=List[FacturaConfirmada])
 async def listar_facturas_confirmadas(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=PAGINA_MAX, description=f"Facturas por página ({PAGINA_DEFAULT} si solo se envía cursor)"),
+    cursor: Optional[str] = Query(None, description="Valor de X-Next-Cursor de la página anterior"),
+    fecha_desde: Optional[str] = Query(None, description="Fecha de facturación mínima (YYYY-MM-DD)"),
+    fecha_hasta: Optional[str] = Query(None, description="Fecha de facturación máxima (YYYY-MM-DD)"),
+    cliente_id: Optional[str] = Query(None),
+    incluir_datos_completos: Optional[bool] = Query(None, description="Incluir la copia completa del pedido (por defecto solo sin paginar)"),
     user: dict = Depends(get_current_user)
 ):
     """
-    Listar todas las facturas confirmadas.
-    Ordenadas por fecha de creación descendente (más recientes primero).
+    Listar facturas confirmadas.
+    Sin limit ni cursor devuelve todas las que cumplen los filtros con datosCompletos,
+    ordenadas por fecha de creación descendente, como antes.
+    Con limit o cursor pagina por cursor, más recientes primero (por fecha de facturación):
+    si hay más, el header X-Next-Cursor trae el cursor de la siguiente página. Paginado
+    devuelve por defecto el resumen sin datosCompletos; la copia completa del pedido
+    se obtiene con GET /facturas-confirmadas/{pedidoId} o con incluir_datos_completos=true.
     """
     try:
-        facturas = list(
-            facturas_confirmadas_collection.find().sort("fecha_creacion", -1)
-        )
-        # Transformar todas las facturas a camelCase para el frontend
-        return [transform_factura_to_camelcase(factura) for factura in facturas]
+        filtro = {}
+        if fecha_desde or fecha_hasta:
+            # fecha_facturacion se guarda como ISO string, que se ordena igual que la fecha
+            rango = {}
+            if fecha_desde:
+                rango["$gte"] = fecha_desde
+            if fecha_hasta:
+                # Incluir todo el día de fecha_hasta
+                rango["$lte"] = fecha_hasta + "\uffff" if len(fecha_hasta) == 10 else fecha_hasta
+            filtro["fecha_facturacion"] = rango
+        if cliente_id:
+            filtro["cliente_id"] = cliente_id.strip()
+        
+        if limit is None and cursor is None:
+            if incluir_datos_completos is None:
+                incluir_datos_completos = True
+            facturas = list(
+                facturas_confirmadas_collection.find(
+                    filtro,
+                    None if incluir_datos_completos else PROYECCION_RESUMEN_FACTURA
+                ).sort("fecha_creacion", -1)
+            )
+        else:
+            if incluir_datos_completos is None:
+                incluir_datos_completos = False
+            facturas, siguiente = paginar(
+                facturas_confirmadas_collection,
+                filtro,
+                ORDEN_FACTURAS,
+                limit or PAGINA_DEFAULT,
+                cursor,
+                None if incluir_datos_completos else PROYECCION_RESUMEN_FACTURA
+            )
+            if siguiente:
+                response.headers["X-Next-Cursor"] = siguiente
+        
+        # Transformar las facturas a camelCase para el frontend
+        resultado = []
+        for factura in facturas:
+            factura_transformed = transform_factura_to_camelcase(factura)
+            if not incluir_datos_completos:
+                factura_transformed["datosCompletos"] = None
+            resultado.append(factura_transformed)
+        return resultado
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"ERROR GET FACTURAS: {str(e)}")
         import traceback
         print(f"TRACEBACK: {traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=f"Error al obtener facturas: {str(e)}")
 
+@router.get("/facturas-confirmadas/{pedidoId}", response_model=FacturaConfirmada)
+async def obtener_factura_confirmada(
+    pedidoId: str,
+    user: dict = Depends(get_current_user)
+):
+    """
+    Obtener una factura confirmada completa (incluye datosCompletos) por su pedidoId.
+    """
+    try:
+        factura = facturas_confirmadas_collection.find_one({"pedidoId": pedidoId.strip()})
+        if not factura:
+            raise HTTPException(status_code=404, detail="Factura confirmada no encontrada")
+        return transform_factura_to_camelcase(factura)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"ERROR GET FACTURA: {str(e)}")
+        import traceback
+        print(f"TRACEBACK: {traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail=f"Error al obtener factura: {str(e)}")
+
 @router.delete("/facturas-confirmadas/{pedidoId}")
 async def eliminar_factura_confirmada(
     pedidoId: str,
@@ -355,9 +476,10 @@ async def crear_pedido_cargado_inventario(
             "fecha_carga": request.fecha_carga or fecha_actual,
             "items": request.items or [],
             "items_actualizados": int(request.items_actualizados) if request.items_actualizados is not None else 0,
-            "items_creados": int(request.items_creados) if request.items_creados is not None else 0,
-            "datos_completos": request.datos_completos or {}
+            "items_creados": int(request.items_creados) if request.items_creados is not None else 0
         }
+        # Guardar el pedido como snapshot compacto (solo lo que no está ya en el registro)
+        pedido_dict[CAMPO_SNAPSHOT] = compactar_snapshot(request.datos_completos or {}, pedido_dict, pedido_id)
         
         if pedido_existente:
             # Actualizar registro existente
@@ -365,7 +487,7 @@ async def crear_pedido_cargado_inventario(
             
             result = pedidos_cargados_inventario_collection.update_one(
                 {"pedidoId": pedido_id},
-                {"$set": pedido_dict}
+                {"$set": pedido_dict, "$unset": {"datos_completos": ""}}
             )
             
             if result.modified_count == 0:
@@ -373,7 +495,7 @@ async def crear_pedido_cargado_inventario(
             
             pedido_actualizado = pedidos_cargados_inventario_collection.find_one({"pedidoId": pedido_id})
             print(f"DEBUG PEDIDO CARGADO: Pedido cargado actualizado para pedidoId: {pedido_id}")
-            return object_id_to_str(pedido_actualizado)
+            return object_id_to_str(expandir_snapshot(pedido_actualizado, pedidos_collection))
         else:
             # Crear nuevo registro
             pedido_dict["fecha_creacion"] = fecha_actual
@@ -382,7 +504,7 @@ async def crear_pedido_cargado_inventario(
             pedido_creado = pedidos_cargados_inventario_collection.find_one({"_id": result.inserted_id})
             
             print(f"DEBUG PEDIDO CARGADO: Nuevo pedido cargado creado para pedidoId: {pedido_id}")
-            return object_id_to_str(pedido_creado)
+            return object_id_to_str(expandir_snapshot(pedido_creado, pedidos_collection))
         
     except HTTPException:
         raise
@@ -404,7 +526,7 @@ async def listar_pedidos_cargados_inventario(
         pedidos = list(
             pedidos_cargados_inventario_collection.find().sort("fecha_creacion", -1)
         )
-        return [object_id_to_str(pedido) for pedido in pedidos]
+        return [object_id_to_str(expandir_snapshot(pedido, pedidos_collection)) for pedido in pedidos]
     except Exception as e:
         print(f"ERROR GET PEDIDOS CARGADOS: {str(e)}")
         import traceback
@@ -451,16 +573,21 @@ async def actualizar_pedido_cargado_inventario(
         if request.items_creados is not None:
             update_data["items_creados"] = int(request.items_creados)
         
-        if request.datos_completos is not None:
-            update_data["datos_completos"] = request.datos_completos
-        
-        if not update_data:
+        if not update_data and request.datos_completos is None:
             raise HTTPException(status_code=400, detail="No hay campos para actualizar")
         
+        cambios = {}
+        if request.datos_completos is not None:
+            # Compactar respecto al registro ya actualizado con los demás campos
+            documento = {**pedido_existente, **update_data}
+            update_data[CAMPO_SNAPSHOT] = compactar_snapshot(request.datos_completos, documento, pedido_id)
+            cambios["$unset"] = {"datos_completos": ""}
+        cambios["$set"] = update_data
+        
         # Actualizar el registro
         result = pedidos_cargados_inventario_collection.update_one(
             {"pedidoId": pedido_id},
-            {"$set": update_data}
+            cambios
         )
         
         if result.modified_count == 0:
@@ -469,7 +596,7 @@ async def actualizar_pedido_cargado_inventario(
         pedido_actualizado = pedidos_cargados_inventario_collection.find_one({"pedidoId": pedido_id})
         print(f"DEBUG PEDIDO CARGADO: Pedido cargado actualizado para pedidoId: {pedido_id}")
         
-        return object_id_to_str(pedido_actualizado)
+        return object_id_to_str(expandir_snapshot(pedido_actualizado, pedidos_collection))
         
     except HTTPException:
         raise
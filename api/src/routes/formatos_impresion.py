@@ -1,7 +1,10 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request, Response
 from typing import List, Optional
 from pydantic import BaseModel
+import hashlib
+import json
 from ..auth.auth import get_current_user
+from ..utils.versiones import RECURSO_FORMATOS_IMPRESION, respuesta_condicional
 
 router = APIRouter()
 
@@ -21,40 +24,49 @@ class FormatoImpresion(BaseModel):
     configuracion: ConfiguracionFormato
     activo: bool = True
 
+# Formatos por defecto (todavía no se guardan en base de datos)
+FORMATOS_POR_DEFECTO = [
+    {
+        "id": "preliminar_default",
+        "nombre": "Preliminar por defecto",
+        "tipo": "preliminar",
+        "configuracion": {
+            "nombre_empresa": "Tu Empresa",
+            "rif": "J-12345678-9",
+            "direccion": "Tu Dirección",
+            "telefono": "0212-1234567",
+            "email": "info@tuempresa.com",
+            "componentes": []
+        },
+        "activo": True
+    },
+    {
+        "id": "nota_entrega_default",
+        "nombre": "Nota de Entrega por defecto",
+        "tipo": "nota_entrega",
+        "configuracion": {
+            "nombre_empresa": "Tu Empresa",
+            "rif": "J-12345678-9",
+            "direccion": "Tu Dirección",
+            "telefono": "0212-1234567",
+            "email": "info@tuempresa.com",
+            "componentes": []
+        },
+        "activo": True
+    }
+]
+
+# Los formatos por defecto solo cambian con un despliegue: su hash forma parte del ETag
+VARIANTE_FORMATOS = hashlib.sha1(json.dumps(FORMATOS_POR_DEFECTO, sort_keys=True).encode()).hexdigest()[:12]
+
 # Endpoints básicos
 @router.get("/formatos-impresion")
-async def get_formatos(current_user = Depends(get_current_user)):
+async def get_formatos(request: Request, response: Response, current_user = Depends(get_current_user)):
+    no_modificado = respuesta_condicional(request, response, RECURSO_FORMATOS_IMPRESION, VARIANTE_FORMATOS)
+    if no_modificado:
+        return no_modificado
     # Retornar formatos por defecto o desde base de datos
-    return [
-        {
-            "id": "preliminar_default",
-            "nombre": "Preliminar por defecto",
-            "tipo": "preliminar",
-            "configuracion": {
-                "nombre_empresa": "Tu Empresa",
-                "rif": "J-12345678-9",
-                "direccion": "Tu Dirección",
-                "telefono": "0212-1234567",
-                "email": "info@tuempresa.com",
-                "componentes": []
-            },
-            "activo": True
-        },
-        {
-            "id": "nota_entrega_default",
-            "nombre": "Nota de Entrega por defecto",
-            "tipo": "nota_entrega",
-            "configuracion": {
-                "nombre_empresa": "Tu Empresa",
-                "rif": "J-12345678-9",
-                "direccion": "Tu Dirección",
-                "telefono": "0212-1234567",
-                "email": "info@tuempresa.com",
-                "componentes": []
-            },
-            "activo": True
-        }
-    ]
+    return FORMATOS_POR_DEFECTO
 
 @router.post("/formatos-impresion")
 async def create_formato(formato: FormatoImpresion, current_user = Depends(get_current_user)):
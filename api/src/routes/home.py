@@ -1,8 +1,10 @@
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from typing import Optional
 from ..models.authmodels import HomeConfig, HomeConfigRequest
 from ..config.mongodb import home_config_collection
+from ..utils.imagenes import CACHE_CONTROL_INMUTABLE, PATRON_NOMBRE_BLOB, expandir_urls_config, extraer_imagenes_config, get_almacen
+from ..utils.versiones import RECURSO_HOME_CONFIG, incrementar_version, respuesta_condicional
 from bson import ObjectId
 import os
 import json
@@ -214,12 +216,17 @@ def normalize_config(config_doc):
     return config_doc
 
 @router.get("/config")
-async def get_home_config():
+async def get_home_config(request: Request, response: Response):
     """
     Obtener la configuración de la página de inicio.
     Retorna la configuración completa normalizada o estructura por defecto si no existe.
+    Responde 304 si el cliente ya tiene la versión actual (If-None-Match).
     """
     try:
+        no_modificado = respuesta_condicional(request, response, RECURSO_HOME_CONFIG, publico=True)
+        if no_modificado:
+            return no_modificado
+        
         # Buscar el único documento de configuración
         config_doc = home_config_collection.find_one({})
         
@@ -275,7 +282,8 @@ async def get_home_config():
         # Verificación final de imágenes en la respuesta
         log_image_info(config_doc, "GET RESPUESTA FINAL: ")
         
-        return {"config": config_doc}
+        # Las imágenes guardadas como ruta (/home/imagenes/...) se devuelven con la URL de esta API
+        return {"config": expandir_urls_config(config_doc, str(request.base_url))}
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al obtener configuración: {str(e)}")
@@ -334,7 +342,7 @@ def log_image_info(config_dict, prefix=""):
     debug_log(f"{prefix}================================")
 
 @router.put("/config")
-async def update_home_config(request: HomeConfigRequest):
+async def update_home_config(request: HomeConfigRequest, http_request: Request):
     """
     Guardar o actualizar la configuración de la página de inicio.
     Solo debe haber un documento en la colección HOME_CONFIG.
@@ -666,6 +674,13 @@ async def update_home_config(request: HomeConfigRequest):
                         config_dict_clean["products"]["products"] = config_dict["products"].get("products", [])
                         debug_log(f"✅ FORZADO: Array de productos restaurado desde config_dict")
         
+        # Subir las imágenes base64 como blobs: en el documento quedan solo su URL y su hash
+        try:
+            imagenes_extraidas = extraer_imagenes_config(config_dict_clean)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        debug_log(f"Imágenes extraídas a blobs: {imagenes_extraidas}")
+        
         # Actualizar o crear la configuración (upsert garantiza que solo haya un documento)
         # CRÍTICO: Usar $set para actualizar campos específicos, preservando otros campos existentes
         result = home_config_collection.update_one(
@@ -673,6 +688,7 @@ async def update_home_config(request: HomeConfigRequest):
             {"$set": config_dict_clean},
             upsert=True
         )
+        incrementar_version(RECURSO_HOME_CONFIG)
         
         debug_log(f"Resultado update: matched={result.matched_count}, modified={result.modified_count}, upserted_id={result.upserted_id}")
         
@@ -976,13 +992,14 @@ async def update_home_config(request: HomeConfigRequest):
                 debug_log(f"✅ Tamaño después de restaurar desde config_dict_clean: {response_size} bytes (~{response_size//1024}KB)")
             
             # Retornar usando JSONResponse para asegurar serialización correcta
+            expandir_urls_config(response_dict["config"], str(http_request.base_url))
             return JSONResponse(content=response_dict)
         except Exception as e:
             debug_log(f"❌ ERROR al serializar respuesta: {str(e)}")
             import traceback
             debug_log(f"Traceback: {traceback.format_exc()}")
             # Fallback: retornar directamente (FastAPI lo serializará)
-            return {"config": updated_config, "message": "Configuración guardada exitosamente"}
+            return {"config": expandir_urls_config(updated_config, str(http_request.base_url)), "message": "Configuración guardada exitosamente"}
     
     except HTTPException:
         raise
@@ -992,3 +1009,23 @@ async def update_home_config(request: HomeConfigRequest):
         debug_log(f"Traceback: {traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=f"Error al guardar configuración: {str(e)}")
 
+@router.get("/imagenes/{nombre}")
+async def get_home_imagen(nombre: str):
+    """
+    Servir una imagen del home guardada como blob ({sha256}.{ext}).
+    El contenido de un nombre nunca cambia, así que se puede cachear indefinidamente.
+    """
+    if not PATRON_NOMBRE_BLOB.match(nombre):
+        raise HTTPException(status_code=404, detail="Imagen no encontrada")
+    try:
+        blob = get_almacen().abrir(nombre)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al leer imagen: {str(e)}")
+    if blob is None:
+        raise HTTPException(status_code=404, detail="Imagen no encontrada")
+    contenido, content_type = blob
+    return StreamingResponse(
+        contenido,
+        media_type=content_type,
+        headers={"Cache-Control": CACHE_CONTROL_INMUTABLE, "ETag": f'"{nombre.split(".")[0]}"'}
+    )
@@ -1,12 +1,28 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File, status, Query, Body
-from ..config.mongodb import items_collection, pedidos_collection, contadores_collection
+from fastapi import APIRouter, HTTPException, UploadFile, File, status, Query, Body, Request, Response
+from ..config.mongodb import items_collection, pedidos_collection, contadores_collection, init_codigo_norm_index
 from ..models.authmodels import Item, InventarioExcelItem
+from ..utils.versiones import RECURSO_INVENTARIO, incrementar_version, respuesta_condicional, versiones
+from ..utils.busqueda import BusquedaSincronizada
+from ..utils.paginacion import PAGINA_DEFAULT, PAGINA_MAX, paginar
+from ..utils.inventario import (
+    CAMPO_CODIGO_NORM, CAMPOS_EXISTENCIA, ETAPA_SIN_EXISTENCIA, actualizar_sin_existencia, con_codigo_norm,
+    con_sin_existencia, expresion_existencia_sucursal, filtro_en_existencia, normalizar_codigo,
+    resolver_items_inventario
+)
+from ..config.config import INVENTARIO_BUSQUEDA_RECONSTRUIR_SEGUNDOS
+from ..utils.jobs import JobContext, iterar_por_lotes
+from .jobs import job_runner
 from bson import ObjectId
 from pydantic import BaseModel
 from typing import List, Literal, Optional  # Keep this import as it's used in the /bulk endpoint
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from itertools import islice
+import asyncio
+import hashlib
 import openpyxl
-import io
 import os
+import tempfile
 
 router = APIRouter()
 
@@ -39,6 +55,209 @@ def generar_codigo_automatico():
     numero = contador_doc.get("secuencia", 271)
     return f"ITEM-{numero:04d}"
 
+# Tamaño de lote para cargas masivas ($in de códigos y bulk_write)
+BULK_LOTE = 1000
+
+def cargar_items_por_codigo(codigos: List[str], proyeccion: Optional[dict] = None) -> dict:
+    """Obtener los items existentes para una lista de códigos con consultas $in por lotes"""
+    existentes = {}
+    for inicio in range(0, len(codigos), BULK_LOTE):
+        for doc in items_collection.find({"codigo": {"$in": codigos[inicio:inicio + BULK_LOTE]}}, proyeccion):
+            existentes.setdefault(doc["codigo"], doc)
+    return existentes
+
+def ejecutar_bulk_items(operaciones: list, origenes: List[dict]) -> dict:
+    """
+    Aplicar operaciones sobre inventario con bulk_write(ordered=False) por lotes.
+    origenes[i] describe la fila/item de operaciones[i] y se devuelve junto al error si falla.
+    """
+    resumen = {"insertados": 0, "actualizados": 0, "errores": []}
+    for inicio in range(0, len(operaciones), BULK_LOTE):
+        lote = operaciones[inicio:inicio + BULK_LOTE]
+        try:
+            resultado = items_collection.bulk_write(lote, ordered=False).bulk_api_result
+        except BulkWriteError as e:
+            resultado = e.details
+            for error in resultado.get("writeErrors", []):
+                resumen["errores"].append({**origenes[inicio + error["index"]], "error": error.get("errmsg")})
+        resumen["insertados"] += resultado.get("nInserted", 0) + resultado.get("nUpserted", 0)
+        resumen["actualizados"] += resultado.get("nMatched", 0)
+    if operaciones:
+        incrementar_version(RECURSO_INVENTARIO)
+    return resumen
+
+# Campos del buscador y su peso en la relevancia
+CAMPOS_BUSQUEDA = {"codigo": 3.0, "nombre": 2.0, "descripcion": 1.5, "marca": 1.0, "departamento": 1.0}
+
+def cargar_items_busqueda():
+    # Más recientes primero: es el orden de desempate entre resultados con igual relevancia
+    return items_collection.find({}, {campo: 1 for campo in CAMPOS_BUSQUEDA}).sort("_id", -1)
+
+def version_inventario():
+    version = versiones.obtener(RECURSO_INVENTARIO)
+    return version["epoca"], version["version"]
+
+busqueda_inventario = BusquedaSincronizada(
+    "inventario",
+    cargar_items_busqueda,
+    CAMPOS_BUSQUEDA,
+    version_inventario,
+    INVENTARIO_BUSQUEDA_RECONSTRUIR_SEGUNDOS
+)
+
+def sin_cambios(existente: dict, campos: dict) -> bool:
+    """True si el documento existente ya tiene exactamente esos valores"""
+    return all(existente.get(clave) == valor for clave, valor in campos.items())
+
+# Importación de Excel: el archivo se lee en modo read_only fila por fila y se procesa por lotes
+EXCEL_PREVIEW_MAX_FILAS = 200
+EXCEL_LOTE_FILAS = 500
+EXCEL_ENCABEZADOS_REQUERIDOS = ("codigo", "descripcion", "precio", "costo")
+
+async def guardar_upload_temporal(file: UploadFile) -> str:
+    """Copiar el archivo subido a un temporal en disco por bloques (sin cargarlo completo en memoria)"""
+    sufijo = os.path.splitext(file.filename or "")[1]
+    with tempfile.NamedTemporaryFile(delete=False, suffix=sufijo) as tmp:
+        while True:
+            bloque = await file.read(1024 * 1024)
+            if not bloque:
+                break
+            await asyncio.to_thread(tmp.write, bloque)
+        return tmp.name
+
+def iterar_filas_excel(workbook):
+    """
+    Devuelve (headers, filas) de la hoja activa; filas es un iterador perezoso de
+    (numero_fila, {header: valor}) que omite las filas vacías.
+    """
+    sheet = workbook.active
+    filas = sheet.iter_rows(values_only=True)
+    headers = list(next(filas, None) or [])
+    
+    # Validar encabezados requeridos (acepta variaciones)
+    headers_lower = {str(h).strip().lower() if h else "" for h in headers}
+    if any(requerido not in headers_lower for requerido in EXCEL_ENCABEZADOS_REQUERIDOS):
+        raise HTTPException(status_code=400, detail="Faltan encabezados requeridos: codigo, descripcion, precio, costo")
+    
+    def generador():
+        for row_index, valores in enumerate(filas, start=2):
+            if all(value is None for value in valores):
+                continue
+            yield row_index, dict(zip(headers, valores))
+    
+    return headers, generador()
+
+def normalizar_fila_excel(row_data_raw: dict, existencia_default=None) -> dict:
+    """Normalizar nombres de columnas para mapear a existencia/existencia2"""
+    row_data = {}
+    for key, value in row_data_raw.items():
+        key_lower = str(key).strip().lower() if key else ""
+        # Mapear variaciones de nombres de columnas
+        if key_lower in ["existencia", "sucursal 1", "sucursal1"]:
+            row_data["existencia"] = value if value is not None else existencia_default
+        elif key_lower in ["sucursal 2", "sucursal2", "existencia2"]:
+            row_data["existencia2"] = value if value is not None else existencia_default
+        else:
+            row_data[key] = value
+    return row_data
+
+def leer_preview_excel(ruta: str, max_filas: int) -> dict:
+    """Leer encabezados y como máximo max_filas filas con datos (se ejecuta en un hilo)"""
+    workbook = openpyxl.load_workbook(ruta, read_only=True, data_only=True)
+    try:
+        headers, filas = iterar_filas_excel(workbook)
+        preview_data = [normalizar_fila_excel(row_data) for _, row_data in islice(filas, max_filas)]
+        truncado = next(filas, None) is not None
+    finally:
+        workbook.close()
+    return {
+        "total_rows": len(preview_data),
+        "truncado": truncado,
+        "headers": headers,
+        "data": preview_data
+    }
+
+def procesar_lote_excel(lote: list, errores: list) -> dict:
+    """Validar un lote de filas y aplicarlo al inventario con un $in y un bulk_write"""
+    items_por_codigo = {}
+    for row_index, row_data_raw in lote:
+        row_data = normalizar_fila_excel(row_data_raw, existencia_default=0)
+        
+        # Si no hay existencia mapeada, establecer default
+        if "existencia" not in row_data:
+            row_data["existencia"] = 0
+        if "existencia2" not in row_data:
+            row_data["existencia2"] = 0
+        
+        # Validate with InventarioExcelItem model
+        try:
+            excel_item = InventarioExcelItem(**row_data)
+        except Exception as e:
+            errores.append({"fila": row_index, "error": f"Error de validación: {e}"})
+            continue
+
+        # Map to the main Item model
+        item_data = Item(
+            codigo=excel_item.codigo,
+            nombre=excel_item.descripcion, # Defaulting nombre to descripcion
+            descripcion=excel_item.descripcion,
+            departamento=excel_item.departamento,
+            marca=excel_item.marca,
+            categoria="General", # Defaulting categoria
+            precio=excel_item.precio,
+            costo=excel_item.costo,
+            # costoProduccion will use its default value from the Item model
+            cantidad=0, # Defaulting quantity, as it's not in Excel input
+            existencia=excel_item.existencia,
+            existencia2=excel_item.existencia2 if excel_item.existencia2 is not None else 0,
+            activo=True,
+            imagenes=[]
+        )
+        # Si un código se repite, la última fila prevalece
+        items_por_codigo[excel_item.codigo] = (row_index, con_sin_existencia(con_codigo_norm(item_data.dict(by_alias=True, exclude_unset=True))))
+
+    resultado = {"validos": len(items_por_codigo), "insertados": 0, "actualizados": 0, "sin_cambios": 0}
+    if not items_por_codigo:
+        return resultado
+
+    # Cargar los existentes con un solo $in y comparar en memoria
+    campos = list(next(iter(items_por_codigo.values()))[1].keys())
+    existentes = cargar_items_por_codigo(list(items_por_codigo.keys()), {campo: 1 for campo in campos})
+
+    operaciones = []
+    origenes = []
+    for codigo, (row_index, item_data) in items_por_codigo.items():
+        existente = existentes.get(codigo)
+        if existente and sin_cambios(existente, item_data):
+            resultado["sin_cambios"] += 1
+            continue
+        operaciones.append(UpdateOne({"codigo": codigo}, {"$set": item_data}, upsert=True))
+        origenes.append({"fila": row_index, "codigo": codigo})
+
+    resumen_bulk = ejecutar_bulk_items(operaciones, origenes)
+    errores.extend(resumen_bulk["errores"])
+    resultado["insertados"] = resumen_bulk["insertados"]
+    resultado["actualizados"] = resumen_bulk["actualizados"]
+    return resultado
+
+def importar_excel(ruta: str) -> dict:
+    """Leer el Excel en streaming y aplicarlo por lotes de EXCEL_LOTE_FILAS (se ejecuta en un hilo)"""
+    totales = {"validos": 0, "insertados": 0, "actualizados": 0, "sin_cambios": 0}
+    errores = []
+    workbook = openpyxl.load_workbook(ruta, read_only=True, data_only=True)
+    try:
+        _, filas = iterar_filas_excel(workbook)
+        while True:
+            lote = list(islice(filas, EXCEL_LOTE_FILAS))
+            if not lote:
+                break
+            for clave, valor in procesar_lote_excel(lote, errores).items():
+                totales[clave] += valor
+    finally:
+        workbook.close()
+    totales["errores"] = errores
+    return totales
+
 class ActualizarExistenciaRequest(BaseModel):
     cantidad: float
     tipo: Literal['cargar', 'descargar']
@@ -72,8 +291,18 @@ async def cargar_existencias_desde_pedido(pedido_id: str = Body(..., embed=True)
         
         print(f"DEBUG CARGAR EXISTENCIAS: Procesando pedido {pedido_id}")
         
+        # Resolver todos los items del pedido contra el inventario con una sola consulta
+        items_pedido = pedido.get("items", [])
+        items_inventario = resolver_items_inventario([
+            {"codigo": item.get("codigo") or item.get("id") or item.get("_id"), "id": item.get("id")}
+            for item in items_pedido
+        ])
+        # Items creados en esta carga (un código repetido en el pedido suma sobre el mismo item)
+        creados = {}
+        actualizados_ids = []
+        
         # Para cada item del pedido
-        for idx, item_pedido in enumerate(pedido.get("items", [])):
+        for idx, item_pedido in enumerate(items_pedido):
             codigo_item_raw = item_pedido.get("codigo") or item_pedido.get("id") or item_pedido.get("_id")
             if not codigo_item_raw:
                 print(f"DEBUG CARGAR EXISTENCIAS: Item {idx} sin código, saltando")
@@ -89,21 +318,9 @@ async def cargar_existencias_desde_pedido(pedido_id: str = Body(..., embed=True)
                 print(f"DEBUG CARGAR EXISTENCIAS: Item {idx} con cantidad <= 0, saltando")
                 continue
             
-            # Buscar item en inventario con código normalizado
-            # Intentar búsqueda exacta primero
-            item_inventario = items_collection.find_one({"codigo": codigo_item})
-            codigo_bd = codigo_item  # Código que usaremos para actualizar
-            
-            # Si no se encuentra, intentar búsqueda sin distinguir mayúsculas/minúsculas
-            if not item_inventario:
-                print(f"DEBUG CARGAR EXISTENCIAS: No se encontró item con código exacto '{codigo_item}', intentando búsqueda case-insensitive")
-                item_inventario = items_collection.find_one({
-                    "codigo": {"$regex": f"^{codigo_item}$", "$options": "i"}
-                })
-                if item_inventario:
-                    # Usar el código exacto de la BD, no el normalizado del pedido
-                    codigo_bd = item_inventario.get("codigo")
-                    print(f"DEBUG CARGAR EXISTENCIAS: Item encontrado con búsqueda flexible. Código en BD: '{codigo_bd}', código pedido: '{codigo_item}'")
+            # Item del inventario por código normalizado (o id), ya resuelto antes del bucle
+            item_inventario = items_inventario[idx] or creados.get(normalizar_codigo(codigo_item))
+            codigo_bd = codigo_item
             
             if item_inventario:
                 codigo_bd_real = item_inventario.get("codigo", codigo_bd)
@@ -166,6 +383,7 @@ async def cargar_existencias_desde_pedido(pedido_id: str = Body(..., embed=True)
                             print(f"DEBUG CARGAR EXISTENCIAS: ✓ Item actualizado correctamente. Nueva cantidad: {item_actualizado.get('cantidad')}")
                 
                 items_actualizados += 1
+                actualizados_ids.append(item_id)
             else:
                 # Crear nuevo item en inventario
                 print(f"DEBUG CARGAR EXISTENCIAS: Item '{codigo_item}' no existe en inventario, creándolo nuevo")
@@ -181,11 +399,16 @@ async def cargar_existencias_desde_pedido(pedido_id: str = Body(..., embed=True)
                     "activo": True,
                     "imagenes": item_pedido.get("imagenes", [])
                 }
-                result = items_collection.insert_one(nuevo_item)
+                result = items_collection.insert_one(con_sin_existencia(con_codigo_norm(nuevo_item)))
+                creados[nuevo_item.get(CAMPO_CODIGO_NORM)] = nuevo_item
                 print(f"DEBUG CARGAR EXISTENCIAS: Item '{codigo_item}' creado con _id: {result.inserted_id}, cantidad inicial: {cantidad}")
                 items_creados += 1
         
         print(f"DEBUG CARGAR EXISTENCIAS: Proceso completado - Actualizados: {items_actualizados}, Creados: {items_creados}")
+        if items_actualizados:
+            actualizar_sin_existencia({"_id": {"$in": actualizados_ids}})
+        if items_actualizados or items_creados:
+            incrementar_version(RECURSO_INVENTARIO)
         
         return {
             "message": "Existencias cargadas al inventario correctamente",
@@ -199,12 +422,22 @@ async def cargar_existencias_desde_pedido(pedido_id: str = Body(..., embed=True)
         raise HTTPException(status_code=500, detail=f"Error al cargar existencias: {str(e)}")
 
 @router.get("/all")
-async def get_all_items(sucursal: Optional[str] = Query(None, description="Filtrar por sucursal: 'sucursal1' o 'sucursal2'")):
+async def get_all_items(
+    request: Request,
+    response: Response,
+    sucursal: Optional[str] = Query(None, description="Filtrar por sucursal: 'sucursal1' o 'sucursal2'")
+):
     """
     Obtener todos los items del inventario.
     Filtra solo items activos con precio > 0.
     Si se especifica sucursal, incluye información de existencia de esa sucursal.
+    Responde 304 si el cliente envía el ETag vigente (cada sucursal tiene el suyo).
+    Para listas grandes usar /inventario/catalogo (paginado, con filtros y sin imágenes).
     """
+    no_modificado = respuesta_condicional(request, response, RECURSO_INVENTARIO, sucursal or "todas")
+    if no_modificado:
+        return no_modificado
+
     # Proyección optimizada: solo campos necesarios
     projection = {
         "_id": 1,
@@ -245,6 +478,73 @@ async def get_all_items(sucursal: Optional[str] = Query(None, description="Filtr
     
     return items
 
+# Catálogo paginado: campos que se pueden pedir con ?campos= y los que se devuelven por defecto (sin imágenes)
+CAMPOS_CATALOGO = {
+    "codigo", "nombre", "descripcion", "categoria", "departamento", "marca", "modelo",
+    "precio", "costo", "costoProduccion", "cantidad", "existencia", "existencia2", "activo", "imagenes"
+}
+CAMPOS_CATALOGO_DEFAULT = CAMPOS_CATALOGO - {"imagenes", "costoProduccion"}
+ORDEN_CATALOGO = [("_id", -1)]
+
+@router.get("/catalogo")
+async def get_catalogo(
+    request: Request,
+    response: Response,
+    categoria: Optional[str] = Query(None, description="Filtrar por categoría"),
+    departamento: Optional[str] = Query(None, description="Filtrar por departamento"),
+    marca: Optional[str] = Query(None, description="Filtrar por marca"),
+    sucursal: Optional[Literal["sucursal1", "sucursal2"]] = Query(None, description="Incluir existencia_sucursal de esta sucursal"),
+    en_existencia: bool = Query(False, description="Solo items con existencia > 0 en la sucursal (sucursal1 si no se indica)"),
+    campos: Optional[str] = Query(None, description="Campos separados por coma; por defecto todos menos imagenes y costoProduccion"),
+    limit: int = Query(PAGINA_DEFAULT, gt=0, le=PAGINA_MAX, description="Items por página"),
+    cursor: Optional[str] = Query(None, description="Cursor de la página siguiente (header X-Next-Cursor)")
+):
+    """
+    Catálogo de inventario paginado por cursor para POS y creación de pedidos.
+    Solo items activos con precio > 0, más recientes primero (como /all).
+    Los filtros usan los índices idx_item_catalogo_*. Si hay más páginas, el header
+    X-Next-Cursor trae el cursor de la siguiente. Responde 304 si el cliente envía el ETag vigente.
+    """
+    try:
+        if campos:
+            seleccion = {c.strip() for c in campos.split(",") if c.strip()}
+            invalidos = seleccion - CAMPOS_CATALOGO
+            if invalidos:
+                raise HTTPException(status_code=400, detail=f"Campos no válidos: {', '.join(sorted(invalidos))}")
+        else:
+            seleccion = CAMPOS_CATALOGO_DEFAULT
+
+        # Cada combinación de parámetros (incluido el cursor) tiene su propio ETag
+        variante = hashlib.sha1(str(sorted(request.query_params.multi_items())).encode()).hexdigest()[:12]
+        no_modificado = respuesta_condicional(request, response, RECURSO_INVENTARIO, variante)
+        if no_modificado:
+            return no_modificado
+
+        filtro = {"activo": True, "precio": {"$gt": 0}}
+        for campo, valor in (("categoria", categoria), ("departamento", departamento), ("marca", marca)):
+            if valor:
+                filtro[campo] = valor
+        if en_existencia:
+            filtro.update(filtro_en_existencia(sucursal or "sucursal1"))
+
+        proyeccion = {campo: 1 for campo in seleccion}
+        if sucursal:
+            proyeccion["existencia_sucursal"] = expresion_existencia_sucursal(sucursal)
+
+        items, siguiente = paginar(items_collection, filtro, ORDEN_CATALOGO, limit, cursor, proyeccion)
+        if siguiente:
+            response.headers["X-Next-Cursor"] = siguiente
+        for item in items:
+            item["_id"] = str(item["_id"])
+        return items
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"ERROR CATALOGO: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Error al obtener el catálogo: {str(e)}")
+
 @router.get("/id/{item_id}/")
 async def get_item(item_id: str):
     """
@@ -278,8 +578,11 @@ async def create_item(item: Item):
             item.codigo = generar_codigo_automatico()
             debug_log(f"DEBUG CREATE ITEM: Código generado automáticamente: {item.codigo}")
         
-        # Verificar que el código no exista
-        existing_item = items_collection.find_one({"codigo": item.codigo})
+        # Verificar que el código no exista (también con otras mayúsculas o espacios)
+        existing_item = items_collection.find_one({"$or": [
+            {"codigo": item.codigo},
+            {CAMPO_CODIGO_NORM: normalizar_codigo(item.codigo)}
+        ]})
         if existing_item:
             debug_log(f"DEBUG CREATE ITEM: ❌ Código ya existe: {item.codigo}")
             raise HTTPException(status_code=400, detail="El item con este código ya existe")
@@ -328,7 +631,8 @@ async def create_item(item: Item):
         debug_log(f"  - activo: {item_dict_clean.get('activo')}")
         
         # Insertar en la base de datos
-        result = items_collection.insert_one(item_dict_clean)
+        result = items_collection.insert_one(con_sin_existencia(con_codigo_norm(item_dict_clean)))
+        incrementar_version(RECURSO_INVENTARIO)
         
         if not result.inserted_id:
             debug_log(f"DEBUG CREATE ITEM: ❌ ERROR: No se obtuvo inserted_id")
@@ -352,6 +656,8 @@ async def create_item(item: Item):
         }
     except HTTPException:
         raise
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="El item con este código ya existe")
     except Exception as e:
         debug_log(f"DEBUG CREATE ITEM: ❌ EXCEPCIÓN: {str(e)}")
         debug_log(f"DEBUG CREATE ITEM: Tipo: {type(e).__name__}")
@@ -400,11 +706,14 @@ async def patch_item(item_id: str, update_data: dict = Body(...)):
         # Realizar la actualización
         result = items_collection.update_one(
             {"_id": item_obj_id},
-            {"$set": update_data_clean}
+            {"$set": con_codigo_norm(update_data_clean)}
         )
         
         if result.matched_count == 0:
             raise HTTPException(status_code=404, detail="Item no encontrado")
+        if any(campo in update_data_clean for campo in CAMPOS_EXISTENCIA):
+            actualizar_sin_existencia({"_id": item_obj_id})
+        incrementar_version(RECURSO_INVENTARIO)
         
         # Obtener el item actualizado
         item_actualizado = items_collection.find_one({"_id": item_obj_id})
@@ -415,6 +724,8 @@ async def patch_item(item_id: str, update_data: dict = Body(...)):
     except HTTPException:
         # Re-lanzar HTTPExceptions (errores conocidos)
         raise
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Ya existe otro item con este código")
     except Exception as e:
         # Capturar cualquier otro error inesperado
         raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
@@ -448,190 +759,133 @@ async def update_item(item_id: str, item: Item):
         # Realizar la actualización
         result = items_collection.update_one(
             {"_id": item_obj_id},
-            {"$set": update_data}
+            {"$set": con_codigo_norm(update_data)}
         )
         
         if result.matched_count == 0:
             raise HTTPException(status_code=404, detail="Item no encontrado")
+        if any(campo in update_data for campo in CAMPOS_EXISTENCIA):
+            actualizar_sin_existencia({"_id": item_obj_id})
+        incrementar_version(RECURSO_INVENTARIO)
             
         return {"message": "Item actualizado correctamente", "id": item_id}
         
     except HTTPException:
         # Re-lanzar HTTPExceptions (errores conocidos)
         raise
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Ya existe otro item con este código")
     except Exception as e:
         # Capturar cualquier otro error inesperado
         raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
 
 @router.post("/preview-excel")
-async def preview_inventory_excel(file: UploadFile = File(...)):
-    """Endpoint para previsualizar el contenido del Excel antes de cargarlo"""
+async def preview_inventory_excel(
+    file: UploadFile = File(...),
+    limite: int = Query(EXCEL_PREVIEW_MAX_FILAS, ge=1, le=1000, description="Máximo de filas a previsualizar")
+):
+    """Endpoint para previsualizar el contenido del Excel antes de cargarlo (solo las primeras filas)"""
     if not file.filename.endswith(('.xlsx', '.xls')):
         raise HTTPException(status_code=400, detail="Formato de archivo no válido. Se espera un archivo Excel (.xlsx o .xls)")
 
+    ruta = None
     try:
-        contents = await file.read()
-        workbook = openpyxl.load_workbook(io.BytesIO(contents))
-        sheet = workbook.active
-
-        # Asumiendo que la primera fila son los encabezados
-        headers = [cell.value for cell in sheet[1]]
-        
-        # Validar encabezados requeridos (acepta variaciones)
-        headers_lower = {str(h).strip().lower() if h else "" for h in headers}
-        if "codigo" not in headers_lower or "descripcion" not in headers_lower or "precio" not in headers_lower or "costo" not in headers_lower:
-            raise HTTPException(status_code=400, detail="Faltan encabezados requeridos: codigo, descripcion, precio, costo")
-
-        preview_data = []
-        for row_index in range(2, sheet.max_row + 1):
-            row_data_raw = {headers[i]: cell.value for i, cell in enumerate(sheet[row_index])}
-            
-            # Normalizar nombres de columnas para mapear a existencia/existencia2
-            row_data = {}
-            for key, value in row_data_raw.items():
-                key_lower = str(key).strip().lower() if key else ""
-                # Mapear variaciones de nombres de columnas
-                if key_lower in ["existencia", "sucursal 1", "sucursal1"]:
-                    row_data["existencia"] = value
-                elif key_lower in ["sucursal 2", "sucursal2", "existencia2"]:
-                    row_data["existencia2"] = value
-                else:
-                    row_data[key] = value
-            
-            # Solo incluir datos si hay información en la fila
-            if any(value is not None for value in row_data.values()):
-                preview_data.append(row_data)
-
-        return {
-            "total_rows": len(preview_data),
-            "headers": headers,
-            "data": preview_data
-        }
+        ruta = await guardar_upload_temporal(file)
+        return await asyncio.to_thread(leer_preview_excel, ruta, limite)
 
     except HTTPException as e:
         raise e
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al procesar el archivo Excel: {str(e)}")
+    finally:
+        if ruta:
+            os.remove(ruta)
 
 @router.post("/upload-excel", status_code=status.HTTP_201_CREATED)
 async def upload_inventory_excel(file: UploadFile = File(...)):
     if not file.filename.endswith(('.xlsx', '.xls')):
         raise HTTPException(status_code=400, detail="Formato de archivo no válido. Se espera un archivo Excel (.xlsx o .xls)")
 
+    ruta = None
     try:
-        contents = await file.read()
-        workbook = openpyxl.load_workbook(io.BytesIO(contents))
-        sheet = workbook.active
+        ruta = await guardar_upload_temporal(file)
+        resultado = await asyncio.to_thread(importar_excel, ruta)
+        errores = resultado["errores"]
 
-        # Asumiendo que la primera fila son los encabezados
-        headers = [cell.value for cell in sheet[1]]
-        
-        # Validar encabezados requeridos
-        headers_lower = {str(h).strip().lower() if h else "" for h in headers}
-        if "codigo" not in headers_lower or "descripcion" not in headers_lower or "precio" not in headers_lower or "costo" not in headers_lower:
-            raise HTTPException(status_code=400, detail="Faltan encabezados requeridos: codigo, descripcion, precio, costo")
+        if not resultado["validos"]:
+            detalle = "No se encontraron datos válidos para insertar en el archivo Excel."
+            if errores:
+                detalle += f" Errores: {errores[:20]}"
+            raise HTTPException(status_code=400, detail=detalle)
 
-        items_to_insert = []
-        for row_index in range(2, sheet.max_row + 1):
-            row_data_raw = {headers[i]: cell.value for i, cell in enumerate(sheet[row_index])}
-            
-            # Normalizar nombres de columnas para mapear a existencia/existencia2
-            row_data = {}
-            for key, value in row_data_raw.items():
-                key_lower = str(key).strip().lower() if key else ""
-                # Mapear variaciones de nombres de columnas
-                if key_lower in ["existencia", "sucursal 1", "sucursal1"]:
-                    row_data["existencia"] = value if value is not None else 0
-                elif key_lower in ["sucursal 2", "sucursal2", "existencia2"]:
-                    row_data["existencia2"] = value if value is not None else 0
-                else:
-                    row_data[key] = value
-            
-            # Si no hay existencia mapeada, establecer default
-            if "existencia" not in row_data:
-                row_data["existencia"] = 0
-            if "existencia2" not in row_data:
-                row_data["existencia2"] = 0
-            
-            # Validate with InventarioExcelItem model
-            try:
-                excel_item = InventarioExcelItem(**row_data)
-            except Exception as e:
-                raise HTTPException(status_code=400, detail=f"Error de validación en la fila {row_index}: {e}")
-
-            # Map to the main Item model
-            item_data = Item(
-                codigo=excel_item.codigo,
-                nombre=excel_item.descripcion, # Defaulting nombre to descripcion
-                descripcion=excel_item.descripcion,
-                departamento=excel_item.departamento,
-                marca=excel_item.marca,
-                categoria="General", # Defaulting categoria
-                precio=excel_item.precio,
-                costo=excel_item.costo,
-                # costoProduccion will use its default value from the Item model
-                cantidad=0, # Defaulting quantity, as it's not in Excel input
-                existencia=excel_item.existencia,
-                existencia2=excel_item.existencia2 if excel_item.existencia2 is not None else 0,
-                activo=True,
-                imagenes=[]
-            )
-            items_to_insert.append(item_data.dict(by_alias=True, exclude_unset=True))
-
-        if not items_to_insert:
-            raise HTTPException(status_code=400, detail="No se encontraron datos válidos para insertar en el archivo Excel.")
-
-        # Insert or update items
-        inserted_count = 0
-        updated_count = 0
-        for item_data in items_to_insert:
-            # Check if item with this 'codigo' already exists
-            existing_item = items_collection.find_one({"codigo": item_data["codigo"]})
-            if existing_item:
-                items_collection.update_one(
-                    {"_id": existing_item["_id"]},
-                    {"$set": item_data}
-                )
-                updated_count += 1
-            else:
-                items_collection.insert_one(item_data)
-                inserted_count += 1
-
-        return {"message": f"Inventario procesado correctamente. Insertados: {inserted_count}, Actualizados: {updated_count}"}
+        return {
+            "message": f"Inventario procesado correctamente. Insertados: {resultado['insertados']}, Actualizados: {resultado['actualizados']}, Sin cambios: {resultado['sin_cambios']}, Con errores: {len(errores)}",
+            "insertados": resultado["insertados"],
+            "actualizados": resultado["actualizados"],
+            "sin_cambios": resultado["sin_cambios"],
+            "errores": errores
+        }
 
     except HTTPException as e:
         raise e
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al procesar el archivo Excel: {str(e)}")
+    finally:
+        if ruta:
+            os.remove(ruta)
 
 @router.get("/search", response_model=List[Item])
 async def search_items(
+    response: Response,
     query: str = Query(..., min_length=1, description="Texto de búsqueda para código, descripción, nombre, departamento o marca"),
-    limit: int = Query(10, gt=0, description="Número máximo de resultados a devolver"),
+    limit: int = Query(10, gt=0, le=PAGINA_MAX, description="Número máximo de resultados a devolver"),
     skip: int = Query(0, ge=0, description="Número de resultados a omitir para paginación")
 ):
-    search_filter = {
-        "$or": [
-            {"codigo": {"$regex": query, "$options": "i"}},
-            {"descripcion": {"$regex": query, "$options": "i"}},
-            {"nombre": {"$regex": query, "$options": "i"}},
-            {"departamento": {"$regex": query, "$options": "i"}},
-            {"marca": {"$regex": query, "$options": "i"}}
-        ]
-    }
-    
-    items = list(items_collection.find(search_filter).skip(skip).limit(limit))
-    for item in items:
-        item["_id"] = str(item["_id"])
-    return items
+    """
+    Buscar items por prefijo de palabra (sin distinguir mayúsculas ni acentos), tolerando
+    errores de tipeo, ordenados por relevancia. Usa el índice en memoria de utils/busqueda.py;
+    los documentos de la página se leen de MongoDB por _id (precio y existencias al día).
+    El total de coincidencias se devuelve en el header X-Total-Count.
+    """
+    try:
+        # La primera búsqueda (o la lectura de la versión) no debe bloquear el event loop
+        indice = await asyncio.to_thread(busqueda_inventario.obtener_indice)
+        ids, total = indice.buscar(query, limit, skip)
+        response.headers["X-Total-Count"] = str(total)
+        if not ids:
+            return []
+
+        por_id = {item["_id"]: item for item in items_collection.find({"_id": {"$in": ids}})}
+        items = []
+        for item_id in ids:
+            item = por_id.get(item_id)
+            if item:  # Eliminado después de construir el índice
+                item["_id"] = str(item["_id"])
+                items.append(item)
+        return items
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"ERROR SEARCH ITEMS: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Error al buscar items: {str(e)}")
+
+@router.get("/search/metricas")
+async def get_metricas_busqueda():
+    """Tamaño del índice de búsqueda y estado de su última reconstrucción"""
+    return busqueda_inventario.get_metricas()
 
 @router.post("/bulk")
 async def bulk_upsert_items(items: List[Item]):
-    inserted_count = 0
-    updated_count = 0
-    skipped_items = []
-    errors = []
+    # Cargar los existentes con un solo $in y decidir inserción/actualización en memoria
+    codigos = list({item.codigo for item in items if item.codigo})
+    existentes = cargar_items_por_codigo(codigos)
 
+    operaciones = []
+    origenes = []
+    nuevos = {}  # codigo -> (documento a insertar, item original)
+    existencia_ids = []  # items actualizados con cambios de existencia
     for item_data in items:
         item_dict = item_data.dict(by_alias=True)
         
@@ -639,52 +893,51 @@ async def bulk_upsert_items(items: List[Item]):
         if "_id" in item_dict:
             del item_dict["_id"]
 
-        # Check if item with same codigo already exists
-        existing_item = items_collection.find_one({"codigo": item_data.codigo})
+        update_fields = {
+            "descripcion": item_dict.get("descripcion"),
+            "modelo": item_dict.get("modelo"),
+            "precio": item_dict.get("precio"),
+            "costo": item_dict.get("costo"),
+            "nombre": item_dict.get("nombre"),
+            "categoria": item_dict.get("categoria"),
+            "costoProduccion": item_dict.get("costoProduccion"),
+            "activo": item_dict.get("activo"),
+            "imagenes": item_dict.get("imagenes"),
+        }
+        # Remove None values to avoid setting them in MongoDB
+        update_fields = {k: v for k, v in update_fields.items() if v is not None}
+        for campo in ("cantidad", "existencia", "existencia2"):
+            if campo in item_dict:
+                update_fields[campo] = item_dict[campo]
 
-        if existing_item:
-            # Update existing item
-            try:
-                update_fields = {
-                    "descripcion": item_dict.get("descripcion"),
-                    "modelo": item_dict.get("modelo"),
-                    "precio": item_dict.get("precio"),
-                    "costo": item_dict.get("costo"),
-                    "nombre": item_dict.get("nombre"),
-                    "categoria": item_dict.get("categoria"),
-                    "costoProduccion": item_dict.get("costoProduccion"),
-                    "activo": item_dict.get("activo"),
-                    "imagenes": item_dict.get("imagenes"),
-                }
-                # Remove None values to avoid setting them in MongoDB
-                update_fields = {k: v for k, v in update_fields.items() if v is not None}
+        codigo = item_data.codigo
+        if not codigo:
+            operaciones.append(InsertOne(con_sin_existencia(item_dict)))
+            origenes.append({"item": item_data.dict(by_alias=True), "action": "insert"})
+        elif codigo in nuevos:
+            # Código repetido en la misma carga: aplicar la actualización sobre el documento a insertar
+            nuevos[codigo][0].update(update_fields)
+        elif codigo in existentes:
+            if sin_cambios(existentes[codigo], update_fields):
+                continue
+            operaciones.append(UpdateOne({"_id": existentes[codigo]["_id"]}, {"$set": update_fields}))
+            origenes.append({"item": item_data.dict(by_alias=True), "action": "update"})
+            if any(campo in update_fields for campo in CAMPOS_EXISTENCIA):
+                existencia_ids.append(existentes[codigo]["_id"])
+        else:
+            nuevos[codigo] = (item_dict, item_data)
 
-                update_operation = {"$set": update_fields}
+    for codigo, (item_dict, item_data) in nuevos.items():
+        # $setOnInsert + upsert: no duplica si otro proceso lo insertó mientras tanto
+        operaciones.append(UpdateOne({"codigo": codigo}, {"$setOnInsert": con_sin_existencia(con_codigo_norm(item_dict))}, upsert=True))
+        origenes.append({"item": item_data.dict(by_alias=True), "action": "insert"})
 
-                # Set cantidad if provided
-                if "cantidad" in item_dict:
-                    update_operation["$set"]["cantidad"] = item_dict["cantidad"]
-                
-                # Set existencia and existencia2 if provided
-                if "existencia" in item_dict:
-                    update_operation["$set"]["existencia"] = item_dict["existencia"]
-                if "existencia2" in item_dict:
-                    update_operation["$set"]["existencia2"] = item_dict["existencia2"]
-
-                items_collection.update_one(
-                    {"_id": existing_item["_id"]},
-                    update_operation
-                )
-                updated_count += 1
-            except Exception as e:
-                errors.append({"item": item_data.dict(by_alias=True), "error": str(e), "action": "update"})
-        else:
-            # Insert new item
-            try:
-                items_collection.insert_one(item_dict)
-                inserted_count += 1
-            except Exception as e:
-                errors.append({"item": item_data.dict(by_alias=True), "error": str(e), "action": "insert"})
+    resultado = ejecutar_bulk_items(operaciones, origenes)
+    if existencia_ids:
+        actualizar_sin_existencia({"_id": {"$in": existencia_ids}})
+    inserted_count = resultado["insertados"]
+    updated_count = resultado["actualizados"]
+    errors = resultado["errores"]
 
     return {
         "message": f"Procesamiento de carga masiva completado. {inserted_count} items insertados, {updated_count} items actualizados, {len(errors)} con errores.",
@@ -738,11 +991,12 @@ async def actualizar_existencia(item_id: str, request: ActualizarExistenciaReque
         # Actualizar la existencia según la sucursal
         result = items_collection.update_one(
             {"_id": item_obj_id},
-            {"$set": {campo_existencia: nueva_cantidad}}
+            [{"$set": {campo_existencia: nueva_cantidad}}, ETAPA_SIN_EXISTENCIA]
         )
         
         if result.matched_count == 0:
             raise HTTPException(status_code=404, detail="Item no encontrado")
+        incrementar_version(RECURSO_INVENTARIO)
         
         # Obtener el item actualizado
         item_actualizado = items_collection.find_one({"_id": item_obj_id})
@@ -763,3 +1017,89 @@ async def actualizar_existencia(item_id: str, request: ActualizarExistenciaReque
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
+
+
+# Items que todavía no tienen codigo_norm (anteriores a su registro en escritura)
+FILTRO_CODIGO_SIN_NORMALIZAR = {
+    CAMPO_CODIGO_NORM: {"$exists": False},
+    "codigo": {"$nin": [None, ""]},
+    "apartado": {"$ne": True}
+}
+
+@job_runner.registrar("normalizar_codigos_inventario")
+def job_normalizar_codigos_inventario(ctx: JobContext):
+    """
+    Agregar codigo_norm a los items que no lo tienen, por lotes (más antiguos primero).
+    Si el código normalizado ya lo tiene otro item (ej: "ab-12" y "AB-12") el item se deja
+    sin codigo_norm y se cuenta en duplicados: se sigue resolviendo por su código y hay que
+    revisarlo a mano. Al terminar crea el índice único si al arrancar no se pudo.
+    """
+    ctx.set_total(items_collection.count_documents(FILTRO_CODIGO_SIN_NORMALIZAR))
+    
+    proyeccion = {"codigo": 1}
+    for lote in iterar_por_lotes(ctx, items_collection, FILTRO_CODIGO_SIN_NORMALIZAR, proyeccion):
+        por_codigo = {}
+        con_codigo = 0
+        for item in lote:
+            codigo_norm = normalizar_codigo(item.get("codigo"))
+            if codigo_norm:
+                con_codigo += 1
+                por_codigo.setdefault(codigo_norm, item["_id"])
+        ocupados = {
+            documento[CAMPO_CODIGO_NORM]
+            for documento in items_collection.find(
+                {CAMPO_CODIGO_NORM: {"$in": list(por_codigo)}}, {CAMPO_CODIGO_NORM: 1}
+            )
+        }
+        operaciones = [
+            UpdateOne(
+                {"_id": item_id, CAMPO_CODIGO_NORM: {"$exists": False}},
+                {"$set": {CAMPO_CODIGO_NORM: codigo_norm}}
+            )
+            for codigo_norm, item_id in por_codigo.items() if codigo_norm not in ocupados
+        ]
+        actualizados = 0
+        repetidos_en_escritura = 0
+        if operaciones:
+            try:
+                actualizados = items_collection.bulk_write(operaciones, ordered=False).modified_count
+            except BulkWriteError as e:
+                # Otro item tomó el mismo código entre la lectura y la escritura (índice único)
+                for error in e.details.get("writeErrors", []):
+                    if error.get("code") != 11000:
+                        raise
+                repetidos_en_escritura = len(e.details.get("writeErrors", []))
+                actualizados = e.details.get("nModified", 0)
+        ctx.guardar_progreso(
+            procesados=len(lote),
+            checkpoint={"ultimo_id": lote[-1]["_id"]},
+            items_actualizados=actualizados,
+            duplicados=con_codigo - len(operaciones) + repetidos_en_escritura
+        )
+    
+    init_codigo_norm_index()
+
+def programar_normalizacion_codigos():
+    """
+    Lanzar normalizar_codigos_inventario al arrancar si quedan items sin codigo_norm
+    (llamar desde el event loop). Mientras tanto resolver_items_inventario los sigue
+    encontrando por su código como antes.
+    """
+    try:
+        if items_collection.find_one(FILTRO_CODIGO_SIN_NORMALIZAR, {"_id": 1}):
+            job_runner.lanzar("normalizar_codigos_inventario")
+    except Exception as e:
+        print(f"ERROR INVENTARIO: No se pudo lanzar la normalización de códigos: {e}")
+
+@router.put("/normalizar-codigos/", status_code=202)
+async def normalizar_codigos_inventario():
+    """
+    Agregar codigo_norm a los items que aún no lo tienen. Se ejecuta en segundo plano;
+    consultar el progreso en /jobs/{job_id}
+    """
+    job = job_runner.lanzar("normalizar_codigos_inventario")
+    return {
+        "message": "Normalización de códigos del inventario en ejecución",
+        "job_id": job["job_id"],
+        "estado": job["estado"]
+    }
@@ -0,0 +1,55 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from typing import Optional
+from bson import ObjectId
+from ..config.mongodb import jobs_collection
+from ..utils.jobs import JobRunner, serializar_job
+from ..auth.auth import get_current_admin_user
+
+router = APIRouter()
+
+# Los módulos de rutas registran sus handlers con @job_runner.registrar("tipo")
+job_runner = JobRunner(jobs_collection)
+
+def _job_object_id(job_id: str) -> ObjectId:
+    if not ObjectId.is_valid(job_id):
+        raise HTTPException(status_code=400, detail="ID de trabajo inválido")
+    return ObjectId(job_id)
+
+@router.get("/", dependencies=[Depends(get_current_admin_user)])
+async def get_jobs(
+    tipo: Optional[str] = Query(None),
+    estado: Optional[str] = Query(None),
+    limit: int = Query(50, ge=1, le=200)
+):
+    """Listar los trabajos más recientes, opcionalmente filtrados por tipo y estado"""
+    query = {}
+    if tipo:
+        query["tipo"] = tipo
+    if estado:
+        query["estado"] = estado
+    jobs = jobs_collection.find(query).sort("fecha_creacion", -1).limit(limit)
+    return [serializar_job(job) for job in jobs]
+
+@router.get("/{job_id}", dependencies=[Depends(get_current_admin_user)])
+async def get_job(job_id: str):
+    """Obtener estado, progreso y resultado de un trabajo"""
+    job = jobs_collection.find_one({"_id": _job_object_id(job_id)})
+    if not job:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return serializar_job(job)
+
+@router.post("/{job_id}/cancelar", dependencies=[Depends(get_current_admin_user)])
+async def cancelar_job(job_id: str):
+    """Solicitar la cancelación de un trabajo pendiente o en ejecución"""
+    job = job_runner.cancelar(_job_object_id(job_id))
+    if not job:
+        raise HTTPException(status_code=409, detail="El trabajo no existe o ya terminó")
+    return job
+
+@router.post("/{job_id}/reanudar", dependencies=[Depends(get_current_admin_user)])
+async def reanudar_job(job_id: str):
+    """Reanudar un trabajo fallido o cancelado desde su último checkpoint"""
+    job = job_runner.reanudar(_job_object_id(job_id))
+    if not job:
+        raise HTTPException(status_code=409, detail="Solo se pueden reanudar trabajos fallidos o cancelados")
+    return job
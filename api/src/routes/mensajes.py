@@ -1,10 +1,15 @@
-from fastapi import APIRouter, HTTPException, Body, Depends, Request
+from fastapi import APIRouter, HTTPException, Body, Depends, Request, Query, Response
 from fastapi import Request as FastAPIRequest
 from bson import ObjectId
 from datetime import datetime
 from typing import List, Optional, Dict, Any
 from ..config.mongodb import db, clientes_usuarios_collection, usuarios_collection
 from ..auth.auth import get_current_user, get_current_cliente, SECRET_KEY, ALGORITHM
+from ..utils.paginacion import PAGINA_DEFAULT, PAGINA_MAX, codificar_cursor, decodificar_cursor, filtro_despues_de
+from ..utils.jobs import JobContext
+from ..utils.eventos import publicar_evento
+from .jobs import job_runner
+from pymongo import UpdateOne
 import jwt
 from pydantic import BaseModel
 
@@ -13,6 +18,15 @@ router = APIRouter()
 # Colección de mensajes
 mensajes_collection = db["mensajes"]
 
+# Contadores de no leídos por conversación: {_id: pedido_id, no_leidos: {admin: n, cliente: n}}
+# Se incrementan al crear un mensaje y se reinician al leer la conversación
+contadores_no_leidos_collection = db["mensajes_no_leidos"]
+AUDIENCIAS = ("admin", "cliente")
+
+# Las conversaciones de soporte usan pedido_id = "soporte_{cliente_id}"
+PREFIJO_SOPORTE = "soporte_"
+ORDEN_CONVERSACIONES = [("ultima_fecha", -1), ("_id", -1)]
+
 class MensajeRequest(BaseModel):
     pedido_id: str
     mensaje: str
@@ -21,10 +35,83 @@ class MensajeRequest(BaseModel):
     remitente_tipo: Optional[str] = None  # "admin", "cliente"
     leido: bool = False
 
+def cliente_id_de_conversacion(pedido_id: str) -> Optional[str]:
+    """Extraer cliente_id del formato "soporte_{cliente_id}" (None si no es de soporte)"""
+    if pedido_id and pedido_id.startswith(PREFIJO_SOPORTE):
+        return pedido_id[len(PREFIJO_SOPORTE):]
+    return None
+
+def audiencia_destinataria(remitente_tipo: Optional[str]) -> str:
+    """Quién debe leer un mensaje: los del admin los lee el cliente y viceversa"""
+    return "cliente" if remitente_tipo == "admin" else "admin"
+
+def incrementar_no_leidos(pedido_id: str, remitente_tipo: Optional[str]):
+    contadores_no_leidos_collection.update_one(
+        {"_id": pedido_id},
+        {
+            "$inc": {f"no_leidos.{audiencia_destinataria(remitente_tipo)}": 1},
+            "$set": {"fecha_actualizacion": datetime.now().isoformat()}
+        },
+        upsert=True
+    )
+
+def obtener_no_leidos(pedido_ids: List[str], audiencia: str) -> Dict[str, int]:
+    """Contadores de no leídos de varias conversaciones para una audiencia (una consulta)"""
+    if not pedido_ids:
+        return {}
+    return {
+        contador["_id"]: int((contador.get("no_leidos") or {}).get(audiencia, 0))
+        for contador in contadores_no_leidos_collection.find(
+            {"_id": {"$in": pedido_ids}},
+            {f"no_leidos.{audiencia}": 1}
+        )
+    }
+
+def obtener_lector(request: FastAPIRequest) -> dict:
+    """
+    Validar el token (admin o cliente) de la petición.
+    Devuelve {"tipo": "admin"|"cliente", "id": str}.
+    """
+    authorization = request.headers.get("authorization", "")
+    token = authorization.replace("Bearer ", "") if authorization.startswith("Bearer ") else None
+    if not token:
+        raise HTTPException(status_code=401, detail="Debes estar autenticado para ver mensajes")
+    
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        if payload.get("rol") == "admin":
+            user_doc = usuarios_collection.find_one({"_id": ObjectId(payload.get("id"))}, {"_id": 1})
+            if user_doc:
+                return {"tipo": "admin", "id": str(user_doc["_id"])}
+        elif payload.get("rol") == "cliente":
+            cliente_doc = clientes_usuarios_collection.find_one({"_id": ObjectId(payload.get("id"))}, {"_id": 1})
+            if cliente_doc:
+                return {"tipo": "cliente", "id": str(cliente_doc["_id"])}
+    except jwt.PyJWTError:
+        raise HTTPException(status_code=401, detail="Token inválido o expirado")
+    except Exception as e:
+        raise HTTPException(status_code=401, detail=f"Error al validar token: {str(e)}")
+    
+    raise HTTPException(status_code=401, detail="Debes estar autenticado para ver mensajes")
+
+def verificar_acceso_conversacion(pedido_id: str, lector: dict):
+    """Un cliente solo puede acceder a su propia conversación de soporte"""
+    cliente_id = cliente_id_de_conversacion(pedido_id)
+    if cliente_id and lector["tipo"] == "cliente" and lector["id"] != cliente_id:
+        raise HTTPException(status_code=403, detail="No puedes ver conversaciones de otros clientes")
+
 @router.get("/soporte")
-async def get_conversaciones_soporte(current_user: dict = Depends(get_current_user)):
+async def get_conversaciones_soporte(
+    response: Response,
+    limit: int = Query(PAGINA_DEFAULT, ge=1, le=PAGINA_MAX),
+    cursor: Optional[str] = Query(None, description="Valor de X-Next-Cursor de la página anterior"),
+    current_user: dict = Depends(get_current_user)
+):
     """
-    Obtener todas las conversaciones de soporte agrupadas por cliente.
+    Obtener las conversaciones de soporte, una fila por cliente con el último mensaje
+    y la cantidad de no leídos, ordenadas por último mensaje (más reciente primero).
+    Los mensajes completos se obtienen al abrir la conversación con /mensajes/pedido/{pedido_id}.
+    Paginado por cursor: si hay más, el header X-Next-Cursor trae el cursor de la siguiente página.
     Solo para administradores.
     """
     try:
@@ -32,64 +119,56 @@ async def get_conversaciones_soporte(current_user: dict = Depends(get_current_us
         if current_user.get("rol") != "admin":
             raise HTTPException(status_code=403, detail="No tienes permisos para acceder a este recurso")
         
-        # Buscar todos los mensajes de soporte (pedido_id que empiece con "soporte_")
-        mensajes = list(mensajes_collection.find({
-            "pedido_id": {"$regex": "^soporte_"}
-        }).sort("fecha_creacion", 1))
-        
-        # Agrupar por cliente_id (extraído del pedido_id)
-        conversaciones_por_cliente = {}
-        
-        for mensaje in mensajes:
-            pedido_id = mensaje.get("pedido_id", "")
-            # Extraer cliente_id del formato "soporte_{cliente_id}"
-            if pedido_id.startswith("soporte_"):
-                cliente_id = pedido_id.replace("soporte_", "")
-                
-                if cliente_id not in conversaciones_por_cliente:
-                    # Buscar información del cliente
-                    try:
-                        cliente_obj_id = ObjectId(cliente_id)
-                        cliente_doc = clientes_usuarios_collection.find_one({"_id": cliente_obj_id})
-                        cliente_nombre = cliente_doc.get("nombre", "Cliente desconocido") if cliente_doc else "Cliente desconocido"
-                    except Exception:
-                        cliente_nombre = "Cliente desconocido"
-                    
-                    conversaciones_por_cliente[cliente_id] = {
-                        "cliente_id": cliente_id,
-                        "cliente_nombre": cliente_nombre,
-                        "pedido_id": pedido_id,
-                        "mensajes": [],
-                        "total_mensajes": 0,
-                        "mensajes_no_leidos": 0,
-                        "ultimo_mensaje": None
-                    }
-                
-                # Convertir ObjectId a string
-                mensaje["_id"] = str(mensaje["_id"])
-                
-                # Agregar mensaje a la conversación
-                conversaciones_por_cliente[cliente_id]["mensajes"].append(mensaje)
-                conversaciones_por_cliente[cliente_id]["total_mensajes"] += 1
-                
-                # Contar no leídos
-                if not mensaje.get("leido", False):
-                    conversaciones_por_cliente[cliente_id]["mensajes_no_leidos"] += 1
-                
-                # Actualizar último mensaje (usar fecha si existe, sino fecha_creacion)
-                fecha = mensaje.get("fecha") or mensaje.get("fecha_creacion", "")
-                if fecha:
-                    ultimo_mensaje_actual = conversaciones_por_cliente[cliente_id]["ultimo_mensaje"]
-                    fecha_ultimo = ultimo_mensaje_actual.get("fecha") or ultimo_mensaje_actual.get("fecha_creacion", "") if ultimo_mensaje_actual else ""
-                    if not ultimo_mensaje_actual or fecha > fecha_ultimo:
-                        conversaciones_por_cliente[cliente_id]["ultimo_mensaje"] = mensaje
-        
-        # Convertir a lista y ordenar por último mensaje (más reciente primero)
-        conversaciones = list(conversaciones_por_cliente.values())
-        conversaciones.sort(
-            key=lambda x: (x["ultimo_mensaje"].get("fecha") or x["ultimo_mensaje"].get("fecha_creacion", "")) if x["ultimo_mensaje"] else "",
-            reverse=True
-        )
+        pipeline = [
+            # Prefijo anclado: usa el índice (pedido_id, fecha_creacion)
+            {"$match": {"pedido_id": {"$regex": f"^{PREFIJO_SOPORTE}"}}},
+            {"$sort": {"pedido_id": -1, "fecha_creacion": -1}},
+            {"$group": {
+                "_id": "$pedido_id",
+                "ultimo_mensaje": {"$first": "$$ROOT"},
+                "ultima_fecha": {"$first": "$fecha_creacion"},
+                "total_mensajes": {"$sum": 1}
+            }},
+            {"$sort": {"ultima_fecha": -1, "_id": -1}}
+        ]
+        if cursor:
+            valores = decodificar_cursor(cursor)
+            if len(valores) != 2:
+                raise HTTPException(status_code=400, detail="Cursor de paginación inválido")
+            pipeline.append({"$match": filtro_despues_de(ORDEN_CONVERSACIONES, valores)})
+        pipeline.append({"$limit": limit + 1})
+        
+        filas = list(mensajes_collection.aggregate(pipeline))
+        siguiente = None
+        if len(filas) > limit:
+            filas = filas[:limit]
+            siguiente = codificar_cursor([filas[-1]["ultima_fecha"], filas[-1]["_id"]])
+        if siguiente:
+            response.headers["X-Next-Cursor"] = siguiente
+        
+        # Una sola consulta para los nombres de todos los clientes de la página
+        cliente_ids = [cliente_id_de_conversacion(fila["_id"]) for fila in filas]
+        cliente_obj_ids = [ObjectId(cid) for cid in cliente_ids if cid and ObjectId.is_valid(cid)]
+        nombres = {
+            str(cliente["_id"]): cliente.get("nombre", "Cliente desconocido")
+            for cliente in clientes_usuarios_collection.find({"_id": {"$in": cliente_obj_ids}}, {"nombre": 1})
+        } if cliente_obj_ids else {}
+        
+        # No leídos por el admin, desde los contadores (una consulta)
+        no_leidos = obtener_no_leidos([fila["_id"] for fila in filas], "admin")
+        
+        conversaciones = []
+        for fila, cliente_id in zip(filas, cliente_ids):
+            ultimo_mensaje = fila["ultimo_mensaje"]
+            ultimo_mensaje["_id"] = str(ultimo_mensaje["_id"])
+            conversaciones.append({
+                "cliente_id": cliente_id,
+                "cliente_nombre": nombres.get(cliente_id, "Cliente desconocido"),
+                "pedido_id": fila["_id"],
+                "total_mensajes": fila["total_mensajes"],
+                "mensajes_no_leidos": no_leidos.get(fila["_id"], 0),
+                "ultimo_mensaje": ultimo_mensaje
+            })
         
         # Devolver directamente el array (el frontend espera un array, no un objeto)
         return conversaciones
@@ -180,10 +259,21 @@ async def crear_mensaje(
             "fecha": fecha_iso,  # Campo fecha para compatibilidad
             "fecha_creacion": fecha_iso  # Mantener para ordenamiento
         }
+        cliente_id = cliente_id_de_conversacion(pedido_id)
+        if cliente_id:
+            mensaje_doc["cliente_id"] = cliente_id
         
         # Insertar mensaje
         result = mensajes_collection.insert_one(mensaje_doc)
         mensaje_doc["_id"] = str(result.inserted_id)
+        if not mensaje_doc["leido"]:
+            incrementar_no_leidos(pedido_id, remitente_tipo)
+        publicar_evento(
+            f"mensajes:{pedido_id}",
+            pedido_id=pedido_id,
+            mensaje_id=mensaje_doc["_id"],
+            remitente_tipo=remitente_tipo
+        )
         
         return {
             "message": "Mensaje creado exitosamente",
@@ -320,68 +410,18 @@ async def contar_mensajes_no_leidos(
     request: FastAPIRequest
 ):
     """
-    Contar mensajes no leídos de una conversación de soporte.
+    Contar mensajes no leídos de una conversación para quien consulta
+    (el admin ve los enviados por el cliente y viceversa).
+    Se responde desde el contador de la conversación, sin recorrer los mensajes.
     Formato: /mensajes/pedido/soporte_{cliente_id}/no-leidos
     """
     try:
-        # Intentar obtener token
-        authorization = request.headers.get("authorization", "")
-        token = None
-        if authorization.startswith("Bearer "):
-            token = authorization.replace("Bearer ", "")
-        
-        if not token:
-            raise HTTPException(status_code=401, detail="Debes estar autenticado para ver mensajes")
-        
-        # Verificar autenticación (admin o cliente)
-        es_admin = False
-        es_cliente = False
-        current_user = None
-        current_cliente = None
-        
-        try:
-            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-            if payload.get("rol") == "admin":
-                user_doc = usuarios_collection.find_one({"_id": ObjectId(payload.get("id"))})
-                if user_doc:
-                    es_admin = True
-                    current_user = {
-                        "id": str(user_doc["_id"]),
-                        "rol": user_doc.get("rol", "admin")
-                    }
-            elif payload.get("rol") == "cliente":
-                cliente_doc = clientes_usuarios_collection.find_one({"_id": ObjectId(payload.get("id"))})
-                if cliente_doc:
-                    es_cliente = True
-                    current_cliente = {
-                        "id": str(cliente_doc["_id"]),
-                        "nombre": cliente_doc.get("nombre", "Cliente")
-                    }
-        except jwt.PyJWTError:
-            raise HTTPException(status_code=401, detail="Token inválido o expirado")
-        except Exception as e:
-            raise HTTPException(status_code=401, detail=f"Error al validar token: {str(e)}")
-        
-        if not es_admin and not es_cliente:
-            raise HTTPException(status_code=401, detail="Debes estar autenticado para ver mensajes")
-        
-        # Si es conversación de soporte, verificar permisos
-        if pedido_id.startswith("soporte_"):
-            cliente_id_conversacion = pedido_id.replace("soporte_", "")
-            
-            # Si es cliente, solo puede ver sus propias conversaciones
-            if es_cliente and current_cliente and current_cliente.get("id") != cliente_id_conversacion:
-                raise HTTPException(status_code=403, detail="No puedes ver conversaciones de otros clientes")
-        
-        # Contar mensajes no leídos
-        count = mensajes_collection.count_documents({
-            "pedido_id": pedido_id,
-            "leido": False
-        })
+        lector = obtener_lector(request)
+        verificar_acceso_conversacion(pedido_id, lector)
         
         return {
             "pedido_id": pedido_id,
-            "mensajes_no_leidos": count
+            "mensajes_no_leidos": obtener_no_leidos([pedido_id], lector["tipo"]).get(pedido_id, 0)
         }
         
     except HTTPException:
@@ -392,3 +432,98 @@ async def contar_mensajes_no_leidos(
         print(f"ERROR CONTAR NO LEIDOS TRACEBACK: {traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=f"Error al contar mensajes no leídos: {str(e)}")
 
+@router.put("/pedido/{pedido_id}/leidos")
+async def marcar_mensajes_leidos(
+    pedido_id: str,
+    request: FastAPIRequest
+):
+    """
+    Marcar como leídos los mensajes de la conversación dirigidos a quien consulta
+    y reiniciar su contador de no leídos.
+    """
+    try:
+        lector = obtener_lector(request)
+        verificar_acceso_conversacion(pedido_id, lector)
+        
+        # Mensajes dirigidos al lector: los enviados por la otra audiencia
+        filtro = {"pedido_id": pedido_id, "leido": False}
+        if lector["tipo"] == "admin":
+            filtro["remitente_tipo"] = {"$ne": "admin"}
+        else:
+            filtro["remitente_tipo"] = "admin"
+        result = mensajes_collection.update_many(filtro, {"$set": {"leido": True}})
+        
+        contadores_no_leidos_collection.update_one(
+            {"_id": pedido_id},
+            {"$set": {f"no_leidos.{lector['tipo']}": 0, "fecha_actualizacion": datetime.now().isoformat()}}
+        )
+        
+        return {
+            "pedido_id": pedido_id,
+            "mensajes_marcados": result.modified_count
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"ERROR MARCAR LEIDOS: {str(e)}")
+        import traceback
+        print(f"ERROR MARCAR LEIDOS TRACEBACK: {traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail=f"Error al marcar mensajes como leídos: {str(e)}")
+
+@job_runner.registrar("reconstruir_contadores_no_leidos")
+def job_reconstruir_contadores_no_leidos(ctx: JobContext):
+    """
+    Reconstruir los contadores de no leídos desde los mensajes.
+    Corrige contadores desfasados (mensajes borrados o marcados fuera de la API).
+    """
+    conteos: Dict[str, Dict[str, int]] = {}
+    for fila in mensajes_collection.aggregate([
+        {"$match": {"leido": False}},
+        {"$group": {
+            "_id": {"pedido_id": "$pedido_id", "remitente_tipo": "$remitente_tipo"},
+            "total": {"$sum": 1}
+        }}
+    ]):
+        pedido_id = fila["_id"].get("pedido_id")
+        if not pedido_id:
+            continue
+        audiencia = audiencia_destinataria(fila["_id"].get("remitente_tipo"))
+        conteos.setdefault(pedido_id, {a: 0 for a in AUDIENCIAS})[audiencia] += fila["total"]
+    
+    ctx.set_total(len(conteos))
+    ahora = datetime.now().isoformat()
+    pedido_ids = list(conteos.keys())
+    for inicio in range(0, len(pedido_ids), 500):
+        lote = pedido_ids[inicio:inicio + 500]
+        contadores_no_leidos_collection.bulk_write([
+            UpdateOne(
+                {"_id": pedido_id},
+                {"$set": {"no_leidos": conteos[pedido_id], "fecha_actualizacion": ahora}},
+                upsert=True
+            )
+            for pedido_id in lote
+        ], ordered=False)
+        ctx.guardar_progreso(procesados=len(lote))
+    
+    # Conversaciones sin mensajes pendientes
+    reiniciados = contadores_no_leidos_collection.update_many(
+        {"_id": {"$nin": pedido_ids}},
+        {"$set": {"no_leidos": {a: 0 for a in AUDIENCIAS}, "fecha_actualizacion": ahora}}
+    ).modified_count
+    return {"conversaciones_con_no_leidos": len(pedido_ids), "contadores_reiniciados": reiniciados}
+
+@router.post("/contadores/reconstruir", status_code=202)
+async def reconstruir_contadores_no_leidos(current_user: dict = Depends(get_current_user)):
+    """
+    Reconstruir los contadores de no leídos desde los mensajes en segundo plano.
+    Consultar el progreso en /jobs/{job_id}. Solo para administradores.
+    """
+    if current_user.get("rol") != "admin":
+        raise HTTPException(status_code=403, detail="No tienes permisos para acceder a este recurso")
+    job = job_runner.lanzar("reconstruir_contadores_no_leidos")
+    return {
+        "message": "Reconstrucción de contadores de no leídos en ejecución",
+        "job_id": job["job_id"],
+        "estado": job["estado"]
+    }
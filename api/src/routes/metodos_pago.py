@@ -1,14 +1,27 @@
-from fastapi import APIRouter, HTTPException, Body
+from fastapi import APIRouter, HTTPException, Body, Query, Request, Response
 from typing import List, Optional
 from bson import ObjectId
+from datetime import datetime
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
 from ..config.mongodb import db
 from ..models.pagosmodels import MetodoPago
 from ..models.transaccionmodels import Transaccion
+from ..utils.jobs import JobContext, iterar_por_lotes
+from ..utils.paginacion import paginar, PAGINA_MAX
+from ..utils.versiones import RECURSO_METODOS_PAGO, incrementar_version, respuesta_condicional
+from .jobs import job_runner
 from pydantic import BaseModel
 
 router = APIRouter()
 metodos_pago_collection = db["metodos_pago"]
 transacciones_collection = db["transacciones"]
+saldos_checkpoints_collection = db["saldos_checkpoints"]
+
+# Cada SALDO_CHECKPOINT_CADA transacciones de un método se guarda una foto de su saldo
+SALDO_CHECKPOINT_CADA = 100
+HISTORIAL_PAGINA_DEFAULT = 100
+ORDEN_HISTORIAL = [("fecha", -1), ("_id", -1)]
 
 def object_id_to_str(data):
     if isinstance(data, dict):
@@ -19,6 +32,104 @@ def object_id_to_str(data):
         return data_copy
     return data
 
+def delta_transaccion(transaccion: dict) -> float:
+    """Efecto de una transacción sobre el saldo (las anteriores a delta lo deducen del tipo)"""
+    if transaccion.get("delta") is not None:
+        return float(transaccion["delta"])
+    monto = float(transaccion.get("monto", 0.0) or 0.0)
+    if transaccion.get("tipo") == "transferencia":
+        return -monto
+    # depósitos suman; pago_cuenta_por_pagar y reversos ya guardan el monto con signo
+    return monto
+
+def guardar_checkpoint_saldo(metodo: dict):
+    """Guardar el saldo del método en su última secuencia de transacciones"""
+    saldos_checkpoints_collection.update_one(
+        {"metodo_pago_id": str(metodo["_id"]), "secuencia": metodo.get("secuencia_transacciones", 0)},
+        {"$set": {"saldo": metodo.get("saldo", 0.0), "fecha": datetime.utcnow()}},
+        upsert=True
+    )
+
+def aplicar_movimiento_saldo(metodo_filtro: dict, delta: float, transaccion: dict) -> Optional[dict]:
+    """
+    Aplicar delta al saldo del método y registrar la transacción con el saldo resultante
+    (saldo_despues) en una sola escritura atómica sobre el documento del método.
+    La transacción queda primero en el outbox del método (transacciones_pendientes) y luego
+    se publica en la colección de transacciones; si el proceso cae entre ambos pasos,
+    publicar_transacciones_pendientes la completa.
+    metodo_filtro permite condicionar la operación (ej: {"saldo": {"$gte": monto}}); si no
+    coincide no se modifica nada y se devuelve None. Devuelve el método actualizado.
+    """
+    transaccion_id = transaccion.get("_id") or ObjectId()
+    transaccion = {**transaccion, "_id": transaccion_id, "delta": delta}
+    if not transaccion.get("fecha"):
+        transaccion["fecha"] = datetime.utcnow()
+
+    # Pipeline de actualización: el saldo, la secuencia y la transacción pendiente se
+    # calculan en el servidor sobre el mismo documento, sin leerlo antes
+    metodo = metodos_pago_collection.find_one_and_update(
+        metodo_filtro,
+        [
+            {"$set": {
+                "saldo": {"$add": [{"$ifNull": ["$saldo", 0.0]}, delta]},
+                "secuencia_transacciones": {"$add": [{"$ifNull": ["$secuencia_transacciones", 0]}, 1]}
+            }},
+            {"$set": {
+                "transacciones_pendientes": {"$concatArrays": [
+                    {"$ifNull": ["$transacciones_pendientes", []]},
+                    [{"$mergeObjects": [
+                        {"$literal": transaccion},
+                        {
+                            "metodo_pago_id": {"$toString": "$_id"},
+                            "saldo_despues": "$saldo",
+                            "secuencia": "$secuencia_transacciones"
+                        }
+                    ]}]
+                ]}
+            }}
+        ],
+        return_document=ReturnDocument.AFTER
+    )
+    if not metodo:
+        return None
+    incrementar_version(RECURSO_METODOS_PAGO)
+
+    pendientes = metodo.pop("transacciones_pendientes", None) or []
+    registrada = next((t for t in pendientes if t.get("_id") == transaccion_id), None)
+    if registrada:
+        publicar_transaccion_pendiente(metodo["_id"], registrada)
+
+    if metodo["secuencia_transacciones"] % SALDO_CHECKPOINT_CADA == 0:
+        guardar_checkpoint_saldo(metodo)
+    return metodo
+
+def publicar_transaccion_pendiente(metodo_id: ObjectId, transaccion: dict):
+    """Insertar la transacción del outbox en el historial y quitarla del método (idempotente)"""
+    try:
+        transacciones_collection.insert_one(transaccion)
+    except DuplicateKeyError:
+        # Ya se había publicado antes de una caída; solo falta limpiar el outbox
+        pass
+    metodos_pago_collection.update_one(
+        {"_id": metodo_id},
+        {"$pull": {"transacciones_pendientes": {"_id": transaccion["_id"]}}}
+    )
+
+def publicar_transacciones_pendientes() -> int:
+    """Publicar las transacciones que quedaron en el outbox de los métodos (startup)"""
+    publicadas = 0
+    metodos = metodos_pago_collection.find(
+        {"transacciones_pendientes.0": {"$exists": True}},
+        {"transacciones_pendientes": 1}
+    )
+    for metodo in metodos:
+        for transaccion in metodo.get("transacciones_pendientes", []):
+            publicar_transaccion_pendiente(metodo["_id"], transaccion)
+            publicadas += 1
+    if publicadas:
+        print(f"✅ Publicadas {publicadas} transacciones pendientes de métodos de pago")
+    return publicadas
+
 class MontoRequest(BaseModel):
     monto: float
 
@@ -72,6 +183,7 @@ async def create_metodo_pago(metodo_pago: MetodoPago):
         
         # Insertar en la base de datos
         result = metodos_pago_collection.insert_one(metodo_pago_dict)
+        incrementar_version(RECURSO_METODOS_PAGO)
         print(f"DEBUG: Resultado de inserción: {result.inserted_id}")
         
         # Obtener el documento creado
@@ -135,6 +247,7 @@ async def create_metodo_pago_simple(request_data: dict):
         
         # Insertar
         result = metodos_pago_collection.insert_one(metodo_pago_dict)
+        incrementar_version(RECURSO_METODOS_PAGO)
         created_metodo = metodos_pago_collection.find_one({"_id": result.inserted_id})
         
         return object_id_to_str(created_metodo)
@@ -192,14 +305,32 @@ async def test_database_connection():
         }
 
 @router.get("/", response_model=List[MetodoPago])
-async def get_all_metodos_pago():
+async def get_all_metodos_pago(request: Request, response: Response):
+    """Listar los métodos de pago; responde 304 si el cliente ya tiene la versión actual"""
+    no_modificado = respuesta_condicional(request, response, RECURSO_METODOS_PAGO)
+    if no_modificado:
+        return no_modificado
     metodos = list(metodos_pago_collection.find())
     return [object_id_to_str(metodo) for metodo in metodos]
 
 @router.get("", response_model=List[MetodoPago], include_in_schema=False)
-async def get_all_metodos_pago_no_slash():
-    metodos = list(metodos_pago_collection.find())
-    return [object_id_to_str(metodo) for metodo in metodos]
+async def get_all_metodos_pago_no_slash(request: Request, response: Response):
+    return await get_all_metodos_pago(request, response)
+
+@router.get("/historial-completo", response_model=List[Transaccion])
+async def get_historial_completo(
+    response: Response,
+    limit: int = Query(HISTORIAL_PAGINA_DEFAULT, ge=1, le=PAGINA_MAX),
+    cursor: Optional[str] = Query(None, description="Valor de X-Next-Cursor de la página anterior")
+):
+    """
+    Obtener el historial de todas las transacciones, de la más nueva a la más antigua.
+    Paginado por cursor: si hay más, el header X-Next-Cursor trae el cursor de la siguiente página.
+    """
+    transacciones, siguiente = paginar(transacciones_collection, {}, ORDEN_HISTORIAL, limit, cursor)
+    if siguiente:
+        response.headers["X-Next-Cursor"] = siguiente
+    return [object_id_to_str(t) for t in transacciones]
 
 @router.get("/{id}", response_model=MetodoPago)
 async def get_metodo_pago(id: str):
@@ -220,6 +351,7 @@ async def update_metodo_pago(id: str, metodo_pago: MetodoPago):
         return_document=True
     )
     if updated_metodo:
+        incrementar_version(RECURSO_METODOS_PAGO)
         return object_id_to_str(updated_metodo)
     raise HTTPException(status_code=404, detail="Método de pago no encontrado")
 
@@ -227,6 +359,7 @@ async def update_metodo_pago(id: str, metodo_pago: MetodoPago):
 async def delete_metodo_pago(id: str):
     result = metodos_pago_collection.delete_one({"_id": ObjectId(id)})
     if result.deleted_count == 1:
+        incrementar_version(RECURSO_METODOS_PAGO)
         return {"message": "Método de pago eliminado correctamente"}
     raise HTTPException(status_code=404, detail="Método de pago no encontrado")
 
@@ -248,16 +381,22 @@ async def depositar_dinero_simple(id: str, request: DepositoRequest):
         
         print(f"DEBUG SIMPLE: Método encontrado: {metodo.get('nombre', 'SIN_NOMBRE')}")
         
-        # Solo incrementar el saldo (sin transacción por ahora)
-        result = metodos_pago_collection.update_one(
+        # Igual que /deposito: registrar la transacción con el saldo resultante y su secuencia
+        transaccion = Transaccion(
+            metodo_pago_id=id,
+            tipo="deposito",
+            monto=request.monto,
+            concepto=request.concepto
+        )
+        metodo_actualizado = aplicar_movimiento_saldo(
             {"_id": ObjectId(id)},
-            {"$inc": {"saldo": request.monto}}
+            request.monto,
+            transaccion.dict(by_alias=True)
         )
+        if not metodo_actualizado:
+            return {"error": "Método no encontrado", "id": id}
         
-        print(f"DEBUG SIMPLE: Resultado update: {result.modified_count} documentos modificados")
-        
-        # Obtener el método actualizado
-        metodo_actualizado = metodos_pago_collection.find_one({"_id": ObjectId(id)})
+        print(f"DEBUG SIMPLE: Depósito registrado, saldo: {metodo_actualizado.get('saldo')}")
         
         return {
             "success": True,
@@ -285,41 +424,22 @@ async def depositar_dinero(id: str, request: DepositoRequest):
             print(f"DEBUG DEPOSITO: ID inválido: {id}")
             raise HTTPException(status_code=400, detail="ID de método de pago inválido")
         
-        # Verificar que el método existe
-        metodo = metodos_pago_collection.find_one({"_id": ObjectId(id)})
-        if not metodo:
-            print(f"DEBUG DEPOSITO: Método no encontrado")
-            raise HTTPException(status_code=404, detail="Método de pago no encontrado")
-        
-        print(f"DEBUG DEPOSITO: Método encontrado: {metodo.get('nombre', 'SIN_NOMBRE')}")
-        
-        # Incrementar el saldo
-        updated_metodo = metodos_pago_collection.find_one_and_update(
-            {"_id": ObjectId(id)},
-            {"$inc": {"saldo": request.monto}},
-            return_document=True
-        )
-        print(f"DEBUG DEPOSITO: Método actualizado: {updated_metodo is not None}")
-        
-        if not updated_metodo:
-            print(f"DEBUG DEPOSITO: Error al actualizar método")
-            raise HTTPException(status_code=500, detail="Error al actualizar método de pago")
-
-        # Registrar la transacción
+        # Incrementar el saldo y registrar la transacción con el saldo resultante
         transaccion = Transaccion(
             metodo_pago_id=id,
             tipo="deposito",
             monto=request.monto,
             concepto=request.concepto
         )
-        transaccion_dict = transaccion.dict(by_alias=True)
-        # No eliminar el campo _id, dejar que MongoDB genere uno automático
-        if "_id" in transaccion_dict and transaccion_dict["_id"] is None:
-            del transaccion_dict["_id"]
-        
-        print(f"DEBUG DEPOSITO: Insertando transacción: {transaccion_dict}")
-        transacciones_collection.insert_one(transaccion_dict)
-        print(f"DEBUG DEPOSITO: Transacción insertada correctamente")
+        updated_metodo = aplicar_movimiento_saldo(
+            {"_id": ObjectId(id)},
+            request.monto,
+            transaccion.dict(by_alias=True)
+        )
+        if not updated_metodo:
+            print(f"DEBUG DEPOSITO: Método no encontrado")
+            raise HTTPException(status_code=404, detail="Método de pago no encontrado")
+        print(f"DEBUG DEPOSITO: Depósito registrado, saldo: {updated_metodo.get('saldo')}")
 
         result = object_id_to_str(updated_metodo)
         print(f"DEBUG DEPOSITO: Retornando resultado: {result.get('nombre', 'SIN_NOMBRE')}")
@@ -343,41 +463,40 @@ async def transferir_dinero(id: str, request: TransferenciaRequest):
     if not id or id == "undefined":
         raise HTTPException(status_code=400, detail="ID de método de pago inválido")
     
-    # Verificar saldo suficiente
-    metodo = metodos_pago_collection.find_one({"_id": ObjectId(id)})
-    if not metodo:
-        raise HTTPException(status_code=404, detail="Método de pago no encontrado")
-    if metodo.get("saldo", 0) < request.monto:
-        raise HTTPException(status_code=400, detail="Saldo insuficiente")
-
-    # Disminuir el saldo
-    updated_metodo = metodos_pago_collection.find_one_and_update(
-        {"_id": ObjectId(id)},
-        {"$inc": {"saldo": -request.monto}},
-        return_document=True
-    )
+    if not ObjectId.is_valid(id):
+        raise HTTPException(status_code=400, detail="ID de método de pago inválido")
+    if request.monto <= 0:
+        raise HTTPException(status_code=400, detail="El monto debe ser mayor a 0")
 
-    # Registrar la transacción
+    # Débito condicional: el filtro con $gte garantiza que dos transferencias concurrentes
+    # no puedan dejar el saldo en negativo (no hay lectura previa del saldo)
     transaccion = Transaccion(
         metodo_pago_id=id,
         tipo="transferencia",
         monto=request.monto,
         concepto=request.concepto
     )
-    transaccion_dict = transaccion.dict(by_alias=True)
-    # No eliminar el campo _id, dejar que MongoDB genere uno automático
-    if "_id" in transaccion_dict and transaccion_dict["_id"] is None:
-        del transaccion_dict["_id"]
-    
-    transacciones_collection.insert_one(transaccion_dict)
+    updated_metodo = aplicar_movimiento_saldo(
+        {"_id": ObjectId(id), "saldo": {"$gte": request.monto}},
+        -request.monto,
+        transaccion.dict(by_alias=True)
+    )
+    if not updated_metodo:
+        # Solo en el caso de fallo se consulta el método para distinguir el error
+        if not metodos_pago_collection.find_one({"_id": ObjectId(id)}, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="Método de pago no encontrado")
+        raise HTTPException(status_code=400, detail="Saldo insuficiente")
 
     return object_id_to_str(updated_metodo)
 
 @router.get("/all", response_model=List[MetodoPago])
 @router.get("/all/", response_model=List[MetodoPago])  # Soporte para ruta con barra final
-async def get_all_metodos_pago_all():
+async def get_all_metodos_pago_all(request: Request, response: Response):
     """Endpoint específico para obtener todos los métodos de pago"""
     try:
+        no_modificado = respuesta_condicional(request, response, RECURSO_METODOS_PAGO)
+        if no_modificado:
+            return no_modificado
         metodos = list(metodos_pago_collection.find())
         return [object_id_to_str(metodo) for metodo in metodos]
     except Exception as e:
@@ -386,60 +505,165 @@ async def get_all_metodos_pago_all():
         print(f"TRACEBACK: {traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=f"Error al obtener métodos de pago: {str(e)}")
 
-@router.get("/historial-completo", response_model=List[Transaccion])
-async def get_historial_completo():
-    """Obtener el historial completo de todas las transacciones"""
-    transacciones = list(transacciones_collection.find().sort("fecha", -1))
-    return [object_id_to_str(t) for t in transacciones]
-
 @router.get("/{id}/historial", response_model=List[Transaccion])
-async def get_historial_transacciones(id: str):
-    """Obtener el historial completo de transacciones de un método de pago con saldo después de cada movimiento"""
-    print(f"DEBUG HISTORIAL: Buscando historial para método {id}")
+async def get_historial_transacciones(
+    id: str,
+    response: Response,
+    limit: int = Query(HISTORIAL_PAGINA_DEFAULT, ge=1, le=PAGINA_MAX),
+    cursor: Optional[str] = Query(None, description="Valor de X-Next-Cursor de la página anterior")
+):
+    """
+    Obtener el historial de transacciones de un método de pago con el saldo después de cada movimiento.
+    saldo_despues se guarda al registrar cada transacción, así que cada página cuesta lo mismo
+    sin importar la longitud del historial. Si hay más, el header X-Next-Cursor trae el cursor.
+    """
     try:
-        # Obtener el saldo actual del método de pago
-        metodo = metodos_pago_collection.find_one({"_id": ObjectId(id)})
-        if not metodo:
+        if not ObjectId.is_valid(id):
+            raise HTTPException(status_code=400, detail="ID de método de pago inválido")
+        if not metodos_pago_collection.find_one({"_id": ObjectId(id)}, {"_id": 1}):
             raise HTTPException(status_code=404, detail="Método de pago no encontrado")
         
-        saldo_actual = metodo.get("saldo", 0.0)
-        print(f"DEBUG HISTORIAL: Saldo actual del método: {saldo_actual}")
-        
-        # Obtener todas las transacciones ordenadas de más nueva a más antigua
-        transacciones = list(transacciones_collection.find({"metodo_pago_id": id}).sort("fecha", -1))
-        print(f"DEBUG HISTORIAL: Encontradas {len(transacciones)} transacciones")
-        
-        # Calcular el saldo después de cada transacción
-        # Empezamos con el saldo actual y vamos hacia atrás en el tiempo
-        saldo_despues = saldo_actual
-        result = []
-        
-        for transaccion in transacciones:
-            transaccion_dict = object_id_to_str(transaccion)
-            
-            # El saldo después de esta transacción es el saldo actual antes de la siguiente
-            # (que ya calculamos)
-            transaccion_dict["saldo_despues"] = saldo_despues
-            
-            # Para calcular el saldo antes de esta transacción, necesitamos revertir el efecto
-            # Si es un depósito, restamos el monto; si es transferencia, sumamos
-            monto = transaccion.get("monto", 0.0)
-            tipo = transaccion.get("tipo", "deposito")
-            
-            if tipo == "deposito":
-                saldo_antes = saldo_despues - monto
-            else:  # transferencia
-                saldo_antes = saldo_despues + monto
-            
-            # Actualizar saldo_despues para la siguiente iteración (transacción anterior)
-            saldo_despues = saldo_antes
-            
-            result.append(transaccion_dict)
-        
-        print(f"DEBUG HISTORIAL: Resultado procesado: {len(result)} elementos con saldos calculados")
-        return result
+        transacciones, siguiente = paginar(
+            transacciones_collection,
+            {"metodo_pago_id": id},
+            ORDEN_HISTORIAL,
+            limit,
+            cursor
+        )
+        if siguiente:
+            response.headers["X-Next-Cursor"] = siguiente
+        return [object_id_to_str(t) for t in transacciones]
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"DEBUG HISTORIAL: Error: {e}")
         import traceback
         print(f"DEBUG HISTORIAL: Traceback: {traceback.format_exc()}")
-        raise HTTPException(status_code=500, detail=f"Error al obtener historial: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error al obtener historial: {str(e)}")
+
+@router.get("/{id}/conciliacion")
+async def get_conciliacion_saldo(id: str):
+    """
+    Comparar el saldo del método con el último checkpoint más las transacciones posteriores.
+    Detecta cambios de saldo que no pasaron por el registro de transacciones.
+    """
+    if not ObjectId.is_valid(id):
+        raise HTTPException(status_code=400, detail="ID de método de pago inválido")
+    metodo = metodos_pago_collection.find_one({"_id": ObjectId(id)})
+    if not metodo:
+        raise HTTPException(status_code=404, detail="Método de pago no encontrado")
+    
+    checkpoint = saldos_checkpoints_collection.find_one(
+        {"metodo_pago_id": id},
+        sort=[("secuencia", -1)]
+    )
+    secuencia_base = checkpoint["secuencia"] if checkpoint else None
+    saldo_base = checkpoint["saldo"] if checkpoint else 0.0
+    
+    filtro = {"metodo_pago_id": id}
+    if secuencia_base is not None:
+        filtro["secuencia"] = {"$gt": secuencia_base}
+    posteriores = list(transacciones_collection.find(filtro, {"delta": 1, "monto": 1, "tipo": 1}))
+    saldo_calculado = saldo_base + sum(delta_transaccion(t) for t in posteriores)
+    saldo_actual = float(metodo.get("saldo", 0.0))
+    
+    return {
+        "metodo_pago_id": id,
+        "saldo_actual": saldo_actual,
+        "saldo_calculado": round(saldo_calculado, 2),
+        "diferencia": round(saldo_actual - saldo_calculado, 2),
+        "conciliado": abs(saldo_actual - saldo_calculado) < 0.01,
+        "checkpoint_secuencia": secuencia_base,
+        "transacciones_desde_checkpoint": len(posteriores)
+    }
+
+@job_runner.registrar("recalcular_saldos_transacciones")
+def job_recalcular_saldos_transacciones(ctx: JobContext):
+    """
+    Completar saldo_despues, delta y secuencia en las transacciones anteriores a su registro
+    en escritura, recorriendo cada método desde su saldo actual hacia atrás. Las transacciones
+    antiguas reciben secuencias <= 0 para quedar antes de las nuevas. También convierte las
+    fechas guardadas como string a datetime y deja un checkpoint por método.
+    """
+    filtro_legado = {"saldo_despues": {"$exists": False}}
+    ctx.set_total(metodos_pago_collection.count_documents({}))
+    
+    for lote in iterar_por_lotes(ctx, metodos_pago_collection, {}, tamano_lote=20):
+        transacciones_actualizadas = 0
+        for metodo in lote:
+            metodo_id = str(metodo["_id"])
+            # Saldo justo antes de la primera transacción registrada con saldo_despues
+            primera_nueva = transacciones_collection.find_one(
+                {"metodo_pago_id": metodo_id, "secuencia": {"$gt": 0}},
+                sort=[("secuencia", 1)]
+            )
+            if primera_nueva:
+                saldo_despues = float(primera_nueva["saldo_despues"]) - delta_transaccion(primera_nueva)
+            else:
+                saldo_despues = float(metodo.get("saldo", 0.0))
+            
+            legado = list(transacciones_collection.find({"metodo_pago_id": metodo_id, **filtro_legado}))
+            for transaccion in legado:
+                fecha = transaccion.get("fecha")
+                if isinstance(fecha, str):
+                    try:
+                        transaccion["fecha"] = datetime.fromisoformat(fecha.replace("Z", "+00:00")).replace(tzinfo=None)
+                    except ValueError:
+                        transaccion["fecha"] = transaccion["_id"].generation_time.replace(tzinfo=None)
+                elif not isinstance(fecha, datetime):
+                    transaccion["fecha"] = transaccion["_id"].generation_time.replace(tzinfo=None)
+            legado.sort(key=lambda t: (t["fecha"], t["_id"]), reverse=True)
+            
+            operaciones = []
+            for secuencia, transaccion in enumerate(legado):
+                delta = delta_transaccion(transaccion)
+                operaciones.append(UpdateOne(
+                    {"_id": transaccion["_id"]},
+                    {"$set": {
+                        "fecha": transaccion["fecha"],
+                        "delta": delta,
+                        "saldo_despues": round(saldo_despues, 2),
+                        "secuencia": -secuencia
+                    }}
+                ))
+                saldo_despues -= delta
+            if operaciones:
+                transacciones_collection.bulk_write(operaciones, ordered=False)
+                transacciones_actualizadas += len(operaciones)
+            
+            # Checkpoint con el estado actual del método
+            metodo_actual = metodos_pago_collection.find_one({"_id": metodo["_id"]})
+            if metodo_actual:
+                guardar_checkpoint_saldo(metodo_actual)
+        
+        ctx.guardar_progreso(
+            procesados=len(lote),
+            checkpoint={"ultimo_id": lote[-1]["_id"]},
+            transacciones_actualizadas=transacciones_actualizadas
+        )
+
+def programar_normalizacion_transacciones():
+    """
+    Lanzar recalcular_saldos_transacciones al arrancar si quedan transacciones sin saldo_despues
+    (llamar desde el event loop): las anteriores a su registro en escritura, con la fecha como
+    texto o como datetime. Así el historial muestra el saldo de cada movimiento y las fechas
+    de texto quedan como datetime, con su secuencia.
+    """
+    try:
+        if transacciones_collection.find_one({"saldo_despues": {"$exists": False}}, {"_id": 1}):
+            job_runner.lanzar("recalcular_saldos_transacciones")
+    except Exception as e:
+        print(f"ERROR TRANSACCIONES: No se pudo lanzar la normalización del historial: {e}")
+
+@router.post("/recalcular-saldos-historial", status_code=202)
+async def recalcular_saldos_historial():
+    """
+    Completar saldo_despues en las transacciones registradas antes de guardarlo en escritura.
+    Se ejecuta en segundo plano; consultar el progreso en /jobs/{job_id}
+    """
+    job = job_runner.lanzar("recalcular_saldos_transacciones")
+    return {
+        "message": "Recalculo de saldos del historial en ejecución",
+        "job_id": job["job_id"],
+        "estado": job["estado"]
+    }
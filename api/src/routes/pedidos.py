@@ -1,11 +1,33 @@
-from typing import List, Optional, Union
-from fastapi import APIRouter, HTTPException, Body, Depends, Query
+from typing import List, Literal, Optional, Union
+from fastapi import APIRouter, HTTPException, Body, Depends, Query, Response
 from bson import ObjectId
 from datetime import datetime, timedelta, timezone
-from pymongo import UpdateOne
+from pymongo import ReplaceOne, UpdateOne
 import os
-from ..config.mongodb import pedidos_collection, db, items_collection, clientes_collection, clientes_usuarios_collection, facturas_cliente_collection, movimientos_logisticos_collection, empleados_collection
+import time
+from ..config.mongodb import apartados_collection, apartados_archivo_collection, pedidos_collection, pedidos_eliminados_collection, db, items_collection, clientes_collection, clientes_usuarios_collection, facturas_cliente_collection, movimientos_logisticos_collection, empleados_collection
 from ..utils.cache import cache, CACHE_KEY_EMPLEADOS, CACHE_KEY_ASIGNACIONES, CACHE_KEY_ASIGNACIONES_MODULO
+from ..utils.empleados import invalidar_empleados
+from ..utils.write_behind import BufferedWriter
+from ..config.config import MOVIMIENTOS_BUFFER_MAX_LOTE, MOVIMIENTOS_BUFFER_INTERVALO_MS, MOVIMIENTOS_BUFFER_MAX_COLA, PEDIDOS_ELIMINADOS_RETENCION_DIAS
+from ..config.config import APARTADOS_ARCHIVO_DIAS, APARTADOS_ARCHIVO_INTERVALO_HORAS
+from ..utils.jobs import JobContext, iterar_por_lotes
+from .jobs import job_runner
+from .metodos_pago import aplicar_movimiento_saldo
+from ..utils.snapshots import CAMPO_SNAPSHOT, compactar_snapshot
+from ..utils.eventos import publicar_evento
+from ..utils.paginacion import PAGINA_DEFAULT, PAGINA_MAX, codificar_cursor, decodificar_cursor, filtro_despues_de, paginar
+from ..utils.versiones import RECURSO_INVENTARIO, incrementar_version
+from ..utils.inventario import (
+    CAMPO_CODIGO_NORM, CAMPO_SIN_EXISTENCIA, CAMPO_SIN_EXISTENCIA2, ETAPA_SIN_EXISTENCIA, con_sin_existencia,
+    descontar_existencias, resolver_items_inventario
+)
+from ..utils.transacciones import ejecutar_en_transaccion
+from ..utils.totales_pedido import (
+    CAMPO_MONTO_TOTAL, CAMPO_SALDO_PENDIENTE, CAMPO_TOTAL_ABONADO, ETAPAS_TOTALES_PEDIDO, afecta_totales, como_pipeline,
+    con_totales, totales_pedido
+)
+from ..utils.concurrencia import ConsultaTimeout, consultas_en_paralelo
 transacciones_collection = db["transacciones"]
 from ..models.authmodels import Pedido
 from ..auth.auth import get_current_user, get_current_cliente
@@ -29,7 +51,45 @@ empleados_collection = db["empleados"]
 # items_collection ya está importado de mongodb.py como db["INVENTARIO"]
 # NO redefinir aquí con minúsculas, usar la importación correcta
 comisiones_collection = db["comisiones"]
-apartados_collection = db["apartados"]  # Colección para módulo APARTADO
+# apartados_collection y apartados_archivo_collection vienen de mongodb.py (índices en init_apartados_indexes)
+APARTADO_PENDIENTE = "pendiente"
+APARTADO_FACTURADO = "facturado"
+
+def actualizar_pedido(filtro: dict, update: dict):
+    """
+    update_one sobre pedidos que además marca fecha_actualizacion como fecha real (indexada).
+    Toda escritura de pedidos debe pasar por aquí para que /pedidos/cambios la detecte.
+    Si el update cambia items, adicionales o total_abonado, recalcula monto_total y saldo_pendiente
+    en la misma escritura (pipeline); si no se puede expresar como pipeline (rutas con punto),
+    los recalcula en una segunda escritura a partir del documento guardado.
+    """
+    update = {**update, "$set": {**update.get("$set", {}), "fecha_actualizacion": datetime.now()}}
+    if not afecta_totales(update):
+        return pedidos_collection.update_one(filtro, update)
+    pipeline = como_pipeline(update)
+    if pipeline is not None:
+        return pedidos_collection.update_one(filtro, pipeline + ETAPAS_TOTALES_PEDIDO)
+    # La segunda escritura va solo por _id: el filtro puede depender de campos que la primera
+    # acaba de cambiar (ej: historial_pagos.{i}.estado al aprobar un abono) y ya no coincidiría
+    pedido_id = filtro.get("_id")
+    if not isinstance(pedido_id, ObjectId):
+        pedido = pedidos_collection.find_one(filtro, {"_id": 1})
+        if pedido is None:
+            return pedidos_collection.update_one(filtro, update)
+        pedido_id = pedido["_id"]
+        filtro = {"$and": [filtro, {"_id": pedido_id}]}
+    resultado = pedidos_collection.update_one(filtro, update)
+    if resultado.matched_count:
+        pedidos_collection.update_one({"_id": pedido_id}, ETAPAS_TOTALES_PEDIDO)
+    return resultado
+
+def registrar_pedido_eliminado(pedido_id: ObjectId, motivo: str = "eliminado"):
+    """Guardar el tombstone de un pedido eliminado para que los clientes lo quiten de su caché"""
+    pedidos_eliminados_collection.update_one(
+        {"_id": pedido_id},
+        {"$set": {"motivo": motivo, "fecha_eliminacion": datetime.now()}},
+        upsert=True
+    )
 
 def obtener_siguiente_modulo(orden_actual: int) -> str:
     """Determinar el siguiente módulo según el orden actual"""
@@ -68,21 +128,6 @@ def excluir_pedidos_web(query: dict) -> dict:
         }
     return query
 
-def calcular_precio_final_item(item: dict) -> float:
-    """
-    Calcula el precio final de un item considerando el descuento.
-    
-    Args:
-        item: Diccionario con los datos del item (debe tener 'precio' y opcionalmente 'descuento')
-    
-    Returns:
-        float: Precio final = max(0, precio - descuento)
-    """
-    precio = float(item.get("precio", 0))
-    descuento = float(item.get("descuento", 0) or 0)
-    precio_final = max(0.0, precio - descuento)
-    return precio_final
-
 def excluir_pedidos_tu_mundo_puerta(query: dict) -> dict:
     """
     Agrega filtro para excluir pedidos de TU MUNDO PUERTA (RIF: J-507172554) de una consulta.
@@ -177,55 +222,40 @@ def enriquecer_pedido_con_datos_cliente(pedido: dict):
         debug_log(f"Advertencia: No se pudo obtener datos del cliente {cliente_id}: {str(e)}")
         pass
 
-@router.get("/all/")
-async def get_all_pedidos(
-    skip: int = Query(0, ge=0, description="Número de resultados a saltar para paginación"),
-    limite: int = Query(100, ge=1, le=1000, description="Límite de resultados por página (1-1000)")
-):
-    """Obtener todos los pedidos con paginación optimizada"""
-    # Obtener todos los pedidos, excluyendo los pedidos web (tipo_pedido: "web")
-    # Incluir pedidos internos (tipo_pedido: "interno") y pedidos sin tipo_pedido (retrocompatibilidad)
-    query = {
-        "$or": [
-            {"tipo_pedido": {"$ne": "web"}},  # No es web
-            {"tipo_pedido": {"$exists": False}}  # No tiene tipo_pedido (pedidos antiguos)
-        ]
-    }
-    # Excluir pedidos web
-    query = excluir_pedidos_web(query)
-    # Excluir pedidos de TU MUNDO PUERTA (RIF: J-507172554)
-    query = excluir_pedidos_tu_mundo_puerta(query)
-    # Excluir todos los pedidos cancelados
-    query["estado_general"] = {"$ne": "cancelado"}
-    
-    # Proyección optimizada: solo campos necesarios
-    projection = {
-        "_id": 1,
-        "numero_orden": 1,
-        "cliente_id": 1,
-        "cliente_nombre": 1,
-        "fecha_creacion": 1,
-        "fecha_actualizacion": 1,
-        "estado_general": 1,
-        "items": 1,
-        "seguimiento": 1,
-        "adicionales": 1,
-        "tipo_pedido": 1,
-        "historial_pagos": 1,
-        "total_abonado": 1,
-        "pago": 1
-    }
-    
-    # Contar total de pedidos
-    total_pedidos = pedidos_collection.count_documents(query)
-    
-    # Obtener pedidos con paginación, ordenados por fecha descendente
-    pedidos = list(pedidos_collection.find(query, projection)
-                   .sort("fecha_creacion", -1)
-                   .skip(skip)
-                   .limit(limite))
-    
-    # OPTIMIZACIÓN: Batch query para obtener todos los clientes de una vez (evita N+1)
+# Proyección optimizada de las listas de pedidos: solo campos necesarios
+PROYECCION_PEDIDOS_LISTA = {
+    "_id": 1,
+    "numero_orden": 1,
+    "cliente_id": 1,
+    "cliente_nombre": 1,
+    "fecha_creacion": 1,
+    "fecha_actualizacion": 1,
+    "estado_general": 1,
+    "items": 1,
+    "seguimiento": 1,
+    "adicionales": 1,
+    "tipo_pedido": 1,
+    "historial_pagos": 1,
+    "total_abonado": 1,
+    "monto_total": 1,
+    "saldo_pendiente": 1,
+    "pago": 1
+}
+
+# Sincronización incremental (/pedidos/cambios): orden keyset de pedidos y de tombstones
+ORDEN_CAMBIOS = [("fecha_actualizacion", 1), ("_id", 1)]
+ORDEN_ELIMINADOS = [("fecha_eliminacion", 1), ("_id", 1)]
+# La fecha de una escritura se toma antes de confirmarla, así que otra más vieja puede
+# hacerse visible después; el token final retrocede este margen (el cliente recibe repetidos)
+CAMBIOS_MARGEN = timedelta(seconds=5)
+ID_MINIMO = ObjectId("0" * 24)
+
+def enriquecer_pedidos_con_clientes(pedidos: List[dict]):
+    """
+    Versión por lotes de enriquecer_pedido_con_datos_cliente: consulta todos los clientes
+    de la lista de una vez (evita N+1) y normaliza _id y adicionales de cada pedido.
+    """
+    # Batch query para obtener todos los clientes de una vez
     cliente_ids = list(set(p.get("cliente_id") for p in pedidos if p.get("cliente_id")))
     clientes_dict = {}
     clientes_usuarios_dict = {}
@@ -285,6 +315,39 @@ async def get_all_pedidos(
                 telefono = cliente.get("telefono") or cliente.get("telefono_contacto", "")
                 if telefono:
                     pedido["cliente_telefono"] = telefono
+
+@router.get("/all/")
+async def get_all_pedidos(
+    skip: int = Query(0, ge=0, description="Número de resultados a saltar para paginación"),
+    limite: int = Query(100, ge=1, le=1000, description="Límite de resultados por página (1-1000)")
+):
+    """Obtener todos los pedidos con paginación optimizada"""
+    # Obtener todos los pedidos, excluyendo los pedidos web (tipo_pedido: "web")
+    # Incluir pedidos internos (tipo_pedido: "interno") y pedidos sin tipo_pedido (retrocompatibilidad)
+    query = {
+        "$or": [
+            {"tipo_pedido": {"$ne": "web"}},  # No es web
+            {"tipo_pedido": {"$exists": False}}  # No tiene tipo_pedido (pedidos antiguos)
+        ]
+    }
+    # Excluir pedidos web
+    query = excluir_pedidos_web(query)
+    # Excluir pedidos de TU MUNDO PUERTA (RIF: J-507172554)
+    query = excluir_pedidos_tu_mundo_puerta(query)
+    # Excluir todos los pedidos cancelados
+    query["estado_general"] = {"$ne": "cancelado"}
+    
+    # Contar total de pedidos
+    total_pedidos = pedidos_collection.count_documents(query)
+    
+    # Obtener pedidos con paginación, ordenados por fecha descendente
+    pedidos = list(pedidos_collection.find(query, PROYECCION_PEDIDOS_LISTA)
+                   .sort("fecha_creacion", -1)
+                   .skip(skip)
+                   .limit(limite))
+    
+    # OPTIMIZACIÓN: Batch query para obtener todos los clientes de una vez (evita N+1)
+    enriquecer_pedidos_con_clientes(pedidos)
     
     return {
         "pedidos": pedidos,
@@ -294,6 +357,98 @@ async def get_all_pedidos(
         "has_more": (skip + len(pedidos)) < total_pedidos
     }
 
+def siguiente_marca(docs: list, campo_fecha: str, hay_mas: bool, fecha, _id, ahora: datetime):
+    """Marca (fecha, _id) desde la que continuar un flujo de /pedidos/cambios"""
+    if docs:
+        fecha, _id = docs[-1][campo_fecha], docs[-1]["_id"]
+    if not hay_mas:
+        limite_seguro = ahora - CAMBIOS_MARGEN
+        if fecha is None or fecha > limite_seguro:
+            fecha, _id = limite_seguro, ID_MINIMO
+    return fecha, _id
+
+@router.get("/cambios")
+async def get_pedidos_cambios(
+    desde: Optional[str] = Query(None, description="Token 'desde' de la respuesta anterior; sin token se devuelven todos los pedidos"),
+    limite: int = Query(PAGINA_MAX, ge=1, le=PAGINA_MAX, description="Máximo de pedidos y de eliminados por respuesta")
+):
+    """
+    Sincronización incremental de la lista de pedidos (mismo alcance que /all/).
+    Devuelve los pedidos modificados desde el token y los tombstones de los pedidos
+    eliminados o cancelados, para que el frontend mantenga una caché local y no vuelva
+    a descargar la lista completa en cada refresco.
+    - Repetir con el token 'desde' devuelto mientras hay_mas sea true y guardarlo para la próxima vez.
+    - Un mismo pedido puede llegar repetido: aplicar los cambios por _id.
+    - resincronizar=true: el token es más viejo que la retención de tombstones; descartar la caché
+      y empezar de nuevo sin token.
+    Solo se consideran pedidos con fecha_actualizacion de tipo fecha
+    (ver PUT /pedidos/normalizar-fecha-actualizacion/).
+    """
+    try:
+        ahora = datetime.now()
+        if desde:
+            valores = decodificar_cursor(desde)
+            if len(valores) != 4:
+                raise HTTPException(status_code=400, detail="Token 'desde' inválido")
+            fecha_pedidos, id_pedidos, fecha_eliminados, id_eliminados = valores
+            if fecha_eliminados < ahora - timedelta(days=PEDIDOS_ELIMINADOS_RETENCION_DIAS):
+                return {"pedidos": [], "eliminados": [], "desde": None, "hay_mas": False, "resincronizar": True}
+        else:
+            # Caché vacía: no hacen falta tombstones anteriores a esta sincronización
+            fecha_pedidos, id_pedidos = None, None
+            fecha_eliminados, id_eliminados = ahora, ID_MINIMO
+        
+        query = excluir_pedidos_web({"fecha_actualizacion": {"$type": "date"}})
+        query = excluir_pedidos_tu_mundo_puerta(query)
+        if fecha_pedidos is not None:
+            query = {"$and": [query, filtro_despues_de(ORDEN_CAMBIOS, [fecha_pedidos, id_pedidos])]}
+        pedidos = list(pedidos_collection.find(query, PROYECCION_PEDIDOS_LISTA)
+                       .sort(ORDEN_CAMBIOS)
+                       .limit(limite + 1))
+        hay_mas_pedidos = len(pedidos) > limite
+        pedidos = pedidos[:limite]
+        
+        eliminados_docs = list(pedidos_eliminados_collection.find(
+            filtro_despues_de(ORDEN_ELIMINADOS, [fecha_eliminados, id_eliminados])
+        ).sort(ORDEN_ELIMINADOS).limit(limite + 1))
+        hay_mas_eliminados = len(eliminados_docs) > limite
+        eliminados_docs = eliminados_docs[:limite]
+        
+        fecha_pedidos, id_pedidos = siguiente_marca(
+            pedidos, "fecha_actualizacion", hay_mas_pedidos, fecha_pedidos, id_pedidos, ahora
+        )
+        fecha_eliminados, id_eliminados = siguiente_marca(
+            eliminados_docs, "fecha_eliminacion", hay_mas_eliminados, fecha_eliminados, id_eliminados, ahora
+        )
+        
+        # Los pedidos cancelados también salen de la lista: se envían como tombstones
+        eliminados = [
+            {"_id": str(e["_id"]), "motivo": e.get("motivo", "eliminado"), "fecha": e["fecha_eliminacion"]}
+            for e in eliminados_docs
+        ]
+        modificados = []
+        for pedido in pedidos:
+            if pedido.get("estado_general") == "cancelado":
+                eliminados.append({"_id": str(pedido["_id"]), "motivo": "cancelado", "fecha": pedido["fecha_actualizacion"]})
+            else:
+                modificados.append(pedido)
+        enriquecer_pedidos_con_clientes(modificados)
+        
+        return {
+            "pedidos": modificados,
+            "eliminados": eliminados,
+            "desde": codificar_cursor([fecha_pedidos, id_pedidos, fecha_eliminados, id_eliminados]),
+            "hay_mas": hay_mas_pedidos or hay_mas_eliminados,
+            "resincronizar": False
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"ERROR CAMBIOS PEDIDOS: {str(e)}")
+        import traceback
+        print(f"ERROR CAMBIOS PEDIDOS TRACEBACK: {traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail=f"Error obteniendo cambios de pedidos: {str(e)}")
+
 @router.get("/test-terminar")
 async def test_terminar_endpoint():
     """Endpoint de prueba para verificar que el servidor está funcionando"""
@@ -484,10 +639,83 @@ async def create_pedido(pedido: Pedido, user: dict = Depends(get_current_user)):
     # Marcar el pedido como tipo "interno" (desde /crearpedido)
     pedido_dict = pedido.dict()
     pedido_dict["tipo_pedido"] = "interno"
+    pedido_dict["fecha_actualizacion"] = datetime.now()
+    
+    # Si hay abonos iniciales en el historial_pagos, el total_abonado es la suma de sus montos
+    total_abonado_inicial = 0.0
+    for pago in pedido.historial_pagos or []:
+        monto_pago = getattr(pago, 'monto', None) if hasattr(pago, 'monto') else (pago.get('monto') if isinstance(pago, dict) else 0)
+        if monto_pago:
+            total_abonado_inicial += float(monto_pago)
+    pedido_dict["total_abonado"] = total_abonado_inicial
+    if total_abonado_inicial > 0:
+        pedido_dict["pago"] = "abonado"
+    # monto_total y saldo_pendiente se guardan con el pedido
+    con_totales(pedido_dict)
+    
+    # Restar cantidades del inventario SOLO para items con estado_item = 4 (disponibles)
+    # Los items con estado_item = 0 (faltantes) NO se restan del inventario, van a producción
+    debug_log(f"DEBUG CREAR PEDIDO: Procesando {len(pedido.items)} items para restar inventario")
+    
+    # Obtener la sucursal del pedido (por defecto sucursal1)
+    sucursal = getattr(pedido, 'sucursal', None) or pedido.dict().get('sucursal', 'sucursal1')
+    if sucursal not in ['sucursal1', 'sucursal2']:
+        sucursal = 'sucursal1'
+    
+    # Items disponibles (estado_item = 4) que se restan del inventario
+    items_a_procesar = []
+    for idx, item in enumerate(pedido.items):
+        estado_item = getattr(item, 'estado_item', None) if hasattr(item, 'estado_item') else (item.get('estado_item') if isinstance(item, dict) else None)
+        codigo = getattr(item, 'codigo', None) if hasattr(item, 'codigo') else (item.get('codigo') if isinstance(item, dict) else None)
+        cantidad = getattr(item, 'cantidad', None) if hasattr(item, 'cantidad') else (item.get('cantidad') if isinstance(item, dict) else None)
+        item_id = getattr(item, 'id', None) if hasattr(item, 'id') else (item.get('id') if isinstance(item, dict) else None)
+        
+        if estado_item == 4 and cantidad and cantidad > 0:
+            items_a_procesar.append({
+                'idx': idx,
+                'codigo': codigo,
+                'id': item_id,
+                'cantidad': float(cantidad)
+            })
+    
+    # Batch query: resolver todos los items contra el inventario con una sola consulta $in
+    if items_a_procesar:
+        try:
+            items_inventario = resolver_items_inventario(items_a_procesar, {"_id": 1})
+        except Exception as e:
+            debug_log(f"ERROR CREAR PEDIDO: Error en batch query de inventario: {e}")
+            items_inventario = [None] * len(items_a_procesar)
+        for item_data, item_inventario in zip(items_a_procesar, items_inventario):
+            item_data['item'] = item_inventario
+            if not item_inventario:
+                debug_log(f"WARNING CREAR PEDIDO [Item {item_data['idx']}]: Item código='{item_data['codigo']}' no encontrado en inventario")
+    
+    def registrar_pedido(session):
+        """Insertar el pedido y descontar el inventario (en una transacción si MongoDB la soporta)"""
+        result = pedidos_collection.insert_one(pedido_dict, session=session)
+        faltantes = []
+        if items_a_procesar:
+            try:
+                faltantes = descontar_existencias(items_a_procesar, sucursal, session=session)
+            except Exception as e:
+                if session is not None:
+                    raise
+                debug_log(f"ERROR CREAR PEDIDO: Error en bulk update de inventario: {e}")
+        return result.inserted_id, faltantes
     
     # Insertar el pedido
-    result = pedidos_collection.insert_one(pedido_dict)
-    pedido_id = str(result.inserted_id)
+    try:
+        inserted_id, faltantes_inventario = ejecutar_en_transaccion(registrar_pedido)
+    except Exception as e:
+        print(f"ERROR CREAR PEDIDO: {e}")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Error al crear el pedido: {str(e)}")
+    pedido_id = str(inserted_id)
+    if items_a_procesar:
+        incrementar_version(RECURSO_INVENTARIO)
+    for faltante in faltantes_inventario:
+        debug_log(f"WARNING CREAR PEDIDO [Item {faltante['idx']}]: No hay suficiente existencia en {sucursal} para {faltante['codigo']}. Disponible: {faltante['disponible']}, Requerida: {faltante['requerido']}")
 
     # Generar asignaciones unitarias para herrería (orden 1) por cada unidad pendiente (estado_item == 0)
     try:
@@ -546,7 +774,7 @@ async def create_pedido(pedido: Pedido, user: dict = Depends(get_current_user)):
 
         proceso_herreria["asignaciones_articulos"] = asignaciones_articulos
 
-        pedidos_collection.update_one(
+        actualizar_pedido(
             {"_id": ObjectId(pedido_id)},
             {"$set": {"seguimiento": seguimiento}},
         )
@@ -575,142 +803,10 @@ async def create_pedido(pedido: Pedido, user: dict = Depends(get_current_user)):
             except Exception as e:
                 debug_log(f"ERROR REGISTRAR MOVIMIENTO CREAR PEDIDO: {e}")
     
-    # OPTIMIZACIÓN: Batch query para items del inventario (evita N+1 queries)
-    # Restar cantidades del inventario SOLO para items con estado_item = 4 (disponibles)
-    # Los items con estado_item = 0 (faltantes) NO se restan del inventario, van a producción
-    debug_log(f"DEBUG CREAR PEDIDO: Procesando {len(pedido.items)} items para restar inventario")
-    
-    # Obtener la sucursal del pedido (por defecto sucursal1)
-    sucursal = getattr(pedido, 'sucursal', None) or pedido.dict().get('sucursal', 'sucursal1')
-    if sucursal not in ['sucursal1', 'sucursal2']:
-        sucursal = 'sucursal1'
-    
-    # Preparar datos para batch query
-    items_a_procesar = []
-    codigos_limpios = []
-    item_ids_validos = []
-    
-    for idx, item in enumerate(pedido.items):
-        estado_item = getattr(item, 'estado_item', None) if hasattr(item, 'estado_item') else (item.get('estado_item') if isinstance(item, dict) else None)
-        codigo = getattr(item, 'codigo', None) if hasattr(item, 'codigo') else (item.get('codigo') if isinstance(item, dict) else None)
-        cantidad = getattr(item, 'cantidad', None) if hasattr(item, 'cantidad') else (item.get('cantidad') if isinstance(item, dict) else None)
-        item_id = getattr(item, 'id', None) if hasattr(item, 'id') else (item.get('id') if isinstance(item, dict) else None)
-        
-        if estado_item == 4 and cantidad and cantidad > 0:
-            items_a_procesar.append({
-                'idx': idx,
-                'codigo': codigo,
-                'item_id': item_id,
-                'cantidad': float(cantidad)
-            })
-            if codigo:
-                codigos_limpios.append(str(codigo).strip())
-            if item_id:
-                try:
-                    item_ids_validos.append(ObjectId(item_id))
-                except:
-                    pass
-    
-    # Batch query: buscar todos los items de una vez
-    items_inventario_dict = {}
-    if codigos_limpios or item_ids_validos:
-        try:
-            # Buscar por códigos (exacto primero)
-            query_codigos = {"codigo": {"$in": codigos_limpios}}
-            items_por_codigo = list(items_collection.find(query_codigos))
-            for item in items_por_codigo:
-                items_inventario_dict[str(item["codigo"]).strip()] = item
-            
-            # Buscar por IDs
-            if item_ids_validos:
-                items_por_id = list(items_collection.find({"_id": {"$in": item_ids_validos}}))
-                for item in items_por_id:
-                    items_inventario_dict[str(item["_id"])] = item
-        except Exception as e:
-            debug_log(f"ERROR CREAR PEDIDO: Error en batch query de inventario: {e}")
-    
-    # Procesar items y preparar updates en batch
-    bulk_operations = []
-    
-    for item_data in items_a_procesar:
-        idx = item_data['idx']
-        codigo = item_data['codigo']
-        item_id = item_data['item_id']
-        cantidad = item_data['cantidad']
-        
-        try:
-            # Buscar item en el diccionario (ya obtenido con batch query)
-            item_inventario = None
-            if codigo:
-                codigo_limpio = str(codigo).strip()
-                item_inventario = items_inventario_dict.get(codigo_limpio)
-            
-            if not item_inventario and item_id:
-                item_inventario = items_inventario_dict.get(str(item_id))
-            
-            # Si aún no se encontró, intentar búsquedas adicionales (fallback)
-            if not item_inventario and codigo:
-                codigo_limpio = str(codigo).strip()
-                try:
-                    # Buscar con regex como fallback
-                    codigo_regex = codigo_limpio.replace(" ", "\\s*")
-                    item_inventario = items_collection.find_one({"codigo": {"$regex": f"^{codigo_regex}$", "$options": "i"}})
-                    if not item_inventario and (codigo_limpio.isdigit() or (codigo_limpio.replace('.', '', 1).isdigit())):
-                        codigo_num = int(float(codigo_limpio))
-                        item_inventario = items_collection.find_one({"codigo": str(codigo_num)}) or items_collection.find_one({"codigo": codigo_num})
-                except:
-                    pass
-            
-            if item_inventario:
-                # Determinar qué campo de existencia usar según la sucursal
-                campo_existencia = "cantidad" if sucursal == "sucursal1" else "existencia2"
-                if sucursal == "sucursal1" and campo_existencia not in item_inventario:
-                    campo_existencia = "existencia"
-                
-                cantidad_actual = item_inventario.get(campo_existencia, 0.0)
-                cantidad_a_restar = cantidad
-                
-                debug_log(f"DEBUG CREAR PEDIDO [Item {idx}]: Sucursal={sucursal}, Campo={campo_existencia}, Cantidad actual={cantidad_actual}, Cantidad a restar={cantidad_a_restar}")
-                
-                if cantidad_a_restar > cantidad_actual:
-                    debug_log(f"WARNING CREAR PEDIDO [Item {idx}]: No hay suficiente existencia en {sucursal} para {item_inventario.get('codigo', 'N/A')}. Existencia: {cantidad_actual}, Requerida: {cantidad_a_restar}")
-                
-                # Preparar update para bulk operation
-                nueva_cantidad = max(0, cantidad_actual - cantidad_a_restar)
-                bulk_operations.append(
-                    UpdateOne(
-                        {"_id": item_inventario["_id"]},
-                        {"$set": {campo_existencia: nueva_cantidad}}
-                    )
-                )
-        except Exception as e:
-            debug_log(f"ERROR CREAR PEDIDO [Item {idx}]: Error al procesar item código='{codigo}': {e}")
-    
-    # Ejecutar todos los updates en batch (una sola operación)
-    if bulk_operations:
-        try:
-            items_collection.bulk_write(bulk_operations, ordered=False)
-            debug_log(f"DEBUG CREAR PEDIDO: Actualizados {len(bulk_operations)} items de inventario en batch")
-        except Exception as e:
-            debug_log(f"ERROR CREAR PEDIDO: Error en bulk update de inventario: {e}")
-    
-    # Si hay abonos iniciales en el historial_pagos, calcular total_abonado e incrementar el saldo de los métodos de pago
-    total_abonado_inicial = 0.0
+    # Si hay abonos iniciales en el historial_pagos, incrementar el saldo de los métodos de pago
+    # (el total_abonado ya se guardó con el pedido)
     if pedido.historial_pagos:
-        debug_log(f"DEBUG CREAR PEDIDO: Procesando {len(pedido.historial_pagos)} abonos iniciales")
-        # Calcular total_abonado sumando todos los montos del historial_pagos
-        for pago in pedido.historial_pagos:
-            monto_pago = getattr(pago, 'monto', None) if hasattr(pago, 'monto') else (pago.get('monto') if isinstance(pago, dict) else 0)
-            if monto_pago:
-                total_abonado_inicial += float(monto_pago)
-        
-        # Actualizar el pedido con el total_abonado calculado
-        if total_abonado_inicial > 0:
-            pedidos_collection.update_one(
-                {"_id": ObjectId(pedido_id)},
-                {"$set": {"total_abonado": total_abonado_inicial, "pago": "abonado" if total_abonado_inicial > 0 else "sin pago"}}
-            )
-            debug_log(f"DEBUG CREAR PEDIDO: Total abonado inicial calculado: {total_abonado_inicial}")
+        debug_log(f"DEBUG CREAR PEDIDO: Procesando {len(pedido.historial_pagos)} abonos iniciales, total abonado: {total_abonado_inicial}")
         
         # OPTIMIZACIÓN: Batch query para métodos de pago (evita N+1 queries)
         metodo_ids = []
@@ -739,10 +835,7 @@ async def create_pedido(pedido: Pedido, user: dict = Depends(get_current_user)):
             for metodo in metodos_por_nombre:
                 metodos_dict[metodo["nombre"]] = metodo
         
-        # Procesar pagos y preparar updates en batch
-        bulk_metodos_operations = []
-        transacciones_a_insertar = []
-        
+        # Registrar cada pago: $inc del saldo y transacción con el saldo resultante
         for pago in pagos_procesar:
             try:
                 metodo_pago = None
@@ -752,52 +845,30 @@ async def create_pedido(pedido: Pedido, user: dict = Depends(get_current_user)):
                     pass
                 
                 if metodo_pago:
-                    saldo_actual = metodo_pago.get("saldo", 0.0)
-                    nuevo_saldo = saldo_actual + pago.monto
-                    debug_log(f"DEBUG CREAR PEDIDO: Incrementando saldo de {saldo_actual} a {nuevo_saldo} para método '{metodo_pago.get('nombre', 'SIN_NOMBRE')}'")
-                    
-                    # Preparar update para bulk operation
-                    bulk_metodos_operations.append(
-                        UpdateOne(
-                            {"_id": metodo_pago["_id"]},
-                            {"$inc": {"saldo": pago.monto}}
-                        )
-                    )
-                    
-                    # Preparar transacción para insertar en batch
                     transaccion_deposito = {
-                        "metodo_pago_id": str(metodo_pago["_id"]),
                         "tipo": "deposito",
                         "monto": float(pago.monto),
                         "concepto": pago.get("concepto") if hasattr(pago, 'get') else (getattr(pago, 'concepto', None) or f"Pago inicial de pedido {pedido_id}"),
                         "pedido_id": pedido_id,
-                        "fecha": datetime.utcnow().isoformat()
+                        "fecha": datetime.utcnow()
                     }
-                    transacciones_a_insertar.append(transaccion_deposito)
+                    actualizado = aplicar_movimiento_saldo({"_id": metodo_pago["_id"]}, float(pago.monto), transaccion_deposito)
+                    if actualizado:
+                        debug_log(f"DEBUG CREAR PEDIDO: Saldo de '{metodo_pago.get('nombre', 'SIN_NOMBRE')}' ahora es {actualizado.get('saldo')}")
                 else:
                     debug_log(f"DEBUG CREAR PEDIDO: Método de pago '{pago.metodo}' no encontrado")
             except Exception as e:
                 debug_log(f"DEBUG CREAR PEDIDO: Error al procesar pago: {e}")
                 import traceback
                 debug_log(f"DEBUG CREAR PEDIDO: Traceback: {traceback.format_exc()}")
-        
-        # Ejecutar todos los updates de métodos de pago en batch
-        if bulk_metodos_operations:
-            try:
-                metodos_pago_collection.bulk_write(bulk_metodos_operations, ordered=False)
-                debug_log(f"DEBUG CREAR PEDIDO: Actualizados {len(bulk_metodos_operations)} métodos de pago en batch")
-            except Exception as e:
-                debug_log(f"ERROR CREAR PEDIDO: Error en bulk update de métodos de pago: {e}")
-        
-        # Insertar todas las transacciones en batch
-        if transacciones_a_insertar:
-            try:
-                transacciones_collection.insert_many(transacciones_a_insertar)
-                debug_log(f"DEBUG CREAR PEDIDO: Insertadas {len(transacciones_a_insertar)} transacciones en batch")
-            except Exception as e:
-                debug_log(f"ERROR CREAR PEDIDO: Error al insertar transacciones en batch: {e}")
     
-    return {"message": "Pedido creado correctamente", "id": pedido_id, "cliente_nombre": pedido.cliente_nombre}
+    publicar_evento("pedidos", pedido_id=pedido_id, accion="creado")
+    return {
+        "message": "Pedido creado correctamente",
+        "id": pedido_id,
+        "cliente_nombre": pedido.cliente_nombre,
+        "faltantes_inventario": faltantes_inventario
+    }
 
 @router.put("/subestados/")
 async def update_subestados(
@@ -860,7 +931,7 @@ async def update_subestados(
     if estado_general is not None:
         update_fields["estado_general"] = estado_general
     try:
-        result = pedidos_collection.update_one(
+        result = actualizar_pedido(
             {"_id": pedido_id},
             {"$set": update_fields}
         )
@@ -868,6 +939,7 @@ async def update_subestados(
         raise HTTPException(status_code=500, detail=f"Error actualizando pedido: {str(e)}")
     if result.matched_count == 0:
         raise HTTPException(status_code=400, detail="Pedido no encontrado al actualizar")
+    publicar_evento("asignaciones", pedido_id=pedido_id, accion="subestado")
     return {"message": "Subestado actualizado correctamente"}
 
 # Endpoint OPTIONS específico para herreria
@@ -1006,35 +1078,97 @@ async def get_pedidos_herreria(
             detail=f"Error al obtener items de herrería: {str(e)}"
         )
 
-@router.put("/inicializar-estado-items/")
+# Items sin estado_item (faltante o nulo); el 0 ya es el estado pendiente
+FILTRO_ITEM_SIN_ESTADO = {"$in": [None, "", False]}
+
+@job_runner.registrar("inicializar_estado_items")
+def job_inicializar_estado_items(ctx: JobContext):
+    """Poner estado_item = 0 en los items que no lo tengan, por lotes de pedidos"""
+    filtro = {"items": {"$elemMatch": {"estado_item": FILTRO_ITEM_SIN_ESTADO}}}
+    ctx.set_total(pedidos_collection.count_documents(filtro))
+    
+    for lote in iterar_por_lotes(ctx, pedidos_collection, filtro, {"items.estado_item": 1}):
+        operaciones = [
+            UpdateOne(
+                {"_id": pedido["_id"]},
+                {"$set": {"items.$[item].estado_item": 0, "fecha_actualizacion": datetime.now()}},
+                array_filters=[{"item.estado_item": FILTRO_ITEM_SIN_ESTADO}]
+            )
+            for pedido in lote
+        ]
+        items_lote = sum(
+            1 for pedido in lote for item in pedido.get("items", [])
+            if item.get("estado_item") in (None, "", False)
+        )
+        pedidos_collection.bulk_write(operaciones, ordered=False)
+        ctx.guardar_progreso(
+            procesados=len(lote),
+            checkpoint={"ultimo_id": lote[-1]["_id"]},
+            items_actualizados=items_lote
+        )
+
+@router.put("/inicializar-estado-items/", status_code=202)
 async def inicializar_estado_items():
-    """Inicializar estado_item en 0 para todos los items que no lo tengan"""
-    try:
-        pedidos = list(pedidos_collection.find({}))
-        items_actualizados = 0
-        
-        for pedido in pedidos:
-            for item in pedido.get("items", []):
-                if not item.get("estado_item"):
-                    # Actualizar el item específico
-                    result = pedidos_collection.update_one(
-                        {"_id": pedido["_id"], "items.id": item["id"]},
-                        {"$set": {"items.$.estado_item": 0}}  # Estado pendiente
-                    )
-                    if result.modified_count > 0:
-                        items_actualizados += 1
-        
-        return {
-            "message": f"Se inicializaron {items_actualizados} items con estado_item: 0",
-            "items_actualizados": items_actualizados
-        }
-        
-    except Exception as e:
-        print(f"Error en inicializar_estado_items: {e}")
-        return {
-            "error": str(e),
-            "items_actualizados": 0
-        }
+    """
+    Inicializar estado_item en 0 para todos los items que no lo tengan.
+    Se ejecuta en segundo plano; consultar el progreso en /jobs/{job_id}
+    """
+    job = job_runner.lanzar("inicializar_estado_items")
+    return {
+        "message": "Inicialización de estado_item en ejecución",
+        "job_id": job["job_id"],
+        "estado": job["estado"]
+    }
+
+def fecha_actualizacion_normalizada(pedido: dict) -> datetime:
+    """fecha_actualizacion como datetime: la guardada (texto ISO), fecha_creacion o la del _id"""
+    for campo in ("fecha_actualizacion", "fecha_creacion"):
+        valor = pedido.get(campo)
+        if isinstance(valor, datetime):
+            return valor.replace(tzinfo=None)
+        if isinstance(valor, str) and valor:
+            try:
+                fecha = datetime.fromisoformat(valor.replace("Z", "+00:00"))
+                if fecha.tzinfo:
+                    fecha = fecha.astimezone(timezone.utc).replace(tzinfo=None)
+                return fecha
+            except ValueError:
+                pass
+    return pedido["_id"].generation_time.replace(tzinfo=None)
+
+@job_runner.registrar("normalizar_fecha_actualizacion")
+def job_normalizar_fecha_actualizacion(ctx: JobContext):
+    """Convertir fecha_actualizacion a fecha real en los pedidos que la tienen como texto o no la tienen"""
+    filtro = {"fecha_actualizacion": {"$not": {"$type": "date"}}}
+    ctx.set_total(pedidos_collection.count_documents(filtro))
+    
+    for lote in iterar_por_lotes(ctx, pedidos_collection, filtro, {"fecha_actualizacion": 1, "fecha_creacion": 1}):
+        operaciones = [
+            UpdateOne(
+                # Condicionar al valor leído para no pisar una escritura concurrente
+                {"_id": pedido["_id"], "fecha_actualizacion": pedido.get("fecha_actualizacion")},
+                {"$set": {"fecha_actualizacion": fecha_actualizacion_normalizada(pedido)}}
+            )
+            for pedido in lote
+        ]
+        pedidos_collection.bulk_write(operaciones, ordered=False)
+        ctx.guardar_progreso(
+            procesados=len(lote),
+            checkpoint={"ultimo_id": lote[-1]["_id"]}
+        )
+
+@router.put("/normalizar-fecha-actualizacion/", status_code=202)
+async def normalizar_fecha_actualizacion():
+    """
+    Convertir fecha_actualizacion a fecha real en los pedidos anteriores, para que aparezcan
+    en /pedidos/cambios. Se ejecuta en segundo plano; consultar el progreso en /jobs/{job_id}
+    """
+    job = job_runner.lanzar("normalizar_fecha_actualizacion")
+    return {
+        "message": "Normalización de fecha_actualizacion en ejecución",
+        "job_id": job["job_id"],
+        "estado": job["estado"]
+    }
 
 @router.put("/asignar-item/")
 async def asignar_item(
@@ -1101,7 +1235,7 @@ async def asignar_item(
             debug_log(f"DEBUG ASIGNAR ITEM: Empleado {empleado_id} no encontrado en BD, usando nombre del frontend: {empleado_nombre}")
         
         # Actualizar el item específico
-        result = pedidos_collection.update_one(
+        result = actualizar_pedido(
             {
                 "_id": ObjectId(pedido_id),
                 "items.id": item_id
@@ -1251,7 +1385,7 @@ async def asignar_item(
             debug_log(f"DEBUG ASIGNAR ITEM: Asignada unidad_index={asignacion_obj.get('unidad_index')} para item {item_id}")
             
             # Actualizar en la base de datos
-            pedidos_collection.update_one(
+            actualizar_pedido(
                 {
                     "_id": ObjectId(pedido_id),
                     "seguimiento.orden": orden
@@ -1275,7 +1409,7 @@ async def asignar_item(
             }
             
             # Agregar a seguimiento
-            pedidos_collection.update_one(
+            actualizar_pedido(
                 {"_id": ObjectId(pedido_id)},
                 {
                     "$push": {
@@ -1293,6 +1427,7 @@ async def asignar_item(
                 item_asignado = item
                 break
         
+        publicar_evento("asignaciones", pedido_id=pedido_id, item_id=item_id, accion="asignado")
         return {
             "message": "Item asignado correctamente", 
             "estado_item": nuevo_estado_item,
@@ -1478,7 +1613,7 @@ async def asignar_items_bulk(payload: dict = Body(...)):
                 })
 
             # Persistir cambios del pedido (una sola escritura por pedido)
-            pedidos_collection.update_one(
+            actualizar_pedido(
                 {"_id": ObjectId(pedido_id)},
                 {"$set": {"seguimiento": seguimiento, "items": items_lista}}
             )
@@ -1492,6 +1627,9 @@ async def asignar_items_bulk(payload: dict = Body(...)):
 
     ok_count = sum(1 for r in resultados if r.get("ok"))
     fail_count = len(resultados) - ok_count
+    if ok_count:
+        pedidos_afectados = sorted({r.get("pedido_id") for r in resultados if r.get("ok") and r.get("pedido_id")})
+        publicar_evento("asignaciones", pedido_ids=pedidos_afectados, accion="asignado")
     return {"message": "Asignaciones procesadas", "ok": ok_count, "errores": fail_count, "resultados": resultados}
 
 
@@ -1529,7 +1667,7 @@ async def terminar_asignacion(
             nuevo_estado = 4  # Máximo estado
         
         # Actualizar el estado del item
-        result = pedidos_collection.update_one(
+        result = actualizar_pedido(
             {
                 "_id": ObjectId(pedido_id),
                 "items.id": item_id
@@ -1546,6 +1684,7 @@ async def terminar_asignacion(
         if result.matched_count == 0:
             raise HTTPException(status_code=404, detail="Item no encontrado para actualizar")
         
+        publicar_evento("asignaciones", pedido_id=pedido_id, item_id=item_id, accion="terminado")
         return {
             "message": "Asignación terminada correctamente",
             "estado_anterior": estado_actual,
@@ -2089,7 +2228,7 @@ async def finalizar_pedido(
     if not actualizado:
         raise HTTPException(status_code=400, detail="Subestado no encontrado")
     try:
-        result = pedidos_collection.update_one(
+        result = actualizar_pedido(
             {"_id": pedido_obj_id},
             {"$set": {"seguimiento": seguimiento, "estado_general": nuevo_estado_general}}
         )
@@ -2097,6 +2236,7 @@ async def finalizar_pedido(
         raise HTTPException(status_code=500, detail=f"Error actualizando pedido: {str(e)}")
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Pedido no encontrado al actualizar")
+    publicar_evento("pedidos", pedido_id=pedido_id, accion="finalizado")
     return {"message": "Pedido finalizado correctamente"}
 
 @router.get("/produccion/ruta")
@@ -2157,6 +2297,15 @@ async def get_pedidos_por_estado(estado_general: list[str] = Query(..., descript
             }
         }
     
+    # SOLO pedidos con saldo pendiente, filtrado en la base de datos con saldo_pendiente guardado
+    # (los pedidos aún sin totales guardados se calculan abajo)
+    filtro.setdefault("$and", []).append({
+        "$or": [
+            {CAMPO_SALDO_PENDIENTE: {"$gt": 0}},
+            {CAMPO_SALDO_PENDIENTE: {"$exists": False}}
+        ]
+    })
+    
     # Proyección optimizada: solo campos necesarios
     projection = {
         "_id": 1,
@@ -2171,6 +2320,8 @@ async def get_pedidos_por_estado(estado_general: list[str] = Query(..., descript
         "adicionales": 1,
         "historial_pagos": 1,  # Necesario para el módulo de pagos
         "total_abonado": 1,  # Necesario para el módulo de pagos
+        "monto_total": 1,
+        "saldo_pendiente": 1,
         "pago": 1  # Necesario para el módulo de pagos
     }
     
@@ -2185,6 +2336,10 @@ async def get_pedidos_por_estado(estado_general: list[str] = Query(..., descript
         pedido["_id"] = str(pedido["_id"])
         items_originales = pedido.get("items", [])
         
+        # Totales guardados en el pedido (monto_total incluye descuentos y adicionales);
+        # se leen antes de filtrar los items, que en pedidos sin totales guardados se usan para calcularlos
+        total_pedido, total_abonado, saldo_pendiente = totales_pedido(pedido)
+        
         if es_facturacion:
             # Para facturación: devolver TODOS los items con TODOS sus campos, incluyendo estado_item
             pedido["items"] = items_originales
@@ -2197,37 +2352,6 @@ async def get_pedidos_por_estado(estado_general: list[str] = Query(..., descript
         if "adicionales" not in pedido or pedido["adicionales"] is None:
             pedido["adicionales"] = []
         
-        # Calcular total_pedido (considerando descuentos) y total_abonado
-        total_items = sum(
-            calcular_precio_final_item(item) * float(item.get("cantidad", 0)) 
-            for item in items_originales  # Usar items originales para el cálculo completo
-        )
-        
-        # Calcular total de adicionales
-        adicionales = pedido.get("adicionales", [])
-        total_adicionales = 0
-        if adicionales and isinstance(adicionales, list):
-            for adicional in adicionales:
-                cantidad = adicional.get("cantidad", 1)
-                precio = adicional.get("precio", 0)
-                total_adicionales += precio * cantidad
-        
-        total_pedido = total_items + total_adicionales
-        
-        # Calcular total_abonado desde historial_pagos
-        historial_pagos = pedido.get("historial_pagos", [])
-        total_abonado = sum(
-            float(pago.get("monto", 0)) 
-            for pago in historial_pagos 
-            if pago.get("monto") is not None
-        )
-        
-        # Si no hay historial_pagos pero hay total_abonado guardado, usar ese valor como fallback
-        if total_abonado == 0 and not historial_pagos:
-            total_abonado = float(pedido.get("total_abonado", 0))
-        
-        saldo_pendiente = total_pedido - total_abonado
-        
         # SOLO incluir pedidos con saldo pendiente (total_pedido > total_abonado)
         # Esto asegura que solo aparezcan pedidos que aún deben dinero
         if saldo_pendiente > 0:
@@ -2254,12 +2378,11 @@ async def facturar_pedido(
     Marcar un pedido como facturado y guardar el número de factura
     """
     try:
-        from ..config.mongodb import pedidos_collection
         
         pedido_obj_id = ObjectId(pedido_id)
         
         # Actualizar el pedido agregando información de facturación
-        result = pedidos_collection.update_one(
+        result = actualizar_pedido(
             {"_id": pedido_obj_id},
             {
                 "$set": {
@@ -2976,7 +3099,7 @@ async def actualizar_estado_general_pedido(
         raise HTTPException(status_code=400, detail=f"pedido_id no es un ObjectId válido: {str(e)}")
     if not nuevo_estado_general:
         raise HTTPException(status_code=400, detail="Falta el nuevo estado_general")
-    result = pedidos_collection.update_one(
+    result = actualizar_pedido(
         {"_id": pedido_obj_id},
         {"$set": {"estado_general": nuevo_estado_general}}
     )
@@ -3459,115 +3582,76 @@ async def debug_comisiones():
     except Exception as e:
         return {"error": str(e)}
 
-# Endpoint para sincronizar TODOS los empleados automáticamente
-@router.get("/sync-todos-empleados")
-async def sync_todos_empleados():
-    """Sincronizar automáticamente todos los empleados desde las asignaciones activas"""
-    try:
-        print(f"DEBUG SYNC: Iniciando sincronización automática de empleados")
-        
-        # Obtener todos los empleados únicos desde las asignaciones activas
-        empleados_encontrados = set()
-        
-        # Buscar en todos los pedidos
-        pedidos = list(pedidos_collection.find({}))
-        print(f"DEBUG SYNC: Revisando {len(pedidos)} pedidos para encontrar empleados")
-        
-        for pedido in pedidos:
-            if not pedido:
-                continue
-                
-            seguimiento = pedido.get("seguimiento")
-            if not seguimiento or not isinstance(seguimiento, list):
-                continue
-                
-            for sub in seguimiento:
-                if not sub or not isinstance(sub, dict):
-                    continue
-                    
-                asignaciones_articulos = sub.get("asignaciones_articulos")
-                if not asignaciones_articulos or not isinstance(asignaciones_articulos, list):
+@job_runner.registrar("sync_todos_empleados")
+def job_sync_todos_empleados(ctx: JobContext):
+    """Crear en empleados los empleadoId de las asignaciones que aún no existan, por lotes de pedidos"""
+    filtro = {"seguimiento.asignaciones_articulos.empleadoId": {"$nin": [None, ""]}}
+    proyeccion = {
+        "seguimiento.asignaciones_articulos.empleadoId": 1,
+        "seguimiento.asignaciones_articulos.nombreempleado": 1
+    }
+    ctx.set_total(pedidos_collection.count_documents(filtro))
+    # Empleados ya tratados en lotes anteriores (se guarda en el checkpoint para reanudar)
+    vistos = set(ctx.checkpoint.get("empleados_vistos", []))
+    
+    for lote in iterar_por_lotes(ctx, pedidos_collection, filtro, proyeccion):
+        nuevos = {}
+        for pedido in lote:
+            for sub in pedido.get("seguimiento") or []:
+                if not isinstance(sub, dict):
                     continue
-                    
-                for asignacion in asignaciones_articulos:
-                    if not asignacion or not isinstance(asignacion, dict):
+                for asignacion in sub.get("asignaciones_articulos") or []:
+                    if not isinstance(asignacion, dict):
                         continue
-                        
                     empleado_id = asignacion.get("empleadoId")
-                    empleado_nombre = asignacion.get("nombreempleado", "")
-                    
-                    if empleado_id and empleado_id not in empleados_encontrados:
-                        empleados_encontrados.add(empleado_id)
-                        print(f"DEBUG SYNC: Empleado encontrado: {empleado_id} - {empleado_nombre}")
-        
-        print(f"DEBUG SYNC: Total empleados encontrados: {len(empleados_encontrados)}")
-        
-        empleados_sincronizados = []
-        empleados_ya_existentes = []
-        
-        for empleado_id in empleados_encontrados:
-            # Verificar si ya existe en la base de datos
-            empleado_existente = empleados_collection.find_one({"identificador": empleado_id})
-            
-            if empleado_existente:
-                print(f"DEBUG SYNC: Empleado {empleado_id} ya existe en BD")
-                empleados_ya_existentes.append(empleado_id)
-            else:
-                # Buscar el nombre del empleado en las asignaciones
-                nombre_empleado = f"Empleado {empleado_id}"
-                for pedido in pedidos:
-                    seguimiento = pedido.get("seguimiento", [])
-                    if not seguimiento:
-                        continue
-                        
-                    for sub in seguimiento:
-                        if not sub:
-                            continue
-                            
-                        asignaciones_articulos = sub.get("asignaciones_articulos", [])
-                        if not asignaciones_articulos:
-                            continue
-                            
-                        for asignacion in asignaciones_articulos:
-                            if not asignacion:
-                                continue
-                                
-                            if asignacion.get("empleadoId") == empleado_id:
-                                nombre_empleado = asignacion.get("nombreempleado", f"Empleado {empleado_id}")
-                                break
-                        if nombre_empleado != f"Empleado {empleado_id}":
-                            break
-                    if nombre_empleado != f"Empleado {empleado_id}":
-                        break
-                
-                # Crear nuevo empleado
-                nuevo_empleado = {
-                    "identificador": empleado_id,
-                    "nombreCompleto": nombre_empleado,
-                    "pin": "1234",  # PIN por defecto
-                    "fecha_creacion": datetime.now(),
-                    "activo": True
-                }
-                
-                result = empleados_collection.insert_one(nuevo_empleado)
-                print(f"DEBUG SYNC: Empleado {empleado_id} ({nombre_empleado}) sincronizado con ID: {result.inserted_id}")
-                empleados_sincronizados.append(empleado_id)
-        
-        return {
-            "mensaje": "Sincronización automática completada",
-            "empleados_encontrados": list(empleados_encontrados),
-            "empleados_sincronizados": empleados_sincronizados,
-            "empleados_ya_existentes": empleados_ya_existentes,
-            "total_encontrados": len(empleados_encontrados),
-            "total_sincronizados": len(empleados_sincronizados),
-            "total_ya_existentes": len(empleados_ya_existentes)
-        }
-        
-    except Exception as e:
-        print(f"ERROR SYNC: Error sincronizando empleados: {e}")
-        import traceback
-        print(f"ERROR SYNC: Traceback: {traceback.format_exc()}")
-        return {"error": str(e)}
+                    if empleado_id and empleado_id not in vistos and empleado_id not in nuevos:
+                        nuevos[empleado_id] = asignacion.get("nombreempleado") or f"Empleado {empleado_id}"
+        
+        sincronizados = 0
+        ya_existentes = 0
+        if nuevos:
+            # $setOnInsert: solo crea los que no existen (PIN por defecto 1234)
+            resultado = empleados_collection.bulk_write([
+                UpdateOne(
+                    {"identificador": empleado_id},
+                    {"$setOnInsert": {
+                        "identificador": empleado_id,
+                        "nombreCompleto": nombre,
+                        "pin": "1234",
+                        "fecha_creacion": datetime.now(),
+                        "activo": True
+                    }},
+                    upsert=True
+                )
+                for empleado_id, nombre in nuevos.items()
+            ], ordered=False)
+            sincronizados = resultado.upserted_count
+            ya_existentes = resultado.matched_count
+            if sincronizados:
+                invalidar_empleados()
+            vistos.update(nuevos.keys())
+        
+        ctx.guardar_progreso(
+            procesados=len(lote),
+            checkpoint={"ultimo_id": lote[-1]["_id"], "empleados_vistos": sorted(vistos)},
+            total_encontrados=len(nuevos),
+            total_sincronizados=sincronizados,
+            total_ya_existentes=ya_existentes
+        )
+
+# Endpoint para sincronizar TODOS los empleados automáticamente
+@router.get("/sync-todos-empleados", status_code=202)
+async def sync_todos_empleados():
+    """
+    Sincronizar automáticamente todos los empleados desde las asignaciones activas.
+    Se ejecuta en segundo plano; consultar el progreso en /jobs/{job_id}
+    """
+    job = job_runner.lanzar("sync_todos_empleados")
+    return {
+        "mensaje": "Sincronización de empleados en ejecución",
+        "job_id": job["job_id"],
+        "estado": job["estado"]
+    }
 
 # Endpoint para obtener el progreso de un artículo
 @router.get("/progreso-articulo/{pedido_id}/{item_id}")
@@ -3667,6 +3751,7 @@ async def sync_anubis_simple():
         }
         
         resultado = empleados_collection.insert_one(anubis_data)
+        invalidar_empleados()
         
         return {
             "mensaje": "ANUBIS PUENTES sincronizado exitosamente",
@@ -3712,6 +3797,7 @@ async def sincronizar_anubis():
         
         # Crear ANUBIS PUENTES
         resultado = empleados_collection.insert_one(anubis_data)
+        invalidar_empleados()
         
         print(f"DEBUG SINCRONIZAR: ANUBIS PUENTES creado: {resultado.inserted_id}")
         
@@ -3758,6 +3844,7 @@ async def sincronizar_empleado(
         }
         
         resultado = empleados_collection.insert_one(nuevo_empleado)
+        invalidar_empleados()
         
         print(f"DEBUG SINCRONIZAR: Empleado creado: {resultado.inserted_id}")
         
@@ -4077,7 +4164,7 @@ async def terminar_asignacion_articulo(
     # LIMPIAR campos de asignación del item, actualizar seguimiento e incrementar estado_item
     try:
         # Limpiar empleado_asignado, nombre_empleado, modulo_actual del item E incrementar estado_item
-        result = pedidos_collection.update_one(
+        result = actualizar_pedido(
             {
                 "_id": pedido_obj_id,
                 "items.id": item_id
@@ -4174,7 +4261,7 @@ async def terminar_asignacion_articulo(
             pedido["comisiones"].append(comision_pedido)
             
             # Actualizar el pedido con la comisión
-            result_comision = pedidos_collection.update_one(
+            result_comision = actualizar_pedido(
                 {"_id": pedido_obj_id},
                 {"$push": {"comisiones": comision_pedido}}
             )
@@ -4232,8 +4319,12 @@ async def terminar_asignacion_articulo(
                             print(f"DEBUG TERMINAR: Item apartado existe - sumando cantidad")
                             result_actualizacion = items_collection.update_one(
                                 {"codigo": codigo_item, "apartado": True},
-                                {"$inc": {"cantidad": cantidad}}
+                                [
+                                    {"$set": {"cantidad": {"$add": [{"$ifNull": ["$cantidad", 0]}, cantidad]}}},
+                                    ETAPA_SIN_EXISTENCIA
+                                ]
                             )
+                            incrementar_version(RECURSO_INVENTARIO)
                             print(f"DEBUG TERMINAR: Apartado actualizado: {result_actualizacion.modified_count} documentos modificados")
                         else:
                             # Si no existe apartado, crear uno nuevo con cantidad
@@ -4243,7 +4334,10 @@ async def terminar_asignacion_articulo(
                             item_apartado_data["cantidad"] = cantidad
                             if "_id" in item_apartado_data:
                                 del item_apartado_data["_id"]
-                            items_collection.insert_one(item_apartado_data)
+                            # El apartado es una copia del item: no ocupa su código en el índice único
+                            item_apartado_data.pop(CAMPO_CODIGO_NORM, None)
+                            items_collection.insert_one(con_sin_existencia(item_apartado_data))
+                            incrementar_version(RECURSO_INVENTARIO)
                             print(f"DEBUG TERMINAR: Nuevo apartado insertado")
                     else:
                         print(f"DEBUG TERMINAR: Item no encontrado en inventario con codigo: {codigo_item}")
@@ -4266,7 +4360,9 @@ async def terminar_asignacion_articulo(
                             "fecha_terminado_manillar": datetime.now().isoformat(),
                             "estado_item": nuevo_estado_item,
                             "empleado_ultimo_trabajo": empleado.get("nombreCompleto", empleado_id) if empleado else empleado_id,
-                            "imagenes": item_pedido.get("imagenes", [])
+                            "imagenes": item_pedido.get("imagenes", []),
+                            "estado": APARTADO_PENDIENTE,
+                            "fecha": datetime.now()
                         }
                         
                         apartados_collection.insert_one(apartado_doc)
@@ -4303,7 +4399,7 @@ async def terminar_asignacion_articulo(
                         # Mover a orden4 si está en orden1, orden2 o orden3 (no si ya está en orden4, orden5, orden6 o cancelado)
                         if estado_general in ["orden1", "orden2", "orden3"]:
                             # Mover pedido a orden4 (Facturación)
-                            result_orden = pedidos_collection.update_one(
+                            result_orden = actualizar_pedido(
                                 {"_id": pedido_obj_id},
                                 {"$set": {"estado_general": "orden4"}}
                             )
@@ -4314,6 +4410,7 @@ async def terminar_asignacion_articulo(
             # No lanzar error, solo loggear
         
         # Retornar respuesta exitosa CON el inventario actualizado
+        publicar_evento("asignaciones", pedido_id=pedido_id, item_id=item_id, accion="terminado")
         return {
             "success": True,
             "message": "Asignación terminada y agregada a comisiones",
@@ -4530,7 +4627,7 @@ async def asignar_siguiente_modulo(
         proceso_destino["asignaciones_articulos"].append(nueva_asignacion)
         
         # Actualizar el estado del item
-        result = pedidos_collection.update_one(
+        result = actualizar_pedido(
             {"_id": pedido_obj_id},
             {
                 "$set": {
@@ -4545,6 +4642,7 @@ async def asignar_siguiente_modulo(
         
         print(f"DEBUG ASIGNAR SIGUIENTE: Item asignado exitosamente al módulo {modulo_destino}")
         
+        publicar_evento("asignaciones", pedido_id=pedido_id, item_id=item_id, accion="asignado")
         return {
             "message": f"Item asignado al módulo {modulo_destino}",
             "nuevo_estado_item": modulo_destino,
@@ -4622,7 +4720,7 @@ async def terminar_asignacion_articulo_mejorado(
     
     # Actualizar pedido en base de datos
     try:
-        result = pedidos_collection.update_one(
+        result = actualizar_pedido(
             {"_id": pedido_obj_id},
             {"$set": {"seguimiento": seguimiento}}
         )
@@ -4638,6 +4736,7 @@ async def terminar_asignacion_articulo_mejorado(
     
     print(f"DEBUG TERMINAR MEJORADO: === TERMINACIÓN COMPLETADA ===")
     
+    publicar_evento("asignaciones", pedido_id=pedido_id, item_id=item_id, accion="terminado")
     return {
         "message": "Asignación terminada correctamente",
         "success": True,
@@ -4858,41 +4957,49 @@ async def cancelar_pedido(
         transacciones_eliminadas = 0
         saldos_revertidos = 0
         if historial_pagos_anterior:
-            # Buscar todas las transacciones relacionadas con este pedido
-            transacciones_pedido = list(transacciones_collection.find({"pedido_id": pedido_id}))
+            # Buscar los depósitos vigentes relacionados con este pedido.
+            # No se borran: se registra un reverso (para que el saldo_despues del historial
+            # siga siendo consistente) y el depósito original queda marcado como anulado
+            transacciones_pedido = list(transacciones_collection.find({
+                "pedido_id": pedido_id,
+                "tipo": "deposito",
+                "anulada": {"$ne": True}
+            }))
             
             for transaccion in transacciones_pedido:
                 try:
                     metodo_pago_id = transaccion.get("metodo_pago_id")
-                    monto = transaccion.get("monto", 0.0)
-                    tipo = transaccion.get("tipo", "")
+                    monto = float(transaccion.get("monto", 0.0) or 0.0)
                     
-                    # Solo revertir depósitos (pagos que aumentaron el saldo)
-                    if tipo == "deposito" and monto > 0 and metodo_pago_id:
-                        # Buscar el método de pago
-                        try:
-                            metodo_obj_id = ObjectId(metodo_pago_id)
-                            metodo_pago = metodos_pago_collection.find_one({"_id": metodo_obj_id})
-                            
-                            if metodo_pago:
-                                # Revertir el saldo (restar el monto que se había agregado)
-                                metodos_pago_collection.update_one(
-                                    {"_id": metodo_obj_id},
-                                    {"$inc": {"saldo": -float(monto)}}
-                                )
-                                saldos_revertidos += 1
-                                debug_log(f"DEBUG CANCELAR: Saldo revertido para método {metodo_pago.get('nombre', 'N/A')}: -{monto}")
-                        except Exception as e:
-                            debug_log(f"ERROR CANCELAR: Error al revertir saldo de método {metodo_pago_id}: {e}")
+                    if monto > 0 and metodo_pago_id and ObjectId.is_valid(metodo_pago_id):
+                        # Revertir el saldo (restar el monto que se había agregado)
+                        metodo_pago = aplicar_movimiento_saldo(
+                            {"_id": ObjectId(metodo_pago_id)},
+                            -monto,
+                            {
+                                "tipo": "reverso",
+                                "monto": -monto,
+                                "concepto": f"Reverso por cancelación del pedido {pedido_id}",
+                                "pedido_id": pedido_id,
+                                "transaccion_original_id": str(transaccion["_id"]),
+                                "fecha": datetime.utcnow()
+                            }
+                        )
+                        if metodo_pago:
+                            saldos_revertidos += 1
+                            debug_log(f"DEBUG CANCELAR: Saldo revertido para método {metodo_pago.get('nombre', 'N/A')}: -{monto}")
                     
-                    # Eliminar la transacción
-                    transacciones_collection.delete_one({"_id": transaccion["_id"]})
+                    # Anular la transacción original
+                    transacciones_collection.update_one(
+                        {"_id": transaccion["_id"]},
+                        {"$set": {"anulada": True, "fecha_anulacion": datetime.utcnow()}}
+                    )
                     transacciones_eliminadas += 1
                 except Exception as e:
                     debug_log(f"ERROR CANCELAR: Error al procesar transacción {transaccion.get('_id', 'N/A')}: {e}")
         
         # Actualizar el estado_general del pedido y limpiar pagos
-        result = pedidos_collection.update_one(
+        result = actualizar_pedido(
             {"_id": pedido_obj_id},
             {
                 "$set": {
@@ -4900,7 +5007,6 @@ async def cancelar_pedido(
                     "fecha_cancelacion": fecha_cancelacion,
                     "motivo_cancelacion": request.motivo_cancelacion,
                     "cancelado_por": usuario_cancelacion,
-                    "fecha_actualizacion": fecha_cancelacion,
                     "pago": "sin pago",  # Limpiar estado de pago
                     "total_abonado": 0,  # Limpiar total abonado
                     "historial_pagos": []  # Limpiar historial de pagos
@@ -4920,62 +5026,41 @@ async def cancelar_pedido(
             # Determinar qué campo de existencia usar según la sucursal
             campo_existencia = "cantidad" if sucursal == "sucursal1" else "existencia2"
             
-            for item in items_pedido:
+            # Resolver todos los items del pedido con una sola consulta (misma lógica que al crear)
+            items_a_restaurar = [item for item in items_pedido if item.get("cantidad") and item.get("cantidad") > 0]
+            items_inventario = resolver_items_inventario(items_a_restaurar) if items_a_restaurar else []
+            
+            for item, item_inventario in zip(items_a_restaurar, items_inventario):
                 # Restaurar todos los items del pedido al inventario
                 # Al cancelar un pedido, se devuelven todas las cantidades que se restaron al crearlo
                 # Solo se restaron del inventario los items con estado_item == 4 al crear el pedido,
                 # pero al cancelar, restauramos todos para asegurar que el inventario quede correcto
                 codigo = item.get("codigo")
                 cantidad = item.get("cantidad", 0)
-                item_id = item.get("id")
                 
-                if cantidad and cantidad > 0:
-                    try:
-                        # Buscar el item en el inventario por código o ID (misma lógica que al crear)
-                        item_inventario = None
-                        
-                        if codigo:
-                            codigo_limpio = str(codigo).strip()
-                            item_inventario = items_collection.find_one({"codigo": codigo_limpio})
-                            if not item_inventario:
-                                codigo_regex = codigo_limpio.replace(" ", "\\s*")
-                                item_inventario = items_collection.find_one({"codigo": {"$regex": f"^{codigo_regex}$", "$options": "i"}})
-                                if not item_inventario:
-                                    try:
-                                        if codigo_limpio.isdigit() or (codigo_limpio.replace('.', '', 1).isdigit()):
-                                            codigo_num = int(float(codigo_limpio))
-                                            item_inventario = items_collection.find_one({"codigo": str(codigo_num)})
-                                            if not item_inventario:
-                                                item_inventario = items_collection.find_one({"codigo": codigo_num})
-                                    except:
-                                        pass
+                try:
+                    if item_inventario:
+                        # Si es sucursal1 y no existe "cantidad", usar "existencia" como fallback
+                        campo_item = campo_existencia
+                        if sucursal == "sucursal1" and campo_item not in item_inventario:
+                            campo_item = "existencia"
                         
-                        if not item_inventario and item_id:
-                            try:
-                                item_obj_id = ObjectId(item_id)
-                                item_inventario = items_collection.find_one({"_id": item_obj_id})
-                            except Exception:
-                                pass
+                        cantidad_actual = item_inventario.get(campo_item, 0.0)
+                        cantidad_a_restaurar = float(cantidad)
                         
-                        if item_inventario:
-                            # Si es sucursal1 y no existe "cantidad", usar "existencia" como fallback
-                            if sucursal == "sucursal1" and campo_existencia not in item_inventario:
-                                campo_existencia = "existencia"
-                            
-                            cantidad_actual = item_inventario.get(campo_existencia, 0.0)
-                            cantidad_a_restaurar = float(cantidad)
-                            
-                            # Restaurar la cantidad sumando al inventario
-                            nueva_cantidad = cantidad_actual + cantidad_a_restaurar
-                            items_collection.update_one(
-                                {"_id": item_inventario["_id"]},
-                                {"$set": {campo_existencia: nueva_cantidad}}
-                            )
-                            items_inventario_restaurados += 1
-                            print(f"DEBUG CANCELAR: Restaurada cantidad {cantidad_a_restaurar} para item {codigo} en {sucursal}. Nueva cantidad: {nueva_cantidad}")
-                    except Exception as e:
-                        print(f"ERROR CANCELAR: Error restaurando inventario para item {codigo}: {e}")
+                        # Restaurar la cantidad sumando al inventario
+                        nueva_cantidad = cantidad_actual + cantidad_a_restaurar
+                        items_collection.update_one(
+                            {"_id": item_inventario["_id"]},
+                            [{"$set": {campo_item: nueva_cantidad}}, ETAPA_SIN_EXISTENCIA]
+                        )
+                        items_inventario_restaurados += 1
+                        print(f"DEBUG CANCELAR: Restaurada cantidad {cantidad_a_restaurar} para item {codigo} en {sucursal}. Nueva cantidad: {nueva_cantidad}")
+                except Exception as e:
+                    print(f"ERROR CANCELAR: Error restaurando inventario para item {codigo}: {e}")
             
+            if items_inventario_restaurados:
+                incrementar_version(RECURSO_INVENTARIO)
             print(f"DEBUG CANCELAR: Restauradas cantidades de {items_inventario_restaurados} items en inventario")
         except Exception as e:
             print(f"ERROR CANCELAR: Error restaurando inventario: {e}")
@@ -4985,10 +5070,10 @@ async def cancelar_pedido(
         # Eliminar items de apartados_collection relacionados con este pedido
         apartados_eliminados = 0
         try:
-            apartados_pedido = list(apartados_collection.find({"pedido_id": pedido_id}))
-            for apartado in apartados_pedido:
-                apartados_collection.delete_one({"_id": apartado["_id"]})
-                apartados_eliminados += 1
+            # Los apartados guardan pedido_id como ObjectId (algunos antiguos como texto)
+            apartados_eliminados = apartados_collection.delete_many(
+                {"pedido_id": {"$in": [pedido_obj_id, pedido_id]}}
+            ).deleted_count
             print(f"DEBUG CANCELAR: Eliminados {apartados_eliminados} items de apartados_collection")
         except Exception as e:
             print(f"ERROR CANCELAR: Error eliminando apartados: {e}")
@@ -4997,7 +5082,7 @@ async def cancelar_pedido(
         # Esto hará que desaparezcan de PedidosHerreria
         items_actualizados = 0
         for i, item in enumerate(pedido.get("items", [])):
-            item_result = pedidos_collection.update_one(
+            item_result = actualizar_pedido(
                 {
                     "_id": pedido_obj_id,
                     f"items.{i}.id": item.get("id")
@@ -5015,7 +5100,7 @@ async def cancelar_pedido(
         
         # Actualizar seguimiento con asignaciones canceladas
         if seguimiento:
-            pedidos_collection.update_one(
+            actualizar_pedido(
                 {"_id": pedido_obj_id},
                 {"$set": {"seguimiento": seguimiento}}
             )
@@ -5026,6 +5111,7 @@ async def cancelar_pedido(
         if result.modified_count == 0:
             raise HTTPException(status_code=400, detail="No se pudo actualizar el pedido")
         
+        publicar_evento("pedidos", pedido_id=pedido_id, accion="cancelado")
         return {
             "success": True,
             "message": "Pedido cancelado exitosamente",
@@ -5249,7 +5335,7 @@ async def totalizar_pago(
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"pedido_id no es un ObjectId válido: {str(e)}")
 
-    update_result = pedidos_collection.update_one(
+    update_result = actualizar_pedido(
         {"_id": pedido_obj_id},
         {"$set": {"pago": "pagado", "fecha_totalizado": datetime.utcnow().isoformat()}}
     )
@@ -5339,11 +5425,11 @@ async def actualizar_pago(
 
     try:
 
-        current_total_abonado = pedido.get("total_abonado", 0.0)
-        new_total_abonado = current_total_abonado + (monto if monto is not None else 0.0)
-        update["$set"]["total_abonado"] = new_total_abonado
+        # $inc atómico del total_abonado (saldo_pendiente se recalcula en la misma escritura)
+        if registro:
+            update["$inc"] = {"total_abonado": registro["monto"]}
 
-        result = pedidos_collection.update_one(
+        result = actualizar_pedido(
             {"_id": ObjectId(pedido_id)},
             update
         )
@@ -5437,36 +5523,18 @@ async def actualizar_pago(
                     nuevo_saldo = saldo_actual + monto
                     print(f"DEBUG PAGO: Saldo actual: {saldo_actual}, Nuevo saldo: {nuevo_saldo} para método '{metodo_pago.get('nombre', 'SIN_NOMBRE')}'")
                     
-                    # Actualizar saldo usando $inc (operación atómica)
-                    result_update = metodos_pago_collection.update_one(
-                        {"_id": metodo_pago["_id"]},
-                        {"$inc": {"saldo": monto}}
-                    )
-                    print(f"DEBUG PAGO: Resultado de actualización: {result_update.modified_count} documentos modificados")
-                    
-                    # Registrar transacción automáticamente (depósito)
-                    try:
-                        transaccion_deposito = {
-                            "metodo_pago_id": str(metodo_pago["_id"]),
-                            "tipo": "deposito",
-                            "monto": float(monto),
-                            "concepto": data.get("concepto") or f"Abono a pedido {pedido_id}",
-                            "pedido_id": pedido_id,
-                            "numero_referencia": data.get("numero_referencia"),
-                            "comprobante": data.get("comprobante"),
-                            "fecha": datetime.utcnow().isoformat()
-                        }
-                        transacciones_collection.insert_one(transaccion_deposito)
-                        print(f"DEBUG PAGO: Transacción de depósito registrada automáticamente para método '{metodo_pago.get('nombre', 'SIN_NOMBRE')}'")
-                    except Exception as trans_error:
-                        print(f"ERROR PAGO: Error al registrar transacción de depósito: {trans_error}")
-                        import traceback
-                        print(f"TRACEBACK: {traceback.format_exc()}")
-                        # No interrumpimos el flujo si falla el registro de transacción
-                    
-                    # Verificar que se actualizó correctamente
-                    metodo_verificado = metodos_pago_collection.find_one({"_id": metodo_pago["_id"]})
-                    print(f"DEBUG PAGO: Saldo verificado después de actualizar: {metodo_verificado.get('saldo', 'ERROR')}")
+                    # Actualizar saldo con $inc y registrar el depósito con el saldo resultante
+                    transaccion_deposito = {
+                        "tipo": "deposito",
+                        "monto": float(monto),
+                        "concepto": data.get("concepto") or f"Abono a pedido {pedido_id}",
+                        "pedido_id": pedido_id,
+                        "numero_referencia": data.get("numero_referencia"),
+                        "comprobante": data.get("comprobante"),
+                        "fecha": datetime.utcnow()
+                    }
+                    metodo_actualizado = aplicar_movimiento_saldo({"_id": metodo_pago["_id"]}, float(monto), transaccion_deposito)
+                    print(f"DEBUG PAGO: Saldo después del depósito: {metodo_actualizado.get('saldo', 'ERROR') if metodo_actualizado else 'ERROR'}")
                 else:
                     print(f"DEBUG PAGO: Método de pago '{metodo}' no encontrado")
                     # Listar todos los métodos disponibles para debug
@@ -5497,7 +5565,7 @@ async def actualizar_pago(
                 
                 if todos_completos and estado_general in ["orden1", "orden2", "orden3"]:
                     # Mover pedido a orden4 (Facturación)
-                    pedidos_collection.update_one(
+                    actualizar_pedido(
                         {"_id": ObjectId(pedido_id)},
                         {"$set": {"estado_general": "orden4"}}
                     )
@@ -5515,10 +5583,12 @@ async def actualizar_pago(
 async def obtener_pagos(
     fecha_inicio: Optional[str] = Query(None, description="Fecha inicio en formato YYYY-MM-DD"),
     fecha_fin: Optional[str] = Query(None, description="Fecha fin en formato YYYY-MM-DD"),
+    con_saldo: bool = Query(False, description="Solo pedidos con saldo pendiente"),
 ):
     """
     Retorna los pagos de los pedidos internos, filtrando por rango de fechas si se especifica.
     Excluye pedidos web (tipo_pedido: "web").
+    Cada pedido incluye monto_total y saldo_pendiente guardados; con_saldo filtra por saldo en la base de datos.
     """
 
     filtro = {}
@@ -5537,6 +5607,14 @@ async def obtener_pagos(
     filtro = excluir_pedidos_tu_mundo_puerta(filtro)
     # Excluir todos los pedidos cancelados
     filtro["estado_general"] = {"$ne": "cancelado"}
+    if con_saldo:
+        # Los pedidos aún sin totales guardados se incluyen (el frontend los calcula con items)
+        filtro.setdefault("$and", []).append({
+            "$or": [
+                {CAMPO_SALDO_PENDIENTE: {"$gt": 0}},
+                {CAMPO_SALDO_PENDIENTE: {"$exists": False}}
+            ]
+        })
 
     # Buscar pedidos internos solamente
     pedidos = list(
@@ -5549,6 +5627,8 @@ async def obtener_pagos(
                 "pago": 1,
                 "historial_pagos": 1,
                 "total_abonado": 1,
+                "monto_total": 1,
+                "saldo_pendiente": 1,
                 "items": 1, # Necesario para calcular el total del pedido en el frontend
                 "adicionales": 1,  # Necesario para calcular el total del pedido (items + adicionales)
             },
@@ -6214,6 +6294,7 @@ async def eliminar_pedido_prueba2():
             result = pedidos_collection.delete_one({"_id": pedido["_id"]})
             
             if result.deleted_count > 0:
+                registrar_pedido_eliminado(pedido["_id"])
                 pedidos_eliminados.append({
                     "pedido_id": pedido_id,
                     "cliente_nombre": cliente_nombre,
@@ -6306,13 +6387,8 @@ async def get_datos_impresion(pedido_id: str, current_user = Depends(get_current
         # Convertir ObjectId a string
         pedido["_id"] = str(pedido["_id"])
         
-        # Calcular saldo pendiente (considerando descuentos)
-        total_pedido = sum(
-            calcular_precio_final_item(item) * float(item.get("cantidad", 0)) 
-            for item in pedido.get("items", [])
-        )
-        total_abonado = pedido.get("total_abonado", 0)
-        saldo_pendiente = total_pedido - total_abonado
+        # Totales guardados en el pedido (considerando descuentos y adicionales)
+        total_pedido, total_abonado, saldo_pendiente = totales_pedido(pedido)
         
         return {
             "pedido": pedido,
@@ -6368,22 +6444,8 @@ async def get_pagos_pedido(pedido_id: str):
         if total_abonado == 0 and not historial_pagos:
             total_abonado = float(pedido.get("total_abonado", 0))
         
-        # Calcular total del pedido (items + adicionales, considerando descuentos)
-        total_items = sum(
-            calcular_precio_final_item(item) * float(item.get("cantidad", 0)) 
-            for item in pedido.get("items", [])
-        )
-
-        # Calcular total de adicionales
-        adicionales = pedido.get("adicionales", [])
-        total_adicionales = 0
-        if adicionales and isinstance(adicionales, list):
-            for adicional in adicionales:
-                cantidad = adicional.get("cantidad", 1)
-                precio = adicional.get("precio", 0)
-                total_adicionales += precio * cantidad
-
-        total_pedido = total_items + total_adicionales
+        # Total del pedido guardado (items + adicionales, considerando descuentos)
+        total_pedido, _, _ = totales_pedido(pedido)
         
         saldo_pendiente = total_pedido - total_abonado
         
@@ -6457,24 +6519,8 @@ async def aprobar_abono_pendiente(
                 detail=f"El abono ya está aprobado o procesado. Estado actual: {estado_actual}"
             )
         
-        # Calcular el total del pedido (items + adicionales, considerando descuentos)
-        monto_total_items = sum(
-            calcular_precio_final_item(item) * float(item.get("cantidad", 0))
-            for item in pedido.get("items", [])
-        )
-        
-        # Sumar adicionales si existen
-        monto_total_adicionales = 0.0
-        adicionales = pedido.get("adicionales", [])
-        if adicionales and isinstance(adicionales, list):
-            for adicional in adicionales:
-                if isinstance(adicional, dict):
-                    precio = float(adicional.get("precio", 0))
-                    cantidad = float(adicional.get("cantidad", 1))
-                    monto_total_adicionales += precio * cantidad
-        
-        total_pedido = monto_total_items + monto_total_adicionales
-        total_abonado_actual = float(pedido.get("total_abonado", 0))
+        # Total del pedido guardado (items + adicionales, considerando descuentos)
+        total_pedido, total_abonado_actual, saldo_anterior = totales_pedido(pedido)
         monto_abono = float(abono.get("monto", 0))
         
         # Si el abono estaba pendiente, ahora se suma al total_abonado
@@ -6492,17 +6538,19 @@ async def aprobar_abono_pendiente(
         update_query = {
             "$set": {
                 f"historial_pagos.{index}.estado": nuevo_estado_abono,
-                "total_abonado": nuevo_total_abonado,
-                "pago": nuevo_estado_pago,
-                "fecha_actualizacion": datetime.now().isoformat()
-            }
+                "pago": nuevo_estado_pago
+            },
+            "$inc": {"total_abonado": monto_abono}
         }
         
-        result = pedidos_collection.update_one(
-            {"_id": pedido_obj_id},
+        # Condicionado al estado leído: si dos aprobaciones del mismo abono se cruzan, solo una suma
+        result = actualizar_pedido(
+            {"_id": pedido_obj_id, f"historial_pagos.{index}.estado": abono.get("estado")},
             update_query
         )
         
+        if result.matched_count == 0:
+            raise HTTPException(status_code=409, detail="El abono cambió mientras se aprobaba, vuelve a intentarlo")
         if result.modified_count == 0:
             raise HTTPException(status_code=500, detail="Error al actualizar el abono")
         
@@ -6510,6 +6558,12 @@ async def aprobar_abono_pendiente(
         pedido_actualizado = pedidos_collection.find_one({"_id": pedido_obj_id})
         historial_actualizado = pedido_actualizado.get("historial_pagos", [])
         
+        # El abono aprobado debe bajar el saldo guardado (índices idx_*_saldo y filtro de /estado/)
+        _, _, saldo_nuevo = totales_pedido(pedido_actualizado)
+        if monto_abono > 0 and saldo_nuevo > saldo_anterior - monto_abono + 0.01:
+            print(f"ERROR APROBAR ABONO: saldo_pendiente de {pedido_id} no bajó ({saldo_anterior} -> {saldo_nuevo}); recalculando")
+            pedidos_collection.update_one({"_id": pedido_obj_id}, ETAPAS_TOTALES_PEDIDO)
+        
         # Verificar si el pedido debería estar en orden4 (Facturación)
         # Si todos los items tienen estado_item >= 4, mover a orden4
         try:
@@ -6520,7 +6574,7 @@ async def aprobar_abono_pendiente(
                 
                 if todos_completos and estado_general in ["orden1", "orden2", "orden3"]:
                     # Mover pedido a orden4 (Facturación)
-                    pedidos_collection.update_one(
+                    actualizar_pedido(
                         {"_id": pedido_obj_id},
                         {"$set": {"estado_general": "orden4"}}
                     )
@@ -6586,24 +6640,8 @@ async def agregar_abono_pedido(
         if monto <= 0:
             raise HTTPException(status_code=400, detail="El monto debe ser mayor que 0")
         
-        # Calcular el total del pedido (items + adicionales, considerando descuentos)
-        monto_total_items = sum(
-            calcular_precio_final_item(item) * float(item.get("cantidad", 0))
-            for item in pedido.get("items", [])
-        )
-        
-        # Sumar adicionales si existen
-        monto_total_adicionales = 0.0
-        adicionales = pedido.get("adicionales", [])
-        if adicionales and isinstance(adicionales, list):
-            for adicional in adicionales:
-                if isinstance(adicional, dict):
-                    precio = float(adicional.get("precio", 0))
-                    cantidad = float(adicional.get("cantidad", 1))
-                    monto_total_adicionales += precio * cantidad
-        
-        total_pedido = monto_total_items + monto_total_adicionales
-        total_abonado_actual = float(pedido.get("total_abonado", 0))
+        # Total del pedido guardado (items + adicionales, considerando descuentos)
+        total_pedido, total_abonado_actual, saldo_anterior = totales_pedido(pedido)
         
         # Crear registro de abono
         nuevo_abono = {
@@ -6640,17 +6678,15 @@ async def agregar_abono_pedido(
             if nuevo_total_abonado > 0:
                 nuevo_estado_pago = "abonado"
         
-        # Preparar actualización
+        # Preparar actualización ($inc atómico del total_abonado si el abono ya está aprobado)
         update_query = {
             "$push": {"historial_pagos": nuevo_abono},
-            "$set": {
-                "total_abonado": nuevo_total_abonado,
-                "pago": nuevo_estado_pago,
-                "fecha_actualizacion": datetime.now().isoformat()
-            }
+            "$set": {"pago": nuevo_estado_pago}
         }
+        if nuevo_total_abonado != total_abonado_actual:
+            update_query["$inc"] = {"total_abonado": monto}
         
-        result = pedidos_collection.update_one(
+        result = actualizar_pedido(
             {"_id": pedido_obj_id},
             update_query
         )
@@ -6662,6 +6698,12 @@ async def agregar_abono_pedido(
         pedido_actualizado = pedidos_collection.find_one({"_id": pedido_obj_id})
         historial_actualizado = pedido_actualizado.get("historial_pagos", [])
         
+        # El abono aprobado debe bajar el saldo guardado (índices idx_*_saldo y filtro de /estado/)
+        _, _, saldo_nuevo = totales_pedido(pedido_actualizado)
+        if monto_abono > 0 and saldo_nuevo > saldo_anterior - monto_abono + 0.01:
+            print(f"ERROR APROBAR ABONO: saldo_pendiente de {pedido_id} no bajó ({saldo_anterior} -> {saldo_nuevo}); recalculando")
+            pedidos_collection.update_one({"_id": pedido_obj_id}, ETAPAS_TOTALES_PEDIDO)
+        
         # Verificar si el pedido debería estar en orden4 (Facturación)
         # Si todos los items tienen estado_item >= 4, mover a orden4
         try:
@@ -6672,7 +6714,7 @@ async def agregar_abono_pedido(
                 
                 if todos_completos and estado_general in ["orden1", "orden2", "orden3"]:
                     # Mover pedido a orden4 (Facturación)
-                    pedidos_collection.update_one(
+                    actualizar_pedido(
                         {"_id": pedido_obj_id},
                         {"$set": {"estado_general": "orden4"}}
                     )
@@ -6771,6 +6813,7 @@ async def eliminar_pedido(
             mensajes_collection = db["mensajes"]
             result_mensajes = mensajes_collection.delete_many({"pedido_id": pedido_id})
             mensajes_eliminados = result_mensajes.deleted_count
+            db["mensajes_no_leidos"].delete_one({"_id": pedido_id})
         except Exception as e:
             print(f"ADVERTENCIA: No se pudo eliminar mensajes (puede que la colección no exista aún): {str(e)}")
         
@@ -6779,6 +6822,7 @@ async def eliminar_pedido(
         
         if result_pedido.deleted_count == 0:
             raise HTTPException(status_code=404, detail="No se pudo eliminar el pedido")
+        registrar_pedido_eliminado(pedido_obj_id)
         
         return {
             "message": "Pedido eliminado exitosamente",
@@ -7266,7 +7310,7 @@ async def terminar_asignacion_articulo_v2(
     
     # Actualizar pedido en base de datos
     try:
-        result = pedidos_collection.update_one(
+        result = actualizar_pedido(
             {"_id": pedido_obj_id},
             {"$set": {"seguimiento": seguimiento}}
         )
@@ -7279,6 +7323,7 @@ async def terminar_asignacion_articulo_v2(
     
     print(f"DEBUG TERMINAR V2: === TERMINACIÓN COMPLETADA ===")
     
+    publicar_evento("asignaciones", pedido_id=pedido_id, item_id=item_id, accion="terminado")
     return {
         "message": "Asignación terminada correctamente",
         "success": True,
@@ -7499,13 +7544,14 @@ async def asignar_item_multiple(
             break
 
     # Persistir cambios
-    result = pedidos_collection.update_one(
+    result = actualizar_pedido(
         {"_id": pedido_obj_id},
         {"$set": {"seguimiento": seguimiento, "items": items}}
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Pedido no encontrado al actualizar")
 
+    publicar_evento("asignaciones", pedido_id=pedido_id, item_id=item_id, accion="asignado")
     return {
         "message": "Asignaciones registradas",
         "success": True,
@@ -7893,78 +7939,149 @@ def calcular_progreso_mejorado(items: list, seguimiento: list) -> dict:
             "detalle_items": []
         }
 
-@router.put("/inicializar-estado-items/")
-async def inicializar_estado_items():
+# ========================================
+# ENDPOINTS PARA MÓDULO APARTADO
+# ========================================
+
+ORDEN_APARTADOS = [("fecha", -1), ("_id", -1)]
+
+def fecha_apartado(apartado: dict) -> datetime:
+    """Fecha del apartado (fecha_terminado_manillar) para los apartados anteriores al campo fecha"""
+    texto = apartado.get("fecha_terminado_manillar")
+    if isinstance(texto, str):
+        try:
+            return datetime.fromisoformat(texto)
+        except ValueError:
+            pass
+    return apartado["_id"].generation_time.replace(tzinfo=None)
+
+@job_runner.registrar("archivar_apartados")
+def job_archivar_apartados(ctx: JobContext):
     """
-    Inicializar estado_item = 0 en todos los items que no lo tengan
+    Completar estado/fecha en los apartados anteriores y mover a apartados_archivo los
+    facturados hace más de APARTADOS_ARCHIVO_DIAS. Cada lote se copia antes de borrarlo,
+    así que si el trabajo se interrumpe se puede relanzar sin perder ni duplicar apartados.
     """
+    completados = 0
+    sin_estado = {"estado": {"$exists": False}}
+    while True:
+        lote = list(apartados_collection.find(
+            sin_estado, {"facturado": 1, "fecha_facturado": 1, "fecha_terminado_manillar": 1}
+        ).limit(500))
+        if not lote:
+            break
+        operaciones = []
+        for apartado in lote:
+            cambios = {"fecha": fecha_apartado(apartado)}
+            if apartado.get("facturado"):
+                cambios["estado"] = APARTADO_FACTURADO
+                if not apartado.get("fecha_facturado"):
+                    cambios["fecha_facturado"] = datetime.now().isoformat()
+            else:
+                cambios["estado"] = APARTADO_PENDIENTE
+            operaciones.append(UpdateOne({"_id": apartado["_id"], **sin_estado}, {"$set": cambios}))
+        apartados_collection.bulk_write(operaciones, ordered=False)
+        completados += len(lote)
+        ctx.guardar_progreso(procesados=len(lote), completados=len(lote))
+
+    archivados = 0
+    if APARTADOS_ARCHIVO_DIAS:
+        # fecha_facturado es un ISO string, que se ordena igual que la fecha
+        corte = (datetime.now() - timedelta(days=APARTADOS_ARCHIVO_DIAS)).isoformat()
+        filtro = {"estado": APARTADO_FACTURADO, "fecha_facturado": {"$lt": corte}}
+        while True:
+            lote = list(apartados_collection.find(filtro).limit(500))
+            if not lote:
+                break
+            apartados_archivo_collection.bulk_write(
+                [ReplaceOne({"_id": apartado["_id"]}, {**apartado, "fecha_archivo": datetime.now()}, upsert=True) for apartado in lote],
+                ordered=False
+            )
+            apartados_collection.delete_many({"_id": {"$in": [apartado["_id"] for apartado in lote]}})
+            archivados += len(lote)
+            ctx.guardar_progreso(procesados=len(lote), archivados=len(lote))
+    return {"completados": completados, "archivados": archivados}
+
+_ultimo_archivo_apartados = None
+
+def programar_archivo_apartados():
+    """Lanzar el archivo de apartados si pasaron APARTADOS_ARCHIVO_INTERVALO_HORAS desde el último (llamar desde el event loop)"""
+    global _ultimo_archivo_apartados
+    ahora = time.monotonic()
+    if _ultimo_archivo_apartados is not None and ahora - _ultimo_archivo_apartados < APARTADOS_ARCHIVO_INTERVALO_HORAS * 3600:
+        return
+    _ultimo_archivo_apartados = ahora
     try:
-        print("INICIALIZANDO: Buscando items sin estado_item")
-        
-        # Buscar todos los pedidos
-        pedidos = list(pedidos_collection.find({}))
-        items_actualizados = 0
-        
-        for pedido in pedidos:
-            pedido_id = pedido["_id"]
-            pedido_items_actualizados = 0
-            
-            # Actualizar cada item que no tenga estado_item
-            for i, item in enumerate(pedido.get("items", [])):
-                if not item.get("estado_item"):
-                    result = pedidos_collection.update_one(
-                        {
-                            "_id": pedido_id,
-                            f"items.{i}": item
-                        },
-                        {
-                            "$set": {
-                                f"items.{i}.estado_item": 0  # Estado pendiente
-                            }
-                        }
-                    )
-                    if result.modified_count > 0:
-                        pedido_items_actualizados += 1
-            
-            if pedido_items_actualizados > 0:
-                items_actualizados += pedido_items_actualizados
-                print(f"INICIALIZANDO: Pedido {pedido_id} - {pedido_items_actualizados} items actualizados")
-        
-        return {
-            "message": "Inicialización completada",
-            "pedidos_procesados": len(pedidos),
-            "items_actualizados": items_actualizados
-        }
-        
+        job_runner.lanzar("archivar_apartados")
     except Exception as e:
-        print(f"Error inicializando estado_items: {e}")
-        return {"error": str(e)}
+        print(f"ERROR APARTADOS: No se pudo lanzar el archivo de apartados: {e}")
 
-# ========================================
-# ENDPOINTS PARA MÓDULO APARTADO
-# ========================================
+def fecha_filtro_apartados(valor: str, parametro: str) -> datetime:
+    try:
+        return datetime.strptime(valor, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{parametro} debe tener el formato YYYY-MM-DD")
 
 @router.get("/apartados/")
-async def get_apartados():
+async def get_apartados(
+    response: Response,
+    estado: Optional[Literal["pendiente", "facturado"]] = Query(None, description="pendiente o facturado; todos si no se indica"),
+    pedido_id: Optional[str] = Query(None, description="Solo los apartados de este pedido"),
+    fecha_desde: Optional[str] = Query(None, description="Fecha mínima del apartado (YYYY-MM-DD)"),
+    fecha_hasta: Optional[str] = Query(None, description="Fecha máxima del apartado (YYYY-MM-DD, incluida)"),
+    limit: Optional[int] = Query(None, gt=0, le=PAGINA_MAX, description=f"Apartados por página ({PAGINA_DEFAULT} si solo se envía cursor)"),
+    cursor: Optional[str] = Query(None, description="Cursor de la página siguiente (header X-Next-Cursor)")
+):
     """
-    Obtener todos los items en apartados
+    Obtener los items en apartados.
+    Sin limit ni cursor devuelve todos los que cumplen los filtros, como antes.
+    Con limit o cursor pagina por cursor, más recientes primero: si hay más, el header
+    X-Next-Cursor trae el cursor de la siguiente página. total es siempre el número de
+    apartados que cumplen los filtros (no el tamaño de la página).
+    Los facturados hace más de APARTADOS_ARCHIVO_DIAS se mueven a apartados_archivo.
     """
     try:
-        # Buscar items en la colección de apartados
-        apartados = list(apartados_collection.find({}))
+        filtro = {}
+        if estado:
+            filtro["estado"] = estado
+        if pedido_id:
+            if not ObjectId.is_valid(pedido_id):
+                raise HTTPException(status_code=400, detail="pedido_id inválido")
+            filtro["pedido_id"] = {"$in": [ObjectId(pedido_id), pedido_id]}
+        if fecha_desde or fecha_hasta:
+            rango = {}
+            if fecha_desde:
+                rango["$gte"] = fecha_filtro_apartados(fecha_desde, "fecha_desde")
+            if fecha_hasta:
+                rango["$lt"] = fecha_filtro_apartados(fecha_hasta, "fecha_hasta") + timedelta(days=1)
+            filtro["fecha"] = rango
+        
+        siguiente = None
+        if limit is None and cursor is None:
+            apartados = list(apartados_collection.find(filtro))
+            total = len(apartados)
+        else:
+            apartados, siguiente = paginar(apartados_collection, filtro, ORDEN_APARTADOS, limit or PAGINA_DEFAULT, cursor)
+            if siguiente:
+                response.headers["X-Next-Cursor"] = siguiente
+            total = apartados_collection.count_documents(filtro)
         
         # Convertir ObjectId a string
         for apartado in apartados:
             apartado["_id"] = str(apartado["_id"])
-            apartado["pedido_id"] = str(apartado["pedido_id"])
-            apartado["item_id"] = str(apartado["item_id"])
+            apartado["pedido_id"] = str(apartado.get("pedido_id"))
+            apartado["item_id"] = str(apartado.get("item_id"))
         
+        programar_archivo_apartados()
         return {
             "apartados": apartados,
-            "total": len(apartados),
+            "total": total,
+            "siguiente_cursor": siguiente,
             "success": True
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"ERROR APARTADOS: Error al obtener apartados: {e}")
         raise HTTPException(status_code=500, detail=f"Error al obtener apartados: {str(e)}")
@@ -7999,6 +8116,7 @@ async def marcar_apartado_facturado(apartado_id: str):
             {"_id": ObjectId(apartado_id)},
             {"$set": {
                 "facturado": True,
+                "estado": APARTADO_FACTURADO,
                 "fecha_facturado": datetime.now().isoformat()
             }}
         )
@@ -8048,7 +8166,7 @@ async def verificar_pedido_completo(pedido_id: str):
         # Si todos los items están completos y el pedido está en orden1, orden2 o orden3
         if todos_completos and estado_general in ["orden1", "orden2", "orden3"]:
             # Actualizar estado_general a orden4
-            result = pedidos_collection.update_one(
+            result = actualizar_pedido(
                 {"_id": pedido_obj_id},
                 {"$set": {"estado_general": "orden4"}}
             )
@@ -8074,69 +8192,46 @@ async def verificar_pedido_completo(pedido_id: str):
         print(f"ERROR VERIFICAR PEDIDO: Traceback: {traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=f"Error verificando pedido: {str(e)}")
 
-@router.post("/verificar-todos-pedidos-completos")
+@job_runner.registrar("verificar_todos_pedidos_completos")
+def job_verificar_todos_pedidos_completos(ctx: JobContext):
+    """Mover a orden4 los pedidos en orden1-3 cuyos items tienen todos estado_item >= 4, por lotes"""
+    filtro = {"estado_general": {"$in": ["orden1", "orden2", "orden3"]}}
+    ctx.set_total(pedidos_collection.count_documents(filtro))
+    
+    for lote in iterar_por_lotes(ctx, pedidos_collection, filtro, {"items.estado_item": 1, "estado_general": 1}):
+        operaciones = []
+        for pedido in lote:
+            items = pedido.get("items", [])
+            if items and all((item.get("estado_item") or 0) >= 4 for item in items):
+                # Condicionar al estado leído para no pisar cambios concurrentes
+                operaciones.append(UpdateOne(
+                    {"_id": pedido["_id"], "estado_general": pedido.get("estado_general")},
+                    {"$set": {"estado_general": "orden4", "fecha_actualizacion": datetime.now()}}
+                ))
+        
+        movidos = 0
+        if operaciones:
+            movidos = pedidos_collection.bulk_write(operaciones, ordered=False).modified_count
+        ctx.guardar_progreso(
+            procesados=len(lote),
+            checkpoint={"ultimo_id": lote[-1]["_id"]},
+            total_movidos=movidos,
+            pedidos_completos_no_movidos=len(operaciones) - movidos
+        )
+
+@router.post("/verificar-todos-pedidos-completos", status_code=202)
 async def verificar_todos_pedidos_completos():
     """
     Verificar todos los pedidos y mover aquellos que tienen 100% (todos items estado_item >= 4) a orden4
-    Útil para corregir pedidos que deberían estar en Facturación pero no lo están
+    Útil para corregir pedidos que deberían estar en Facturación pero no lo están.
+    Se ejecuta en segundo plano; consultar el progreso en /jobs/{job_id}
     """
-    try:
-        # Buscar todos los pedidos que están en orden1, orden2 o orden3
-        pedidos = pedidos_collection.find({
-            "estado_general": {"$in": ["orden1", "orden2", "orden3"]}
-        })
-        
-        pedidos_movidos = []
-        pedidos_completos_no_movidos = []
-        
-        for pedido in pedidos:
-            try:
-                pedido_id = str(pedido["_id"])
-                items = pedido.get("items", [])
-                
-                if not items:
-                    continue
-                
-                # Verificar si todos los items tienen estado_item >= 4
-                todos_completos = all(item.get("estado_item", 0) >= 4 for item in items)
-                
-                if todos_completos:
-                    estado_general = pedido.get("estado_general", "")
-                    # Mover a orden4
-                    result = pedidos_collection.update_one(
-                        {"_id": pedido["_id"]},
-                        {"$set": {"estado_general": "orden4"}}
-                    )
-                    
-                    if result.modified_count > 0:
-                        pedidos_movidos.append({
-                            "pedido_id": pedido_id,
-                            "estado_anterior": estado_general,
-                            "estado_nuevo": "orden4"
-                        })
-                    else:
-                        pedidos_completos_no_movidos.append({
-                            "pedido_id": pedido_id,
-                            "estado_actual": estado_general,
-                            "razon": "No se pudo actualizar"
-                        })
-                        
-            except Exception as e:
-                print(f"ERROR VERIFICAR TODOS: Error procesando pedido {pedido.get('_id', 'N/A')}: {e}")
-                continue
-        
-        return {
-            "message": f"Verificación completada. {len(pedidos_movidos)} pedidos movidos a orden4",
-            "pedidos_movidos": pedidos_movidos,
-            "pedidos_completos_no_movidos": pedidos_completos_no_movidos,
-            "total_movidos": len(pedidos_movidos)
-        }
-        
-    except Exception as e:
-        print(f"ERROR VERIFICAR TODOS: Error verificando pedidos: {e}")
-        import traceback
-        print(f"ERROR VERIFICAR TODOS: Traceback: {traceback.format_exc()}")
-        raise HTTPException(status_code=500, detail=f"Error verificando pedidos: {str(e)}")
+    job = job_runner.lanzar("verificar_todos_pedidos_completos")
+    return {
+        "message": "Verificación de pedidos completos en ejecución",
+        "job_id": job["job_id"],
+        "estado": job["estado"]
+    }
 
 @router.post("/recalcular-total-abonado/{pedido_id}")
 async def recalcular_total_abonado(pedido_id: str):
@@ -8165,24 +8260,8 @@ async def recalcular_total_abonado(pedido_id: str):
         
         total_abonado_actual = float(pedido.get("total_abonado", 0))
         
-        # Calcular total del pedido (considerando descuentos)
-        items = pedido.get("items", [])
-        monto_total_items = sum(
-            calcular_precio_final_item(item) * float(item.get("cantidad", 0))
-            for item in items
-        )
-        
-        # Sumar adicionales si existen
-        monto_total_adicionales = 0.0
-        adicionales = pedido.get("adicionales", [])
-        if adicionales and isinstance(adicionales, list):
-            for adicional in adicionales:
-                if isinstance(adicional, dict):
-                    precio = float(adicional.get("precio", 0))
-                    cantidad = float(adicional.get("cantidad", 1))
-                    monto_total_adicionales += precio * cantidad
-        
-        total_pedido = monto_total_items + monto_total_adicionales
+        # Total del pedido guardado (items + adicionales, considerando descuentos)
+        total_pedido, _, _ = totales_pedido(pedido)
         
         # Determinar nuevo estado de pago
         if total_abonado_calculado >= total_pedido - 0.01:  # Tolerancia para floats
@@ -8192,8 +8271,8 @@ async def recalcular_total_abonado(pedido_id: str):
         else:
             nuevo_estado_pago = "sin pago"
         
-        # Actualizar total_abonado y estado de pago
-        result = pedidos_collection.update_one(
+        # Actualizar total_abonado y estado de pago (también recalcula monto_total y saldo_pendiente)
+        result = actualizar_pedido(
             {"_id": pedido_obj_id},
             {
                 "$set": {
@@ -8209,6 +8288,7 @@ async def recalcular_total_abonado(pedido_id: str):
             "total_abonado_anterior": total_abonado_actual,
             "total_abonado_nuevo": total_abonado_calculado,
             "total_pedido": total_pedido,
+            "saldo_pendiente": round(total_pedido - total_abonado_calculado, 2),
             "estado_pago_anterior": pedido.get("pago", ""),
             "estado_pago_nuevo": nuevo_estado_pago,
             "historial_pagos_count": len(historial_pagos),
@@ -8221,6 +8301,47 @@ async def recalcular_total_abonado(pedido_id: str):
         print(f"ERROR RECALCULAR ABONO: Traceback: {traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=f"Error recalculando total abonado: {str(e)}")
 
+@job_runner.registrar("recalcular_totales_pedidos")
+def job_recalcular_totales_pedidos(ctx: JobContext):
+    """
+    Guardar monto_total, total_abonado y saldo_pendiente en todos los pedidos, por lotes.
+    Los pedidos cuyos totales cambian reciben fecha_actualizacion (como en actualizar_pedido)
+    para que /pedidos/cambios los envíe; los que ya estaban bien no se tocan.
+    """
+    ctx.set_total(pedidos_collection.count_documents({}))
+    totales = ["$" + CAMPO_MONTO_TOTAL, "$" + CAMPO_TOTAL_ABONADO, "$" + CAMPO_SALDO_PENDIENTE]
+    
+    for lote in iterar_por_lotes(ctx, pedidos_collection, {}, {"_id": 1}):
+        # Mismo pipeline que las escrituras: se calcula en MongoDB sin traer los items
+        resultado = pedidos_collection.update_many(
+            {"_id": {"$in": [pedido["_id"] for pedido in lote]}},
+            [{"$set": {"_totales_anteriores": totales}}] + ETAPAS_TOTALES_PEDIDO + [
+                {"$set": {"fecha_actualizacion": {"$cond": [
+                    {"$eq": ["$_totales_anteriores", totales]}, "$fecha_actualizacion", datetime.now()
+                ]}}},
+                {"$unset": "_totales_anteriores"}
+            ]
+        )
+        ctx.guardar_progreso(
+            procesados=len(lote),
+            checkpoint={"ultimo_id": lote[-1]["_id"]},
+            pedidos_actualizados=resultado.modified_count
+        )
+
+@router.put("/recalcular-totales/", status_code=202)
+async def recalcular_totales_pedidos():
+    """
+    Calcular monto_total y saldo_pendiente de los pedidos anteriores (o corregirlos si se
+    editaron directamente en la base de datos). Se ejecuta en segundo plano; consultar el
+    progreso en /jobs/{job_id}
+    """
+    job = job_runner.lanzar("recalcular_totales_pedidos")
+    return {
+        "message": "Recálculo de totales de pedidos en ejecución",
+        "job_id": job["job_id"],
+        "estado": job["estado"]
+    }
+
 # ============================================================================
 # ENDPOINTS PARA CLIENTES AUTENTICADOS
 # ============================================================================
@@ -8247,7 +8368,7 @@ async def create_pedido_cliente(pedido: Pedido, cliente: dict = Depends(get_curr
         # Mantener compatibilidad con campo "tipo" por si acaso
         pedido_dict["tipo"] = "cliente"
         pedido_dict["fecha_creacion"] = datetime.now().isoformat()
-        pedido_dict["fecha_actualizacion"] = datetime.now().isoformat()
+        pedido_dict["fecha_actualizacion"] = datetime.now()
         
         # Asegurar estado_item inicial para cada item
         # Validar descuentos en items
@@ -8270,8 +8391,8 @@ async def create_pedido_cliente(pedido: Pedido, cliente: dict = Depends(get_curr
                         detail=f"El descuento ({descuento}) no puede exceder el precio ({precio}) para el item '{item.get('nombre', 'sin nombre')}'"
                     )
         
-        # Insertar el pedido
-        result = pedidos_collection.insert_one(pedido_dict)
+        # Insertar el pedido con monto_total y saldo_pendiente
+        result = pedidos_collection.insert_one(con_totales(pedido_dict))
         pedido_id = str(result.inserted_id)
         
         # Generar asignaciones unitarias para herrería (similar al endpoint normal)
@@ -8319,7 +8440,7 @@ async def create_pedido_cliente(pedido: Pedido, cliente: dict = Depends(get_curr
             
             proceso_herreria["asignaciones_articulos"] = asignaciones_articulos
             
-            pedidos_collection.update_one(
+            actualizar_pedido(
                 {"_id": ObjectId(pedido_id)},
                 {"$set": {"seguimiento": seguimiento}},
             )
@@ -8328,25 +8449,8 @@ async def create_pedido_cliente(pedido: Pedido, cliente: dict = Depends(get_curr
         
         # Crear factura automáticamente para el pedido del cliente
         try:
-            # Calcular monto total del pedido (items + adicionales, considerando descuentos)
-            monto_total_items = sum(
-                calcular_precio_final_item(item) * float(item.get("cantidad", 0))
-                for item in pedido_dict.get("items", [])
-            )
-            
-            # Sumar adicionales si existen
-            monto_total_adicionales = 0.0
-            adicionales = pedido_dict.get("adicionales", [])
-            if adicionales and isinstance(adicionales, list):
-                # Los adicionales pueden tener estructura: [{"descripcion": "...", "precio": 100, "cantidad": 1}]
-                # O simplemente: [{"precio": 100}] si cantidad es siempre 1
-                for adicional in adicionales:
-                    if isinstance(adicional, dict):
-                        precio = float(adicional.get("precio", 0))
-                        cantidad = float(adicional.get("cantidad", 1))  # Default cantidad = 1
-                        monto_total_adicionales += precio * cantidad
-            
-            monto_total = monto_total_items + monto_total_adicionales
+            # Monto total del pedido (items + adicionales, considerando descuentos), ya guardado en el pedido
+            monto_total = pedido_dict["monto_total"]
             
             # Obtener total_abonado inicial del pedido (si viene con historial_pagos)
             total_abonado_inicial = 0.0
@@ -8387,11 +8491,10 @@ async def create_pedido_cliente(pedido: Pedido, cliente: dict = Depends(get_curr
                 "monto_abonado": total_abonado_inicial,
                 "saldo_pendiente": saldo_pendiente_inicial,
                 "estado": "pendiente" if saldo_pendiente_inicial > 0.01 else "pagada",
-                "historial_abonos": historial_abonos_inicial,
-                "datos_completos": {
-                    "pedido": pedido_dict
-                }
+                "historial_abonos": historial_abonos_inicial
             }
+            # Copia del pedido como snapshot compacto (comprimido, referenciado por pedido_id)
+            factura_dict[CAMPO_SNAPSHOT] = compactar_snapshot({"pedido": pedido_dict}, factura_dict, pedido_id)
             
             # Insertar la factura
             factura_result = facturas_cliente_collection.insert_one(factura_dict)
@@ -8406,6 +8509,7 @@ async def create_pedido_cliente(pedido: Pedido, cliente: dict = Depends(get_curr
             print(f"TRACEBACK: {traceback.format_exc()}")
             # No interrumpimos el flujo, solo logueamos el error
         
+        publicar_evento("pedidos", pedido_id=pedido_id, accion="creado")
         return {
             "message": "Pedido creado exitosamente",
             "pedido_id": pedido_id
@@ -8441,6 +8545,8 @@ async def get_pedidos_web():
             "pago": 1,
             "historial_pagos": 1,
             "total_abonado": 1,
+            "monto_total": 1,
+            "saldo_pendiente": 1,
             "tipo": 1,
             "tipo_pedido": 1,
             "creado_por": 1
@@ -8504,6 +8610,8 @@ async def get_pedidos_cliente(cliente_id: str, cliente: dict = Depends(get_curre
             "pago": 1,
             "historial_pagos": 1,
             "total_abonado": 1,
+            "monto_total": 1,
+            "saldo_pendiente": 1,
             "tipo": 1,
             "tipo_pedido": 1,
             "creado_por": 1
@@ -8545,6 +8653,16 @@ async def get_pedidos_cliente(cliente_id: str, cliente: dict = Depends(get_curre
 # PANEL DE CONTROL LOGÍSTICO
 # ============================================================================
 
+# Los movimientos se escriben en lotes (insert_many) desde una tarea en segundo plano.
+# main.py lo inicia en startup y lo vacía en shutdown.
+movimientos_writer = BufferedWriter(
+    movimientos_logisticos_collection,
+    nombre="movimientos_logisticos",
+    max_batch=MOVIMIENTOS_BUFFER_MAX_LOTE,
+    flush_interval_ms=MOVIMIENTOS_BUFFER_INTERVALO_MS,
+    max_queue=MOVIMIENTOS_BUFFER_MAX_COLA
+)
+
 def registrar_movimiento_logistico(
     item_id: str,
     item_codigo: str,
@@ -8557,90 +8675,128 @@ def registrar_movimiento_logistico(
     empleado_id: Optional[str] = None
 ):
     """
-    Registra un movimiento de unidades en el sistema logístico
+    Registra un movimiento de unidades en el sistema logístico (escritura diferida en lote).
+    fecha_dt es el timeField de la colección time-series y meta su metaField;
+    fecha (string) se conserva para la respuesta al frontend.
     """
     try:
+        ahora = datetime.now()
         movimiento = {
+            "fecha_dt": ahora,
+            "meta": {
+                "item_codigo": item_codigo,
+                "tipo_movimiento": tipo_movimiento
+            },
             "item_id": item_id,
             "item_codigo": item_codigo,
             "item_nombre": item_nombre,
             "tipo_movimiento": tipo_movimiento,
             "cantidad": cantidad,
-            "fecha": datetime.now().isoformat(),
-            "timestamp": datetime.now().timestamp(),
+            "fecha": ahora.isoformat(),
+            "timestamp": ahora.timestamp(),
             "pedido_id": pedido_id,
             "estado_anterior": estado_anterior,
             "estado_nuevo": estado_nuevo,
             "empleado_id": empleado_id
         }
-        movimientos_logisticos_collection.insert_one(movimiento)
+        movimientos_writer.enqueue(movimiento)
     except Exception as e:
         print(f"ERROR REGISTRAR MOVIMIENTO: Error registrando movimiento: {e}")
         # No lanzar error, solo loggear para no interrumpir el flujo principal
 
+def parse_fecha_movimiento(valor: str) -> datetime:
+    """
+    Convierte una fecha ISO del query string (YYYY-MM-DD o completa) al datetime
+    naive local con el que se guarda fecha_dt en los movimientos logísticos.
+    """
+    try:
+        fecha = datetime.fromisoformat(valor.replace("Z", "+00:00"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Fecha inválida: {valor}")
+    if fecha.tzinfo is not None:
+        fecha = fecha.astimezone().replace(tzinfo=None)
+    return fecha
+
+def rango_fecha_movimiento(fecha_inicio: Optional[str], fecha_fin: Optional[str]) -> dict:
+    """Construye el filtro sobre fecha_dt a partir de fechas opcionales del query string"""
+    rango = {}
+    if fecha_inicio:
+        rango["$gte"] = parse_fecha_movimiento(fecha_inicio)
+    if fecha_fin:
+        rango["$lte"] = parse_fecha_movimiento(fecha_fin)
+    return rango
+
+@router.get("/panel-control-logistico/movimientos-buffer/")
+async def get_metricas_movimientos_buffer():
+    """
+    Métricas del buffer de escritura diferida de movimientos (pendientes, escritos, fallos)
+    """
+    return movimientos_writer.get_metricas()
+
 @router.get("/panel-control-logistico/resumen/")
 async def get_resumen_panel_control_logistico():
     """
     Resumen general del panel de control logístico con totales
     """
     try:
-        # Items en producción (estado_item < 4)
-        items_produccion = pedidos_collection.aggregate([
-            {"$unwind": "$items"},
-            {"$match": {"items.estado_item": {"$lt": 4}}},
-            {"$group": {
-                "_id": "$items.codigo",
-                "cantidad": {"$sum": "$items.cantidad"},
-                "item_nombre": {"$first": "$items.nombre"},
-                "item_descripcion": {"$first": "$items.descripcion"}
-            }}
-        ])
-        
-        total_items_produccion = sum(item["cantidad"] for item in items_produccion)
-        
-        # Items vendidos (estado_item >= 4 en pedidos facturados o completados)
-        items_vendidos = pedidos_collection.aggregate([
-            {"$unwind": "$items"},
-            {"$match": {
-                "items.estado_item": {"$gte": 4},
-                "estado_general": {"$in": ["orden4", "orden5", "orden6"]}
-            }},
-            {"$group": {
-                "_id": "$items.codigo",
-                "cantidad": {"$sum": "$items.cantidad"}
-            }}
-        ])
-        
-        total_items_vendidos = sum(item["cantidad"] for item in items_vendidos)
-        
-        # Items en inventario
-        total_items_inventario = items_collection.count_documents({"activo": True})
-        
-        # Items con existencia en 0
-        items_existencia_cero = items_collection.count_documents({
-            "$or": [
-                {"cantidad": 0},
-                {"cantidad": {"$exists": False}},
-                {"existencia": 0},
-                {"existencia": {"$exists": False}}
-            ],
-            "activo": True
-        })
+        # Las consultas son independientes: se ejecutan a la vez
+        fecha_7_dias = datetime.now() - timedelta(days=7)
+        try:
+            datos = await consultas_en_paralelo({
+                # Items en producción (estado_item < 4)
+                "produccion": lambda: list(pedidos_collection.aggregate([
+                    {"$unwind": "$items"},
+                    {"$match": {"items.estado_item": {"$lt": 4}}},
+                    {"$group": {
+                        "_id": "$items.codigo",
+                        "cantidad": {"$sum": "$items.cantidad"},
+                        "item_nombre": {"$first": "$items.nombre"},
+                        "item_descripcion": {"$first": "$items.descripcion"}
+                    }}
+                ])),
+                # Items vendidos (estado_item >= 4 en pedidos facturados o completados)
+                "vendidos": lambda: list(pedidos_collection.aggregate([
+                    {"$unwind": "$items"},
+                    {"$match": {
+                        "items.estado_item": {"$gte": 4},
+                        "estado_general": {"$in": ["orden4", "orden5", "orden6"]}
+                    }},
+                    {"$group": {
+                        "_id": "$items.codigo",
+                        "cantidad": {"$sum": "$items.cantidad"}
+                    }}
+                ])),
+                # Items en inventario
+                "inventario": lambda: items_collection.count_documents({"activo": True}),
+                # Items con existencia en 0 (conteo sobre los índices parciales de sin_existencia)
+                "existencia_cero": lambda: items_collection.count_documents({CAMPO_SIN_EXISTENCIA: True, "activo": True}),
+                "existencia_cero_sucursal2": lambda: items_collection.count_documents({CAMPO_SIN_EXISTENCIA2: True, "activo": True}),
+                # Movimientos en últimos 7 días
+                "movimientos": lambda: movimientos_logisticos_collection.count_documents({
+                    "fecha_dt": {"$gte": fecha_7_dias}
+                })
+            })
+        except ConsultaTimeout as e:
+            raise HTTPException(status_code=504, detail=f"Tiempo de espera agotado al obtener resumen: {e.nombre}")
         
-        # Movimientos en últimos 7 días
-        fecha_7_dias = (datetime.now() - timedelta(days=7)).isoformat()
-        movimientos_7_dias = movimientos_logisticos_collection.count_documents({
-            "fecha": {"$gte": fecha_7_dias}
-        })
+        total_items_produccion = sum(item["cantidad"] for item in datos["produccion"])
+        total_items_vendidos = sum(item["cantidad"] for item in datos["vendidos"])
+        total_items_inventario = datos["inventario"]
+        items_existencia_cero = datos["existencia_cero"]
+        items_existencia_cero_sucursal2 = datos["existencia_cero_sucursal2"]
+        movimientos_7_dias = datos["movimientos"]
         
         return {
             "total_items_produccion": total_items_produccion,
             "total_items_vendidos": total_items_vendidos,
             "total_items_inventario": total_items_inventario,
             "items_existencia_cero": items_existencia_cero,
+            "items_existencia_cero_sucursal2": items_existencia_cero_sucursal2,
             "movimientos_7_dias": movimientos_7_dias,
             "fecha_actualizacion": datetime.now().isoformat()
         }
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"ERROR RESUMEN PANEL: {e}")
         import traceback
@@ -8709,16 +8865,11 @@ async def get_movimientos_unidades(
         if item_id:
             query["item_id"] = item_id
         if item_codigo:
-            query["item_codigo"] = item_codigo
-        if fecha_inicio:
-            query["fecha"] = {"$gte": fecha_inicio}
-        if fecha_fin:
-            if "fecha" in query:
-                query["fecha"]["$lte"] = fecha_fin
-            else:
-                query["fecha"] = {"$lte": fecha_fin}
+            query["meta.item_codigo"] = item_codigo
+        if fecha_inicio or fecha_fin:
+            query["fecha_dt"] = rango_fecha_movimiento(fecha_inicio, fecha_fin)
         
-        movimientos = list(movimientos_logisticos_collection.find(query).sort("fecha", -1).limit(1000))
+        movimientos = list(movimientos_logisticos_collection.find(query, {"meta": 0}).sort("fecha_dt", -1).limit(1000))
         
         # Convertir ObjectId a string
         for movimiento in movimientos:
@@ -8728,6 +8879,8 @@ async def get_movimientos_unidades(
             "movimientos": movimientos,
             "total": len(movimientos)
         }
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"ERROR MOVIMIENTOS: {e}")
         import traceback
@@ -8740,12 +8893,12 @@ async def get_items_sin_movimiento():
     Items sin movimiento en los últimos 7 días
     """
     try:
-        fecha_7_dias = (datetime.now() - timedelta(days=7)).isoformat()
+        fecha_7_dias = datetime.now() - timedelta(days=7)
         
         # Obtener items que han tenido movimientos en los últimos 7 días
-        items_con_movimiento = movimientos_logisticos_collection.distinct("item_codigo", {
-            "fecha": {"$gte": fecha_7_dias}
-        })
+        items_con_movimiento = set(movimientos_logisticos_collection.distinct("meta.item_codigo", {
+            "fecha_dt": {"$gte": fecha_7_dias}
+        }))
         
         # Obtener todos los items activos
         todos_items = list(items_collection.find({"activo": True}, {"codigo": 1, "nombre": 1, "descripcion": 1, "cantidad": 1, "existencia": 1, "existencia2": 1}))
@@ -8817,13 +8970,13 @@ async def get_items_mas_movidos():
     Items más movidos en los últimos 7 días
     """
     try:
-        fecha_7_dias = (datetime.now() - timedelta(days=7)).isoformat()
+        fecha_7_dias = datetime.now() - timedelta(days=7)
         
         # Agrupar movimientos por item
         items_movidos = list(movimientos_logisticos_collection.aggregate([
-            {"$match": {"fecha": {"$gte": fecha_7_dias}}},
+            {"$match": {"fecha_dt": {"$gte": fecha_7_dias}}},
             {"$group": {
-                "_id": "$item_codigo",
+                "_id": "$meta.item_codigo",
                 "item_id": {"$first": "$item_id"},
                 "item_nombre": {"$first": "$item_nombre"},
                 "total_movimientos": {"$sum": 1},
@@ -8855,20 +9008,15 @@ async def get_items_mas_movidos():
         raise HTTPException(status_code=500, detail=f"Error al obtener items más movidos: {str(e)}")
 
 @router.get("/panel-control-logistico/items-existencia-cero/")
-async def get_items_existencia_cero():
+async def get_items_existencia_cero(
+    sucursal: Literal["sucursal1", "sucursal2"] = Query("sucursal1", description="Sucursal cuya existencia se revisa")
+):
     """
-    Items con existencia en 0
+    Items con existencia en 0 (o menor) en la sucursal indicada
     """
     try:
-        items_cero = list(items_collection.find({
-            "$or": [
-                {"cantidad": 0},
-                {"cantidad": {"$exists": False}},
-                {"existencia": 0},
-                {"existencia": {"$exists": False}}
-            ],
-            "activo": True
-        }, {
+        campo_sin_existencia = CAMPO_SIN_EXISTENCIA if sucursal == "sucursal1" else CAMPO_SIN_EXISTENCIA2
+        items_cero = list(items_collection.find({campo_sin_existencia: True, "activo": True}, {
             "codigo": 1,
             "nombre": 1,
             "descripcion": 1,
@@ -9034,54 +9182,62 @@ async def get_graficas_panel_control(
     """
     try:
         periodo_int = int(periodo)
-        fecha_inicio = (datetime.now() - timedelta(days=periodo_int)).isoformat()
-        fecha_fin = datetime.now().isoformat()
-        
-        # Movimientos por día
-        movimientos_por_dia = list(movimientos_logisticos_collection.aggregate([
-            {"$match": {"fecha": {"$gte": fecha_inicio, "$lte": fecha_fin}}},
-            {"$group": {
-                "_id": {"$substr": ["$fecha", 0, 10]},  # Extraer fecha (YYYY-MM-DD)
-                "total_movimientos": {"$sum": 1},
-                "cantidad_total": {"$sum": "$cantidad"}
-            }},
-            {"$sort": {"_id": 1}}
-        ]))
-        
-        # Items más movidos
-        items_movidos = list(movimientos_logisticos_collection.aggregate([
-            {"$match": {"fecha": {"$gte": fecha_inicio, "$lte": fecha_fin}}},
-            {"$group": {
-                "_id": "$item_codigo",
-                "item_nombre": {"$first": "$item_nombre"},
-                "total_movimientos": {"$sum": 1},
-                "cantidad_total": {"$sum": "$cantidad"}
-            }},
-            {"$sort": {"total_movimientos": -1}},
-            {"$limit": 10}
-        ]))
-        
-        # Movimientos por tipo
-        movimientos_por_tipo = list(movimientos_logisticos_collection.aggregate([
-            {"$match": {"fecha": {"$gte": fecha_inicio, "$lte": fecha_fin}}},
-            {"$group": {
-                "_id": "$tipo_movimiento",
-                "total": {"$sum": 1},
-                "cantidad_total": {"$sum": "$cantidad"}
+        ahora = datetime.now()
+        fecha_inicio_dt = ahora - timedelta(days=periodo_int)
+        fecha_inicio_anterior_dt = ahora - timedelta(days=periodo_int * 2)
+        fecha_inicio = fecha_inicio_dt.isoformat()
+        fecha_fin = ahora.isoformat()
+        
+        # Un solo recorrido de los buckets time-series (período actual + anterior):
+        # movimientos por día, items más movidos, movimientos por tipo y comparación
+        periodo_actual = {"$match": {"fecha_dt": {"$gte": fecha_inicio_dt}}}
+        resultado = list(movimientos_logisticos_collection.aggregate([
+            {"$match": {"fecha_dt": {"$gte": fecha_inicio_anterior_dt, "$lte": ahora}}},
+            {"$facet": {
+                "movimientos_por_dia": [
+                    periodo_actual,
+                    {"$group": {
+                        "_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$fecha_dt"}},
+                        "total_movimientos": {"$sum": 1},
+                        "cantidad_total": {"$sum": "$cantidad"}
+                    }},
+                    {"$sort": {"_id": 1}}
+                ],
+                "items_mas_movidos": [
+                    periodo_actual,
+                    {"$group": {
+                        "_id": "$meta.item_codigo",
+                        "item_nombre": {"$first": "$item_nombre"},
+                        "total_movimientos": {"$sum": 1},
+                        "cantidad_total": {"$sum": "$cantidad"}
+                    }},
+                    {"$sort": {"total_movimientos": -1}},
+                    {"$limit": 10}
+                ],
+                "movimientos_por_tipo": [
+                    periodo_actual,
+                    {"$group": {
+                        "_id": "$meta.tipo_movimiento",
+                        "total": {"$sum": 1},
+                        "cantidad_total": {"$sum": "$cantidad"}
+                    }}
+                ],
+                "comparacion": [
+                    {"$group": {
+                        "_id": None,
+                        "actual": {"$sum": {"$cond": [{"$gte": ["$fecha_dt", fecha_inicio_dt]}, 1, 0]}},
+                        "anterior": {"$sum": {"$cond": [{"$lt": ["$fecha_dt", fecha_inicio_dt]}, 1, 0]}}
+                    }}
+                ]
             }}
         ]))
-        
-        # Comparar con período anterior
-        fecha_inicio_anterior = (datetime.now() - timedelta(days=periodo_int * 2)).isoformat()
-        fecha_fin_anterior = fecha_inicio
-        
-        movimientos_anterior = movimientos_logisticos_collection.count_documents({
-            "fecha": {"$gte": fecha_inicio_anterior, "$lte": fecha_fin_anterior}
-        })
-        
-        movimientos_actual = movimientos_logisticos_collection.count_documents({
-            "fecha": {"$gte": fecha_inicio, "$lte": fecha_fin}
-        })
+        facetas = resultado[0] if resultado else {}
+        movimientos_por_dia = facetas.get("movimientos_por_dia", [])
+        items_movidos = facetas.get("items_mas_movidos", [])
+        movimientos_por_tipo = facetas.get("movimientos_por_tipo", [])
+        comparacion = (facetas.get("comparacion") or [{}])[0]
+        movimientos_actual = comparacion.get("actual", 0)
+        movimientos_anterior = comparacion.get("anterior", 0)
         
         variacion = ((movimientos_actual - movimientos_anterior) / movimientos_anterior * 100) if movimientos_anterior > 0 else 0
         
@@ -9118,13 +9274,7 @@ async def get_planificacion_produccion():
         }
         
         # Items urgentes (existencia <= 0)
-        items_urgentes = list(items_collection.find({
-            "$or": [
-                {"cantidad": {"$lte": 0}},
-                {"existencia": {"$lte": 0}}
-            ],
-            "activo": True
-        }, {
+        items_urgentes = list(items_collection.find({CAMPO_SIN_EXISTENCIA: True, "activo": True}, {
             "codigo": 1,
             "nombre": 1,
             "descripcion": 1,
@@ -9264,16 +9414,12 @@ async def get_asignaciones_terminadas(
         
         # Filtrar por fechas si se especifican
         if fecha_inicio or fecha_fin:
-            query["fecha"] = {}
-            if fecha_inicio:
-                query["fecha"]["$gte"] = fecha_inicio
-            if fecha_fin:
-                query["fecha"]["$lte"] = fecha_fin
+            query["fecha_dt"] = rango_fecha_movimiento(fecha_inicio, fecha_fin)
         
         # Buscar movimientos de tipo "terminar_asignacion"
-        query["tipo_movimiento"] = "terminar_asignacion"
+        query["meta.tipo_movimiento"] = "terminar_asignacion"
         
-        asignaciones = list(movimientos_logisticos_collection.find(query).sort("fecha", -1).limit(1000))
+        asignaciones = list(movimientos_logisticos_collection.find(query, {"meta": 0}).sort("fecha_dt", -1).limit(1000))
         
         # Convertir ObjectId a string y enriquecer con datos
         for asignacion in asignaciones:
@@ -9292,6 +9438,8 @@ async def get_asignaciones_terminadas(
             "total": len(asignaciones),
             "fecha_actualizacion": datetime.now().isoformat()
         }
+    except HTTPException:
+        raise
     except Exception as e:
         debug_log(f"ERROR ASIGNACIONES TERMINADAS: {e}")
         import traceback
@@ -9308,15 +9456,11 @@ async def get_empleados_items_terminados(
     """
     try:
         query = {
-            "tipo_movimiento": "terminar_asignacion"
+            "meta.tipo_movimiento": "terminar_asignacion"
         }
         
         if fecha_inicio or fecha_fin:
-            query["fecha"] = {}
-            if fecha_inicio:
-                query["fecha"]["$gte"] = fecha_inicio
-            if fecha_fin:
-                query["fecha"]["$lte"] = fecha_fin
+            query["fecha_dt"] = rango_fecha_movimiento(fecha_inicio, fecha_fin)
         
         # Agrupar por empleado
         empleados_items = list(movimientos_logisticos_collection.aggregate([
@@ -9352,6 +9496,8 @@ async def get_empleados_items_terminados(
             "total_empleados": len(empleados_items),
             "fecha_actualizacion": datetime.now().isoformat()
         }
+    except HTTPException:
+        raise
     except Exception as e:
         debug_log(f"ERROR EMPLEADOS ITEMS TERMINADOS: {e}")
         import traceback
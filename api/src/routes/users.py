@@ -3,6 +3,9 @@ from bson import ObjectId
 from ..config.mongodb import usuarios_collection
 from ..auth.auth import get_password_hash, get_current_admin_user
 from ..models.authmodels import UserAdmin
+from ..utils.jobs import JobContext, iterar_por_lotes
+from .jobs import job_runner
+from pymongo import UpdateOne
 
 router = APIRouter()
 
@@ -34,7 +37,50 @@ async def get_all_users():
         user["_id"] = str(user["_id"])
     return users
 
-@router.post("/agregar-permiso-cuentas-por-pagar", dependencies=[Depends(get_current_admin_user)])
+@job_runner.registrar("agregar_permiso_cuentas_por_pagar")
+def job_agregar_permiso_cuentas_por_pagar(ctx: JobContext):
+    """
+    Agregar el permiso 'cuentas_por_pagar' al usuario JOHE y a todos los admins, por lotes.
+    Idempotente: $addToSet no duplica el permiso.
+    """
+    permiso = "cuentas_por_pagar"
+    filtro = {"$or": [{"usuario": "JOHE"}, {"rol": "admin"}]}
+    ctx.set_total(usuarios_collection.count_documents(filtro))
+    
+    for lote in iterar_por_lotes(ctx, usuarios_collection, filtro, {"usuario": 1, "rol": 1, "permisos": 1}):
+        pendientes = [u for u in lote if permiso not in (u.get("permisos") or [])]
+        actualizados = 0
+        if pendientes:
+            actualizados = usuarios_collection.bulk_write([
+                UpdateOne({"_id": u["_id"]}, {"$addToSet": {"permisos": permiso}})
+                for u in pendientes
+            ], ordered=False).modified_count
+        ctx.guardar_progreso(
+            procesados=len(lote),
+            checkpoint={"ultimo_id": lote[-1]["_id"]},
+            usuarios_actualizados=actualizados,
+            usuarios_ya_tenian=len(lote) - len(pendientes)
+        )
+    
+    # Resumen final con los usuarios que tienen el permiso
+    usuarios_con_permiso = usuarios_collection.find(
+        {"permisos": permiso},
+        {"usuario": 1, "nombreCompleto": 1, "permisos": 1, "rol": 1}
+    )
+    return {
+        "permiso": permiso,
+        "usuarios_con_permiso": [
+            {
+                "usuario": usuario.get("usuario"),
+                "nombreCompleto": usuario.get("nombreCompleto"),
+                "rol": usuario.get("rol"),
+                "permisos": usuario.get("permisos", [])
+            }
+            for usuario in usuarios_con_permiso
+        ]
+    }
+
+@router.post("/agregar-permiso-cuentas-por-pagar", status_code=202, dependencies=[Depends(get_current_admin_user)])
 async def agregar_permiso_cuentas_por_pagar():
     """
     Endpoint específico para agregar el permiso 'cuentas_por_pagar' a usuarios.
@@ -42,61 +88,15 @@ async def agregar_permiso_cuentas_por_pagar():
     1. Usuario JOHE (específico)
     2. Todos los usuarios con rol 'admin'
     
-    Este endpoint es idempotente: no duplicará el permiso si ya existe.
+    Se ejecuta en segundo plano; consultar el progreso y el resumen en /jobs/{job_id}.
+    Es idempotente: no duplicará el permiso si ya existe.
     """
-    permiso = "cuentas_por_pagar"
-    resultados = {
-        "permiso": permiso,
-        "johe_actualizado": False,
-        "johe_ya_tenia": False,
-        "admins_actualizados": 0,
-        "admins_ya_tenian": 0,
-        "usuarios_con_permiso": []
+    job = job_runner.lanzar("agregar_permiso_cuentas_por_pagar")
+    return {
+        "message": "Asignación del permiso 'cuentas_por_pagar' en ejecución",
+        "job_id": job["job_id"],
+        "estado": job["estado"]
     }
-    
-    # 1. Agregar a usuario JOHE específico
-    resultado_johe = usuarios_collection.update_one(
-        {"usuario": "JOHE"},
-        {"$addToSet": {"permisos": permiso}}
-    )
-    
-    if resultado_johe.matched_count > 0:
-        if resultado_johe.modified_count > 0:
-            resultados["johe_actualizado"] = True
-            print(f"✅ Permiso '{permiso}' agregado al usuario JOHE")
-        else:
-            resultados["johe_ya_tenia"] = True
-            print(f"ℹ️  Usuario JOHE ya tenía el permiso '{permiso}'")
-    else:
-        print(f"⚠️  Usuario JOHE no encontrado")
-    
-    # 2. Agregar a todos los usuarios con rol 'admin'
-    resultado_admins = usuarios_collection.update_many(
-        {"rol": "admin"},
-        {"$addToSet": {"permisos": permiso}}
-    )
-    
-    resultados["admins_actualizados"] = resultado_admins.modified_count
-    resultados["admins_ya_tenian"] = resultado_admins.matched_count - resultado_admins.modified_count
-    
-    print(f"✅ {resultado_admins.modified_count} usuarios admin actualizados")
-    print(f"ℹ️  {resultado_admins.matched_count - resultado_admins.modified_count} usuarios admin ya tenían el permiso")
-    
-    # 3. Verificar usuarios con el permiso
-    usuarios_con_permiso = list(usuarios_collection.find(
-        {"permisos": {"$in": [permiso]}},
-        {"usuario": 1, "nombreCompleto": 1, "permisos": 1, "rol": 1}
-    ))
-    
-    for usuario in usuarios_con_permiso:
-        resultados["usuarios_con_permiso"].append({
-            "usuario": usuario.get("usuario"),
-            "nombreCompleto": usuario.get("nombreCompleto"),
-            "rol": usuario.get("rol"),
-            "permisos": usuario.get("permisos", [])
-        })
-    
-    return resultados
 
 @router.post("/agregar-permiso/{permiso}", dependencies=[Depends(get_current_admin_user)])
 async def agregar_permiso_a_usuarios(
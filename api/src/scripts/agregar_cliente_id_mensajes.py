@@ -0,0 +1,97 @@
+"""
+Script para agregar el campo cliente_id a los mensajes de soporte existentes.
+Los mensajes de soporte tienen pedido_id = "soporte_{cliente_id}"; desde ahora
+crear_mensaje guarda también cliente_id, y este script lo completa en los anteriores.
+La actualización se hace en el servidor (update con pipeline) y es idempotente.
+
+Ejecutar desde el directorio raíz del proyecto:
+    python api/src/scripts/agregar_cliente_id_mensajes.py
+"""
+import sys
+import os
+from pathlib import Path
+
+# Obtener el directorio raíz del proyecto (donde está este script)
+script_dir = Path(__file__).resolve().parent
+api_dir = script_dir.parent
+project_root = api_dir.parent.parent
+
+# Agregar el directorio raíz al path
+sys.path.insert(0, str(project_root))
+
+# Cargar variables de entorno
+from dotenv import load_dotenv
+env_file = project_root / '.env'
+if env_file.exists():
+    load_dotenv(env_file)
+
+from pymongo import MongoClient
+
+# Obtener MONGO_URI desde variables de entorno
+MONGO_URI = os.getenv("MONGO_URI")
+if not MONGO_URI:
+    print("❌ Error: MONGO_URI no encontrada en las variables de entorno")
+    print(f"   Buscando .env en: {env_file}")
+    sys.exit(1)
+
+# Conectar a MongoDB
+try:
+    client = MongoClient(MONGO_URI, tls=True, tlsAllowInvalidCertificates=True)
+    db = client["PROCESOS"]
+    mensajes_collection = db["mensajes"]
+    print("✅ Conectado a MongoDB")
+except Exception as e:
+    print(f"❌ Error conectando a MongoDB: {e}")
+    sys.exit(1)
+
+PREFIJO_SOPORTE = "soporte_"
+
+def agregar_cliente_id():
+    """
+    Copia el cliente_id del pedido_id a los mensajes de soporte que no lo tienen.
+    """
+    print("\n🔧 Agregando cliente_id a mensajes de soporte...")
+    print("-" * 60)
+
+    filtro = {
+        "pedido_id": {"$regex": f"^{PREFIJO_SOPORTE}"},
+        "cliente_id": {"$exists": False}
+    }
+    pendientes = mensajes_collection.count_documents(filtro)
+    print(f"📊 Mensajes de soporte sin cliente_id: {pendientes}")
+
+    if pendientes == 0:
+        print("ℹ️  No hay mensajes que actualizar.")
+        return
+
+    largo_prefijo = len(PREFIJO_SOPORTE)
+    resultado = mensajes_collection.update_many(
+        filtro,
+        [{"$set": {
+            "cliente_id": {"$substrCP": [
+                "$pedido_id",
+                largo_prefijo,
+                {"$subtract": [{"$strLenCP": "$pedido_id"}, largo_prefijo]}
+            ]}
+        }}]
+    )
+
+    # Resumen
+    print("\n" + "=" * 60)
+    print("📊 RESUMEN")
+    print("=" * 60)
+    print(f"✅ Mensajes actualizados: {resultado.modified_count}")
+
+if __name__ == "__main__":
+    try:
+        agregar_cliente_id()
+        print("\n✅ Script ejecutado correctamente!")
+        sys.exit(0)
+    except KeyboardInterrupt:
+        print("\n\n❌ Script interrumpido por el usuario.")
+        sys.exit(1)
+    except Exception as e:
+        print(f"\n❌ Error ejecutando script: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
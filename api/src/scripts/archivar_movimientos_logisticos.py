@@ -0,0 +1,101 @@
+"""
+Script para archivar movimientos logísticos antiguos.
+Copia los movimientos de MOVIMIENTOS_LOGISTICOS_TS con fecha_dt anterior a
+MOVIMIENTOS_ARCHIVO_DIAS (por defecto 180) a la colección MOVIMIENTOS_LOGISTICOS_ARCHIVO.
+
+La eliminación de la colección time-series la hace MongoDB según MOVIMIENTOS_RETENCION_DIAS
+(expireAfterSeconds), por lo que MOVIMIENTOS_ARCHIVO_DIAS debe ser menor que la retención
+y el script debe ejecutarse periodicamente (ej: cron semanal) para no perder movimientos.
+Es idempotente: los movimientos ya archivados no se duplican.
+
+Ejecutar desde el directorio raíz del proyecto:
+    python api/src/scripts/archivar_movimientos_logisticos.py
+"""
+import sys
+import os
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# Obtener el directorio raíz del proyecto (donde está este script)
+script_dir = Path(__file__).resolve().parent
+api_dir = script_dir.parent
+project_root = api_dir.parent.parent
+
+# Agregar el directorio raíz al path
+sys.path.insert(0, str(project_root))
+
+# Cargar variables de entorno
+from dotenv import load_dotenv
+env_file = project_root / '.env'
+if env_file.exists():
+    load_dotenv(env_file)
+
+from pymongo import MongoClient
+
+# Obtener MONGO_URI desde variables de entorno
+MONGO_URI = os.getenv("MONGO_URI")
+if not MONGO_URI:
+    print("❌ Error: MONGO_URI no encontrada en las variables de entorno")
+    print(f"   Buscando .env en: {env_file}")
+    sys.exit(1)
+
+MOVIMIENTOS_ARCHIVO_DIAS = int(os.getenv("MOVIMIENTOS_ARCHIVO_DIAS", "180") or 180)
+MOVIMIENTOS_RETENCION_DIAS = int(os.getenv("MOVIMIENTOS_RETENCION_DIAS", "0") or 0)
+
+# Conectar a MongoDB
+try:
+    client = MongoClient(MONGO_URI, tls=True, tlsAllowInvalidCertificates=True)
+    db = client["PROCESOS"]
+    movimientos_collection = db["MOVIMIENTOS_LOGISTICOS_TS"]
+    archivo_collection = db["MOVIMIENTOS_LOGISTICOS_ARCHIVO"]
+    print("✅ Conectado a MongoDB")
+except Exception as e:
+    print(f"❌ Error conectando a MongoDB: {e}")
+    sys.exit(1)
+
+def archivar_movimientos():
+    """
+    Copia al archivo los movimientos más antiguos que MOVIMIENTOS_ARCHIVO_DIAS con $merge.
+    """
+    if MOVIMIENTOS_RETENCION_DIAS and MOVIMIENTOS_ARCHIVO_DIAS >= MOVIMIENTOS_RETENCION_DIAS:
+        print(f"⚠️  ADVERTENCIA: MOVIMIENTOS_ARCHIVO_DIAS ({MOVIMIENTOS_ARCHIVO_DIAS}) >= MOVIMIENTOS_RETENCION_DIAS ({MOVIMIENTOS_RETENCION_DIAS}).")
+        print("   Los movimientos expiran antes de ser archivados.")
+    
+    fecha_corte = datetime.now() - timedelta(days=MOVIMIENTOS_ARCHIVO_DIAS)
+    print(f"\n🔧 Archivando movimientos anteriores a {fecha_corte.isoformat()}...")
+    print("-" * 60)
+    
+    total_antes = archivo_collection.count_documents({})
+    
+    movimientos_collection.aggregate([
+        {"$match": {"fecha_dt": {"$lt": fecha_corte}}},
+        {"$merge": {
+            "into": "MOVIMIENTOS_LOGISTICOS_ARCHIVO",
+            "on": "_id",
+            "whenMatched": "keepExisting",
+            "whenNotMatched": "insert"
+        }}
+    ])
+    
+    total_despues = archivo_collection.count_documents({})
+    
+    # Resumen
+    print("\n" + "=" * 60)
+    print("📊 RESUMEN DE ARCHIVO")
+    print("=" * 60)
+    print(f"✅ Movimientos archivados en esta ejecución: {total_despues - total_antes}")
+    print(f"📦 Total en MOVIMIENTOS_LOGISTICOS_ARCHIVO: {total_despues}")
+
+if __name__ == "__main__":
+    try:
+        archivar_movimientos()
+        print("\n✅ Script ejecutado correctamente!")
+        sys.exit(0)
+    except KeyboardInterrupt:
+        print("\n\n❌ Script interrumpido por el usuario.")
+        sys.exit(1)
+    except Exception as e:
+        print(f"\n❌ Error ejecutando script: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
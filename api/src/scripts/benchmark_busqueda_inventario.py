@@ -0,0 +1,142 @@
+"""
+Benchmark del buscador de inventario (utils/busqueda.py) con un inventario sintético.
+Genera ITEMS_BENCHMARK items (por defecto 50.000) con códigos, nombres, descripciones,
+marcas y departamentos parecidos a los reales y mide:
+- Tiempo de construcción del índice en memoria
+- Latencia de búsqueda (prefijos mientras se escribe, varias palabras, código exacto, tipeos)
+- La misma consulta con el método anterior: $or de cinco regex sin anclar evaluado sobre
+  todos los documentos (equivale al recorrido completo de la colección, sin contar la red)
+
+No necesita MongoDB. Ejecutar desde el directorio raíz del proyecto:
+    python api/src/scripts/benchmark_busqueda_inventario.py
+"""
+import sys
+import os
+import random
+import re
+import time
+from pathlib import Path
+
+# Obtener el directorio raíz del proyecto (donde está este script)
+script_dir = Path(__file__).resolve().parent
+api_dir = script_dir.parent
+project_root = api_dir.parent.parent
+
+# Agregar el directorio raíz y api/ al path (para importar src.utils)
+sys.path.insert(0, str(project_root))
+sys.path.insert(0, str(api_dir.parent))
+
+from src.utils.busqueda import IndiceBusqueda
+
+ITEMS_BENCHMARK = int(os.getenv("ITEMS_BENCHMARK", "50000"))
+REPETICIONES = 20
+CAMPOS_BUSQUEDA = {"codigo": 3.0, "nombre": 2.0, "descripcion": 1.5, "marca": 1.0, "departamento": 1.0}
+
+TIPOS = ["Puerta", "Ventana", "Marco", "Reja", "Portón", "Cerradura", "Bisagra", "Manilla", "Vidrio", "Closet"]
+MATERIALES = ["Madera", "Hierro", "Aluminio", "Caoba", "Cedro", "Pino", "Acero", "PVC", "Vidrio templado"]
+ACABADOS = ["natural", "lacado", "pintado", "entamborado", "macizo", "corredizo", "batiente", "doble hoja"]
+MARCAS = ["Tu Mundo", "Cisa", "Yale", "Stanley", "Phillips", "Genérica", "Fermetal", "Alutec"]
+DEPARTAMENTOS = ["Carpintería", "Herrería", "Ferretería", "Vidriería", "Accesorios", "Pintura"]
+
+CONSULTAS = [
+    ("prefijo corto", "pu"),
+    ("prefijo", "puert"),
+    ("palabra completa", "ventana"),
+    ("varias palabras", "puerta caoba 90"),
+    ("acentos", "porton hierro"),
+    ("código exacto", None),  # se completa con un código existente
+    ("tipeo", "ventnaa aluminio"),
+    ("sin resultados", "zzzzzz"),
+]
+
+
+def generar_items(cantidad: int, semilla: int = 42) -> list:
+    aleatorio = random.Random(semilla)
+    items = []
+    for numero in range(cantidad, 0, -1):
+        tipo = aleatorio.choice(TIPOS)
+        material = aleatorio.choice(MATERIALES)
+        medida = f"{aleatorio.choice([60, 70, 80, 90, 100, 120])}x{aleatorio.choice([200, 210, 220])}"
+        items.append({
+            "_id": numero,
+            "codigo": f"ITEM-{numero:05d}",
+            "nombre": f"{tipo} {material} {medida}",
+            "descripcion": f"{tipo} de {material.lower()} {aleatorio.choice(ACABADOS)} {medida} cm",
+            "marca": aleatorio.choice(MARCAS),
+            "departamento": aleatorio.choice(DEPARTAMENTOS)
+        })
+    return items
+
+
+def buscar_regex(items: list, consulta: str, limite: int) -> list:
+    """Búsqueda anterior: $or de regex sin anclar, case-insensitive, sobre cinco campos"""
+    patron = re.compile(consulta, re.IGNORECASE)
+    resultados = []
+    for item in items:
+        if any(patron.search(str(item.get(campo) or "")) for campo in CAMPOS_BUSQUEDA):
+            resultados.append(item["_id"])
+            if len(resultados) >= limite:
+                break
+    return resultados
+
+
+def contar_regex(items: list, consulta: str) -> int:
+    patron = re.compile(consulta, re.IGNORECASE)
+    return sum(1 for item in items if any(patron.search(str(item.get(campo) or "")) for campo in CAMPOS_BUSQUEDA))
+
+
+def medir(funcion, repeticiones: int = REPETICIONES) -> float:
+    """Milisegundos promedio por llamada"""
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        funcion()
+    return (time.perf_counter() - inicio) * 1000 / repeticiones
+
+
+def benchmark_busqueda_inventario():
+    print(f"\n🔧 Generando {ITEMS_BENCHMARK} items sintéticos...")
+    items = generar_items(ITEMS_BENCHMARK)
+
+    inicio = time.perf_counter()
+    indice = IndiceBusqueda(items, CAMPOS_BUSQUEDA)
+    construccion = time.perf_counter() - inicio
+    print(f"✅ Índice construido en {construccion:.2f}s ({len(indice.vocabulario)} términos)")
+
+    print("\n" + "=" * 96)
+    print(f"{'Consulta':<18} {'Texto':<20} {'Total':>7} {'Índice (ms)':>12} {'Regex, 10 (ms)':>15} {'Regex, total (ms)':>18}")
+    print("=" * 96)
+    codigo_ejemplo = items[len(items) // 2]["codigo"]
+    for nombre, consulta in CONSULTAS:
+        consulta = consulta or codigo_ejemplo
+        ids, total = indice.buscar(consulta, 10)
+        ms_indice = medir(lambda: indice.buscar(consulta, 10))
+        # La búsqueda anterior no contaba el total; con pocas coincidencias recorre toda la colección
+        ms_regex = medir(lambda: buscar_regex(items, consulta, 10), 3)
+        ms_regex_total = medir(lambda: contar_regex(items, consulta), 1)
+        print(f"{nombre:<18} {consulta:<20} {total:>7} {ms_indice:>12.2f} {ms_regex:>15.2f} {ms_regex_total:>18.2f}")
+        if nombre == "código exacto" and (not ids or ids[0] != items[len(items) // 2]["_id"]):
+            print(f"⚠️  El código exacto {consulta} no quedó en el primer lugar")
+
+    # Resumen
+    print("\n" + "=" * 60)
+    print("📊 RESUMEN")
+    print("=" * 60)
+    print(f"Items: {ITEMS_BENCHMARK}")
+    print(f"Construcción del índice: {construccion:.2f}s")
+    print("La búsqueda con regex no encuentra 'ventnaa' (tipeo) ni 'porton' sin acento;")
+    print("el índice sí, y ordena por relevancia en lugar del orden natural de la colección.")
+
+
+if __name__ == "__main__":
+    try:
+        benchmark_busqueda_inventario()
+        print("\n✅ Script ejecutado correctamente!")
+        sys.exit(0)
+    except KeyboardInterrupt:
+        print("\n\n❌ Script interrumpido por el usuario.")
+        sys.exit(1)
+    except Exception as e:
+        print(f"\n❌ Error ejecutando script: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
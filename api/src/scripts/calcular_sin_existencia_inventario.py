@@ -0,0 +1,102 @@
+"""
+Script para calcular sin_existencia y sin_existencia2 en los items existentes del inventario.
+Los conteos y listados de items sin existencia (panel de control logístico, planificación)
+filtran por esas banderas con índices parciales; cada escritura de existencias las mantiene
+(utils/inventario.py), pero los items anteriores no las tienen hasta ejecutar este script.
+Se puede ejecutar varias veces.
+
+Ejecutar desde el directorio raíz del proyecto:
+    python api/src/scripts/calcular_sin_existencia_inventario.py
+"""
+import sys
+import os
+from pathlib import Path
+
+# Obtener el directorio raíz del proyecto (donde está este script)
+script_dir = Path(__file__).resolve().parent
+api_dir = script_dir.parent
+project_root = api_dir.parent.parent
+
+# Agregar el directorio raíz al path
+sys.path.insert(0, str(project_root))
+
+# Cargar variables de entorno
+from dotenv import load_dotenv
+env_file = project_root / '.env'
+if env_file.exists():
+    load_dotenv(env_file)
+
+from pymongo import MongoClient
+
+# Obtener MONGO_URI desde variables de entorno
+MONGO_URI = os.getenv("MONGO_URI")
+if not MONGO_URI:
+    print("❌ Error: MONGO_URI no encontrada en las variables de entorno")
+    print(f"   Buscando .env en: {env_file}")
+    sys.exit(1)
+
+# Misma etapa que ETAPA_SIN_EXISTENCIA en utils/inventario.py
+ETAPA_SIN_EXISTENCIA = {"$set": {
+    "sin_existencia": {"$lte": [{"$cond": [
+        {"$ne": [{"$ifNull": ["$cantidad", 0]}, 0]},
+        "$cantidad",
+        {"$ifNull": ["$existencia", 0]}
+    ]}, 0]},
+    "sin_existencia2": {"$lte": [{"$ifNull": ["$existencia2", 0]}, 0]}
+}}
+
+# Conectar a MongoDB
+try:
+    client = MongoClient(MONGO_URI, tls=True, tlsAllowInvalidCertificates=True)
+    db = client["PROCESOS"]
+    items_collection = db["INVENTARIO"]
+    print("✅ Conectado a MongoDB")
+except Exception as e:
+    print(f"❌ Error conectando a MongoDB: {e}")
+    sys.exit(1)
+
+def calcular_sin_existencia_inventario():
+    """
+    Recalcula las banderas de existencia de todos los items con un update_many de pipeline
+    (se evalúa en el servidor, sin traer los documentos).
+    """
+    print("\n🔧 Calculando banderas de existencia del inventario...")
+    print("-" * 60)
+
+    total = items_collection.count_documents({})
+    print(f"📊 Total de items: {total}")
+
+    resultado = items_collection.update_many({}, [ETAPA_SIN_EXISTENCIA])
+
+    # Resumen
+    print("\n" + "=" * 60)
+    print("📊 RESUMEN")
+    print("=" * 60)
+    print(f"✅ Items actualizados: {resultado.modified_count}")
+    print(f"📦 Sin existencia en sucursal1: {items_collection.count_documents({'sin_existencia': True})}")
+    print(f"📦 Sin existencia en sucursal2: {items_collection.count_documents({'sin_existencia2': True})}")
+
+if __name__ == "__main__":
+    try:
+        # Confirmación antes de ejecutar
+        print("\n" + "=" * 60)
+        print("⚠️  BANDERAS DE EXISTENCIA DEL INVENTARIO - CONFIRMACIÓN")
+        print("=" * 60)
+        print("Este script agregará sin_existencia y sin_existencia2 a todos los items del inventario.")
+        respuesta = input("\n¿Deseas continuar? (s/n): ").strip().lower()
+
+        if respuesta not in ['s', 'si', 'sí', 'y', 'yes']:
+            print("❌ Migración cancelada por el usuario.")
+            sys.exit(0)
+
+        calcular_sin_existencia_inventario()
+        print("\n✅ Script ejecutado correctamente!")
+        sys.exit(0)
+    except KeyboardInterrupt:
+        print("\n\n❌ Script interrumpido por el usuario.")
+        sys.exit(1)
+    except Exception as e:
+        print(f"\n❌ Error ejecutando script: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
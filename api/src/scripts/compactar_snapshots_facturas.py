@@ -0,0 +1,169 @@
+"""
+Script para compactar los respaldos datos_completos guardados en facturas_confirmadas,
+pedidos_cargados_inventario y facturas_cliente.
+Cada documento con datos_completos pasa a tener datos_completos_snapshot
+(ver utils/snapshots.py): referencia al pedido, campos congelados y el resto comprimido.
+
+Antes de escribir se verifica que el snapshot reconstruye exactamente el datos_completos
+original (cuando el resto se guarda comprimido). El script es idempotente: solo procesa
+documentos que todavía tienen datos_completos.
+Al terminar conviene ejecutar "compact" sobre las colecciones para liberar el espacio.
+
+Ejecutar desde el directorio raíz del proyecto:
+    python api/src/scripts/compactar_snapshots_facturas.py
+"""
+import sys
+import os
+from pathlib import Path
+
+# Obtener el directorio raíz del proyecto (donde está este script)
+script_dir = Path(__file__).resolve().parent
+api_dir = script_dir.parent
+project_root = api_dir.parent.parent
+
+# Agregar el directorio raíz y api/ al path (para importar src.utils)
+sys.path.insert(0, str(project_root))
+sys.path.insert(0, str(api_dir.parent))
+
+# Cargar variables de entorno
+from dotenv import load_dotenv
+env_file = project_root / '.env'
+if env_file.exists():
+    load_dotenv(env_file)
+
+import bson
+from pymongo import MongoClient, UpdateOne
+
+# Obtener MONGO_URI desde variables de entorno
+MONGO_URI = os.getenv("MONGO_URI")
+if not MONGO_URI:
+    print("❌ Error: MONGO_URI no encontrada en las variables de entorno")
+    print(f"   Buscando .env en: {env_file}")
+    sys.exit(1)
+
+from src.utils.snapshots import CAMPO_SNAPSHOT, compactar_snapshot, reconstruir_datos_completos
+from src.config.config import SNAPSHOT_COMPRIMIR_RESTO
+
+# Conectar a MongoDB
+try:
+    client = MongoClient(MONGO_URI, tls=True, tlsAllowInvalidCertificates=True)
+    db = client["PROCESOS"]
+    print("✅ Conectado a MongoDB")
+except Exception as e:
+    print(f"❌ Error conectando a MongoDB: {e}")
+    sys.exit(1)
+
+TAMANO_LOTE = 200
+
+# (colección, campo con el id del pedido)
+COLECCIONES = [
+    ("facturas_confirmadas", "pedidoId"),
+    ("pedidos_cargados_inventario", "pedidoId"),
+    ("facturas_cliente", "pedido_id")
+]
+
+def compactar_coleccion(nombre: str, campo_pedido: str):
+    """
+    Reemplaza datos_completos por el snapshot compacto en una colección, por lotes.
+    """
+    collection = db[nombre]
+    filtro = {"datos_completos": {"$exists": True}}
+    total = collection.count_documents(filtro)
+    print(f"\n🔧 {nombre}: {total} documentos con datos_completos")
+
+    compactados = 0
+    errores = 0
+    bytes_antes = 0
+    bytes_despues = 0
+    ultimo_id = None
+
+    while True:
+        query = {**filtro, "_id": {"$gt": ultimo_id}} if ultimo_id else filtro
+        lote = list(collection.find(query).sort("_id", 1).limit(TAMANO_LOTE))
+        if not lote:
+            break
+        ultimo_id = lote[-1]["_id"]
+
+        operaciones = []
+        for documento in lote:
+            try:
+                datos_completos = documento.get("datos_completos") or {}
+                base = {k: v for k, v in documento.items() if k != "datos_completos"}
+                pedido_id = documento.get(campo_pedido)
+                snapshot = compactar_snapshot(datos_completos, base, str(pedido_id) if pedido_id else None)
+
+                # Verificar que la reconstrucción es exacta antes de borrar el original
+                if SNAPSHOT_COMPRIMIR_RESTO:
+                    reconstruido = reconstruir_datos_completos({**base, CAMPO_SNAPSHOT: snapshot})
+                    if reconstruido != datos_completos:
+                        print(f"  ⚠️  {documento['_id']}: la reconstrucción no coincide, omitido")
+                        errores += 1
+                        continue
+
+                bytes_antes += len(bson.encode({"datos_completos": datos_completos}))
+                bytes_despues += len(bson.encode({CAMPO_SNAPSHOT: snapshot}))
+                operaciones.append(UpdateOne(
+                    {"_id": documento["_id"]},
+                    {"$set": {CAMPO_SNAPSHOT: snapshot}, "$unset": {"datos_completos": ""}}
+                ))
+            except Exception as e:
+                print(f"  ❌ Error compactando {documento.get('_id', 'N/A')}: {e}")
+                errores += 1
+
+        if operaciones:
+            collection.bulk_write(operaciones, ordered=False)
+            compactados += len(operaciones)
+        print(f"  [{compactados}/{total}] ✅ Lote compactado")
+
+    print(f"  ✅ Compactados: {compactados}  ❌ Errores: {errores}")
+    if bytes_antes:
+        print(f"  📦 datos_completos: {bytes_antes / 1024:.1f} KB -> {bytes_despues / 1024:.1f} KB")
+    return compactados, errores
+
+def compactar_snapshots():
+    print("\n🔧 Compactando snapshots de pedidos...")
+    print("-" * 60)
+    if not SNAPSHOT_COMPRIMIR_RESTO:
+        print("ℹ️  SNAPSHOT_COMPRIMIR_RESTO=false: solo se conservan los campos congelados,")
+        print("   el resto se leerá del pedido actual.")
+
+    total_compactados = 0
+    total_errores = 0
+    for nombre, campo_pedido in COLECCIONES:
+        compactados, errores = compactar_coleccion(nombre, campo_pedido)
+        total_compactados += compactados
+        total_errores += errores
+
+    # Resumen
+    print("\n" + "=" * 60)
+    print("📊 RESUMEN DE COMPACTACIÓN")
+    print("=" * 60)
+    print(f"✅ Documentos compactados: {total_compactados}")
+    print(f"❌ Errores: {total_errores}")
+
+if __name__ == "__main__":
+    try:
+        # Confirmación antes de ejecutar
+        print("\n" + "=" * 60)
+        print("⚠️  COMPACTACIÓN DE SNAPSHOTS - CONFIRMACIÓN")
+        print("=" * 60)
+        print("Este script reemplazará datos_completos por datos_completos_snapshot en:")
+        for nombre, _ in COLECCIONES:
+            print(f"  - {nombre}")
+        respuesta = input("\n¿Deseas continuar? (s/n): ").strip().lower()
+
+        if respuesta not in ['s', 'si', 'sí', 'y', 'yes']:
+            print("❌ Compactación cancelada por el usuario.")
+            sys.exit(0)
+
+        compactar_snapshots()
+        print("\n✅ Script ejecutado correctamente!")
+        sys.exit(0)
+    except KeyboardInterrupt:
+        print("\n\n❌ Script interrumpido por el usuario.")
+        sys.exit(1)
+    except Exception as e:
+        print(f"\n❌ Error ejecutando script: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
@@ -0,0 +1,116 @@
+"""
+Script para mover las imágenes base64 del documento HOME_CONFIG a blobs.
+Banner, logo, productos y servicios guardaban la imagen como "data:image/...;base64,..."
+dentro del documento; cada una se sube al almacén configurado (HOME_IMAGENES_ALMACEN,
+ver utils/imagenes.py) y en el documento queda solo su URL y su hash.
+Los blobs se nombran por su sha256, así que el script es idempotente.
+
+Ejecutar desde el directorio raíz del proyecto:
+    python api/src/scripts/migrar_imagenes_home.py
+"""
+import sys
+import os
+import json
+from pathlib import Path
+
+# Obtener el directorio raíz del proyecto (donde está este script)
+script_dir = Path(__file__).resolve().parent
+api_dir = script_dir.parent
+project_root = api_dir.parent.parent
+
+# Agregar el directorio raíz y api/ al path (para importar src.utils)
+sys.path.insert(0, str(project_root))
+sys.path.insert(0, str(api_dir.parent))
+
+# Cargar variables de entorno
+from dotenv import load_dotenv
+env_file = project_root / '.env'
+if env_file.exists():
+    load_dotenv(env_file)
+
+from pymongo import MongoClient
+
+# Obtener MONGO_URI desde variables de entorno
+MONGO_URI = os.getenv("MONGO_URI")
+if not MONGO_URI:
+    print("❌ Error: MONGO_URI no encontrada en las variables de entorno")
+    print(f"   Buscando .env en: {env_file}")
+    sys.exit(1)
+
+from src.utils.imagenes import extraer_imagenes_config
+from src.config.config import HOME_IMAGENES_ALMACEN, HOME_IMAGENES_URL_BASE
+
+# Conectar a MongoDB
+try:
+    client = MongoClient(MONGO_URI, tls=True, tlsAllowInvalidCertificates=True)
+    db = client["PROCESOS"]
+    home_config_collection = db["HOME_CONFIG"]
+    print("✅ Conectado a MongoDB")
+except Exception as e:
+    print(f"❌ Error conectando a MongoDB: {e}")
+    sys.exit(1)
+
+def tamano_documento(documento: dict) -> int:
+    return len(json.dumps(documento, default=str))
+
+def migrar_imagenes_home():
+    """
+    Extrae las imágenes base64 de HOME_CONFIG a blobs y actualiza el documento.
+    """
+    print("\n🔧 Migrando imágenes de HOME_CONFIG a blobs...")
+    print("-" * 60)
+
+    documento = home_config_collection.find_one({})
+    if not documento:
+        print("ℹ️  No existe configuración del home.")
+        return
+
+    doc_id = documento.pop("_id")
+    bytes_antes = tamano_documento(documento)
+
+    extraidas = extraer_imagenes_config(documento)
+    if extraidas == 0:
+        print("ℹ️  El documento no tiene imágenes base64.")
+    else:
+        # Reemplazar solo las secciones que pueden tener imágenes
+        secciones = {clave: documento[clave] for clave in ("banner", "logo", "products", "servicios") if clave in documento}
+        resultado = home_config_collection.update_one({"_id": doc_id}, {"$set": secciones})
+        if resultado.matched_count == 0:
+            print("⚠️  El documento desapareció durante la migración; no se actualizó.")
+            return
+
+    bytes_despues = tamano_documento(documento)
+
+    # Resumen
+    print("\n" + "=" * 60)
+    print("📊 RESUMEN")
+    print("=" * 60)
+    print(f"✅ Imágenes extraídas: {extraidas}")
+    print(f"📦 HOME_CONFIG: {bytes_antes / 1024:.1f} KB -> {bytes_despues / 1024:.1f} KB")
+
+if __name__ == "__main__":
+    try:
+        # Confirmación antes de ejecutar
+        print("\n" + "=" * 60)
+        print("⚠️  MIGRACIÓN DE IMÁGENES DEL HOME - CONFIRMACIÓN")
+        print("=" * 60)
+        print(f"Almacén: {HOME_IMAGENES_ALMACEN}")
+        print(f"URL base de las imágenes: {HOME_IMAGENES_URL_BASE}")
+        print("Este script reemplazará las imágenes base64 de HOME_CONFIG por URLs de blobs.")
+        respuesta = input("\n¿Deseas continuar? (s/n): ").strip().lower()
+
+        if respuesta not in ['s', 'si', 'sí', 'y', 'yes']:
+            print("❌ Migración cancelada por el usuario.")
+            sys.exit(0)
+
+        migrar_imagenes_home()
+        print("\n✅ Script ejecutado correctamente!")
+        sys.exit(0)
+    except KeyboardInterrupt:
+        print("\n\n❌ Script interrumpido por el usuario.")
+        sys.exit(1)
+    except Exception as e:
+        print(f"\n❌ Error ejecutando script: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
@@ -0,0 +1,165 @@
+"""
+Script para migrar los movimientos logísticos de la colección MOVIMIENTOS_LOGISTICOS
+(fecha como string ISO) a la colección time-series MOVIMIENTOS_LOGISTICOS_TS.
+Cada documento se copia con:
+- fecha_dt: datetime real (timeField de la colección time-series)
+- meta: {item_codigo, tipo_movimiento} (metaField)
+
+La colección time-series se crea al arrancar la API (init_movimientos_logisticos_collection).
+El script es idempotente: omite los movimientos cuyo _id ya existe en la colección destino.
+
+Ejecutar desde el directorio raíz del proyecto:
+    python api/src/scripts/migrar_movimientos_logisticos_timeseries.py
+"""
+import sys
+import os
+from datetime import datetime
+from pathlib import Path
+
+# Obtener el directorio raíz del proyecto (donde está este script)
+script_dir = Path(__file__).resolve().parent
+api_dir = script_dir.parent
+project_root = api_dir.parent.parent
+
+# Agregar el directorio raíz al path
+sys.path.insert(0, str(project_root))
+
+# Cargar variables de entorno
+from dotenv import load_dotenv
+env_file = project_root / '.env'
+if env_file.exists():
+    load_dotenv(env_file)
+
+from pymongo import MongoClient
+
+# Obtener MONGO_URI desde variables de entorno
+MONGO_URI = os.getenv("MONGO_URI")
+if not MONGO_URI:
+    print("❌ Error: MONGO_URI no encontrada en las variables de entorno")
+    print(f"   Buscando .env en: {env_file}")
+    sys.exit(1)
+
+# Conectar a MongoDB
+try:
+    client = MongoClient(MONGO_URI, tls=True, tlsAllowInvalidCertificates=True)
+    db = client["PROCESOS"]
+    origen_collection = db["MOVIMIENTOS_LOGISTICOS"]
+    destino_collection = db["MOVIMIENTOS_LOGISTICOS_TS"]
+    print("✅ Conectado a MongoDB")
+except Exception as e:
+    print(f"❌ Error conectando a MongoDB: {e}")
+    sys.exit(1)
+
+TAMANO_LOTE = 1000
+
+def convertir_movimiento(movimiento):
+    """
+    Agrega fecha_dt y meta a un movimiento de la colección anterior.
+    Usa timestamp si existe; si no, interpreta el string fecha.
+    """
+    fecha_dt = None
+    if movimiento.get("timestamp"):
+        fecha_dt = datetime.fromtimestamp(movimiento["timestamp"])
+    elif movimiento.get("fecha"):
+        fecha_dt = datetime.fromisoformat(str(movimiento["fecha"]))
+    if fecha_dt is None:
+        return None
+    
+    movimiento["fecha_dt"] = fecha_dt
+    movimiento["meta"] = {
+        "item_codigo": movimiento.get("item_codigo"),
+        "tipo_movimiento": movimiento.get("tipo_movimiento")
+    }
+    return movimiento
+
+def migrar_movimientos():
+    """
+    Copia todos los movimientos de la colección anterior a la time-series en lotes.
+    """
+    print("\n🔧 Iniciando migración de movimientos logísticos...")
+    print("-" * 60)
+    
+    total_origen = origen_collection.count_documents({})
+    print(f"📊 Total de movimientos en MOVIMIENTOS_LOGISTICOS: {total_origen}")
+    
+    if total_origen == 0:
+        print("ℹ️  No hay movimientos que migrar.")
+        return
+    
+    migrados = 0
+    omitidos = 0
+    errores = 0
+    lote = []
+    
+    def insertar_lote(lote):
+        # Saltar los _id que ya se migraron en una ejecución anterior
+        ids_existentes = set(
+            doc["_id"] for doc in destino_collection.find(
+                {"_id": {"$in": [m["_id"] for m in lote]}},
+                {"_id": 1}
+            )
+        )
+        nuevos = [m for m in lote if m["_id"] not in ids_existentes]
+        if nuevos:
+            destino_collection.insert_many(nuevos, ordered=False)
+        return len(nuevos), len(lote) - len(nuevos)
+    
+    for idx, movimiento in enumerate(origen_collection.find({}).sort("_id", 1), 1):
+        try:
+            convertido = convertir_movimiento(movimiento)
+            if convertido is None:
+                print(f"  [{idx}/{total_origen}] ⚠️  Movimiento {movimiento['_id']} sin fecha, omitido")
+                errores += 1
+                continue
+            lote.append(convertido)
+        except Exception as e:
+            print(f"  [{idx}/{total_origen}] ❌ Error convirtiendo movimiento {movimiento.get('_id', 'N/A')}: {e}")
+            errores += 1
+            continue
+        
+        if len(lote) >= TAMANO_LOTE:
+            nuevos, repetidos = insertar_lote(lote)
+            migrados += nuevos
+            omitidos += repetidos
+            lote = []
+            print(f"  [{idx}/{total_origen}] ✅ Lote migrado")
+    
+    if lote:
+        nuevos, repetidos = insertar_lote(lote)
+        migrados += nuevos
+        omitidos += repetidos
+    
+    # Resumen
+    print("\n" + "=" * 60)
+    print("📊 RESUMEN DE MIGRACIÓN")
+    print("=" * 60)
+    print(f"✅ Movimientos migrados: {migrados}")
+    print(f"ℹ️  Movimientos ya existentes (omitidos): {omitidos}")
+    print(f"❌ Errores: {errores}")
+    print(f"📦 Total en MOVIMIENTOS_LOGISTICOS_TS: {destino_collection.count_documents({})}")
+
+if __name__ == "__main__":
+    try:
+        # Confirmación antes de ejecutar
+        print("\n" + "=" * 60)
+        print("⚠️  MIGRACIÓN DE MOVIMIENTOS LOGÍSTICOS - CONFIRMACIÓN")
+        print("=" * 60)
+        print("Este script copiará MOVIMIENTOS_LOGISTICOS a la colección time-series MOVIMIENTOS_LOGISTICOS_TS.")
+        print("La colección original no se modifica.")
+        respuesta = input("\n¿Deseas continuar? (s/n): ").strip().lower()
+        
+        if respuesta not in ['s', 'si', 'sí', 'y', 'yes']:
+            print("❌ Migración cancelada por el usuario.")
+            sys.exit(0)
+        
+        migrar_movimientos()
+        print("\n✅ Script ejecutado correctamente!")
+        sys.exit(0)
+    except KeyboardInterrupt:
+        print("\n\n❌ Script interrumpido por el usuario.")
+        sys.exit(1)
+    except Exception as e:
+        print(f"\n❌ Error ejecutando script: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
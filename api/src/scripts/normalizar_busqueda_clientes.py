@@ -0,0 +1,128 @@
+"""
+Script para calcular nombre_busqueda y rif_normalizado en los clientes existentes.
+/clientes/buscar busca por prefijo sobre esos campos; los clientes creados antes de
+agregarlos (o editados directamente en la base de datos) no aparecen hasta ejecutar
+este script. Recalcula todos los clientes y solo escribe los que cambiaron, así que
+se puede ejecutar varias veces.
+
+Ejecutar desde el directorio raíz del proyecto:
+    python api/src/scripts/normalizar_busqueda_clientes.py
+"""
+import sys
+import os
+from pathlib import Path
+
+# Obtener el directorio raíz del proyecto (donde está este script)
+script_dir = Path(__file__).resolve().parent
+api_dir = script_dir.parent
+project_root = api_dir.parent.parent
+
+# Agregar el directorio raíz y api/ al path (para importar src.utils)
+sys.path.insert(0, str(project_root))
+sys.path.insert(0, str(api_dir.parent))
+
+# Cargar variables de entorno
+from dotenv import load_dotenv
+env_file = project_root / '.env'
+if env_file.exists():
+    load_dotenv(env_file)
+
+from pymongo import MongoClient, UpdateOne
+
+# Obtener MONGO_URI desde variables de entorno
+MONGO_URI = os.getenv("MONGO_URI")
+if not MONGO_URI:
+    print("❌ Error: MONGO_URI no encontrada en las variables de entorno")
+    print(f"   Buscando .env en: {env_file}")
+    sys.exit(1)
+
+from src.utils.clientes import claves_busqueda_cliente
+
+LOTE = 1000
+
+# Conectar a MongoDB
+try:
+    client = MongoClient(MONGO_URI, tls=True, tlsAllowInvalidCertificates=True)
+    db = client["PROCESOS"]
+    clientes_collection = db["CLIENTES"]
+    print("✅ Conectado a MongoDB")
+except Exception as e:
+    print(f"❌ Error conectando a MongoDB: {e}")
+    sys.exit(1)
+
+def normalizar_busqueda_clientes():
+    """
+    Recalcula las claves de búsqueda de todos los clientes con bulk_write por lotes.
+    """
+    print("\n🔧 Normalizando claves de búsqueda de clientes...")
+    print("-" * 60)
+
+    proyeccion = {
+        "nombre": 1, "nombres": 1, "cliente_nombre": 1, "rif": 1, "cedula": 1,
+        "nombre_busqueda": 1, "rif_normalizado": 1
+    }
+    total = clientes_collection.count_documents({})
+    print(f"📊 Total de clientes: {total}")
+
+    revisados = 0
+    actualizados = 0
+    errores = 0
+    operaciones = []
+
+    def aplicar_lote():
+        nonlocal actualizados, errores
+        if not operaciones:
+            return
+        try:
+            actualizados += clientes_collection.bulk_write(operaciones, ordered=False).modified_count
+        except Exception as e:
+            print(f"  ❌ Error en lote: {e}")
+            errores += len(operaciones)
+        operaciones.clear()
+
+    for cliente in clientes_collection.find({}, proyeccion).sort("_id", 1):
+        revisados += 1
+        claves = claves_busqueda_cliente(cliente)
+        if any(cliente.get(campo) != valor for campo, valor in claves.items()):
+            operaciones.append(UpdateOne({"_id": cliente["_id"]}, {"$set": claves}))
+        if len(operaciones) >= LOTE:
+            aplicar_lote()
+            print(f"  [{revisados}/{total}] {actualizados} clientes actualizados")
+    aplicar_lote()
+
+    # Resumen
+    print("\n" + "=" * 60)
+    print("📊 RESUMEN")
+    print("=" * 60)
+    print(f"✅ Clientes revisados: {revisados}")
+    print(f"✅ Clientes actualizados: {actualizados}")
+    print(f"❌ Errores: {errores}")
+
+    sin_nombre = clientes_collection.count_documents({"nombre_busqueda": {"$in": [None, ""]}})
+    if sin_nombre:
+        print(f"⚠️  Clientes sin nombre (no aparecen al buscar por nombre): {sin_nombre}")
+
+if __name__ == "__main__":
+    try:
+        # Confirmación antes de ejecutar
+        print("\n" + "=" * 60)
+        print("⚠️  NORMALIZACIÓN DE BÚSQUEDA DE CLIENTES - CONFIRMACIÓN")
+        print("=" * 60)
+        print("Este script agregará nombre_busqueda y rif_normalizado a todos los clientes.")
+        respuesta = input("\n¿Deseas continuar? (s/n): ").strip().lower()
+
+        if respuesta not in ['s', 'si', 'sí', 'y', 'yes']:
+            print("❌ Migración cancelada por el usuario.")
+            sys.exit(0)
+
+        normalizar_busqueda_clientes()
+        print("\n✅ Script ejecutado correctamente!")
+        sys.exit(0)
+    except KeyboardInterrupt:
+        print("\n\n❌ Script interrumpido por el usuario.")
+        sys.exit(1)
+    except Exception as e:
+        print(f"\n❌ Error ejecutando script: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
@@ -0,0 +1,137 @@
+"""
+Script para agregar codigo_norm (código sin espacios y en mayúsculas) a los items del inventario.
+Los pedidos se resuelven contra el inventario por codigo_norm con un índice único
+(utils/inventario.py). Si varios items comparten el mismo código normalizado
+(ej: "ab-12" y "AB-12"), solo el más antiguo recibe codigo_norm y el resto se lista
+para revisarlo a mano. Los apartados (copias reservadas de un item) no llevan codigo_norm.
+Se puede ejecutar varias veces.
+
+Ejecutar desde el directorio raíz del proyecto:
+    python api/src/scripts/normalizar_codigos_inventario.py
+"""
+import sys
+import os
+from pathlib import Path
+
+# Obtener el directorio raíz del proyecto (donde está este script)
+script_dir = Path(__file__).resolve().parent
+api_dir = script_dir.parent
+project_root = api_dir.parent.parent
+
+# Agregar el directorio raíz y api/ al path (para importar src.utils)
+sys.path.insert(0, str(project_root))
+sys.path.insert(0, str(api_dir.parent))
+
+# Cargar variables de entorno
+from dotenv import load_dotenv
+env_file = project_root / '.env'
+if env_file.exists():
+    load_dotenv(env_file)
+
+from pymongo import MongoClient, UpdateOne
+
+# Obtener MONGO_URI desde variables de entorno
+MONGO_URI = os.getenv("MONGO_URI")
+if not MONGO_URI:
+    print("❌ Error: MONGO_URI no encontrada en las variables de entorno")
+    print(f"   Buscando .env en: {env_file}")
+    sys.exit(1)
+
+from src.utils.inventario import normalizar_codigo
+
+CAMPO_CODIGO_NORM = "codigo_norm"
+
+LOTE = 1000
+
+# Conectar a MongoDB
+try:
+    client = MongoClient(MONGO_URI, tls=True, tlsAllowInvalidCertificates=True)
+    db = client["PROCESOS"]
+    items_collection = db["INVENTARIO"]
+    print("✅ Conectado a MongoDB")
+except Exception as e:
+    print(f"❌ Error conectando a MongoDB: {e}")
+    sys.exit(1)
+
+def normalizar_codigos_inventario():
+    """
+    Calcula codigo_norm para todos los items (más antiguos primero) con bulk_write por lotes.
+    """
+    print("\n🔧 Normalizando códigos del inventario...")
+    print("-" * 60)
+
+    total = items_collection.count_documents({})
+    print(f"📊 Total de items: {total}")
+
+    asignados = {}  # codigo_norm -> (_id, codigo) del item que lo conserva
+    duplicados = []
+    operaciones = []
+    actualizados = 0
+    errores = 0
+
+    def aplicar_lote():
+        nonlocal actualizados, errores
+        if not operaciones:
+            return
+        try:
+            actualizados += items_collection.bulk_write(operaciones, ordered=False).modified_count
+        except Exception as e:
+            print(f"  ❌ Error en lote: {e}")
+            errores += len(operaciones)
+        operaciones.clear()
+
+    proyeccion = {"codigo": 1, "apartado": 1, CAMPO_CODIGO_NORM: 1}
+    for item in items_collection.find({}, proyeccion).sort("_id", 1):
+        codigo_norm = None if item.get("apartado") else normalizar_codigo(item.get("codigo"))
+        if codigo_norm and codigo_norm in asignados:
+            duplicados.append((codigo_norm, item["_id"], item.get("codigo"), asignados[codigo_norm]))
+            codigo_norm = None
+
+        if codigo_norm:
+            asignados[codigo_norm] = (item["_id"], item.get("codigo"))
+            if item.get(CAMPO_CODIGO_NORM) != codigo_norm:
+                operaciones.append(UpdateOne({"_id": item["_id"]}, {"$set": {CAMPO_CODIGO_NORM: codigo_norm}}))
+        elif CAMPO_CODIGO_NORM in item:
+            operaciones.append(UpdateOne({"_id": item["_id"]}, {"$unset": {CAMPO_CODIGO_NORM: ""}}))
+
+        if len(operaciones) >= LOTE:
+            aplicar_lote()
+            print(f"  {actualizados} items actualizados...")
+    aplicar_lote()
+
+    # Resumen
+    print("\n" + "=" * 60)
+    print("📊 RESUMEN")
+    print("=" * 60)
+    print(f"✅ Items con codigo_norm: {len(asignados)}")
+    print(f"✅ Items actualizados: {actualizados}")
+    print(f"❌ Errores: {errores}")
+    if duplicados:
+        print(f"\n⚠️  Items con código repetido (sin codigo_norm, revisar a mano): {len(duplicados)}")
+        for codigo_norm, item_id, codigo, (id_original, codigo_original) in duplicados:
+            print(f"   - {item_id} '{codigo}' repite '{codigo_original}' ({id_original}) -> {codigo_norm}")
+
+if __name__ == "__main__":
+    try:
+        # Confirmación antes de ejecutar
+        print("\n" + "=" * 60)
+        print("⚠️  NORMALIZACIÓN DE CÓDIGOS DE INVENTARIO - CONFIRMACIÓN")
+        print("=" * 60)
+        print("Este script agregará codigo_norm a todos los items del inventario.")
+        respuesta = input("\n¿Deseas continuar? (s/n): ").strip().lower()
+
+        if respuesta not in ['s', 'si', 'sí', 'y', 'yes']:
+            print("❌ Migración cancelada por el usuario.")
+            sys.exit(0)
+
+        normalizar_codigos_inventario()
+        print("\n✅ Script ejecutado correctamente!")
+        sys.exit(0)
+    except KeyboardInterrupt:
+        print("\n\n❌ Script interrumpido por el usuario.")
+        sys.exit(1)
+    except Exception as e:
+        print(f"\n❌ Error ejecutando script: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
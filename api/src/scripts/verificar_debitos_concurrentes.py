@@ -0,0 +1,125 @@
+"""
+Script para verificar que los débitos concurrentes de métodos de pago nunca dejan
+el saldo en negativo ni pierden transacciones.
+Lanza muchas transferencias en paralelo contra un método de prueba usando
+aplicar_movimiento_saldo (el mismo camino que /metodos-pago/{id}/transferir) y comprueba:
+- El saldo final nunca es negativo
+- Solo se aplicaron las transferencias que cabían en el saldo inicial
+- Cada débito aplicado tiene su transacción con saldo_despues y secuencia correctos
+
+Usa una base de datos de prueba aparte (PRUEBA_DB, por defecto PROCESOS_PRUEBA_CONCURRENCIA)
+que se elimina al terminar: los métodos, transacciones, checkpoints y contadores de versión
+(VERSIONES_RECURSOS) se redirigen a ella, así que no toca los datos reales.
+
+Ejecutar desde el directorio raíz del proyecto:
+    python api/src/scripts/verificar_debitos_concurrentes.py
+"""
+import sys
+import os
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+# Obtener el directorio raíz del proyecto (donde está este script)
+script_dir = Path(__file__).resolve().parent
+api_dir = script_dir.parent
+project_root = api_dir.parent.parent
+
+# Agregar el directorio raíz y api/ al path (para importar src.routes)
+sys.path.insert(0, str(project_root))
+sys.path.insert(0, str(api_dir.parent))
+
+# Cargar variables de entorno
+from dotenv import load_dotenv
+env_file = project_root / '.env'
+if env_file.exists():
+    load_dotenv(env_file)
+
+from pymongo import MongoClient
+
+# Obtener MONGO_URI desde variables de entorno
+MONGO_URI = os.getenv("MONGO_URI")
+if not MONGO_URI:
+    print("❌ Error: MONGO_URI no encontrada en las variables de entorno")
+    print(f"   Buscando .env en: {env_file}")
+    sys.exit(1)
+
+PRUEBA_DB = os.getenv("PRUEBA_DB", "PROCESOS_PRUEBA_CONCURRENCIA")
+SALDO_INICIAL = 1000.0
+MONTO_TRANSFERENCIA = 30.0
+TRANSFERENCIAS = 200
+HILOS = 32
+
+# Conectar a MongoDB
+try:
+    client = MongoClient(MONGO_URI)
+    db_prueba = client[PRUEBA_DB]
+    print(f"✅ Conectado a MongoDB (base de prueba: {PRUEBA_DB})")
+except Exception as e:
+    print(f"❌ Error conectando a MongoDB: {e}")
+    sys.exit(1)
+
+from src.routes import metodos_pago
+from src.utils import versiones
+
+# Redirigir el módulo a las colecciones de prueba
+metodos_pago.metodos_pago_collection = db_prueba["metodos_pago"]
+metodos_pago.transacciones_collection = db_prueba["transacciones"]
+metodos_pago.saldos_checkpoints_collection = db_prueba["saldos_checkpoints"]
+# aplicar_movimiento_saldo incrementa la versión de metodos_pago (ETags): también en la base de prueba
+versiones.versiones = versiones.VersionesRecursos(db_prueba["VERSIONES_RECURSOS"], versiones.VERSIONES_REFRESCO_SEGUNDOS)
+
+def verificar_debitos_concurrentes() -> bool:
+    metodos = db_prueba["metodos_pago"]
+    transacciones = db_prueba["transacciones"]
+    metodo_id = metodos.insert_one({"nombre": "PRUEBA CONCURRENCIA", "saldo": SALDO_INICIAL}).inserted_id
+
+    def transferir(_):
+        return metodos_pago.aplicar_movimiento_saldo(
+            {"_id": metodo_id, "saldo": {"$gte": MONTO_TRANSFERENCIA}},
+            -MONTO_TRANSFERENCIA,
+            {"tipo": "transferencia", "monto": MONTO_TRANSFERENCIA, "concepto": "Prueba de concurrencia"}
+        ) is not None
+
+    print(f"\n🔧 Lanzando {TRANSFERENCIAS} transferencias de {MONTO_TRANSFERENCIA} con {HILOS} hilos...")
+    with ThreadPoolExecutor(max_workers=HILOS) as executor:
+        aplicadas = sum(executor.map(transferir, range(TRANSFERENCIAS)))
+
+    metodo = metodos.find_one({"_id": metodo_id})
+    registradas = list(transacciones.find({"metodo_pago_id": str(metodo_id)}).sort("secuencia", 1))
+    esperadas = int(SALDO_INICIAL // MONTO_TRANSFERENCIA)
+    saldo_esperado = SALDO_INICIAL - esperadas * MONTO_TRANSFERENCIA
+
+    print("-" * 60)
+    print(f"   Transferencias aplicadas: {aplicadas} (esperadas: {esperadas})")
+    print(f"   Saldo final: {metodo['saldo']} (esperado: {saldo_esperado})")
+    print(f"   Transacciones registradas: {len(registradas)}")
+    print(f"   Pendientes en outbox: {len(metodo.get('transacciones_pendientes', []))}")
+
+    errores = []
+    if metodo["saldo"] < 0:
+        errores.append("el saldo quedó en negativo")
+    if aplicadas != esperadas or abs(metodo["saldo"] - saldo_esperado) > 0.001:
+        errores.append("el número de débitos aplicados no coincide con el saldo inicial")
+    if len(registradas) != aplicadas:
+        errores.append("hay débitos sin transacción registrada")
+    saldo = SALDO_INICIAL
+    for secuencia, transaccion in enumerate(registradas, start=1):
+        saldo -= MONTO_TRANSFERENCIA
+        if transaccion.get("secuencia") != secuencia or abs(transaccion.get("saldo_despues", -1) - saldo) > 0.001:
+            errores.append(f"saldo_despues/secuencia incorrectos en la transacción {transaccion['_id']}")
+            break
+
+    if errores:
+        for error in errores:
+            print(f"❌ {error}")
+        return False
+    print("✅ Los débitos concurrentes son consistentes")
+    return True
+
+if __name__ == "__main__":
+    try:
+        ok = verificar_debitos_concurrentes()
+    finally:
+        client.drop_database(PRUEBA_DB)
+        print(f"🧹 Base de prueba {PRUEBA_DB} eliminada")
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,259 @@
+"""
+Motor de búsqueda en memoria para el inventario.
+La búsqueda anterior era un $or de cinco $regex sin anclar (case-insensitive) sobre
+codigo, descripcion, nombre, departamento y marca: cada tecla recorría la colección
+completa. Ahora se mantiene un índice invertido en memoria:
+
+- Texto normalizado: minúsculas y sin acentos ("Ñandú" -> "nandu"), separado en tokens.
+- Búsqueda por prefijo de cada token (vocabulario ordenado + bisect), para buscar mientras se escribe.
+- Tolerancia a errores de tipeo: los tokens sin coincidencias se buscan en el vocabulario por
+  trigramas y se aceptan con distancia de edición pequeña.
+- Resultados ordenados por relevancia: coincidencia exacta > prefijo > tipeo, ponderada por campo
+  (el código pesa más que la descripción), y el código exacto va primero.
+
+El índice del inventario se reconstruye cuando cambia la versión del recurso "inventario"
+(utils/versiones.py, la incrementan todas las escrituras de items). Mientras se reconstruye
+en segundo plano se sigue respondiendo con el índice anterior.
+"""
+import bisect
+import threading
+import time
+import unicodedata
+import re
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# Puntaje por tipo de coincidencia de un token de la consulta
+PUNTAJE_EXACTO = 1.0
+PUNTAJE_PREFIJO = 0.7
+PUNTAJE_TIPEO = 0.4
+# Bonificación si la consulta completa es el código del item
+BONO_CODIGO_EXACTO = 10.0
+# Longitud mínima de un token para buscarlo con tolerancia a errores
+TIPEO_LONGITUD_MINIMA = 4
+# Candidatos del vocabulario (por trigramas compartidos) que se comparan con distancia de edición
+TIPEO_MAX_CANDIDATOS = 200
+
+_NO_ALFANUMERICO = re.compile(r"[^0-9a-z]+")
+
+
+def normalizar(texto) -> str:
+    """Minúsculas, sin acentos y con cualquier separador convertido en espacio"""
+    if texto is None:
+        return ""
+    texto = unicodedata.normalize("NFKD", str(texto).lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return _NO_ALFANUMERICO.sub(" ", texto).strip()
+
+
+def tokenizar(texto) -> List[str]:
+    return normalizar(texto).split()
+
+
+def trigramas(token: str) -> Set[str]:
+    relleno = f"  {token} "
+    return {relleno[i:i + 3] for i in range(len(relleno) - 2)}
+
+
+def distancia_edicion(a: str, b: str, maximo: int) -> int:
+    """Levenshtein con corte: devuelve maximo + 1 si la distancia lo supera"""
+    if abs(len(a) - len(b)) > maximo:
+        return maximo + 1
+    anterior = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        actual = [i]
+        for j, cb in enumerate(b, 1):
+            actual.append(min(anterior[j] + 1, actual[j - 1] + 1, anterior[j - 1] + (ca != cb)))
+        if min(actual) > maximo:
+            return maximo + 1
+        anterior = actual
+    return anterior[-1]
+
+
+def tipeos_permitidos(token: str) -> int:
+    return 1 if len(token) <= 6 else 2
+
+
+class IndiceBusqueda:
+    """
+    Índice invertido inmutable: se construye completo y se reemplaza (no se modifica en el lugar),
+    así las búsquedas concurrentes nunca ven un índice a medio construir.
+    campos: {campo: peso}
+    """
+
+    def __init__(self, documentos: Iterable[dict], campos: Dict[str, float], campo_codigo: str = "codigo"):
+        self.ids: List = []
+        self.codigos: Dict[str, List[int]] = {}
+        # token -> {posición del documento: peso del mejor campo donde aparece}
+        self.postings: Dict[str, Dict[int, float]] = {}
+        for documento in documentos:
+            posicion = len(self.ids)
+            self.ids.append(documento["_id"])
+            codigo = normalizar(documento.get(campo_codigo))
+            if codigo:
+                self.codigos.setdefault(codigo, []).append(posicion)
+            for campo, peso in campos.items():
+                for token in tokenizar(documento.get(campo)):
+                    pesos = self.postings.setdefault(token, {})
+                    if pesos.get(posicion, 0) < peso:
+                        pesos[posicion] = peso
+        self.vocabulario: List[str] = sorted(self.postings)
+        self.por_trigrama: Dict[str, List[str]] = {}
+        for token in self.vocabulario:
+            if len(token) >= TIPEO_LONGITUD_MINIMA - 1:
+                for trigrama in trigramas(token):
+                    self.por_trigrama.setdefault(trigrama, []).append(token)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _con_prefijo(self, prefijo: str) -> List[str]:
+        inicio = bisect.bisect_left(self.vocabulario, prefijo)
+        fin = bisect.bisect_left(self.vocabulario, prefijo + "\uffff")
+        return self.vocabulario[inicio:fin]
+
+    def _parecidos(self, token: str) -> List[str]:
+        """Tokens del vocabulario a pocos errores de tipeo (completos o como prefijo)"""
+        compartidos: Dict[str, int] = {}
+        for trigrama in trigramas(token):
+            for candidato in self.por_trigrama.get(trigrama, ()):
+                compartidos[candidato] = compartidos.get(candidato, 0) + 1
+        maximo = tipeos_permitidos(token)
+        mejores = sorted(compartidos, key=compartidos.get, reverse=True)[:TIPEO_MAX_CANDIDATOS]
+        return [
+            candidato for candidato in mejores
+            if distancia_edicion(token, candidato, maximo) <= maximo
+            or distancia_edicion(token, candidato[:len(token)], maximo) <= maximo
+        ]
+
+    def _puntajes_token(self, token: str) -> Dict[int, float]:
+        puntajes: Dict[int, float] = {}
+
+        def acumular(terminos, factor):
+            for termino in terminos:
+                for posicion, peso in self.postings[termino].items():
+                    puntaje = peso * factor
+                    if puntajes.get(posicion, 0) < puntaje:
+                        puntajes[posicion] = puntaje
+
+        terminos = self._con_prefijo(token)
+        if terminos:
+            acumular([t for t in terminos if t != token], PUNTAJE_PREFIJO)
+            if token in self.postings:
+                acumular([token], PUNTAJE_EXACTO)
+        elif len(token) >= TIPEO_LONGITUD_MINIMA:
+            acumular(self._parecidos(token), PUNTAJE_TIPEO)
+        return puntajes
+
+    def buscar(self, consulta: str, limite: int, saltar: int = 0) -> Tuple[List, int]:
+        """
+        Devuelve (ids de la página ordenados por relevancia, total de coincidencias).
+        Todos los tokens de la consulta deben coincidir (exacto, prefijo o con tipeo).
+        """
+        tokens = list(dict.fromkeys(tokenizar(consulta)))
+        if not tokens:
+            return [], 0
+
+        # Empezar por el token más selectivo para intersectar conjuntos pequeños
+        puntajes: Optional[Dict[int, float]] = None
+        for puntajes_token in sorted((self._puntajes_token(t) for t in tokens), key=len):
+            if puntajes is None:
+                puntajes = dict(puntajes_token)
+            else:
+                puntajes = {p: s + puntajes_token[p] for p, s in puntajes.items() if p in puntajes_token}
+            if not puntajes:
+                return [], 0
+
+        for posicion in self.codigos.get(" ".join(tokens), ()):
+            if posicion in puntajes:
+                puntajes[posicion] += BONO_CODIGO_EXACTO
+
+        # Empate: conservar el orden de construcción (más recientes primero)
+        ordenados = sorted(puntajes, key=lambda p: (-puntajes[p], p))
+        return [self.ids[p] for p in ordenados[saltar:saltar + limite]], len(ordenados)
+
+
+class BusquedaSincronizada:
+    """
+    Mantiene un IndiceBusqueda al día con una colección usando su contador de versión.
+    cargar() devuelve los documentos a indexar (en el orden de desempate deseado).
+    """
+
+    def __init__(self, nombre: str, cargar, campos: Dict[str, float], obtener_version, reconstruir_segundos: float):
+        self.nombre = nombre
+        self._cargar = cargar
+        self._campos = campos
+        self._obtener_version = obtener_version
+        self._reconstruir_segundos = reconstruir_segundos
+        self._indice: Optional[IndiceBusqueda] = None
+        self._version = None
+        self._ultima_reconstruccion = 0.0
+        self._duracion = 0.0
+        self._reconstruyendo = False
+        self._lock = threading.Lock()
+        # Se marca al terminar cada reconstrucción (bien o mal): la primera consulta espera en él
+        self._reconstruido = threading.Event()
+
+    def _reconstruir(self, version):
+        try:
+            inicio = time.monotonic()
+            indice = IndiceBusqueda(self._cargar(), self._campos)
+            self._duracion = time.monotonic() - inicio
+            with self._lock:
+                self._indice = indice
+                self._version = version
+            print(f"🔎 Índice de búsqueda de {self.nombre}: {len(indice)} documentos en {self._duracion:.2f}s")
+        except Exception as e:
+            print(f"⚠️  Error reconstruyendo el índice de búsqueda de {self.nombre}: {e}")
+        finally:
+            with self._lock:
+                self._reconstruyendo = False
+            self._reconstruido.set()
+
+    def _iniciar_reconstruccion(self) -> bool:
+        with self._lock:
+            if self._reconstruyendo:
+                return False
+            self._reconstruyendo = True
+            self._ultima_reconstruccion = time.monotonic()
+            self._reconstruido.clear()
+        return True
+
+    def precalentar(self):
+        """Construir el índice en segundo plano (al arrancar la aplicación)"""
+        version = self._obtener_version()
+        if self._iniciar_reconstruccion():
+            threading.Thread(target=self._reconstruir, args=(version,), name=f"busqueda-{self.nombre}", daemon=True).start()
+
+    def obtener_indice(self) -> IndiceBusqueda:
+        """
+        Índice vigente. La primera vez se construye en la llamada; después, si la versión
+        cambió, se reconstruye en segundo plano (como mucho cada reconstruir_segundos)
+        y mientras tanto se usa el anterior.
+        Bloquea (lee la versión y puede construir o esperar el índice): desde una ruta async
+        llamar con asyncio.to_thread.
+        """
+        # La versión se lee antes de cargar: una escritura durante la carga provoca otra reconstrucción
+        version = self._obtener_version()
+        if self._indice is None:
+            if self._iniciar_reconstruccion():
+                self._reconstruir(version)
+            else:
+                # Otro hilo lo está construyendo: esperar a que termine
+                self._reconstruido.wait()
+            if self._indice is None:
+                raise RuntimeError(f"No se pudo construir el índice de búsqueda de {self.nombre}")
+            return self._indice
+
+        if version != self._version and time.monotonic() - self._ultima_reconstruccion >= self._reconstruir_segundos:
+            if self._iniciar_reconstruccion():
+                threading.Thread(target=self._reconstruir, args=(version,), name=f"busqueda-{self.nombre}", daemon=True).start()
+        return self._indice
+
+    def get_metricas(self) -> dict:
+        return {
+            "documentos": len(self._indice) if self._indice else 0,
+            "terminos": len(self._indice.vocabulario) if self._indice else 0,
+            "version": self._version,
+            "reconstruyendo": self._reconstruyendo,
+            "duracion_ultima_reconstruccion": round(self._duracion, 3)
+        }
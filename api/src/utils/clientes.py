@@ -0,0 +1,33 @@
+"""
+Claves de búsqueda de clientes (campos nombre_busqueda y rif_normalizado de CLIENTES).
+/clientes busca por prefijo sobre estas claves con índices de MongoDB en lugar de $regex
+case-insensitive. Los clientes antiguos guardan el nombre en nombre, nombres o cliente_nombre
+y el documento en rif o cedula; las claves se calculan con la misma prioridad que usa /clientes/all.
+"""
+import re
+
+from .busqueda import normalizar
+
+TIPOS_RIF = "VEJGPC"
+_NO_ALFANUMERICO_RIF = re.compile(r"[^0-9A-Z]+")
+
+
+def normalizar_rif(rif) -> str:
+    """'j-12.345.678-9' -> 'J123456789'"""
+    return _NO_ALFANUMERICO_RIF.sub("", str(rif or "").upper())
+
+
+def nombre_cliente(cliente: dict) -> str:
+    return cliente.get("nombre") or cliente.get("nombres") or cliente.get("cliente_nombre") or ""
+
+
+def rif_cliente(cliente: dict) -> str:
+    return cliente.get("rif") or cliente.get("cedula") or ""
+
+
+def claves_busqueda_cliente(cliente: dict) -> dict:
+    """Campos derivados que se guardan junto al cliente en cada escritura"""
+    return {
+        "nombre_busqueda": normalizar(nombre_cliente(cliente)),
+        "rif_normalizado": normalizar_rif(rif_cliente(cliente))
+    }
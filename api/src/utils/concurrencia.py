@@ -0,0 +1,60 @@
+"""
+Consultas en paralelo para endpoints que combinan varias colecciones.
+pymongo es síncrono: cada consulta se ejecuta en un hilo (asyncio.to_thread) y se esperan
+todas a la vez, así la latencia del endpoint es la de la consulta más lenta y no la suma.
+Cada consulta tiene su propio timeout; las opcionales devuelven un valor por defecto si
+fallan o se demoran, las demás propagan el error.
+"""
+import asyncio
+import time
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+
+from ..config.config import CONSULTAS_TIMEOUT_SEGUNDOS
+
+Consulta = Union[Callable[[], Any], Tuple[Callable[[], Any], float]]
+
+
+class ConsultaTimeout(asyncio.TimeoutError):
+    """Una consulta obligatoria superó su timeout"""
+
+    def __init__(self, nombre: str, timeout: float):
+        super().__init__(f"La consulta '{nombre}' superó {timeout}s")
+        self.nombre = nombre
+        self.timeout = timeout
+
+
+async def _ejecutar(nombre: str, funcion: Callable[[], Any], timeout: float, opcionales: Dict[str, Any]):
+    inicio = time.perf_counter()
+    try:
+        # Si vence el timeout el hilo termina su consulta igual, pero ya no se espera
+        return await asyncio.wait_for(asyncio.to_thread(funcion), timeout)
+    except asyncio.TimeoutError:
+        if nombre in opcionales:
+            print(f"⚠️  Consulta '{nombre}' superó {timeout}s, se usa el valor por defecto")
+            return opcionales[nombre]
+        raise ConsultaTimeout(nombre, timeout)
+    except Exception as e:
+        if nombre in opcionales:
+            print(f"⚠️  Consulta '{nombre}' falló tras {time.perf_counter() - inicio:.2f}s ({e}), se usa el valor por defecto")
+            return opcionales[nombre]
+        raise
+
+
+async def consultas_en_paralelo(
+    consultas: Dict[str, Consulta],
+    timeout: float = CONSULTAS_TIMEOUT_SEGUNDOS,
+    opcionales: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """
+    Ejecutar varias consultas síncronas a la vez y devolver {nombre: resultado}.
+    consultas: {nombre: funcion} o {nombre: (funcion, timeout)} para un timeout propio.
+    opcionales: {nombre: valor por defecto} de las consultas que pueden fallar sin hacer fallar al resto.
+    El primer error de una consulta obligatoria se propaga (ConsultaTimeout si fue por tiempo).
+    """
+    opcionales = opcionales or {}
+    tareas = []
+    for nombre, consulta in consultas.items():
+        funcion, limite = consulta if isinstance(consulta, tuple) else (consulta, timeout)
+        tareas.append(_ejecutar(nombre, funcion, limite, opcionales))
+    resultados = await asyncio.gather(*tareas)
+    return dict(zip(consultas.keys(), resultados))
@@ -0,0 +1,14 @@
+"""
+Invalidación del listado de empleados (/empleados/all/).
+El listado se guarda en el caché en memoria (CACHE_KEY_EMPLEADOS) y su ETag sale del contador
+RECURSO_EMPLEADOS: toda escritura de empleados (routes/empleados.py y las sincronizaciones de
+routes/pedidos.py) debe llamar a invalidar_empleados() para que los clientes vean el cambio.
+"""
+from .cache import cache, CACHE_KEY_EMPLEADOS
+from .versiones import RECURSO_EMPLEADOS, incrementar_version
+
+
+def invalidar_empleados():
+    """Después de crear/editar un empleado: vaciar el caché de /all/ y cambiar su ETag"""
+    cache.delete(CACHE_KEY_EMPLEADOS)
+    incrementar_version(RECURSO_EMPLEADOS)
@@ -0,0 +1,179 @@
+"""
+Bus de eventos en proceso para notificar cambios a los clientes por Server-Sent Events.
+Los endpoints publican eventos compactos (tema + datos mínimos, ej: pedido_id/item_id)
+y cada conexión SSE recibe los de los temas a los que se suscribió, de modo que el
+frontend solo vuelve a consultar lo que cambió en lugar de hacer polling.
+
+Temas: "asignaciones", "pedidos" y "mensajes:{pedido_id}". Una suscripción a "mensajes"
+recibe los mensajes de todas las conversaciones.
+
+Opcionalmente (EVENTOS_CHANGE_STREAMS=true) los eventos se generan desde los change
+streams de MongoDB en lugar de las publicaciones locales, lo que permite varias
+instancias de la API; requiere un replica set (sirve uno local de un solo nodo).
+"""
+import asyncio
+import itertools
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Callable, Deque, List, Optional, Set
+
+# Eventos guardados para reenviar a clientes que se reconectan con Last-Event-ID
+EVENTOS_HISTORIAL = 500
+# Eventos pendientes por conexión; si un cliente no consume, se descartan los más viejos
+EVENTOS_MAX_COLA = 200
+
+
+def tema_coincide(tema: str, suscripciones: Set[str]) -> bool:
+    """'mensajes' coincide con 'mensajes:{pedido_id}'"""
+    return tema in suscripciones or tema.split(":", 1)[0] in suscripciones
+
+
+class Suscripcion:
+    def __init__(self, temas: Set[str]):
+        self.temas = temas
+        self.cola: Deque[dict] = deque(maxlen=EVENTOS_MAX_COLA)
+        self.senal = asyncio.Event()
+
+    def entregar(self, evento: dict):
+        self.cola.append(evento)
+        self.senal.set()
+
+    async def siguiente(self, timeout: float) -> List[dict]:
+        """Esperar eventos hasta timeout; devuelve [] si no llegó ninguno (para el heartbeat)"""
+        if not self.cola:
+            self.senal.clear()
+            try:
+                await asyncio.wait_for(self.senal.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        eventos = list(self.cola)
+        self.cola.clear()
+        return eventos
+
+
+class EventBus:
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._suscripciones: Set[Suscripcion] = set()
+        self._historial: Deque[dict] = deque(maxlen=EVENTOS_HISTORIAL)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        # Si los eventos vienen de change streams, las publicaciones locales se ignoran
+        self.desde_change_streams = False
+
+    def iniciar(self):
+        """Debe llamarse desde el event loop (startup)"""
+        self._loop = asyncio.get_running_loop()
+
+    def publicar(self, tema: str, datos: Optional[dict] = None):
+        """Publicar un evento desde un endpoint (no hace nada si se usan change streams)"""
+        if self.desde_change_streams:
+            return
+        self.emitir(tema, datos)
+
+    def emitir(self, tema: str, datos: Optional[dict] = None):
+        """Registrar y repartir un evento; se puede llamar desde cualquier hilo"""
+        with self._lock:
+            evento = {
+                "id": next(self._ids),
+                "tema": tema,
+                "datos": datos or {},
+                "fecha": datetime.now().isoformat()
+            }
+            self._historial.append(evento)
+        if self._loop is None:
+            return
+        try:
+            if asyncio.get_running_loop() is self._loop:
+                self._repartir(evento)
+                return
+        except RuntimeError:
+            pass
+        self._loop.call_soon_threadsafe(self._repartir, evento)
+
+    def _repartir(self, evento: dict):
+        for suscripcion in list(self._suscripciones):
+            if tema_coincide(evento["tema"], suscripcion.temas):
+                suscripcion.entregar(evento)
+
+    def suscribir(self, temas: Set[str], ultimo_id: Optional[int] = None) -> Suscripcion:
+        """Crear una suscripción; con ultimo_id se reenvían los eventos posteriores del historial"""
+        suscripcion = Suscripcion(temas)
+        if ultimo_id is not None:
+            with self._lock:
+                pendientes = [e for e in self._historial if e["id"] > ultimo_id]
+            for evento in pendientes:
+                if tema_coincide(evento["tema"], temas):
+                    suscripcion.entregar(evento)
+        self._suscripciones.add(suscripcion)
+        return suscripcion
+
+    def cancelar(self, suscripcion: Suscripcion):
+        self._suscripciones.discard(suscripcion)
+
+    def get_metricas(self) -> dict:
+        return {
+            "suscripciones": len(self._suscripciones),
+            "ultimo_evento_id": self._historial[-1]["id"] if self._historial else 0,
+            "desde_change_streams": self.desde_change_streams
+        }
+
+
+class ChangeStreamWatcher:
+    """
+    Observa una colección con change streams (en un hilo) y emite eventos en el bus.
+    convertir(change) devuelve [(tema, datos), ...] para cada cambio.
+    """
+
+    def __init__(self, bus: EventBus, collection, convertir: Callable[[dict], list], pipeline: Optional[list] = None):
+        self._bus = bus
+        self._collection = collection
+        self._convertir = convertir
+        self._pipeline = pipeline or []
+        self._stream = None
+        self._detenido = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+
+    def start(self):
+        self._hilo = threading.Thread(
+            target=self._ejecutar,
+            name=f"change-stream-{self._collection.name}",
+            daemon=True
+        )
+        self._hilo.start()
+
+    def stop(self):
+        self._detenido.set()
+        if self._stream is not None:
+            try:
+                self._stream.close()
+            except Exception:
+                pass
+
+    def _ejecutar(self):
+        token = None
+        while not self._detenido.is_set():
+            try:
+                with self._collection.watch(self._pipeline, resume_after=token) as stream:
+                    self._stream = stream
+                    for change in stream:
+                        token = stream.resume_token
+                        for tema, datos in self._convertir(change):
+                            self._bus.emitir(tema, datos)
+            except Exception as e:
+                if self._detenido.is_set():
+                    return
+                print(f"⚠️  Change stream de {self._collection.name} interrumpido: {e}")
+                # Sin replica set no hay change streams: no reintentar en bucle
+                if "replica set" in str(e).lower() or "only supported" in str(e).lower():
+                    return
+                self._detenido.wait(5)
+
+
+def publicar_evento(tema: str, **datos):
+    """Atajo para publicar en el bus de la aplicación"""
+    event_bus.publicar(tema, datos)
+
+
+event_bus = EventBus()
@@ -0,0 +1,231 @@
+"""
+Imágenes guardadas como blobs direccionados por contenido (sha256).
+La configuración del home guardaba banner, logo, productos y servicios como strings
+base64 "data:image/..." dentro del documento HOME_CONFIG; ahora cada imagen se sube
+una sola vez al almacén (R2 con el cliente de routes/files.py, o disco local para
+desarrollo y pruebas) y en el documento queda solo su URL y su hash.
+
+El nombre del blob es "{sha256}.{ext}", así que la misma imagen subida dos veces se
+guarda una sola vez y la URL nunca cambia de contenido (se puede cachear para siempre).
+
+Con HOME_IMAGENES_URL_BASE relativo (por defecto "/home/imagenes") el documento guarda la
+ruta y GET/PUT /home/config la devuelven como URL absoluta de esta API (expandir_urls_config),
+porque el frontend está en otro dominio; al guardar, las URLs absolutas propias que el
+frontend devuelve se vuelven a dejar como ruta.
+"""
+import base64
+import binascii
+import hashlib
+import mimetypes
+import os
+import re
+from typing import Iterator, Optional, Tuple
+from urllib.parse import urlsplit
+
+from ..config.config import HOME_IMAGENES_ALMACEN, HOME_IMAGENES_DIR, HOME_IMAGENES_URL_BASE
+
+# Prefijo de las claves en el bucket
+PREFIJO_CLAVE = "home"
+# Cabecera de caché de los blobs: el contenido de una URL nunca cambia
+CACHE_CONTROL_INMUTABLE = "public, max-age=31536000, immutable"
+
+PATRON_DATA_URI = re.compile(r"^data:(?P<tipo>image/[\w.+-]+);base64,(?P<datos>.+)$", re.DOTALL)
+PATRON_NOMBRE_BLOB = re.compile(r"^(?P<hash>[0-9a-f]{64})\.(?P<ext>[a-z0-9]+)$")
+
+# Campos de imagen de la configuración del home: (sección, lista dentro de la sección o None, campo)
+CAMPOS_IMAGEN_HOME = [
+    ("banner", None, "url"),
+    ("logo", None, "url"),
+    ("products", "products", "image"),
+    ("servicios", "items", "image"),
+]
+
+
+class AlmacenLocal:
+    """Blobs en disco (desarrollo y pruebas)"""
+
+    def __init__(self, directorio: str):
+        self.directorio = directorio
+
+    def _ruta(self, nombre: str) -> str:
+        return os.path.join(self.directorio, nombre)
+
+    def existe(self, nombre: str) -> bool:
+        return os.path.exists(self._ruta(nombre))
+
+    def guardar(self, nombre: str, datos: bytes, content_type: str):
+        os.makedirs(self.directorio, exist_ok=True)
+        # Escribir en un temporal y renombrar para no dejar archivos a medias
+        temporal = self._ruta(f".{nombre}.tmp")
+        with open(temporal, "wb") as archivo:
+            archivo.write(datos)
+        os.replace(temporal, self._ruta(nombre))
+
+    def abrir(self, nombre: str):
+        """Devolver (iterador de bytes, content_type) o None si no existe"""
+        if not self.existe(nombre):
+            return None
+        content_type = mimetypes.guess_type(nombre)[0] or "application/octet-stream"
+        return self._leer_por_bloques(self._ruta(nombre)), content_type
+
+    @staticmethod
+    def _leer_por_bloques(ruta: str, tamano: int = 64 * 1024):
+        with open(ruta, "rb") as archivo:
+            while True:
+                bloque = archivo.read(tamano)
+                if not bloque:
+                    return
+                yield bloque
+
+
+class AlmacenR2:
+    """Blobs en Cloudflare R2 usando el cliente S3 de routes/files.py"""
+
+    def __init__(self):
+        from ..routes.files import s3_client, R2_BUCKET
+        self.cliente = s3_client
+        self.bucket = R2_BUCKET
+
+    def _clave(self, nombre: str) -> str:
+        return f"{PREFIJO_CLAVE}/{nombre}"
+
+    def existe(self, nombre: str) -> bool:
+        try:
+            self.cliente.head_object(Bucket=self.bucket, Key=self._clave(nombre))
+            return True
+        except Exception as e:
+            codigo = getattr(e, "response", {}).get("Error", {}).get("Code")
+            if codigo in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    def guardar(self, nombre: str, datos: bytes, content_type: str):
+        self.cliente.put_object(
+            Bucket=self.bucket,
+            Key=self._clave(nombre),
+            Body=datos,
+            ContentType=content_type,
+            CacheControl=CACHE_CONTROL_INMUTABLE
+        )
+
+    def abrir(self, nombre: str):
+        try:
+            objeto = self.cliente.get_object(Bucket=self.bucket, Key=self._clave(nombre))
+        except Exception as e:
+            codigo = getattr(e, "response", {}).get("Error", {}).get("Code")
+            if codigo in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        return objeto["Body"].iter_chunks(), objeto.get("ContentType") or "application/octet-stream"
+
+
+_almacen = None
+
+def get_almacen():
+    """Almacén configurado en HOME_IMAGENES_ALMACEN ("r2" o "local")"""
+    global _almacen
+    if _almacen is None:
+        _almacen = AlmacenLocal(HOME_IMAGENES_DIR) if HOME_IMAGENES_ALMACEN == "local" else AlmacenR2()
+    return _almacen
+
+
+def es_data_uri(valor) -> bool:
+    return isinstance(valor, str) and valor.startswith("data:image")
+
+
+def decodificar_data_uri(valor: str) -> Tuple[bytes, str]:
+    coincidencia = PATRON_DATA_URI.match(valor.strip())
+    if not coincidencia:
+        raise ValueError("La imagen no es un data URI base64 válido")
+    try:
+        datos = base64.b64decode(coincidencia.group("datos"), validate=False)
+    except (binascii.Error, ValueError):
+        raise ValueError("La imagen no es un data URI base64 válido")
+    return datos, coincidencia.group("tipo")
+
+
+def guardar_imagen(datos: bytes, content_type: str) -> Tuple[str, str]:
+    """Subir la imagen si no existe todavía; devuelve (url, hash)"""
+    hash_imagen = hashlib.sha256(datos).hexdigest()
+    extension = (mimetypes.guess_extension(content_type) or ".bin").lstrip(".")
+    if extension == "jpe":
+        extension = "jpg"
+    nombre = f"{hash_imagen}.{extension}"
+    almacen = get_almacen()
+    if not almacen.existe(nombre):
+        almacen.guardar(nombre, datos, content_type)
+    return f"{HOME_IMAGENES_URL_BASE}/{nombre}", hash_imagen
+
+
+def hash_de_url(url) -> Optional[str]:
+    """Hash de una URL de blob propia (None para URLs externas)"""
+    if not isinstance(url, str) or not url.startswith(f"{HOME_IMAGENES_URL_BASE}/"):
+        return None
+    coincidencia = PATRON_NOMBRE_BLOB.match(url[len(HOME_IMAGENES_URL_BASE) + 1:])
+    return coincidencia.group("hash") if coincidencia else None
+
+
+def url_publica(url, base_api: str):
+    """URL absoluta de un blob propio guardado como ruta relativa (el resto queda igual)"""
+    if isinstance(url, str) and url.startswith("/") and hash_de_url(url):
+        return base_api.rstrip("/") + url
+    return url
+
+
+def url_guardada(url):
+    """Inversa de url_publica: la URL absoluta de un blob propio vuelve a su ruta relativa"""
+    if not isinstance(url, str) or not HOME_IMAGENES_URL_BASE.startswith("/") or url.startswith("/"):
+        return url
+    try:
+        ruta = urlsplit(url).path
+    except ValueError:
+        return url
+    return ruta if hash_de_url(ruta) else url
+
+
+def _contenedores_imagen(config: dict) -> Iterator[Tuple[dict, str]]:
+    # (diccionario, campo) de cada imagen de la configuración del home
+    for seccion, lista, campo in CAMPOS_IMAGEN_HOME:
+        valor_seccion = config.get(seccion)
+        if not isinstance(valor_seccion, dict):
+            continue
+        if lista is None:
+            yield valor_seccion, campo
+            continue
+        for elemento in valor_seccion.get(lista) or []:
+            if isinstance(elemento, dict):
+                yield elemento, campo
+
+
+def _extraer_campo(contenedor: dict, campo: str) -> int:
+    """Reemplazar un data URI por la URL del blob y actualizar '{campo}_hash'"""
+    valor = url_guardada(contenedor.get(campo))
+    extraidas = 0
+    if es_data_uri(valor):
+        datos, content_type = decodificar_data_uri(valor)
+        valor, _ = guardar_imagen(datos, content_type)
+        extraidas = 1
+    if campo in contenedor:
+        contenedor[campo] = valor
+    hash_imagen = hash_de_url(valor)
+    if hash_imagen:
+        contenedor[f"{campo}_hash"] = hash_imagen
+    else:
+        contenedor.pop(f"{campo}_hash", None)
+    return extraidas
+
+
+def extraer_imagenes_config(config: dict) -> int:
+    """
+    Subir las imágenes base64 de la configuración del home y dejar solo URL + hash.
+    Modifica config en el lugar y devuelve cuántas imágenes se extrajeron.
+    """
+    return sum(_extraer_campo(contenedor, campo) for contenedor, campo in _contenedores_imagen(config))
+
+
+def expandir_urls_config(config: dict, base_api: str) -> dict:
+    """Convertir en absolutas (con la URL de esta API) las rutas de blobs de la configuración del home"""
+    for contenedor, campo in _contenedores_imagen(config):
+        if campo in contenedor:
+            contenedor[campo] = url_publica(contenedor[campo], base_api)
+    return config
@@ -0,0 +1,361 @@
+"""
+Resolución de items de pedidos contra el inventario.
+Los pedidos guardan el código del item tal como se escribió ("ab-12 ", 12.0, "AB-12"),
+así que antes se buscaba cada item con un $regex case-insensitive anclado que no usaba
+idx_item_codigo (y ni siquiera escapaba el código). Ahora cada item del inventario guarda
+codigo_norm (sin espacios, en mayúsculas) con un índice único, y un pedido completo se
+resuelve con una sola consulta $in.
+
+Los items sin codigo_norm (anteriores al job normalizar_codigos_inventario, que se lanza al
+arrancar mientras queden items sin normalizar) se siguen encontrando como antes: por su código
+exacto o como número (12 / 12.0) en la misma consulta y, si aún falta alguno, con una segunda
+consulta case-insensitive que ignora los espacios (solo entre los items sin codigo_norm).
+
+descontar_existencias resta las existencias de un pedido con un solo bulk_write de descuentos
+condicionados ($gte), así la existencia nunca queda negativa aunque dos pedidos descuenten
+el mismo item a la vez.
+
+sin_existencia / sin_existencia2 (existencia <= 0 en sucursal1 / sucursal2) se guardan en
+cada item y se recalculan en cada escritura de existencias, para que los conteos y listados
+de items sin existencia usen índices parciales en lugar de recorrer el inventario.
+"""
+import re
+from typing import Dict, List, Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from ..config.mongodb import items_collection
+
+CAMPO_CODIGO_NORM = "codigo_norm"
+CAMPO_SIN_EXISTENCIA = "sin_existencia"
+CAMPO_SIN_EXISTENCIA2 = "sin_existencia2"
+CAMPOS_EXISTENCIA = ("cantidad", "existencia", "existencia2")
+
+# Existencia de sucursal1: "cantidad" y, si es 0 o no existe, "existencia" (la regla de /inventario/all).
+# La misma regla calcula sin_existencia, la existencia_sucursal del catálogo y su filtro en_existencia.
+EXPRESION_EXISTENCIA_SUCURSAL1 = {"$cond": [
+    {"$ne": [{"$ifNull": ["$cantidad", 0]}, 0]},
+    "$cantidad",
+    {"$ifNull": ["$existencia", 0]}
+]}
+
+# Etapa de pipeline de actualización que recalcula las banderas a partir del documento ya actualizado
+# (sucursal1 con EXPRESION_EXISTENCIA_SUCURSAL1; sucursal2 usa "existencia2")
+ETAPA_SIN_EXISTENCIA = {"$set": {
+    CAMPO_SIN_EXISTENCIA: {"$lte": [EXPRESION_EXISTENCIA_SUCURSAL1, 0]},
+    CAMPO_SIN_EXISTENCIA2: {"$lte": [{"$ifNull": ["$existencia2", 0]}, 0]}
+}}
+
+
+def existencia_sucursal1(documento: dict):
+    """EXPRESION_EXISTENCIA_SUCURSAL1 sobre un documento en memoria"""
+    cantidad = documento.get("cantidad")
+    if cantidad is not None and cantidad != 0:
+        return cantidad
+    existencia = documento.get("existencia")
+    return 0 if existencia is None else existencia
+
+
+def expresion_existencia_sucursal(sucursal: str) -> dict:
+    """Existencia de la sucursal como expresión de agregación (proyecciones del catálogo)"""
+    if sucursal == "sucursal2":
+        return {"$ifNull": ["$existencia2", 0]}
+    return EXPRESION_EXISTENCIA_SUCURSAL1
+
+
+def filtro_en_existencia(sucursal: str) -> dict:
+    """Filtro de items con existencia > 0 en la sucursal (misma regla que sin_existencia)"""
+    if sucursal == "sucursal2":
+        return {"existencia2": {"$gt": 0}}
+    return {"$or": [
+        {"cantidad": {"$gt": 0}},
+        {"cantidad": {"$in": [0, None]}, "existencia": {"$gt": 0}}
+    ]}
+
+
+# Código de item normalizado (campo codigo_norm)
+_ESPACIOS = re.compile(r"\s+")
+# "12.0" (código numérico leído de Excel o guardado como float) equivale a "12"
+_ENTERO_CON_DECIMALES = re.compile(r"^(\d+)\.0+$")
+
+
+def normalizar_codigo(codigo) -> Optional[str]:
+    """'  ab 12 ' -> 'AB12'; 12.0 -> '12'; None o vacío -> None"""
+    if codigo is None or isinstance(codigo, bool):
+        return None
+    if isinstance(codigo, float) and codigo.is_integer():
+        codigo = int(codigo)
+    normalizado = _ESPACIOS.sub("", str(codigo)).upper()
+    coincidencia = _ENTERO_CON_DECIMALES.match(normalizado)
+    if coincidencia:
+        normalizado = coincidencia.group(1)
+    return normalizado or None
+
+
+def con_codigo_norm(documento: dict) -> dict:
+    """Agregar codigo_norm a un documento de item antes de insertarlo o actualizar su código"""
+    if "codigo" in documento:
+        codigo_norm = normalizar_codigo(documento.get("codigo"))
+        if codigo_norm:
+            documento[CAMPO_CODIGO_NORM] = codigo_norm
+        else:
+            documento.pop(CAMPO_CODIGO_NORM, None)
+    return documento
+
+
+def _sin_existencia(valor) -> bool:
+    # Igual que $lte de MongoDB: un texto nunca es <= 0
+    return valor is None or (isinstance(valor, (int, float)) and valor <= 0)
+
+
+def con_sin_existencia(documento: dict) -> dict:
+    """Agregar sin_existencia/sin_existencia2 a un documento de item completo antes de insertarlo"""
+    documento[CAMPO_SIN_EXISTENCIA] = _sin_existencia(existencia_sucursal1(documento))
+    documento[CAMPO_SIN_EXISTENCIA2] = _sin_existencia(documento.get("existencia2"))
+    return documento
+
+
+def actualizar_sin_existencia(filtro: dict, session=None) -> None:
+    """Recalcular las banderas de existencia de los items que coinciden con filtro (después de un update)"""
+    items_collection.update_many(filtro, [ETAPA_SIN_EXISTENCIA], session=session)
+
+
+def corregir_sin_existencia_sucursal1() -> None:
+    """
+    Al arrancar: recalcular sin_existencia de los items marcados con la regla anterior
+    (cantidad 0 con "existencia" > 0). Usa el índice parcial de la bandera.
+    """
+    try:
+        items_collection.update_many(
+            {CAMPO_SIN_EXISTENCIA: True, "cantidad": {"$in": [0, None]}, "existencia": {"$gt": 0}},
+            [ETAPA_SIN_EXISTENCIA]
+        )
+    except Exception as e:
+        print(f"⚠️  Error recalculando sin_existencia en inventario: {e}")
+
+
+def _object_id(valor) -> Optional[ObjectId]:
+    if isinstance(valor, ObjectId):
+        return valor
+    if isinstance(valor, str) and ObjectId.is_valid(valor):
+        return ObjectId(valor)
+    return None
+
+
+def _variantes_codigo(codigo, codigo_norm: str) -> list:
+    # Código exacto y, si es numérico, también como int/float (códigos guardados desde Excel)
+    variantes = [str(codigo).strip()]
+    if codigo_norm.isdigit():
+        variantes += [codigo_norm, codigo_norm + ".0", int(codigo_norm), float(codigo_norm)]
+    return variantes
+
+
+def _regex_codigo_legado(codigo_norm: str) -> str:
+    # "AB12" -> ^\s*A\s*B\s*1\s*2\s*$ (con la opción i): mismo criterio que normalizar_codigo
+    return r"^\s*" + r"\s*".join(re.escape(caracter) for caracter in codigo_norm) + r"\s*$"
+
+
+def resolver_items_inventario(items: List[dict], proyeccion: Optional[dict] = None) -> List[Optional[dict]]:
+    """
+    Buscar en el inventario los items de un pedido con una sola consulta.
+    items: [{"codigo": ..., "id": ...}, ...] (los items del pedido tal cual)
+    Devuelve una lista alineada con items: el documento del inventario o None.
+    Prioridad: código normalizado, código de items sin backfill (exacto, numérico o sin
+    distinguir mayúsculas/espacios) y por último el id.
+    Los items "apartado" (copias reservadas para un cliente) no se consideran.
+    """
+    codigos_norm = set()
+    codigos = []
+    ids = set()
+    for item in items:
+        codigo = item.get("codigo")
+        codigo_norm = normalizar_codigo(codigo)
+        if codigo_norm:
+            codigos_norm.add(codigo_norm)
+            codigos += [variante for variante in _variantes_codigo(codigo, codigo_norm) if variante not in codigos]
+        item_id = _object_id(item.get("id"))
+        if item_id:
+            ids.add(item_id)
+
+    condiciones = []
+    if codigos_norm:
+        condiciones.append({CAMPO_CODIGO_NORM: {"$in": list(codigos_norm)}})
+        condiciones.append({"codigo": {"$in": codigos}})
+    if ids:
+        condiciones.append({"_id": {"$in": list(ids)}})
+    if not condiciones:
+        return [None] * len(items)
+
+    if proyeccion is not None:
+        proyeccion = {**proyeccion, "codigo": 1, CAMPO_CODIGO_NORM: 1}
+
+    por_codigo_norm: Dict[str, dict] = {}
+    por_codigo_legado: Dict[str, dict] = {}
+    por_id: Dict[ObjectId, dict] = {}
+
+    def registrar(documento: dict) -> None:
+        if documento.get(CAMPO_CODIGO_NORM):
+            por_codigo_norm.setdefault(documento[CAMPO_CODIGO_NORM], documento)
+        else:
+            codigo_legado = normalizar_codigo(documento.get("codigo"))
+            if codigo_legado:
+                por_codigo_legado.setdefault(codigo_legado, documento)
+        por_id[documento["_id"]] = documento
+
+    for documento in items_collection.find({"$or": condiciones, "apartado": {"$ne": True}}, proyeccion):
+        registrar(documento)
+
+    # Códigos que no aparecieron: buscarlos como antes (sin mayúsculas/espacios) entre los items
+    # que todavía no tienen codigo_norm; con el backfill completo esta consulta no se hace
+    pendientes = [
+        codigo_norm for codigo_norm in codigos_norm
+        if codigo_norm not in por_codigo_norm and codigo_norm not in por_codigo_legado
+    ]
+    if pendientes:
+        filtro_legado = {
+            "$or": [{"codigo": {"$regex": _regex_codigo_legado(codigo_norm), "$options": "i"}} for codigo_norm in pendientes],
+            CAMPO_CODIGO_NORM: {"$exists": False},
+            "apartado": {"$ne": True}
+        }
+        for documento in items_collection.find(filtro_legado, proyeccion):
+            registrar(documento)
+
+    resueltos = []
+    for item in items:
+        documento = None
+        codigo_norm = normalizar_codigo(item.get("codigo"))
+        if codigo_norm:
+            documento = por_codigo_norm.get(codigo_norm) or por_codigo_legado.get(codigo_norm)
+        if documento is None:
+            item_id = _object_id(item.get("id"))
+            if item_id:
+                documento = por_id.get(item_id)
+        resueltos.append(documento)
+    return resueltos
+
+
+def campo_existencia_sucursal(documento: dict, sucursal: str) -> str:
+    """
+    Campo de existencia del item según la sucursal: en sucursal1 el que da su existencia
+    (existencia_sucursal1), es decir "existencia" si "cantidad" es 0 o no existe.
+    """
+    if sucursal == "sucursal2":
+        return "existencia2"
+    if documento.get("cantidad") not in (0, None) or "existencia" not in documento:
+        return "cantidad"
+    return "existencia"
+
+
+def _numero(valor) -> float:
+    try:
+        return float(valor or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def descontar_existencias(lineas: List[dict], sucursal: str, session=None) -> List[dict]:
+    """
+    Restar del inventario las cantidades de un pedido en la sucursal indicada.
+    lineas: [{"idx", "codigo", "item": documento de resolver_items_inventario o None, "cantidad"}]
+    Las líneas del mismo item se agrupan en una sola operación. Si el item alcanza se aplica
+    {campo: {$gte: cantidad}} -> campo - cantidad (junto con las banderas de existencia); si no alcanza se descuenta lo que hay (queda en 0),
+    como antes. Todo va en un único bulk_write (dentro de la transacción si se pasa session).
+    Devuelve los faltantes por línea: [{"idx", "codigo", "item_id", "requerido", "disponible", "faltante"}].
+    """
+    faltantes = []
+    por_item: Dict[ObjectId, List[dict]] = {}
+    for linea in lineas:
+        item = linea.get("item")
+        if not item:
+            faltantes.append({
+                "idx": linea.get("idx"), "codigo": linea.get("codigo"), "item_id": None,
+                "requerido": linea["cantidad"], "disponible": 0.0, "faltante": linea["cantidad"]
+            })
+            continue
+        por_item.setdefault(item["_id"], []).append(linea)
+    if not por_item:
+        return faltantes
+
+    # Leer la existencia actual (dentro de la transacción es la foto sobre la que se escribe)
+    proyeccion = {"cantidad": 1, "existencia": 1, "existencia2": 1}
+    actuales = {
+        documento["_id"]: documento
+        for documento in items_collection.find({"_id": {"$in": list(por_item)}}, proyeccion, session=session)
+    }
+
+    # Sin transacción otro pedido puede descontar entre la lectura y el bulk_write: con upsert,
+    # una operación cuyo filtro ya no coincide intenta insertar un _id existente y falla con
+    # clave duplicada, lo que identifica exactamente qué item hay que volver a calcular.
+    # Dentro de una transacción un error de escritura la aborta, y el conflicto ya lo detecta MongoDB.
+    upsert = session is None
+    planes = []
+    operaciones = []
+    for item_id, lineas_item in por_item.items():
+        documento = actuales.get(item_id)
+        if documento is None:
+            for linea in lineas_item:
+                faltantes.append({
+                    "idx": linea.get("idx"), "codigo": linea.get("codigo"), "item_id": str(item_id),
+                    "requerido": linea["cantidad"], "disponible": 0.0, "faltante": linea["cantidad"]
+                })
+            continue
+        campo = campo_existencia_sucursal(documento, sucursal)
+        disponible = _numero(documento.get(campo))
+        requerido = sum(linea["cantidad"] for linea in lineas_item)
+        if requerido <= disponible:
+            filtro = {"_id": item_id, campo: {"$gte": requerido}}
+            cambio = [{"$set": {campo: {"$subtract": ["$" + campo, requerido]}}}, ETAPA_SIN_EXISTENCIA]
+        else:
+            filtro = {"_id": item_id, campo: documento.get(campo)}
+            cambio = [{"$set": {campo: 0}}, ETAPA_SIN_EXISTENCIA]
+        planes.append((item_id, campo, requerido, disponible, lineas_item))
+        operaciones.append(UpdateOne(filtro, cambio, upsert=upsert))
+
+    fallidas = set()
+    insertados = []
+    if operaciones:
+        try:
+            resultado = items_collection.bulk_write(operaciones, ordered=False, session=session)
+            insertados = list(resultado.upserted_ids.values())
+            if session is not None and resultado.matched_count < len(operaciones):
+                raise RuntimeError("La existencia cambió durante la transacción")
+        except BulkWriteError as e:
+            insertados = [upserted["_id"] for upserted in e.details.get("upserted", [])]
+            for error in e.details.get("writeErrors", []):
+                if error.get("code") != 11000:
+                    raise
+                fallidas.add(error["index"])
+    if insertados:
+        # El item se eliminó entre la lectura y el descuento: quitar el documento creado por el upsert
+        items_collection.delete_many({"_id": {"$in": insertados}})
+    insertados = set(insertados)
+
+    for indice, (item_id, campo, requerido, disponible, lineas_item) in enumerate(planes):
+        if item_id in insertados:
+            disponible = 0.0
+        elif indice in fallidas:
+            # Carrera con otro pedido: descontar de forma atómica sobre el valor actual
+            anterior = items_collection.find_one_and_update(
+                {"_id": item_id},
+                [
+                    {"$set": {campo: {"$max": [0, {"$subtract": [{"$ifNull": ["$" + campo, 0]}, requerido]}]}}},
+                    ETAPA_SIN_EXISTENCIA
+                ],
+                projection={campo: 1},
+                return_document=ReturnDocument.BEFORE
+            )
+            disponible = _numero(anterior.get(campo)) if anterior else 0.0
+        # Repartir lo disponible entre las líneas del item en orden
+        for linea in lineas_item:
+            asignado = min(linea["cantidad"], max(disponible, 0.0))
+            disponible -= asignado
+            if asignado < linea["cantidad"]:
+                faltantes.append({
+                    "idx": linea.get("idx"), "codigo": linea.get("codigo"), "item_id": str(item_id),
+                    "requerido": linea["cantidad"], "disponible": asignado,
+                    "faltante": linea["cantidad"] - asignado
+                })
+    faltantes.sort(key=lambda faltante: faltante["idx"] if faltante["idx"] is not None else -1)
+    return faltantes
@@ -0,0 +1,284 @@
+"""
+Ejecución de trabajos de mantenimiento en segundo plano.
+Cada trabajo se guarda en la colección JOBS con su estado, progreso y checkpoint,
+se ejecuta en un hilo (pymongo es síncrono) lanzado desde el event loop y procesa
+la colección por lotes ordenados por _id, de modo que puede cancelarse y reanudarse
+desde el último lote confirmado.
+"""
+import asyncio
+import traceback
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+# Estados de un trabajo
+JOB_PENDIENTE = "pendiente"
+JOB_EN_EJECUCION = "en_ejecucion"
+JOB_COMPLETADO = "completado"
+JOB_FALLIDO = "fallido"
+JOB_CANCELADO = "cancelado"
+JOB_ESTADOS_ACTIVOS = [JOB_PENDIENTE, JOB_EN_EJECUCION]
+
+# Un trabajo en ejecución sin progreso durante este tiempo se considera interrumpido
+# (proceso reiniciado) y puede ser reclamado de nuevo (al arrancar, al lanzarlo o al reanudarlo)
+JOB_LEASE = timedelta(minutes=5)
+
+# Marca de los trabajos pendientes o en ejecución: el índice único parcial idx_job_tipo_activo
+# (tipo, solo con activo: true) impide que dos lanzamientos simultáneos creen dos trabajos activos
+CAMPO_JOB_ACTIVO = "activo"
+
+
+class JobCancelado(Exception):
+    """Se lanza dentro del handler cuando se solicitó la cancelación del trabajo"""
+
+
+class JobContext:
+    """Estado de un trabajo visible para su handler (parámetros, checkpoint y progreso)"""
+
+    def __init__(self, collection, job: dict):
+        self._collection = collection
+        self.job_id = job["_id"]
+        self.parametros: Dict[str, Any] = job.get("parametros") or {}
+        self.checkpoint: Dict[str, Any] = job.get("checkpoint") or {}
+        self.resultado: Dict[str, Any] = job.get("resultado") or {}
+        self.procesados: int = (job.get("progreso") or {}).get("procesados", 0)
+
+    def set_total(self, total: int):
+        self._collection.update_one(
+            {"_id": self.job_id},
+            {"$set": {"progreso.total": total, "fecha_actualizacion": datetime.now()}}
+        )
+
+    def guardar_progreso(self, procesados: int = 0, checkpoint: Optional[dict] = None, **contadores):
+        """
+        Confirmar un lote: suma procesados y contadores al resultado y guarda el checkpoint.
+        En la misma escritura lee la bandera de cancelación; si está activa lanza JobCancelado.
+        """
+        if checkpoint:
+            self.checkpoint.update(checkpoint)
+        for clave, valor in contadores.items():
+            self.resultado[clave] = self.resultado.get(clave, 0) + valor
+        self.procesados += procesados
+
+        job = self._collection.find_one_and_update(
+            {"_id": self.job_id},
+            {"$set": {
+                "checkpoint": self.checkpoint,
+                "resultado": self.resultado,
+                "progreso.procesados": self.procesados,
+                "fecha_actualizacion": datetime.now()
+            }},
+            projection={"cancelacion_solicitada": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if job and job.get("cancelacion_solicitada"):
+            raise JobCancelado()
+
+
+def iterar_por_lotes(
+    ctx: JobContext,
+    collection,
+    filtro: dict,
+    proyeccion: Optional[dict] = None,
+    tamano_lote: int = 500
+) -> Iterator[List[dict]]:
+    """
+    Recorre los documentos que cumplen el filtro ordenados por _id, en lotes,
+    empezando después de checkpoint["ultimo_id"]. El handler debe confirmar cada lote
+    con ctx.guardar_progreso(checkpoint={"ultimo_id": lote[-1]["_id"]}, ...).
+    """
+    while True:
+        ultimo_id = ctx.checkpoint.get("ultimo_id")
+        query = {"$and": [filtro, {"_id": {"$gt": ultimo_id}}]} if ultimo_id else filtro
+        lote = list(collection.find(query, proyeccion).sort("_id", 1).limit(tamano_lote))
+        if not lote:
+            return
+        yield lote
+        if ctx.checkpoint.get("ultimo_id") == ultimo_id:
+            # El handler no avanzó el checkpoint: avanzar aquí para no repetir el lote
+            ctx.checkpoint["ultimo_id"] = lote[-1]["_id"]
+
+
+class JobRunner:
+    """Registro de handlers y lanzador de trabajos en segundo plano"""
+
+    def __init__(self, collection):
+        self._collection = collection
+        self._handlers: Dict[str, Callable[[JobContext], Optional[dict]]] = {}
+        self._tasks: set = set()
+
+    def registrar(self, tipo: str):
+        """Decorador para registrar el handler (síncrono) de un tipo de trabajo"""
+        def decorator(func: Callable[[JobContext], Optional[dict]]):
+            self._handlers[tipo] = func
+            return func
+        return decorator
+
+    def lanzar(self, tipo: str, parametros: Optional[dict] = None) -> dict:
+        """
+        Crear y lanzar un trabajo. Si ya hay uno activo del mismo tipo se devuelve ese
+        en lugar de crear otro (y se vuelve a programar si su proceso murió sin terminarlo).
+        Debe llamarse desde el event loop.
+        """
+        if tipo not in self._handlers:
+            raise ValueError(f"Tipo de trabajo desconocido: {tipo}")
+
+        activo = self._collection.find_one({"tipo": tipo, "estado": {"$in": JOB_ESTADOS_ACTIVOS}})
+        if activo:
+            return self._retomar_si_vencido(activo)
+
+        ahora = datetime.now()
+        job = {
+            "tipo": tipo,
+            "estado": JOB_PENDIENTE,
+            "parametros": parametros or {},
+            "progreso": {"procesados": 0, "total": None},
+            "checkpoint": {},
+            "resultado": {},
+            "error": None,
+            "cancelacion_solicitada": False,
+            CAMPO_JOB_ACTIVO: True,
+            "fecha_creacion": ahora,
+            "fecha_actualizacion": ahora,
+            "fecha_inicio": None,
+            "fecha_fin": None
+        }
+        try:
+            job["_id"] = self._collection.insert_one(job).inserted_id
+        except DuplicateKeyError:
+            # Otro lanzamiento simultáneo creó el trabajo activo entre la búsqueda y el insert
+            activo = self._collection.find_one({"tipo": tipo, CAMPO_JOB_ACTIVO: True})
+            if activo:
+                return self._retomar_si_vencido(activo)
+            raise
+        self._programar(job["_id"])
+        return serializar_job(job)
+
+    def _retomar_si_vencido(self, job: dict) -> dict:
+        # Activo pero sin progreso durante JOB_LEASE: el proceso que lo ejecutaba murió.
+        # _reclamar es atómico, así que programarlo de más no lo ejecuta dos veces
+        if job.get("fecha_actualizacion") and job["fecha_actualizacion"] < datetime.now() - JOB_LEASE:
+            self._programar(job["_id"])
+        return serializar_job(job)
+
+    def cancelar(self, job_id: ObjectId) -> Optional[dict]:
+        """Solicitar la cancelación; el handler se detiene al confirmar el siguiente lote"""
+        job = self._collection.find_one_and_update(
+            {"_id": job_id, "estado": {"$in": JOB_ESTADOS_ACTIVOS}},
+            {"$set": {"cancelacion_solicitada": True, "fecha_actualizacion": datetime.now()}},
+            return_document=ReturnDocument.AFTER
+        )
+        return serializar_job(job) if job else None
+
+    def reanudar(self, job_id: ObjectId) -> Optional[dict]:
+        """
+        Volver a lanzar desde su último checkpoint un trabajo fallido, cancelado o
+        interrumpido (activo sin progreso durante JOB_LEASE)
+        """
+        ahora = datetime.now()
+        try:
+            job = self._collection.find_one_and_update(
+                {"_id": job_id, "$or": [
+                    {"estado": {"$in": [JOB_FALLIDO, JOB_CANCELADO]}},
+                    {"estado": {"$in": JOB_ESTADOS_ACTIVOS}, "fecha_actualizacion": {"$lt": ahora - JOB_LEASE}}
+                ]},
+                {"$set": {
+                    "estado": JOB_PENDIENTE,
+                    "cancelacion_solicitada": False,
+                    "error": None,
+                    "fecha_fin": None,
+                    CAMPO_JOB_ACTIVO: True,
+                    "fecha_actualizacion": ahora
+                }},
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # Ya hay otro trabajo activo del mismo tipo
+            return None
+        if not job:
+            return None
+        self._programar(job["_id"])
+        return serializar_job(job)
+
+    def reanudar_interrumpidos(self):
+        """Relanzar trabajos pendientes o cuyo proceso murió en ejecución (startup)"""
+        limite = datetime.now() - JOB_LEASE
+        interrumpidos = self._collection.find({
+            "$or": [
+                {"estado": JOB_PENDIENTE},
+                {"estado": JOB_EN_EJECUCION, "fecha_actualizacion": {"$lt": limite}}
+            ]
+        }, {"_id": 1})
+        for job in interrumpidos:
+            self._programar(job["_id"])
+
+    def _programar(self, job_id: ObjectId):
+        task = asyncio.get_running_loop().create_task(self._ejecutar(job_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _reclamar(self, job_id: ObjectId) -> Optional[dict]:
+        # Reclamo atómico: evita que dos workers ejecuten el mismo trabajo
+        ahora = datetime.now()
+        return self._collection.find_one_and_update(
+            {
+                "_id": job_id,
+                "$or": [
+                    {"estado": JOB_PENDIENTE},
+                    {"estado": JOB_EN_EJECUCION, "fecha_actualizacion": {"$lt": ahora - JOB_LEASE}}
+                ]
+            },
+            {"$set": {"estado": JOB_EN_EJECUCION, "fecha_inicio": ahora, "fecha_actualizacion": ahora}},
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _ejecutar(self, job_id: ObjectId):
+        job = await asyncio.to_thread(self._reclamar, job_id)
+        if not job:
+            return
+        await asyncio.to_thread(self._ejecutar_handler, job)
+
+    def _ejecutar_handler(self, job: dict):
+        ctx = JobContext(self._collection, job)
+        handler = self._handlers.get(job["tipo"])
+        try:
+            if handler is None:
+                raise ValueError(f"Tipo de trabajo desconocido: {job['tipo']}")
+            resumen = handler(ctx) or {}
+            self._finalizar(ctx, JOB_COMPLETADO, resumen=resumen)
+            print(f"JOB {job['tipo']} {ctx.job_id}: completado ({ctx.procesados} procesados)")
+        except JobCancelado:
+            self._finalizar(ctx, JOB_CANCELADO)
+            print(f"JOB {job['tipo']} {ctx.job_id}: cancelado en {ctx.procesados} procesados")
+        except Exception as e:
+            print(f"ERROR JOB {job['tipo']} {ctx.job_id}: {e}")
+            print(f"ERROR JOB TRACEBACK: {traceback.format_exc()}")
+            self._finalizar(ctx, JOB_FALLIDO, error=str(e))
+
+    def _finalizar(self, ctx: JobContext, estado: str, resumen: Optional[dict] = None, error: Optional[str] = None):
+        ahora = datetime.now()
+        cambios = {
+            "estado": estado,
+            "error": error,
+            "fecha_fin": ahora,
+            "fecha_actualizacion": ahora
+        }
+        if resumen:
+            cambios["resumen"] = resumen
+        self._collection.update_one({"_id": ctx.job_id}, {"$set": cambios, "$unset": {CAMPO_JOB_ACTIVO: ""}})
+
+
+def serializar_job(job: dict) -> dict:
+    """Convertir un documento de JOBS a JSON (ObjectId del checkpoint incluidos)"""
+    job = dict(job)
+    job["_id"] = str(job["_id"])
+    job["job_id"] = job["_id"]
+    if job.get("checkpoint"):
+        job["checkpoint"] = {
+            k: str(v) if isinstance(v, ObjectId) else v
+            for k, v in job["checkpoint"].items()
+        }
+    return job
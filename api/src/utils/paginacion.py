@@ -0,0 +1,112 @@
+"""
+Paginación por cursor (keyset) para colecciones de MongoDB.
+El cursor codifica los valores de los campos de orden del último documento devuelto,
+de modo que cada página cuesta lo mismo sin importar cuántas se hayan recorrido
+(a diferencia de skip, que recorre todos los documentos anteriores).
+"""
+import base64
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from bson import json_util
+from fastapi import HTTPException
+
+# Tamaño de página por defecto y máximo para los endpoints paginados
+PAGINA_DEFAULT = 50
+PAGINA_MAX = 500
+
+
+def codificar_cursor(valores: list) -> str:
+    """Codificar los valores de orden (ObjectId, datetime, etc.) en un token opaco para la URL"""
+    return base64.urlsafe_b64encode(json_util.dumps(valores).encode()).decode()
+
+
+def decodificar_cursor(cursor: str) -> list:
+    try:
+        valores = json_util.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor de paginación inválido")
+    if not isinstance(valores, list):
+        raise HTTPException(status_code=400, detail="Cursor de paginación inválido")
+    return valores
+
+
+def filtro_despues_de(orden: List[Tuple[str, int]], valores: list) -> dict:
+    """
+    Filtro keyset para los documentos que van después de 'valores' según 'orden'.
+    El último campo de orden debe ser único (normalmente _id) para desempatar.
+    """
+    condiciones = []
+    for i, (campo, direccion) in enumerate(orden):
+        condicion = {orden[j][0]: valores[j] for j in range(i)}
+        rango = {campo: {"$lt" if direccion < 0 else "$gt": valores[i]}}
+        otros_tipos = _tipos_despues_de(valores[i], direccion)
+        if otros_tipos:
+            # null también cubre el campo faltante, que MongoDB ordena como null
+            condicion["$or"] = [rango] + [
+                {campo: None} if tipo == "null" else {campo: {"$type": tipo}} for tipo in otros_tipos
+            ]
+        else:
+            condicion.update(rango)
+        condiciones.append(condicion)
+    return {"$or": condiciones}
+
+
+def _tipos_despues_de(valor, direccion: int) -> list:
+    """
+    $lt/$gt solo comparan valores del mismo tipo, pero el orden de MongoDB mezcla tipos
+    (null < string < date). Con fechas que todavía son texto ISO (datos anteriores a
+    guardarlas como datetime) hay que agregar los tipos que van después del valor del cursor.
+    """
+    if direccion < 0:
+        if isinstance(valor, datetime):
+            return ["string", "null"]
+        if isinstance(valor, str):
+            return ["null"]
+    elif isinstance(valor, str):
+        return ["date"]
+    return []
+
+
+def paginar(
+    collection,
+    filtro: dict,
+    orden: List[Tuple[str, int]],
+    limit: int,
+    cursor: Optional[str] = None,
+    proyeccion: Optional[dict] = None
+) -> Tuple[List[dict], Optional[str]]:
+    """
+    Devolver una página de documentos y el cursor de la siguiente (None si no hay más).
+    Lee limit + 1 documentos para saber si existe una página siguiente.
+    """
+    query = filtro
+    if cursor:
+        valores = decodificar_cursor(cursor)
+        if len(valores) != len(orden):
+            raise HTTPException(status_code=400, detail="Cursor de paginación inválido")
+        query = {"$and": [filtro, filtro_despues_de(orden, valores)]} if filtro else filtro_despues_de(orden, valores)
+
+    if proyeccion is not None:
+        # Los campos de orden son necesarios para construir el siguiente cursor
+        incluye = any(v for k, v in proyeccion.items() if k != "_id")
+        if incluye:
+            proyeccion = {**proyeccion, **{campo: 1 for campo, _ in orden}}
+
+    docs = list(collection.find(query, proyeccion).sort(orden).limit(limit + 1))
+    siguiente = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        ultimo = docs[-1]
+        siguiente = codificar_cursor([obtener_campo(ultimo, campo) for campo, _ in orden])
+    return docs, siguiente
+
+
+def obtener_campo(doc: dict, campo: str):
+    """Leer un campo con notación de punto (ej: 'meta.fecha')"""
+    valor = doc
+    for parte in campo.split("."):
+        if not isinstance(valor, dict):
+            return None
+        valor = valor.get(parte)
+    return valor
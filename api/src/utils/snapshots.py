@@ -0,0 +1,116 @@
+"""
+Snapshots compactos de pedidos en facturas y pedidos cargados al inventario.
+En lugar de guardar una copia completa del pedido en datos_completos se guarda
+datos_completos_snapshot con:
+- pedido_id: referencia al pedido original
+- campos: los campos congelados al facturar (cliente, montos, estado...)
+- campos_en_documento: claves cuyo valor es idéntico al del propio documento (ej: items),
+  que no se duplican
+- resto_z: el resto del snapshot en BSON comprimido con zlib (opcional, ver
+  SNAPSHOT_COMPRIMIR_RESTO); si no se guarda, el resto se toma del pedido actual
+reconstruir_datos_completos devuelve la forma anterior de datos_completos para el frontend.
+"""
+import zlib
+from datetime import datetime
+from typing import Optional
+
+import bson
+from bson import Binary, ObjectId
+
+from ..config.config import SNAPSHOT_COMPRIMIR_RESTO
+
+CAMPO_SNAPSHOT = "datos_completos_snapshot"
+SNAPSHOT_VERSION = 1
+
+# Campos que quedan fijos al momento de facturar/cargar (no cambian si el pedido cambia después)
+CAMPOS_CONGELADOS = [
+    "_id", "id", "pedido_id", "pedidoId",
+    "cliente_id", "clienteId", "cliente_nombre", "clienteNombre",
+    "cliente_rif", "cliente_direccion", "cliente_telefono",
+    "numero_orden", "numeroFactura", "numero_factura",
+    "monto_total", "montoTotal", "total_abonado", "saldo_pendiente", "descuento",
+    "estado_general", "pago", "tipo_pedido", "sucursal",
+    "fecha_creacion", "fecha_facturacion", "fechaFacturacion",
+    "items", "adicionales"
+]
+
+
+def compactar_snapshot(datos_completos: dict, documento: dict, pedido_id: Optional[str] = None) -> dict:
+    """Convertir datos_completos en un snapshot compacto relativo a 'documento'"""
+    campos = {}
+    campos_en_documento = []
+    resto = {}
+    for clave, valor in (datos_completos or {}).items():
+        if clave in documento and documento[clave] == valor:
+            campos_en_documento.append(clave)
+        elif clave in CAMPOS_CONGELADOS:
+            campos[clave] = valor
+        else:
+            resto[clave] = valor
+
+    snapshot = {
+        "version": SNAPSHOT_VERSION,
+        "pedido_id": pedido_id,
+        "campos": campos,
+        "campos_en_documento": campos_en_documento
+    }
+    if resto:
+        if SNAPSHOT_COMPRIMIR_RESTO:
+            snapshot["resto_z"] = Binary(zlib.compress(bson.encode(resto), 6))
+        else:
+            snapshot["resto_en_pedido"] = True
+    return snapshot
+
+
+def reconstruir_datos_completos(documento: dict, pedidos_collection=None) -> dict:
+    """
+    Devolver datos_completos con la forma anterior (documentos sin compactar se devuelven tal cual).
+    pedidos_collection solo se usa para snapshots guardados sin el resto comprimido.
+    """
+    if not isinstance(documento, dict):
+        return {}
+    datos_completos = documento.get("datos_completos") or documento.get("datosCompletos")
+    if isinstance(datos_completos, dict) and datos_completos:
+        return datos_completos
+
+    snapshot = documento.get(CAMPO_SNAPSHOT)
+    if not isinstance(snapshot, dict):
+        return {}
+
+    resultado = {}
+    if snapshot.get("resto_z"):
+        resultado.update(bson.decode(zlib.decompress(snapshot["resto_z"])))
+    elif snapshot.get("resto_en_pedido") and snapshot.get("pedido_id") and pedidos_collection is not None:
+        try:
+            pedido = pedidos_collection.find_one({"_id": ObjectId(snapshot["pedido_id"])})
+        except Exception:
+            pedido = None
+        if pedido:
+            resultado.update(_a_json(pedido))
+    for clave in snapshot.get("campos_en_documento", []):
+        resultado[clave] = documento.get(clave)
+    resultado.update(snapshot.get("campos", {}))
+    return resultado
+
+
+def expandir_snapshot(documento: dict, pedidos_collection=None) -> dict:
+    """Copia del documento con datos_completos reconstruido y sin el snapshot interno"""
+    if not isinstance(documento, dict):
+        return documento
+    documento = dict(documento)
+    documento["datos_completos"] = reconstruir_datos_completos(documento, pedidos_collection)
+    documento.pop(CAMPO_SNAPSHOT, None)
+    return documento
+
+
+def _a_json(valor):
+    """Convertir ObjectId/datetime anidados a string para responder el pedido actual"""
+    if isinstance(valor, dict):
+        return {k: _a_json(v) for k, v in valor.items()}
+    if isinstance(valor, list):
+        return [_a_json(v) for v in valor]
+    if isinstance(valor, ObjectId):
+        return str(valor)
+    if isinstance(valor, datetime):
+        return valor.isoformat()
+    return valor
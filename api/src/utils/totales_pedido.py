@@ -0,0 +1,165 @@
+"""
+Totales precalculados de los pedidos.
+Cada pedido guarda monto_total (items con descuento + adicionales), total_abonado y
+saldo_pendiente (monto_total - total_abonado), así los listados de pagos y cuentas por cobrar
+filtran y ordenan por saldo con un índice en lugar de traer los items de cada pedido y sumarlos.
+
+ETAPAS_TOTALES_PEDIDO recalcula monto_total y saldo_pendiente dentro de la misma escritura
+(update con pipeline) a partir del documento ya actualizado, igual que ETAPA_SIN_EXISTENCIA en
+el inventario: un abono o un cambio de items deja los totales consistentes sin leer antes el pedido.
+calcular_monto_total es la misma cuenta en Python (inserciones y pedidos sin totales guardados).
+"""
+from typing import Optional, Tuple
+
+CAMPO_MONTO_TOTAL = "monto_total"
+CAMPO_TOTAL_ABONADO = "total_abonado"
+CAMPO_SALDO_PENDIENTE = "saldo_pendiente"
+
+# Campos de items/adicionales que cambian el monto del pedido
+CAMPOS_PRECIO = ("precio", "descuento", "cantidad")
+CAMPOS_LINEAS = ("items", "adicionales")
+
+
+def _numero(valor, defecto: float = 0.0) -> float:
+    # Igual que $convert con onError/onNull: lo que no es número cuenta como el defecto
+    if valor is None:
+        return defecto
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        return defecto
+
+
+def calcular_precio_final_item(item: dict) -> float:
+    """
+    Calcula el precio final de un item considerando el descuento.
+
+    Args:
+        item: Diccionario con los datos del item (debe tener 'precio' y opcionalmente 'descuento')
+
+    Returns:
+        float: Precio final = max(0, precio - descuento)
+    """
+    precio = _numero(item.get("precio"))
+    descuento = _numero(item.get("descuento"))
+    return max(0.0, precio - descuento)
+
+
+def calcular_monto_total(pedido: dict) -> float:
+    """Total del pedido: items (precio - descuento) * cantidad más adicionales precio * cantidad (1 por defecto)"""
+    items = pedido.get("items")
+    adicionales = pedido.get("adicionales")
+    total_items = sum(
+        calcular_precio_final_item(item) * _numero(item.get("cantidad"))
+        for item in (items if isinstance(items, list) else []) if isinstance(item, dict)
+    )
+    total_adicionales = sum(
+        _numero(adicional.get("precio")) * _numero(adicional.get("cantidad"), 1.0)
+        for adicional in (adicionales if isinstance(adicionales, list) else []) if isinstance(adicional, dict)
+    )
+    return round(total_items + total_adicionales, 2)
+
+
+def con_totales(documento: dict) -> dict:
+    """Agregar monto_total, total_abonado y saldo_pendiente a un pedido completo antes de insertarlo"""
+    documento[CAMPO_MONTO_TOTAL] = calcular_monto_total(documento)
+    documento[CAMPO_TOTAL_ABONADO] = _numero(documento.get(CAMPO_TOTAL_ABONADO))
+    documento[CAMPO_SALDO_PENDIENTE] = round(documento[CAMPO_MONTO_TOTAL] - documento[CAMPO_TOTAL_ABONADO], 2)
+    return documento
+
+
+def totales_pedido(pedido: dict) -> Tuple[float, float, float]:
+    """
+    (monto_total, total_abonado, saldo_pendiente) de un pedido leído de la base de datos.
+    Usa los totales guardados; los pedidos anteriores que aún no los tienen se calculan aquí.
+    """
+    total_abonado = _numero(pedido.get(CAMPO_TOTAL_ABONADO))
+    if pedido.get(CAMPO_MONTO_TOTAL) is None:
+        monto_total = calcular_monto_total(pedido)
+        return monto_total, total_abonado, round(monto_total - total_abonado, 2)
+    monto_total = _numero(pedido.get(CAMPO_MONTO_TOTAL))
+    saldo_pendiente = pedido.get(CAMPO_SALDO_PENDIENTE)
+    if saldo_pendiente is None:
+        saldo_pendiente = monto_total - total_abonado
+    return monto_total, total_abonado, _numero(saldo_pendiente)
+
+
+# --- Misma cuenta como expresiones de agregación -----------------------------------------
+
+def _expr_numero(expresion, defecto: float = 0):
+    return {"$convert": {"input": expresion, "to": "double", "onError": defecto, "onNull": defecto}}
+
+
+def _expr_suma(campo: str, termino: dict) -> dict:
+    # Suma de termino sobre cada elemento ($$this) del arreglo campo (0 si no es un arreglo)
+    return {"$reduce": {
+        "input": {"$cond": [{"$isArray": "$" + campo}, "$" + campo, []]},
+        "initialValue": 0,
+        "in": {"$add": ["$$value", termino]}
+    }}
+
+
+_EXPR_MONTO_TOTAL = {"$round": [{"$add": [
+    _expr_suma("items", {"$multiply": [
+        {"$max": [0, {"$subtract": [_expr_numero("$$this.precio"), _expr_numero("$$this.descuento")]}]},
+        _expr_numero("$$this.cantidad")
+    ]}),
+    _expr_suma("adicionales", {"$multiply": [
+        _expr_numero("$$this.precio"), _expr_numero("$$this.cantidad", 1)
+    ]})
+]}, 2]}
+
+# Etapas de pipeline de actualización que recalculan los totales a partir del documento ya actualizado
+ETAPAS_TOTALES_PEDIDO = [
+    {"$set": {
+        CAMPO_MONTO_TOTAL: _EXPR_MONTO_TOTAL,
+        CAMPO_TOTAL_ABONADO: _expr_numero("$" + CAMPO_TOTAL_ABONADO)
+    }},
+    {"$set": {
+        CAMPO_SALDO_PENDIENTE: {"$round": [{"$subtract": ["$" + CAMPO_MONTO_TOTAL, "$" + CAMPO_TOTAL_ABONADO]}, 2]}
+    }}
+]
+
+
+def afecta_totales(update: dict) -> bool:
+    """
+    True si un update de pedidos cambia los totales: reemplaza items/adicionales (o una línea),
+    cambia precio/descuento/cantidad de una línea, o cambia total_abonado.
+    Los cambios de estado de los items ("items.$.estado_item") no afectan.
+    """
+    for operador, campos in update.items():
+        if not isinstance(campos, dict):
+            continue
+        for campo in campos:
+            partes = campo.split(".")
+            if partes[0] == CAMPO_TOTAL_ABONADO:
+                return True
+            if partes[0] in CAMPOS_LINEAS:
+                ultimo = partes[-1]
+                if len(partes) == 1 or ultimo in CAMPOS_PRECIO or ultimo.startswith("$") or ultimo.isdigit():
+                    return True
+    return False
+
+
+def como_pipeline(update: dict) -> Optional[list]:
+    """
+    Convertir un update con $set/$inc/$push sobre campos de primer nivel en una etapa de pipeline,
+    para agregarle ETAPAS_TOTALES_PEDIDO y aplicar todo en una sola escritura.
+    Devuelve None si usa otros operadores, rutas con punto o modificadores de $push ($each...).
+    """
+    etapa = {}
+    for operador, campos in update.items():
+        if operador not in ("$set", "$inc", "$push") or not isinstance(campos, dict):
+            return None
+        for campo, valor in campos.items():
+            if "." in campo or campo.startswith("$") or campo in etapa:
+                return None
+            if operador == "$set":
+                etapa[campo] = {"$literal": valor}
+            elif operador == "$inc":
+                etapa[campo] = {"$add": [{"$ifNull": ["$" + campo, 0]}, {"$literal": valor}]}
+            else:
+                if isinstance(valor, dict) and any(clave.startswith("$") for clave in valor):
+                    return None
+                etapa[campo] = {"$concatArrays": [{"$ifNull": ["$" + campo, []]}, [{"$literal": valor}]]}
+    return [{"$set": etapa}]
@@ -0,0 +1,47 @@
+"""
+Transacciones multi-documento de MongoDB cuando el despliegue las soporta.
+Las transacciones solo existen en replica sets y clusters; con un servidor standalone
+(desarrollo local) la misma función se ejecuta sin sesión.
+"""
+import threading
+from typing import Callable, Optional, TypeVar
+
+from ..config.config import MONGO_TRANSACCIONES
+from ..config.mongodb import client
+
+T = TypeVar("T")
+
+_TOPOLOGIAS_CON_TRANSACCIONES = ("ReplicaSetWithPrimary", "Sharded")
+_soporta: Optional[bool] = None
+_lock = threading.Lock()
+
+
+def soporta_transacciones() -> bool:
+    """True si MongoDB es un replica set o un cluster (se consulta una sola vez)"""
+    global _soporta
+    if not MONGO_TRANSACCIONES:
+        return False
+    if _soporta is None:
+        with _lock:
+            if _soporta is None:
+                try:
+                    # Antes de la primera operación la topología todavía es "Unknown"
+                    client.admin.command("ping")
+                    _soporta = client.topology_description.topology_type_name in _TOPOLOGIAS_CON_TRANSACCIONES
+                except Exception as e:
+                    print(f"⚠️  No se pudo determinar si MongoDB soporta transacciones: {e}")
+                    return False
+                print(f"ℹ️  Transacciones de MongoDB {'activas' if _soporta else 'no disponibles (servidor standalone)'}")
+    return _soporta
+
+
+def ejecutar_en_transaccion(funcion: Callable[..., T]) -> T:
+    """
+    Ejecutar funcion(session) dentro de una transacción si está disponible, o funcion(None) si no.
+    Con transacción, with_transaction reintenta funcion ante errores transitorios (conflictos
+    de escritura con otra transacción), así que funcion debe poder repetirse desde el principio.
+    """
+    if not soporta_transacciones():
+        return funcion(None)
+    with client.start_session() as session:
+        return session.with_transaction(funcion)
@@ -0,0 +1,146 @@
+"""
+Respuestas condicionales (ETag / Last-Modified) para recursos que cambian poco.
+Cada recurso tiene un contador de versión en la colección VERSIONES_RECURSOS que las
+escrituras incrementan con incrementar_version(). El ETag se deriva de la versión, así
+que un GET con If-None-Match se responde con 304 sin consultar los datos del recurso.
+
+Las versiones se guardan también en memoria: la versión local se actualiza al instante
+con las escrituras de esta instancia y se vuelve a leer de MongoDB cada
+VERSIONES_REFRESCO_SEGUNDOS para ver las de otras instancias.
+
+Uso en un endpoint:
+    no_modificado = respuesta_condicional(request, response, RECURSO_METODOS_PAGO)
+    if no_modificado:
+        return no_modificado
+"""
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Dict, Optional
+
+from bson import ObjectId
+from fastapi import Request, Response
+from pymongo import ReturnDocument
+
+from ..config.config import VERSIONES_REFRESCO_SEGUNDOS
+from ..config.mongodb import db
+
+versiones_collection = db["VERSIONES_RECURSOS"]
+
+RECURSO_HOME_CONFIG = "home_config"
+RECURSO_METODOS_PAGO = "metodos_pago"
+RECURSO_EMPLEADOS = "empleados"
+RECURSO_FORMATOS_IMPRESION = "formatos_impresion"
+RECURSO_INVENTARIO = "inventario"
+
+# Recursos públicos (se pueden guardar en proxies) y privados (solo el navegador)
+CACHE_CONTROL_PUBLICO = "public, no-cache"
+CACHE_CONTROL_PRIVADO = "private, no-cache"
+
+
+class VersionesRecursos:
+    def __init__(self, collection, refresco_segundos: float):
+        self._collection = collection
+        self._refresco = refresco_segundos
+        self._versiones: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def _guardar_local(self, doc: dict) -> dict:
+        version = {
+            "epoca": doc["epoca"],
+            "version": doc["version"],
+            # Last-Modified tiene precisión de segundos
+            "fecha": doc["fecha_actualizacion"].replace(microsecond=0, tzinfo=timezone.utc),
+            "leida": time.monotonic()
+        }
+        with self._lock:
+            self._versiones[doc["_id"]] = version
+        return version
+
+    def obtener(self, recurso: str) -> dict:
+        """Versión del recurso: {"epoca", "version", "fecha"} (memoria o MongoDB)"""
+        with self._lock:
+            version = self._versiones.get(recurso)
+        if version and time.monotonic() - version["leida"] < self._refresco:
+            return version
+        # La época cambia si se borra el contador, para no repetir ETags de versiones viejas
+        doc = self._collection.find_one_and_update(
+            {"_id": recurso},
+            {"$setOnInsert": {"epoca": str(ObjectId()), "version": 0, "fecha_actualizacion": datetime.utcnow()}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return self._guardar_local(doc)
+
+    def incrementar(self, recurso: str) -> dict:
+        """Marcar el recurso como modificado (llamar después de cada escritura)"""
+        doc = self._collection.find_one_and_update(
+            {"_id": recurso},
+            {
+                "$inc": {"version": 1},
+                "$set": {"fecha_actualizacion": datetime.utcnow()},
+                "$setOnInsert": {"epoca": str(ObjectId())}
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return self._guardar_local(doc)
+
+
+versiones = VersionesRecursos(versiones_collection, VERSIONES_REFRESCO_SEGUNDOS)
+
+
+def incrementar_version(recurso: str):
+    """Atajo para invalidar los ETags de un recurso; un error no debe romper la escritura"""
+    try:
+        versiones.incrementar(recurso)
+    except Exception as e:
+        print(f"⚠️  No se pudo incrementar la versión de {recurso}: {e}")
+
+
+def etag_recurso(recurso: str, version: dict, variante: str = "") -> str:
+    sufijo = f"-{variante}" if variante else ""
+    return f'"{recurso}-{version["epoca"]}-{version["version"]}{sufijo}"'
+
+
+def respuesta_condicional(
+    request: Request,
+    response: Response,
+    recurso: str,
+    variante: str = "",
+    publico: bool = False
+) -> Optional[Response]:
+    """
+    Si el cliente ya tiene la versión actual (If-None-Match, o If-Modified-Since si no envía
+    ETag) devuelve una respuesta 304 que el endpoint debe retornar tal cual. Si no, agrega
+    ETag, Last-Modified y Cache-Control a 'response' y devuelve None.
+    'variante' distingue representaciones del mismo recurso (ej: parámetros de la consulta).
+    """
+    version = versiones.obtener(recurso)
+    etag = etag_recurso(recurso, version, variante)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": format_datetime(version["fecha"], usegmt=True),
+        "Cache-Control": CACHE_CONTROL_PUBLICO if publico else CACHE_CONTROL_PRIVADO
+    }
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        etags_cliente = [e.strip() for e in if_none_match.split(",")]
+        if etag in etags_cliente or "*" in etags_cliente:
+            return Response(status_code=304, headers=headers)
+    else:
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                fecha_cliente = parsedate_to_datetime(if_modified_since)
+                if fecha_cliente.tzinfo is None:
+                    fecha_cliente = fecha_cliente.replace(tzinfo=timezone.utc)
+                if version["fecha"] <= fecha_cliente:
+                    return Response(status_code=304, headers=headers)
+            except (TypeError, ValueError):
+                pass
+
+    response.headers.update(headers)
+    return None
@@ -0,0 +1,178 @@
+"""
+Escritura diferida (write-behind) en lotes para colecciones de solo inserción.
+Los documentos se encolan en memoria y una tarea asyncio los escribe con insert_many
+cuando el lote se llena o cada flush_interval_ms.
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from pymongo.errors import BulkWriteError
+
+
+class BufferedWriter:
+    """Buffer acotado de inserciones con flush en segundo plano mediante insert_many"""
+    
+    def __init__(
+        self,
+        collection,
+        nombre: str,
+        max_batch: int = 500,
+        flush_interval_ms: int = 250,
+        max_queue: int = 10000,
+        max_reintentos: int = 3
+    ):
+        self._collection = collection
+        self.nombre = nombre
+        self._max_batch = max_batch
+        self._flush_interval = flush_interval_ms / 1000
+        self._max_queue = max_queue
+        self._max_reintentos = max_reintentos
+        self._queue: deque = deque()
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._metricas: Dict[str, Any] = {
+            "encolados": 0,
+            "escritos": 0,
+            "lotes_escritos": 0,
+            "escrituras_directas": 0,
+            "backpressure": 0,
+            "lotes_fallidos": 0,
+            "documentos_fallidos": 0,
+            "descartados": 0,
+            "ultimo_error": None,
+            "ultimo_error_fecha": None,
+            "ultimo_flush": None
+        }
+    
+    @property
+    def activo(self) -> bool:
+        return self._task is not None and not self._task.done()
+    
+    def start(self):
+        """Iniciar la tarea de flush. Debe llamarse desde el event loop (startup de FastAPI)"""
+        if self.activo:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task = self._loop.create_task(self._run())
+    
+    async def stop(self):
+        """Detener la tarea de flush y escribir todo lo pendiente (shutdown de FastAPI)"""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wake()
+        await self._task
+        self._task = None
+        await self._flush_all()
+    
+    def enqueue(self, documento: dict):
+        """
+        Encolar un documento para inserción diferida.
+        Si el writer no está activo (scripts, tests) se inserta directamente.
+        Si la cola está llena (max_queue) el documento se descarta y se cuenta en
+        "backpressure" y "descartados": el productor suele ser una ruta async y no debe
+        escribir en línea (insert_many con reintentos bloquearía el event loop). La memoria
+        queda acotada y la tarea de flush se despierta para vaciar la cola.
+        """
+        if not self.activo:
+            self._metricas["escrituras_directas"] += 1
+            self._write_with_retries([documento])
+            return
+        
+        with self._lock:
+            llena = len(self._queue) >= self._max_queue
+            if not llena:
+                self._queue.append(documento)
+                self._metricas["encolados"] += 1
+            pendientes = len(self._queue)
+        
+        if llena:
+            self._metricas["backpressure"] += 1
+            self._metricas["descartados"] += 1
+            if self._metricas["backpressure"] % 1000 == 1:
+                print(f"ERROR WRITE-BEHIND {self.nombre}: cola llena ({pendientes}), descartando documentos")
+            self._wake()
+        elif pendientes >= self._max_batch:
+            self._wake()
+    
+    def get_metricas(self) -> Dict[str, Any]:
+        with self._lock:
+            pendientes = len(self._queue)
+        return {
+            "nombre": self.nombre,
+            "activo": self.activo,
+            "pendientes": pendientes,
+            "max_batch": self._max_batch,
+            "flush_interval_ms": int(self._flush_interval * 1000),
+            "max_queue": self._max_queue,
+            **self._metricas
+        }
+    
+    def _wake(self):
+        if self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+    
+    def _drain(self) -> List[dict]:
+        with self._lock:
+            cantidad = min(len(self._queue), self._max_batch)
+            return [self._queue.popleft() for _ in range(cantidad)]
+    
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self._flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self._flush_all()
+            except Exception as e:
+                print(f"ERROR WRITE-BEHIND {self.nombre}: {e}")
+    
+    async def _flush_all(self):
+        while True:
+            lote = self._drain()
+            if not lote:
+                return
+            await asyncio.to_thread(self._write_with_retries, lote)
+    
+    def _registrar_error(self, error: Exception):
+        self._metricas["ultimo_error"] = str(error)
+        self._metricas["ultimo_error_fecha"] = datetime.now().isoformat()
+    
+    def _write_with_retries(self, lote: List[dict]):
+        """Insertar un lote; reintenta errores transitorios y descarta tras max_reintentos"""
+        if not lote:
+            return
+        for intento in range(1, self._max_reintentos + 1):
+            try:
+                self._collection.insert_many(lote, ordered=False)
+                self._metricas["escritos"] += len(lote)
+                self._metricas["lotes_escritos"] += 1
+                self._metricas["ultimo_flush"] = datetime.now().isoformat()
+                return
+            except BulkWriteError as e:
+                # Errores por documento (no transitorios): contar y no reintentar
+                insertados = e.details.get("nInserted", 0)
+                self._metricas["escritos"] += insertados
+                self._metricas["documentos_fallidos"] += len(lote) - insertados
+                self._metricas["lotes_fallidos"] += 1
+                self._registrar_error(e)
+                print(f"ERROR WRITE-BEHIND {self.nombre}: {len(lote) - insertados} documentos rechazados")
+                return
+            except Exception as e:
+                self._metricas["lotes_fallidos"] += 1
+                self._registrar_error(e)
+                print(f"ERROR WRITE-BEHIND {self.nombre}: intento {intento}/{self._max_reintentos}: {e}")
+                if intento < self._max_reintentos:
+                    time.sleep(0.1 * intento)
+        self._metricas["descartados"] += len(lote)